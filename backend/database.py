@@ -5,11 +5,10 @@ Database connection management
 import os
 import sys
 import logging
+from typing import Optional
 from sqlalchemy import create_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import sessionmaker, Session
 
 # 添加项目根目录到Python路径
 project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -24,7 +23,7 @@ logger = logging.getLogger(__name__)
 # 创建数据库引擎
 engine = create_engine(
     DATABASE_URL,
-    connect_args={"check_same_thread": False},  # 仅适用于SQLite
+    connect_args={"check_same_thread": False, "timeout": 30},  # 仅适用于SQLite，timeout为等待写锁的秒数
     pool_size=10,  # 增加连接池大小
     max_overflow=20,  # 增加最大溢出连接数
     pool_timeout=60,  # 增加连接超时时间
@@ -38,27 +37,104 @@ SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 # 创建基类
 Base = declarative_base()
 
+# 模型结构版本：新增表或索引时加一。数据库的PRAGMA user_version与之相同时，启动时跳过导入全部模型和create_all
+SCHEMA_VERSION = 1
+
+def get_schema_version() -> int:
+    """
+    读取数据库记录的结构版本（SQLite的PRAGMA user_version）
+    Read the schema version recorded in the database (SQLite's PRAGMA user_version)
+    """
+    if engine.dialect.name != "sqlite":
+        return 0
+    with engine.connect() as conn:
+        return conn.exec_driver_sql("PRAGMA user_version").scalar()
+
 async def init_db():
     """初始化数据库"""
     try:
+        # 结构版本一致说明表已创建，无需反射全部表
+        if get_schema_version() == SCHEMA_VERSION:
+            logger.info(f"数据库结构版本 {SCHEMA_VERSION} 已是最新，跳过建表")
+            return
+
         # 导入所有模型以确保它们被注册到Base中
         from backend.models.equipment import Equipment
         from backend.models.reservation import Reservation
         from backend.models.recurring_reservation import RecurringReservation
         from backend.models.admin import Admin
-        from backend.models.email import EmailSettings, EmailTemplate, EmailLog
+        from backend.models.email import EmailSettings, EmailTemplate, EmailLog, EmailBody
         from backend.models.announcement import Announcement
         from backend.models.equipment_time_slot import EquipmentTimeSlot
         from backend.models.equipment_category import EquipmentCategory
         from backend.models.system_log import SystemLog
+        from backend.models.idempotency_key import IdempotencyKey
+        from backend.models.reservation_tombstone import ReservationTombstone
+        from backend.models.reservation_archive import ReservationArchive, ReservationHistoryArchive
+
+        # 新建的SQLite数据库启用增量回收，删除数据后可以用PRAGMA incremental_vacuum归还空闲页；
+        # 已有数据库需要运行migrations/enable_incremental_vacuum.py转换
+        if engine.dialect.name == "sqlite":
+            with engine.connect() as conn:
+                conn.exec_driver_sql("PRAGMA auto_vacuum = INCREMENTAL")
 
         # 创建所有表
         Base.metadata.create_all(bind=engine)
+
+        # 记录结构版本，下次启动时跳过建表
+        if engine.dialect.name == "sqlite":
+            with engine.begin() as conn:
+                conn.exec_driver_sql(f"PRAGMA user_version = {SCHEMA_VERSION}")
         logger.info("数据库初始化成功")
     except Exception as e:
         logger.error(f"数据库初始化失败: {e}")
         raise
 
+def begin_immediate(db: Session) -> None:
+    """
+    在SQLite上以BEGIN IMMEDIATE开启写事务，提前获取写锁，使"检查-插入"在同一事务中串行执行
+    Start a write transaction with BEGIN IMMEDIATE on SQLite so check-then-insert runs serialized
+
+    其他数据库不做处理，由调用方的SELECT ... FOR UPDATE负责加锁。
+    Other databases are left alone; callers lock rows with SELECT ... FOR UPDATE.
+    """
+    connection = db.connection()
+    if connection.dialect.name != "sqlite":
+        return
+
+    # pysqlite只在DML前隐式开启事务，此前的SELECT不会占用事务，可以直接BEGIN IMMEDIATE
+    dbapi_connection = connection.connection.dbapi_connection
+    if not dbapi_connection.in_transaction:
+        connection.exec_driver_sql("BEGIN IMMEDIATE")
+
+def incremental_vacuum(db: Session, max_pages: Optional[int] = None) -> int:
+    """
+    在SQLite上执行PRAGMA incremental_vacuum，把空闲页归还给文件系统，返回回收的页数
+    Run PRAGMA incremental_vacuum on SQLite to return free pages to the file system; returns pages freed
+
+    只有auto_vacuum为INCREMENTAL的数据库才会回收，其他情况直接返回0。
+    Only databases with auto_vacuum = INCREMENTAL are shrunk; otherwise this returns 0.
+    """
+    connection = db.connection()
+    if connection.dialect.name != "sqlite":
+        return 0
+    if connection.exec_driver_sql("PRAGMA auto_vacuum").scalar() != 2:
+        logger.debug("数据库未启用增量回收，跳过incremental_vacuum")
+        return 0
+
+    free_pages = connection.exec_driver_sql("PRAGMA freelist_count").scalar()
+    if not free_pages:
+        return 0
+    pragma = f"PRAGMA incremental_vacuum({int(max_pages)})" if max_pages else "PRAGMA incremental_vacuum"
+    # pysqlite的execute每次只执行一步（回收一页），executescript会执行到结束；
+    # executescript会先提交未完成的事务，这里先显式提交
+    db.commit()
+    dbapi_connection = db.connection().connection.dbapi_connection
+    dbapi_connection.executescript(pragma)
+    freed_pages = free_pages - db.connection().exec_driver_sql("PRAGMA freelist_count").scalar()
+    db.commit()
+    return freed_pages
+
 def get_db():
     """获取数据库会话"""
     db = SessionLocal()
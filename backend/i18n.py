@@ -1,11 +1,21 @@
 """
 国际化支持
 Internationalization support
+
+当前语言保存在contextvars.ContextVar中，每个请求（以及它派生的任务和线程池调用）各自独立，
+并发请求不会互相覆盖语言。翻译文件在启动时编译一次：占位符位置预先解析，翻译时只需拼接。
+
+The current locale lives in a contextvars.ContextVar, so each request (and the tasks and
+thread-pool calls it spawns) has its own and concurrent requests never overwrite each other's
+language. Translation files are compiled once at startup with placeholder positions parsed
+ahead, so translating only joins the pieces.
 """
 import os
+import re
 import json
 import logging
-from typing import Callable, Dict, Optional
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Union
 from fastapi import Request, Response
 from starlette.middleware.base import BaseHTTPMiddleware
 
@@ -15,28 +25,57 @@ logger = logging.getLogger(__name__)
 # 导入配置
 from config import DEFAULT_LANGUAGE, SUPPORTED_LANGUAGES
 
-# 全局变量
-_current_locale = DEFAULT_LANGUAGE
-_translations = {}
+# 当前请求的语言
+_current_locale: ContextVar[str] = ContextVar("locale", default=DEFAULT_LANGUAGE)
+
+# 编译后的翻译：语言 -> 键 -> 纯文本或(文本片段, 占位符名, 文本片段, ...)
+CompiledMessage = Union[str, Tuple[str, ...]]
+_catalogs: Dict[str, Dict[str, CompiledMessage]] = {}
+
+# 占位符格式：{name}
+_PLACEHOLDER = re.compile(r"\{(\w+)\}")
 
 # 国际化中间件
 class I18nMiddleware(BaseHTTPMiddleware):
     async def dispatch(self, request: Request, call_next: Callable):
         # 从Cookie中获取语言设置
-        global _current_locale
         language = request.cookies.get("language", DEFAULT_LANGUAGE)
 
         # 如果语言不受支持，则使用默认语言
         if language not in SUPPORTED_LANGUAGES:
             language = DEFAULT_LANGUAGE
 
-        # 设置当前语言
-        _current_locale = language
-
-        # 继续处理请求
-        response = await call_next(request)
+        # 设置当前请求的语言，请求结束后恢复
+        token = _current_locale.set(language)
+        try:
+            # 继续处理请求
+            response = await call_next(request)
+        finally:
+            _current_locale.reset(token)
         return response
 
+def compile_message(text: str) -> CompiledMessage:
+    """
+    预解析翻译文本中的占位符；没有占位符时原样返回字符串
+    Pre-parse the placeholders of a message; messages without placeholders stay plain strings
+    """
+    parts = _PLACEHOLDER.split(text)
+    if len(parts) == 1:
+        return text
+    return tuple(parts)
+
+def compile_catalog(lang: str, raw: Dict[str, Any]) -> Dict[str, CompiledMessage]:
+    """
+    编译一种语言的翻译文件；条目可以是文本，也可以是{语言: 文本}
+    Compile one language's translation file; entries are either text or {language: text}
+    """
+    catalog = {}
+    for key, value in raw.items():
+        if isinstance(value, dict):
+            value = value.get(lang) or value.get(DEFAULT_LANGUAGE) or key
+        catalog[key] = compile_message(str(value))
+    return catalog
+
 def setup_i18n():
     """设置国际化"""
     try:
@@ -59,13 +98,13 @@ def setup_i18n():
                         "welcome": "欢迎使用设备预定系统" if lang == "zh_CN" else "Welcome to Equipment Reservation System"
                     }, f, ensure_ascii=False, indent=4)
 
-            # 加载翻译文件
+            # 加载并编译翻译文件
             try:
                 with open(lang_file, "r", encoding="utf-8") as f:
-                    _translations[lang] = json.load(f)
+                    _catalogs[lang] = compile_catalog(lang, json.load(f))
             except Exception as e:
                 logger.error(f"加载翻译文件失败 ({lang}): {e}")
-                _translations[lang] = {}
+                _catalogs[lang] = {}
 
         logger.info("国际化设置成功")
     except Exception as e:
@@ -75,22 +114,45 @@ def setup_i18n():
 
 def get_locale() -> str:
     """获取当前语言"""
-    return _current_locale
+    return _current_locale.get()
+
+def set_locale(language: str):
+    """
+    设置当前上下文的语言（请求之外，如后台任务中使用），返回可用于恢复的token
+    Set the locale of the current context (outside requests, e.g. in background jobs);
+    returns a token that restores the previous value
+    """
+    return _current_locale.set(language if language in SUPPORTED_LANGUAGES else DEFAULT_LANGUAGE)
+
+def _render(message: CompiledMessage, kwargs: Dict[str, Any]) -> str:
+    """填入占位符，未提供的参数保留原占位符"""
+    if isinstance(message, str):
+        return message
+    parts = list(message)
+    for i in range(1, len(parts), 2):
+        name = parts[i]
+        parts[i] = str(kwargs[name]) if name in kwargs else f"{{{name}}}"
+    return "".join(parts)
+
+def _lookup(catalog: Dict[str, CompiledMessage], key: str, kwargs: Dict[str, Any]) -> str:
+    """查找并渲染一条翻译，没有翻译的键按原文替换参数"""
+    if key in catalog:
+        return _render(catalog[key], kwargs)
+    return _render(compile_message(key), kwargs) if kwargs else key
 
 def translate(key: str, **kwargs) -> str:
     """翻译文本"""
     try:
-        # 获取当前语言的翻译
-        translations = _translations.get(_current_locale, {})
-
-        # 获取翻译文本
-        text = translations.get(key, key)
-
-        # 替换参数
-        for k, v in kwargs.items():
-            text = text.replace(f"{{{k}}}", str(v))
-
-        return text
+        return _lookup(_catalogs.get(_current_locale.get(), {}), key, kwargs)
     except Exception as e:
         logger.error(f"翻译失败: {e}")
         return key
+
+def translate_many(keys: Iterable[str], locale: Optional[str] = None, **kwargs) -> List[str]:
+    """
+    批量翻译，语言和翻译表只查找一次，适用于导出、统计等列表
+    Translate many keys at once, resolving the locale and catalog only once; meant for
+    lists such as exports and statistics
+    """
+    catalog = _catalogs.get(locale or _current_locale.get(), {})
+    return [_lookup(catalog, key, kwargs) for key in keys]
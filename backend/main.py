@@ -2,18 +2,14 @@
 物品预定系统主应用入口
 Equipment Reservation System main application entry
 """
-import logging
 import os
-from fastapi import FastAPI, Request, Depends, HTTPException
+from fastapi import FastAPI, Request, HTTPException
 from fastapi.templating import Jinja2Templates
-from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import RedirectResponse, JSONResponse
 import sys
 from contextlib import asynccontextmanager
-import uvicorn
 import asyncio
-from datetime import datetime, timedelta
 
 # 添加项目根目录到Python路径
 project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -22,29 +18,38 @@ sys.path.append(project_root)
 # 直接从项目根目录导入config.py
 sys.path.insert(0, project_root)  # 确保项目根目录在导入路径的最前面
 
+# 启动计时器最先导入，统计之后各阶段的耗时
+from backend.utils.startup_timing import startup_timer
+
 # 导入新的日志系统
-from log_config import setup_logging, check_log_file, backup_logs, force_log_rotation
+from log_config import setup_logging, stop_logging, run_log_maintenance
 
 # 导入配置和模块
-from config import TEMPLATES_DIR, STATIC_DIR, APP_NAME, DEFAULT_LANGUAGE
-from backend.database import init_db, get_db
-from backend.i18n import setup_i18n, get_locale, I18nMiddleware
-from backend.utils.status_updater import update_reservation_statuses
-from backend.utils.duplicate_checker import check_and_fix_duplicate_numbers
+with startup_timer.stage("import core modules"):
+    from config import TEMPLATES_DIR, STATIC_DIR, APP_NAME, DEFAULT_LANGUAGE, RESERVATION_ARCHIVE_BATCH_SIZE, DB_MAINTENANCE_INTERVAL_HOURS
+    from backend.database import init_db, get_db
+    from backend.i18n import setup_i18n, get_locale, I18nMiddleware
+    from backend.utils.status_updater import update_reservation_statuses
+    from backend.utils.duplicate_checker import check_and_fix_duplicate_numbers
+    from backend.routes.crud.recurring_reservation import extend_recurring_reservations
+    from backend.utils.reservation_archive import archive_reservations
+    from backend.utils.image_pipeline import shutdown_executor
+    from backend.utils.worker_election import maintenance_worker
+    from backend.utils.log_purge import apply_log_retention
+    from backend.utils.db_backup import backup_due, create_backup, refresh_snapshot_in_background
+    from backend.utils.db_maintenance import run_maintenance
+    from backend.utils.static_files import PrecompressedStaticFiles, precompress_static_assets
 
 # 设置新的日志系统
-logger, log_handler = setup_logging()
-check_log_file()
+with startup_timer.stage("setup_logging"):
+    logger, log_handler = setup_logging()
 logger.info("FastAPI应用初始化中...")
 
 # 定义状态更新任务
 async def status_update_task():
     """定期更新预约状态的后台任务"""
     while True:
-        # 先检查日志文件是否存在
-        check_log_file()
-
-        logger.info("执行预约状态更新任务")
+        logger.debug("执行预约状态更新任务")
         db = None
         try:
             # 获取数据库会话
@@ -53,8 +58,6 @@ async def status_update_task():
             update_reservation_statuses(db)
         except Exception as e:
             logger.error(f"更新预约状态时出错: {str(e)}", exc_info=True)
-            # 发生错误时尝试备份日志
-            backup_logs()
         finally:
             # 确保数据库连接被关闭
             if db:
@@ -65,26 +68,21 @@ async def status_update_task():
 
 # 周期性日志维护任务
 async def log_maintenance_task():
-    """周期性日志维护任务"""
+    """周期性日志维护任务：增量备份、压缩已轮转的日志、执行保留策略，只在维护进程上运行"""
     try:
         while True:
             # 每小时执行一次
             await asyncio.sleep(3600)  # 3600秒 = 1小时
 
-            logger.info("执行日志维护任务")
-
-            # 检查日志文件
-            check_log_file()
-
-            # 备份日志
-            backup_logs()
+            if not maintenance_worker.is_elected():
+                continue
 
-            # 每天午夜左右（0:30）强制执行一次日志轮转，确保日志按天分割
-            current_hour = datetime.now().hour
-            current_minute = datetime.now().minute
-            if current_hour == 0 and current_minute >= 30 and current_minute < 35:
-                logger.info("执行每日日志轮转")
-                force_log_rotation()
+            logger.info("执行日志维护任务")
+            try:
+                # 文件读写在后台线程中进行，不阻塞事件循环和请求线程
+                await asyncio.to_thread(run_log_maintenance)
+            except Exception as e:
+                logger.error(f"日志维护出错: {str(e)}", exc_info=True)
 
     except Exception as e:
         logger.error(f"日志维护任务异常: {e}", exc_info=True)
@@ -110,8 +108,6 @@ async def duplicate_check_task():
                     logger.info("没有发现重复的预约序号")
             except Exception as e:
                 logger.error(f"检查重复预约序号时出错: {str(e)}", exc_info=True)
-                # 发生错误时尝试备份日志
-                backup_logs()
             finally:
                 # 确保数据库连接被关闭
                 if db:
@@ -119,12 +115,135 @@ async def duplicate_check_task():
     except Exception as e:
         logger.error(f"预约序号重复检查任务异常: {e}", exc_info=True)
 
+# 循环预约滚动生成任务
+def extend_recurring_horizon() -> int:
+    """在独立的数据库会话中续生成循环预约子预约，返回新生成的数量"""
+    db = next(get_db())
+    try:
+        return extend_recurring_reservations(db)
+    finally:
+        # 确保数据库连接被关闭
+        db.close()
+
+async def recurring_horizon_task():
+    """定期将循环预约的子预约续生成到滚动窗口的后台任务，只在维护进程上运行"""
+    try:
+        while True:
+            if maintenance_worker.is_elected():
+                logger.info("执行循环预约滚动生成任务")
+                try:
+                    # 冲突检查和批量插入在后台线程中进行，不阻塞事件循环
+                    created = await asyncio.to_thread(extend_recurring_horizon)
+                    if created > 0:
+                        logger.info(f"已续生成 {created} 个循环预约子预约")
+                except Exception as e:
+                    logger.error(f"续生成循环预约子预约时出错: {str(e)}", exc_info=True)
+
+            # 每1小时执行一次（窗口按天推进）
+            await asyncio.sleep(3600)
+    except Exception as e:
+        logger.error(f"循环预约滚动生成任务异常: {e}", exc_info=True)
+
+# 预约归档任务
+def archive_reservation_batch() -> int:
+    """在独立的数据库会话中归档一批预约，返回归档数量"""
+    db = next(get_db())
+    try:
+        return archive_reservations(db, max_batches=1)
+    finally:
+        # 确保数据库连接被关闭
+        db.close()
+
+async def reservation_archive_task():
+    """每天将结束较久的已过期/已取消预约分批移入归档表的后台任务，只在维护进程上运行"""
+    try:
+        while True:
+            if maintenance_worker.is_elected():
+                logger.info("执行预约归档任务")
+                try:
+                    total = 0
+                    while True:
+                        # 每批在后台线程中执行，批与批之间释放写锁
+                        archived = await asyncio.to_thread(archive_reservation_batch)
+                        total += archived
+                        if archived < RESERVATION_ARCHIVE_BATCH_SIZE:
+                            break
+                        await asyncio.sleep(1)
+                    if total > 0:
+                        logger.info(f"已归档 {total} 个预约")
+                except Exception as e:
+                    logger.error(f"归档预约时出错: {str(e)}", exc_info=True)
+
+            # 每天执行一次
+            await asyncio.sleep(86400)
+    except Exception as e:
+        logger.error(f"预约归档任务异常: {e}", exc_info=True)
+
+# 日志保留策略任务
+async def log_retention_task():
+    """每天按保留天数分批清理过期的系统日志和邮件日志，只在维护进程上运行"""
+    try:
+        while True:
+            if maintenance_worker.is_elected():
+                try:
+                    results = await apply_log_retention()
+                    if any(results.values()):
+                        logger.info(f"日志保留策略清理完成: {results}")
+                except Exception as e:
+                    logger.error(f"执行日志保留策略时出错: {str(e)}", exc_info=True)
+
+            # 每天执行一次
+            await asyncio.sleep(86400)
+    except Exception as e:
+        logger.error(f"日志保留策略任务异常: {e}", exc_info=True)
+
+# 数据库备份任务
+async def db_backup_task():
+    """每小时检查一次，距上次备份超过DB_BACKUP_INTERVAL_HOURS小时则在线备份数据库，只在维护进程上运行"""
+    try:
+        while True:
+            if maintenance_worker.is_elected():
+                try:
+                    if await asyncio.to_thread(backup_due):
+                        # 分步复制和压缩在后台线程中进行
+                        await asyncio.to_thread(create_backup)
+                except Exception as e:
+                    logger.error(f"数据库备份出错: {str(e)}", exc_info=True)
+
+            # 每1小时检查一次
+            await asyncio.sleep(3600)
+    except Exception as e:
+        logger.error(f"数据库备份任务异常: {e}", exc_info=True)
+
+# 数据库维护任务
+async def db_maintenance_task():
+    """每DB_MAINTENANCE_INTERVAL_HOURS小时清理过期数据、更新统计信息并在空闲时段回收空间，只在维护进程上运行"""
+    try:
+        while True:
+            if maintenance_worker.is_elected():
+                try:
+                    await run_maintenance()
+                except Exception as e:
+                    logger.error(f"数据库维护出错: {str(e)}", exc_info=True)
+
+            await asyncio.sleep(DB_MAINTENANCE_INTERVAL_HOURS * 3600)
+    except Exception as e:
+        logger.error(f"数据库维护任务异常: {e}", exc_info=True)
+
 # 定义生命周期管理器
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # 启动时执行
     logger.info("应用启动 / Application started")
-    await init_db()
+    with startup_timer.stage("init_db"):
+        await init_db()
+
+    # 为前端构建产物等静态资源生成gzip/brotli预压缩文件
+    with startup_timer.stage("precompress static assets"):
+        await precompress_static_assets(STATIC_DIR)
+
+    # 在后台线程中生成只读快照，首个统计或导出请求不必等待复制数据库
+    refresh_snapshot_in_background()
 
     # 启动状态更新后台任务
     status_task = asyncio.create_task(status_update_task())
@@ -135,7 +254,23 @@ async def lifespan(app: FastAPI):
     # 启动预约序号重复检查任务
     duplicate_task = asyncio.create_task(duplicate_check_task())
 
+    # 启动循环预约滚动生成任务
+    horizon_task = asyncio.create_task(recurring_horizon_task())
+
+    # 启动预约归档任务
+    archive_task = asyncio.create_task(reservation_archive_task())
+
+    # 启动日志保留策略任务
+    retention_task = asyncio.create_task(log_retention_task())
+
+    # 启动数据库备份任务
+    backup_task = asyncio.create_task(db_backup_task())
+
+    # 启动数据库维护任务
+    maintenance_task = asyncio.create_task(db_maintenance_task())
+
     logger.info("后台任务已启动")
+    startup_timer.log_report()
 
     yield
 
@@ -143,19 +278,34 @@ async def lifespan(app: FastAPI):
     status_task.cancel()
     log_task.cancel()
     duplicate_task.cancel()
+    horizon_task.cancel()
+    archive_task.cancel()
+    retention_task.cancel()
+    backup_task.cancel()
+    maintenance_task.cancel()
     try:
         await status_task
         await log_task
         await duplicate_task
+        await horizon_task
+        await archive_task
+        await retention_task
+        await backup_task
+        await maintenance_task
     except asyncio.CancelledError:
         logger.info("后台任务已取消")
 
-    # 关闭日志处理器
-    for handler in logger.handlers:
-        handler.close()
+    # 关闭图片处理进程池
+    shutdown_executor()
+
+    # 释放维护进程身份
+    maintenance_worker.release()
 
     logger.info("应用关闭 / Application shut down")
 
+    # 写完队列中剩余的日志并关闭日志处理器
+    stop_logging()
+
 # 创建FastAPI应用
 app = FastAPI(
     title=APP_NAME[DEFAULT_LANGUAGE],
@@ -187,41 +337,42 @@ async def add_utf8_content_type(request, call_next):
     return response
 
 # 设置国际化中间件
-setup_i18n()
+with startup_timer.stage("setup_i18n"):
+    setup_i18n()
 app.add_middleware(I18nMiddleware)
 
-# 设置静态文件
-app.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
+# 压缩较大的JSON响应（最后添加，位于最外层）
+from backend.middlewares.compression_middleware import JSONGZipMiddleware
+app.add_middleware(JSONGZipMiddleware)
+
+# 设置静态文件（预压缩、哈希文件永久缓存、ETag重新验证）
+app.mount("/static", PrecompressedStaticFiles(directory=STATIC_DIR), name="static")
 
 # 设置模板
 templates = Jinja2Templates(directory=TEMPLATES_DIR)
 templates.env.globals["get_locale"] = get_locale
 
-# 导入路由模块
-from backend.routes.equipment import router as equipment_router
-from backend.routes.equipment_category import router as equipment_category_router
-from backend.routes.reservation import router as reservation_router
-from backend.routes.recurring_reservation import router as recurring_reservation_router
-from backend.routes.admin import router as admin_router
-from backend.routes.statistics import router as statistics_router
-from backend.routes.upload import router as upload_router
-from backend.routes.calendar import router as calendar_router
-from backend.routes.db_admin import router as db_admin_router  # 导入数据库表查看路由
-from backend.routes.announcements import router as announcements_router
-from backend.routes.system_logs import router as system_logs_router  # 导入系统日志路由
-
-# 注册路由
-app.include_router(equipment_router)
-app.include_router(equipment_category_router)
-app.include_router(reservation_router)
-app.include_router(recurring_reservation_router)
-app.include_router(admin_router)
-app.include_router(statistics_router)
-app.include_router(upload_router)
-app.include_router(calendar_router)
-app.include_router(db_admin_router)  # 注册数据库表查看路由
-app.include_router(announcements_router)
-app.include_router(system_logs_router)  # 注册系统日志路由
+# 路由模块（按注册顺序）；Excel、图片等较重的依赖在路由内部首次使用时才导入
+ROUTER_MODULES = [
+    "backend.routes.equipment",
+    "backend.routes.equipment_category",
+    "backend.routes.reservation",
+    "backend.routes.recurring_reservation",
+    "backend.routes.admin",
+    "backend.routes.statistics",
+    "backend.routes.upload",
+    "backend.routes.calendar",
+    "backend.routes.db_admin",  # 数据库表查看路由
+    "backend.routes.announcements",
+    "backend.routes.system_logs",  # 系统日志路由
+    "backend.routes.events",  # 实时事件路由
+]
+
+# 导入并注册路由，逐个记录导入耗时
+for module_name in ROUTER_MODULES:
+    module = startup_timer.import_module(module_name)
+    with startup_timer.stage(f"include_router {module_name}"):
+        app.include_router(module.router)
 
 @app.get("/")
 def root(request: Request):
@@ -263,5 +414,7 @@ def change_language(lang: str):
 
 # 当直接运行此文件时启动服务器
 if __name__ == "__main__":
+    import uvicorn
+
     # 启动服务器，绑定到所有网络接口
     uvicorn.run(app, host="0.0.0.0", port=8000)
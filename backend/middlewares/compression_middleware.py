@@ -0,0 +1,89 @@
+"""
+JSON响应压缩中间件
+JSON response compression middleware
+
+只压缩超过阈值的JSON响应；静态文件（已有预压缩）和图片等其他响应原样透传。
+Only JSON responses above a size threshold are gzipped; static files (already
+precompressed), images and other responses pass through untouched.
+"""
+import gzip
+import logging
+
+import anyio
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from backend.utils.static_files import accepts_encoding
+
+logger = logging.getLogger(__name__)
+
+# 超过该大小（字节）的JSON响应才压缩
+GZIP_MINIMUM_SIZE = 1024
+# 超过该大小的响应在线程中压缩，避免阻塞事件循环
+GZIP_THREAD_THRESHOLD = 256 * 1024
+
+
+class JSONGZipMiddleware:
+    def __init__(
+        self,
+        app: ASGIApp,
+        minimum_size: int = GZIP_MINIMUM_SIZE,
+        compresslevel: int = 6
+    ) -> None:
+        self.app = app
+        self.minimum_size = minimum_size
+        self.compresslevel = compresslevel
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if (
+            scope["type"] != "http"
+            or scope["method"] == "HEAD"
+            or not accepts_encoding(Headers(scope=scope).get("accept-encoding", ""), "gzip")
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        body_parts = []
+        passthrough = False
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal start_message, passthrough
+
+            if passthrough:
+                await send(message)
+                return
+
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                # 非JSON或已编码的响应直接透传
+                if not headers.get("content-type", "").startswith("application/json") or "content-encoding" in headers:
+                    passthrough = True
+                    await send(message)
+                    return
+                start_message = message
+                return
+
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body_parts.append(message.get("body", b""))
+            if message.get("more_body", False):
+                return
+
+            body = b"".join(body_parts)
+            headers = MutableHeaders(raw=start_message["headers"])
+            if len(body) >= self.minimum_size:
+                if len(body) >= GZIP_THREAD_THRESHOLD:
+                    body = await anyio.to_thread.run_sync(gzip.compress, body, self.compresslevel)
+                else:
+                    body = gzip.compress(body, self.compresslevel)
+                headers["Content-Encoding"] = "gzip"
+                headers.add_vary_header("Accept-Encoding")
+            headers["Content-Length"] = str(len(body))
+
+            await send(start_message)
+            await send({"type": "http.response.body", "body": body, "more_body": False})
+
+        await self.app(scope, receive, send_wrapper)
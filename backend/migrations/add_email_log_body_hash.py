@@ -0,0 +1,108 @@
+"""
+邮件日志正文去重压缩的数据库迁移脚本
+Database migration script moving email log bodies into the deduplicated, compressed body table
+"""
+import os
+import sys
+import zlib
+import hashlib
+import logging
+from sqlalchemy import create_engine, text
+
+# 添加项目根目录到Python路径
+project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(project_root)
+
+# 导入配置
+from config import DATABASE_URL
+
+# 设置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 每批迁移的日志数
+BATCH_SIZE = 500
+
+def run_migration():
+    """
+    运行迁移
+    Run migration
+    """
+    try:
+        # 创建数据库引擎
+        engine = create_engine(DATABASE_URL)
+
+        # 连接数据库
+        with engine.connect() as conn:
+            result = conn.execute(text("PRAGMA table_info(email_logs)"))
+            if "body_hash" in {column[1] for column in result.fetchall()}:
+                logger.info("body_hash字段已存在，无需添加")
+            else:
+                conn.execute(text("ALTER TABLE email_logs ADD COLUMN body_hash VARCHAR(64)"))
+                logger.info("成功添加body_hash字段到email_logs表")
+            conn.execute(text("CREATE INDEX IF NOT EXISTS ix_email_logs_body_hash ON email_logs (body_hash)"))
+
+            # 正文表由init_db创建，这里一并创建以便单独运行迁移
+            conn.execute(text("""
+                CREATE TABLE IF NOT EXISTS email_bodies (
+                    hash VARCHAR(64) NOT NULL PRIMARY KEY,
+                    content BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at DATETIME
+                )
+            """))
+            conn.commit()
+
+            # 把旧日志的content_html分批移入正文表
+            moved = 0
+            while True:
+                rows = conn.execute(text(
+                    "SELECT id, content_html FROM email_logs "
+                    "WHERE body_hash IS NULL AND content_html IS NOT NULL AND content_html != '' "
+                    "ORDER BY id LIMIT :limit"
+                ), {"limit": BATCH_SIZE}).fetchall()
+                if not rows:
+                    break
+
+                for log_id, html in rows:
+                    data = html.encode("utf-8")
+                    digest = hashlib.sha256(data).hexdigest()
+                    conn.execute(text(
+                        "INSERT OR IGNORE INTO email_bodies (hash, content, size, created_at) "
+                        "VALUES (:hash, :content, :size, CURRENT_TIMESTAMP)"
+                    ), {"hash": digest, "content": zlib.compress(data, 9), "size": len(data)})
+                    conn.execute(text(
+                        "UPDATE email_logs SET body_hash = :hash, content_html = NULL WHERE id = :id"
+                    ), {"hash": digest, "id": log_id})
+                conn.commit()
+                moved += len(rows)
+                logger.info(f"已迁移 {moved} 条邮件日志正文")
+
+            bodies = conn.execute(text("SELECT COUNT(*) FROM email_bodies")).scalar()
+            logger.info(f"共迁移 {moved} 条邮件日志正文，去重后保存 {bodies} 份正文")
+
+        # 归还旧正文占用的空间；未启用增量回收的数据库需先运行enable_incremental_vacuum.py
+        connection = engine.raw_connection()
+        try:
+            connection.driver_connection.isolation_level = None
+            if connection.driver_connection.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+                connection.driver_connection.executescript("PRAGMA incremental_vacuum")
+                logger.info("已回收空闲页")
+            else:
+                logger.info("数据库未启用增量回收，运行enable_incremental_vacuum.py后可缩小数据库文件")
+        finally:
+            connection.close()
+
+        return True
+    except Exception as e:
+        logger.error(f"迁移失败: {str(e)}")
+        return False
+
+if __name__ == "__main__":
+    logger.info("开始迁移...")
+    success = run_migration()
+    if success:
+        logger.info("迁移成功完成")
+    else:
+        logger.error("迁移失败")
+        sys.exit(1)
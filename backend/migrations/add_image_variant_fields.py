@@ -0,0 +1,62 @@
+"""
+添加设备图片变体字段的数据库迁移脚本
+Database migration script to add image variant fields to equipment table
+"""
+import os
+import sys
+import logging
+from sqlalchemy import create_engine, text
+
+# 添加项目根目录到Python路径
+project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(project_root)
+
+# 导入配置
+from config import DATABASE_URL
+
+# 设置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 需要添加的字段
+NEW_COLUMNS = ["thumbnail_path", "image_webp_path", "image_avif_path"]
+
+def run_migration():
+    """
+    运行迁移
+    Run migration
+    """
+    try:
+        # 创建数据库引擎
+        engine = create_engine(DATABASE_URL)
+
+        # 连接数据库
+        with engine.connect() as conn:
+            # 对于SQLite，我们使用PRAGMA table_info来检查字段是否存在
+            result = conn.execute(text("PRAGMA table_info(equipment)"))
+            existing = {column[1] for column in result.fetchall()}
+
+            for column in NEW_COLUMNS:
+                if column in existing:
+                    logger.info(f"{column}字段已存在，无需添加")
+                    continue
+                conn.execute(text(f"ALTER TABLE equipment ADD COLUMN {column} VARCHAR(255)"))
+                logger.info(f"成功添加{column}字段到equipment表")
+            conn.commit()
+
+        # 已有图片的变体由单独的脚本生成（需要Pillow，耗时较长）
+        logger.info("请运行 scripts/database/backfill_image_variants.py 为已有设备图片生成变体")
+
+        return True
+    except Exception as e:
+        logger.error(f"迁移失败: {str(e)}")
+        return False
+
+if __name__ == "__main__":
+    logger.info("开始迁移...")
+    success = run_migration()
+    if success:
+        logger.info("迁移成功完成")
+    else:
+        logger.error("迁移失败")
+        sys.exit(1)
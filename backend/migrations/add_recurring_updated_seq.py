@@ -0,0 +1,60 @@
+"""
+添加循环预约变更序号字段的数据库迁移脚本
+Database migration script to add the change sequence field to recurring_reservation table
+"""
+import os
+import sys
+import logging
+from sqlalchemy import create_engine, text
+
+# 添加项目根目录到Python路径
+project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(project_root)
+
+# 导入配置
+from config import DATABASE_URL
+
+# 设置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def run_migration():
+    """
+    运行迁移
+    Run migration
+    """
+    try:
+        # 创建数据库引擎
+        engine = create_engine(DATABASE_URL)
+
+        # 连接数据库
+        with engine.connect() as conn:
+            # 对于SQLite，我们使用PRAGMA table_info来检查字段是否存在
+            result = conn.execute(text("PRAGMA table_info(recurring_reservation)"))
+            existing = {column[1] for column in result.fetchall()}
+
+            if "updated_seq" in existing:
+                logger.info("updated_seq字段已存在，无需添加")
+            else:
+                conn.execute(text("ALTER TABLE recurring_reservation ADD COLUMN updated_seq INTEGER NOT NULL DEFAULT 0"))
+                logger.info("成功添加updated_seq字段到recurring_reservation表")
+
+            conn.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_recurring_reservation_updated_seq ON recurring_reservation (updated_seq)"
+            ))
+            logger.info("已创建updated_seq索引")
+            conn.commit()
+
+        return True
+    except Exception as e:
+        logger.error(f"迁移失败: {str(e)}")
+        return False
+
+if __name__ == "__main__":
+    logger.info("开始迁移...")
+    success = run_migration()
+    if success:
+        logger.info("迁移成功完成")
+    else:
+        logger.error("迁移失败")
+        sys.exit(1)
@@ -0,0 +1,109 @@
+"""
+为预约表启用AUTOINCREMENT的数据库迁移脚本
+Database migration script to enable AUTOINCREMENT on the reservation table
+
+没有AUTOINCREMENT时SQLite按max(rowid)+1分配ID，ID最大的预约被删除或归档后，新预约会
+复用已归档预约的ID，归档时主键冲突。本脚本按模型重建reservation表并把自增序列设为
+预约表和归档表中最大的ID。
+Without AUTOINCREMENT SQLite hands out max(rowid)+1, so once the highest reservation is
+deleted or archived a new reservation reuses an archived id and archiving it hits a
+primary-key conflict. This script rebuilds the reservation table from the model and seeds
+the sequence with the highest id of the reservation and archive tables.
+"""
+import os
+import sys
+import logging
+from sqlalchemy import create_engine
+from sqlalchemy.schema import CreateIndex, CreateTable
+
+# 添加项目根目录到Python路径
+project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(project_root)
+
+# 导入配置
+from config import DATABASE_URL
+from backend.models.reservation import Reservation
+
+# 设置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def run_migration():
+    """
+    运行迁移
+    Run migration
+    """
+    try:
+        # 创建数据库引擎
+        engine = create_engine(DATABASE_URL)
+
+        # 重建表需要手动控制事务，使用自动提交的原始连接
+        connection = engine.raw_connection()
+        try:
+            connection.driver_connection.isolation_level = None
+            cursor = connection.driver_connection.cursor()
+            table_sql = cursor.execute(
+                "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'reservation'"
+            ).fetchone()[0]
+
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                if "AUTOINCREMENT" in table_sql.upper():
+                    logger.info("reservation表已启用AUTOINCREMENT，无需重建")
+                else:
+                    # 重命名时不改写其他表中指向reservation的外键
+                    cursor.execute("PRAGMA legacy_alter_table = ON")
+                    cursor.execute("ALTER TABLE reservation RENAME TO reservation_old")
+                    old_indexes = [row[0] for row in cursor.execute(
+                        "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'reservation_old' AND sql IS NOT NULL"
+                    ).fetchall()]
+                    for name in old_indexes:
+                        cursor.execute(f'DROP INDEX "{name}"')
+
+                    # 按模型建表和索引，复制两边共有的列
+                    cursor.execute(str(CreateTable(Reservation.__table__).compile(engine)))
+                    for index in Reservation.__table__.indexes:
+                        cursor.execute(str(CreateIndex(index).compile(engine)))
+                    old_columns = {row[1] for row in cursor.execute("PRAGMA table_info(reservation_old)").fetchall()}
+                    columns = ", ".join(
+                        f'"{column.name}"' for column in Reservation.__table__.columns if column.name in old_columns
+                    )
+                    cursor.execute(f"INSERT INTO reservation ({columns}) SELECT {columns} FROM reservation_old")
+                    cursor.execute("DROP TABLE reservation_old")
+                    cursor.execute("PRAGMA legacy_alter_table = OFF")
+                    logger.info("成功按AUTOINCREMENT重建reservation表")
+
+                # 自增序列从预约表和归档表中最大的ID之后开始
+                has_archive = cursor.execute(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'reservation_archive'"
+                ).fetchone()
+                max_id = cursor.execute(
+                    "SELECT MAX(id) FROM (SELECT MAX(id) AS id FROM reservation"
+                    + (" UNION ALL SELECT MAX(id) FROM reservation_archive" if has_archive else "") + ")"
+                ).fetchone()[0] or 0
+                current = cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'reservation'").fetchone()
+                if current is None:
+                    cursor.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('reservation', ?)", (max_id,))
+                elif current[0] < max_id:
+                    cursor.execute("UPDATE sqlite_sequence SET seq = ? WHERE name = 'reservation'", (max_id,))
+                cursor.execute("COMMIT")
+                logger.info(f"预约ID将从 {max(max_id, current[0] if current else 0) + 1} 开始分配")
+            except Exception:
+                cursor.execute("ROLLBACK")
+                raise
+        finally:
+            connection.close()
+
+        return True
+    except Exception as e:
+        logger.error(f"迁移失败: {str(e)}")
+        return False
+
+if __name__ == "__main__":
+    logger.info("开始迁移...")
+    success = run_migration()
+    if success:
+        logger.info("迁移成功完成")
+    else:
+        logger.error("迁移失败")
+        sys.exit(1)
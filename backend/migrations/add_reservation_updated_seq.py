@@ -0,0 +1,81 @@
+"""
+添加预约变更序号字段的数据库迁移脚本
+Database migration script to add the change sequence field to reservation table
+"""
+import os
+import sys
+import logging
+from sqlalchemy import create_engine, text
+
+# 添加项目根目录到Python路径
+project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(project_root)
+
+# 导入配置
+from config import DATABASE_URL
+
+# 设置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def run_migration():
+    """
+    运行迁移
+    Run migration
+    """
+    try:
+        # 创建数据库引擎
+        engine = create_engine(DATABASE_URL)
+
+        # 连接数据库
+        with engine.connect() as conn:
+            # 对于SQLite，我们使用PRAGMA table_info来检查字段是否存在
+            result = conn.execute(text("PRAGMA table_info(reservation)"))
+            existing = {column[1] for column in result.fetchall()}
+
+            if "updated_seq" in existing:
+                logger.info("updated_seq字段已存在，无需添加")
+            else:
+                conn.execute(text("ALTER TABLE reservation ADD COLUMN updated_seq INTEGER NOT NULL DEFAULT 0"))
+                logger.info("成功添加updated_seq字段到reservation表")
+
+            conn.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_reservation_updated_seq ON reservation (updated_seq)"
+            ))
+            logger.info("已创建updated_seq索引")
+
+            # 删除记录表由init_db创建，这里一并创建以便单独运行迁移
+            conn.execute(text("""
+                CREATE TABLE IF NOT EXISTS reservation_tombstone (
+                    id INTEGER PRIMARY KEY,
+                    reservation_id INTEGER NOT NULL,
+                    equipment_id INTEGER NOT NULL,
+                    recurring_reservation_id INTEGER,
+                    updated_seq INTEGER NOT NULL,
+                    deleted_at DATETIME
+                )
+            """))
+            conn.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_reservation_tombstone_updated_seq ON reservation_tombstone (updated_seq)"
+            ))
+
+            # 早期创建的删除记录表没有recurring_reservation_id字段
+            result = conn.execute(text("PRAGMA table_info(reservation_tombstone)"))
+            if "recurring_reservation_id" not in {column[1] for column in result.fetchall()}:
+                conn.execute(text("ALTER TABLE reservation_tombstone ADD COLUMN recurring_reservation_id INTEGER"))
+                logger.info("成功添加recurring_reservation_id字段到reservation_tombstone表")
+            conn.commit()
+
+        return True
+    except Exception as e:
+        logger.error(f"迁移失败: {str(e)}")
+        return False
+
+if __name__ == "__main__":
+    logger.info("开始迁移...")
+    success = run_migration()
+    if success:
+        logger.info("迁移成功完成")
+    else:
+        logger.error("迁移失败")
+        sys.exit(1)
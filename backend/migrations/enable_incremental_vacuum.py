@@ -0,0 +1,58 @@
+"""
+启用SQLite增量回收的数据库迁移脚本
+Database migration script to enable SQLite incremental auto-vacuum
+"""
+import os
+import sys
+import logging
+from sqlalchemy import create_engine
+
+# 添加项目根目录到Python路径
+project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(project_root)
+
+# 导入配置
+from config import DATABASE_URL
+
+# 设置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def run_migration():
+    """
+    运行迁移
+    Run migration
+    """
+    try:
+        # 创建数据库引擎
+        engine = create_engine(DATABASE_URL)
+
+        # auto_vacuum只能在VACUUM时切换，VACUUM不能在事务中执行，使用自动提交的原始连接
+        connection = engine.raw_connection()
+        try:
+            connection.driver_connection.isolation_level = None
+            cursor = connection.driver_connection.cursor()
+            mode = cursor.execute("PRAGMA auto_vacuum").fetchone()[0]
+            if mode == 2:
+                logger.info("数据库已启用增量回收，无需迁移")
+            else:
+                cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+                logger.info("正在执行VACUUM重建数据库，数据库较大时可能需要一些时间...")
+                cursor.execute("VACUUM")
+                logger.info("成功启用增量回收")
+        finally:
+            connection.close()
+
+        return True
+    except Exception as e:
+        logger.error(f"迁移失败: {str(e)}")
+        return False
+
+if __name__ == "__main__":
+    logger.info("开始迁移...")
+    success = run_migration()
+    if success:
+        logger.info("迁移成功完成")
+    else:
+        logger.error("迁移失败")
+        sys.exit(1)
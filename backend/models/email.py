@@ -2,7 +2,7 @@
 邮件相关模型
 Email related models
 """
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, Text, JSON, func
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, Text, JSON, LargeBinary, func
 from backend.utils.db_utils import BeijingNow
 from sqlalchemy.orm import relationship
 
@@ -70,7 +70,24 @@ class EmailLog(Base):
     reservation_code = Column(String(20), comment="关联的预定码")
     reservation_number = Column(String(20), comment="关联的预约序号")
     created_at = Column(DateTime, default=BeijingNow(), comment="创建时间")
-    content_html = Column(Text, comment="邮件内容HTML")
+    content_html = Column(Text, comment="邮件内容HTML（旧数据，新日志只保存body_hash）")
+    body_hash = Column(String(64), index=True, comment="邮件正文在email_bodies表中的SHA-256")
 
     def __repr__(self):
-        return f"<EmailLog {self.id}: {self.recipient}>"
\ No newline at end of file
+        return f"<EmailLog {self.id}: {self.recipient}>"
+
+class EmailBody(Base):
+    """
+    邮件正文模型类：按内容SHA-256去重、zlib压缩保存，多条日志共用同一正文
+    Email body model class: deduplicated by SHA-256 of the content and stored zlib-compressed,
+    shared by every log with the same body
+    """
+    __tablename__ = "email_bodies"
+
+    hash = Column(String(64), primary_key=True, comment="HTML内容的SHA-256")
+    content = Column(LargeBinary, nullable=False, comment="zlib压缩的HTML内容")
+    size = Column(Integer, nullable=False, comment="压缩前的字节数")
+    created_at = Column(DateTime, default=BeijingNow(), comment="创建时间")
+
+    def __repr__(self):
+        return f"<EmailBody {self.hash[:12]}>"
@@ -23,6 +23,9 @@ class Equipment(Base):
     status = Column(String(20), default="available", comment="设备状态: available, maintenance")
     description = Column(Text, comment="设备描述")
     image_path = Column(String(255), comment="设备图片路径")
+    thumbnail_path = Column(String(255), comment="缩略图路径(WebP)")
+    image_webp_path = Column(String(255), comment="WebP图片路径")
+    image_avif_path = Column(String(255), comment="AVIF图片路径")
     user_guide = Column(Text, comment="设备使用指南")
     video_tutorial = Column(String(255), comment="视频教程链接")
     created_at = Column(DateTime, default=BeijingNow(), comment="创建时间")
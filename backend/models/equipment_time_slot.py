@@ -4,7 +4,10 @@ from sqlalchemy.orm import relationship
 from backend.database import Base
 
 class EquipmentTimeSlot(Base):
-    """设备时间段模型，用于跟踪设备在特定时间段内的同时预约情况"""
+    """
+    设备时间段模型（历史数据）
+    同时预约容量现由有效预约通过扫描线实时计算，创建/取消预约不再维护此表的计数
+    """
     __tablename__ = "equipment_time_slots"
 
     id = Column(Integer, primary_key=True, index=True)
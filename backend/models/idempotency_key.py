@@ -0,0 +1,27 @@
+"""
+幂等键模型
+Idempotency key model
+"""
+from sqlalchemy import Column, Integer, String, Text, DateTime
+
+from backend.database import Base
+from backend.utils.db_utils import get_beijing_now
+
+class IdempotencyKey(Base):
+    """
+    幂等键模型类，保存带Idempotency-Key请求的首次响应
+    Idempotency key model class, stores the first response of a request carrying an Idempotency-Key
+    """
+    __tablename__ = "idempotency_key"
+
+    id = Column(Integer, primary_key=True, index=True)
+    idempotency_key = Column(String(128), nullable=False, unique=True, index=True, comment="客户端提供的幂等键")
+    scope = Column(String(50), nullable=False, comment="接口范围，如 reservation.create")
+    request_hash = Column(String(64), nullable=False, comment="请求参数的SHA-256摘要")
+    status = Column(String(20), nullable=False, default="processing", comment="状态: processing, completed")
+    response_body = Column(Text, comment="首次响应，JSON格式")
+    created_at = Column(DateTime, default=get_beijing_now, comment="创建时间")
+    expires_at = Column(DateTime, nullable=False, index=True, comment="过期时间")
+
+    def __repr__(self):
+        return f"<IdempotencyKey {self.idempotency_key}: {self.scope} {self.status}>"
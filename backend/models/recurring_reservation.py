@@ -38,6 +38,12 @@ class RecurringReservation(Base):
     total_planned = Column(Integer, nullable=True, comment="计划创建的子预约总数")
     created_count = Column(Integer, nullable=True, comment="成功创建的子预约数量")
 
+    # 滚动生成：只生成到该日期为止的子预约，之后的发生日期由后台任务逐步生成；为空表示已全部生成
+    materialized_until = Column(Date, nullable=True, comment="子预约已生成到的日期")
+
+    # 与预约共用的变更序号：尚未生成子预约的系列在创建、修改、取消时同样改变日历同步令牌
+    updated_seq = Column(Integer, nullable=False, default=0, index=True, comment="变更序号，每次新增/修改时递增，用于日历增量同步")
+
     # 关系
     equipment = relationship("Equipment", back_populates="recurring_reservations")
     reservations = relationship("Reservation", back_populates="recurring_reservation", cascade="all, delete-orphan")
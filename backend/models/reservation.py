@@ -2,12 +2,14 @@
 预定模型
 Reservation model
 """
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, event, func, insert, select
+from sqlalchemy.orm import relationship, object_session
 
-from backend.utils.db_utils import BeijingNow
+from backend.utils.db_utils import BeijingNow, get_beijing_now
 
 from backend.database import Base
+from backend.models.reservation_tombstone import ReservationTombstone
+from backend.models.recurring_reservation import RecurringReservation
 
 class Reservation(Base):
     """
@@ -15,6 +17,8 @@ class Reservation(Base):
     Reservation model class
     """
     __tablename__ = "reservation"
+    # SQLite使用AUTOINCREMENT，已删除或已归档的预约ID不会被重新分配
+    __table_args__ = {"sqlite_autoincrement": True}
 
     id = Column(Integer, primary_key=True, index=True)
     reservation_number = Column(String(20), unique=True, nullable=False, index=True, comment="预约序号，唯一标识每个预约")
@@ -29,12 +33,13 @@ class Reservation(Base):
     purpose = Column(Text, comment="使用目的")
     status = Column(String(20), default="confirmed", comment="状态: confirmed(已确认), in_use(使用中), expired(已过期), cancelled(已取消)")
     created_at = Column(DateTime, default=BeijingNow(), comment="创建时间")
+    updated_seq = Column(Integer, nullable=False, default=0, index=True, comment="变更序号，每次新增/修改时递增，用于日历增量同步")
 
     # 循环预约相关字段
     recurring_reservation_id = Column(Integer, ForeignKey("recurring_reservation.id"), nullable=True, comment="循环预约ID")
     is_exception = Column(Integer, default=0, comment="是否为循环预约的例外，0表示否，1表示是")
 
-    # 时间段关联
+    # 时间段关联（历史字段，新预约不再写入）
     time_slot_id = Column(Integer, ForeignKey("equipment_time_slots.id"), nullable=True, comment="关联的设备时间段ID")
 
     # 关系
@@ -46,3 +51,44 @@ class Reservation(Base):
 
     def __repr__(self):
         return f"<Reservation {self.reservation_number}>"
+
+
+def next_updated_seq():
+    """
+    下一个变更序号的SQL表达式，在写入语句中求值，写锁保证序号单调递增；
+    预约、删除记录和循环预约共用同一序列
+    SQL expression for the next change sequence, evaluated inside the write statement so
+    the write lock keeps it monotonic; reservations, tombstones and series share the sequence
+    """
+    return select(
+        func.max(
+            select(func.coalesce(func.max(Reservation.updated_seq), 0)).scalar_subquery(),
+            select(func.coalesce(func.max(ReservationTombstone.updated_seq), 0)).scalar_subquery(),
+            select(func.coalesce(func.max(RecurringReservation.updated_seq), 0)).scalar_subquery()
+        ) + 1
+    ).scalar_subquery()
+
+@event.listens_for(Reservation, "before_insert")
+@event.listens_for(RecurringReservation, "before_insert")
+def _set_updated_seq(mapper, connection, target):
+    """新增预约或循环预约时分配变更序号"""
+    target.updated_seq = next_updated_seq()
+
+@event.listens_for(Reservation, "before_update")
+@event.listens_for(RecurringReservation, "before_update")
+def _bump_updated_seq(mapper, connection, target):
+    """字段确有修改时更新变更序号"""
+    session = object_session(target)
+    if session is not None and session.is_modified(target, include_collections=False):
+        target.updated_seq = next_updated_seq()
+
+@event.listens_for(Reservation, "after_delete")
+def _record_tombstone(mapper, connection, target):
+    """物理删除预约时写入删除记录"""
+    connection.execute(insert(ReservationTombstone).values(
+        reservation_id=target.id,
+        equipment_id=target.equipment_id,
+        recurring_reservation_id=target.recurring_reservation_id,
+        updated_seq=next_updated_seq(),
+        deleted_at=get_beijing_now()
+    ))
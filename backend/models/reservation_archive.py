@@ -0,0 +1,65 @@
+"""
+预约归档模型
+Reservation archive models
+"""
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey
+from sqlalchemy.orm import relationship
+
+from backend.database import Base
+from backend.utils.db_utils import get_beijing_now
+
+class ReservationArchive(Base):
+    """
+    预约归档模型类，字段与reservation表一致，保存已结束较久的已过期/已取消预约
+    Reservation archive model class; same columns as the reservation table, holding
+    expired/cancelled reservations that ended long ago
+    """
+    __tablename__ = "reservation_archive"
+
+    # 保留原预约ID，不自动分配
+    id = Column(Integer, primary_key=True, autoincrement=False, comment="原预约ID")
+    reservation_number = Column(String(20), unique=True, nullable=False, index=True, comment="预约序号")
+    equipment_id = Column(Integer, ForeignKey("equipment.id"), nullable=False, comment="设备ID")
+    reservation_code = Column(String(20), nullable=False, index=True, comment="预定码")
+    user_name = Column(String(100), nullable=False, comment="用户姓名")
+    user_department = Column(String(100), nullable=False, comment="用户部门")
+    user_contact = Column(String(100), nullable=False, comment="联系方式")
+    user_email = Column(String(100), comment="用户邮箱")
+    start_datetime = Column(DateTime, nullable=False, index=True, comment="开始时间")
+    end_datetime = Column(DateTime, nullable=False, comment="结束时间")
+    purpose = Column(Text, comment="使用目的")
+    status = Column(String(20), comment="状态: expired(已过期), cancelled(已取消)")
+    created_at = Column(DateTime, comment="创建时间")
+    updated_seq = Column(Integer, nullable=False, default=0, comment="归档前的变更序号")
+    recurring_reservation_id = Column(Integer, nullable=True, index=True, comment="循环预约ID")
+    is_exception = Column(Integer, default=0, comment="是否为循环预约的例外")
+    time_slot_id = Column(Integer, nullable=True, comment="关联的设备时间段ID（历史字段）")
+    archived_at = Column(DateTime, default=get_beijing_now, comment="归档时间")
+
+    # 关系
+    equipment = relationship("Equipment", viewonly=True)
+
+    def __repr__(self):
+        return f"<ReservationArchive {self.reservation_number}>"
+
+class ReservationHistoryArchive(Base):
+    """
+    预约历史记录归档模型类，随预约一起归档
+    Reservation history archive model class, archived together with its reservation
+    """
+    __tablename__ = "reservation_history_archive"
+
+    id = Column(Integer, primary_key=True, index=True)
+    reservation_id = Column(Integer, nullable=False, index=True, comment="原预约ID")
+    reservation_code = Column(String(20), nullable=False, index=True, comment="预定码")
+    reservation_number = Column(String(20), nullable=True, index=True, comment="预定序号")
+    user_type = Column(String(20), nullable=False, comment="用户类型: admin, user")
+    user_id = Column(String(50), comment="用户ID或用户名")
+    action = Column(String(50), nullable=False, comment="操作类型: update, status_change")
+    field_name = Column(String(50), comment="修改的字段名")
+    old_value = Column(Text, comment="修改前的值")
+    new_value = Column(Text, comment="修改后的值")
+    created_at = Column(DateTime, comment="创建时间")
+
+    def __repr__(self):
+        return f"<ReservationHistoryArchive {self.id}: {self.action} {self.field_name}>"
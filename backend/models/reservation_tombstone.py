@@ -0,0 +1,28 @@
+"""
+预约删除记录模型
+Reservation tombstone model
+"""
+from sqlalchemy import Column, Integer, DateTime
+
+from backend.database import Base
+from backend.utils.db_utils import get_beijing_now
+
+class ReservationTombstone(Base):
+    """
+    预约删除记录模型类，记录被物理删除的预约，供日历增量同步返回删除事件；
+    超过TOMBSTONE_RETENTION_DAYS的记录由例行维护清理
+    Reservation tombstone model class, records hard-deleted reservations so calendar
+    delta syncs can report them as removed; rows older than TOMBSTONE_RETENTION_DAYS are
+    purged by routine maintenance
+    """
+    __tablename__ = "reservation_tombstone"
+
+    id = Column(Integer, primary_key=True, index=True)
+    reservation_id = Column(Integer, nullable=False, comment="被删除的预约ID")
+    equipment_id = Column(Integer, nullable=False, comment="设备ID")
+    recurring_reservation_id = Column(Integer, nullable=True, comment="所属循环预约ID")
+    updated_seq = Column(Integer, nullable=False, index=True, comment="删除时的变更序号")
+    deleted_at = Column(DateTime, default=get_beijing_now, comment="删除时间")
+
+    def __repr__(self):
+        return f"<ReservationTombstone {self.reservation_id}: {self.updated_seq}>"
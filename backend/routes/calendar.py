@@ -1,12 +1,18 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from sqlalchemy import func, select
 from sqlalchemy.orm import Session
-from typing import Optional
+from typing import Dict, Iterable, List, Optional, Tuple
+from collections import defaultdict
 from datetime import datetime
+import hashlib
 
 from backend.database import get_db
-from backend.models.reservation import Reservation
+from backend.models.recurring_reservation import RecurringReservation
+from backend.models.reservation import Reservation, next_updated_seq
+from backend.models.reservation_tombstone import ReservationTombstone
 from backend.models.equipment import Equipment
-from backend.routes.crud.equipment import get_equipment
+from backend.utils.fast_json import FastJSONResponse
+from backend.utils.recurrence import build_series_layout, query_unmaterialized_series
 import logging
 
 logger = logging.getLogger(__name__)
@@ -14,11 +20,288 @@ router = APIRouter(
     tags=["calendar"],
 )
 
+# 日历中显示的预约状态
+CALENDAR_STATUSES = ("confirmed", "in_use")
+# 可由循环规则展开的子预约状态（使用中的子预约颜色不同，作为例外单独返回）
+SERIES_STATUSES = ("confirmed",)
+
+def get_sync_token(db: Session) -> str:
+    """
+    生成同步令牌：预约和循环预约的最新变更序号 + 设备最后修改时间（设备改名会影响事件标题）
+    Build the sync token: latest reservation and series change sequence plus the latest
+    equipment update time (renaming equipment changes event titles)
+    """
+    current_seq = db.execute(select(next_updated_seq() - 1)).scalar() or 0
+    equipment_updated = db.query(func.max(Equipment.updated_at)).scalar()
+    equipment_version = equipment_updated.strftime("%Y%m%d%H%M%S%f") if equipment_updated else "0"
+    return f"{current_seq}-{equipment_version}"
+
+def get_oldest_tombstone_seq(db: Session) -> int:
+    """
+    仍保留的最旧删除记录的变更序号，没有删除记录时为0
+    Change sequence of the oldest tombstone still kept; 0 when there are none
+    """
+    return db.query(func.min(ReservationTombstone.updated_seq)).scalar() or 0
+
+def parse_sync_token(since: Optional[str], current_token: str, oldest_tombstone_seq: int = 0) -> Optional[int]:
+    """
+    解析客户端的同步令牌，返回变更序号；令牌无效、来自未来或设备已修改时返回None（需要全量同步）
+    Parse the client's sync token into a change sequence; returns None (full sync needed)
+    when it is invalid, ahead of the server or the equipment changed since
+
+    早于仍保留的最旧删除记录的令牌同样需要全量同步，期间的删除记录可能已被例行维护清理。
+    Tokens older than the oldest tombstone still kept need a full sync too, since
+    routine maintenance may have purged deletions made after them.
+    """
+    if not since:
+        return None
+    try:
+        since_seq, since_equipment = since.split("-", 1)
+        since_seq = int(since_seq)
+    except ValueError:
+        return None
+
+    current_seq, current_equipment = current_token.split("-", 1)
+    if since_equipment != current_equipment or since_seq < 0 or since_seq > int(current_seq):
+        return None
+    if since_seq < oldest_tombstone_seq - 1:
+        return None
+    return since_seq
+
+def build_event(res: Reservation, equipment_names: Dict[int, str]) -> dict:
+    """
+    将预约转换为日历事件
+    Convert a reservation to a calendar event
+    """
+    # 确定事件颜色 - 基于状态
+    color = "blue" if res.status == "in_use" else "green"
+
+    # 检查是否为循环预约的子预约
+    is_recurring = res.recurring_reservation_id is not None
+
+    return {
+        "id": res.id,
+        "title": equipment_names.get(res.equipment_id),  # 事件标题为设备名称
+        "start": res.start_datetime.isoformat(),
+        "end": res.end_datetime.isoformat(),
+        "color": color,
+        "borderColor": "#ff9800" if is_recurring else color,  # 循环预约使用特殊边框
+        "extendedProps": {
+            "status": res.status,
+            "userName": res.user_name,
+            "userDepartment": res.user_department,
+            "equipmentId": res.equipment_id,
+            "reservationCode": res.reservation_code,
+            "reservationNumber": res.reservation_number,
+            "isRecurring": is_recurring,
+            "recurringReservationId": res.recurring_reservation_id,
+            "purpose": res.purpose,
+            "userEmail": res.user_email
+        }
+    }
+
+def get_equipment_names(db: Session, equipment_ids: Iterable[int]) -> Dict[int, str]:
+    """
+    一次查询取出设备名称
+    Resolve equipment names in one query
+    """
+    equipment_ids = set(equipment_ids)
+    if not equipment_ids:
+        return {}
+    return dict(db.query(Equipment.id, Equipment.name).filter(Equipment.id.in_(equipment_ids)).all())
+
+def build_series_event(recurring: RecurringReservation, series: dict, equipment_names: Dict[int, str]) -> dict:
+    """
+    将循环预约转换为日历系列：RRULE + EXDATE，由客户端展开为事件
+    Convert a recurring reservation to a calendar series (RRULE + EXDATE) the client expands
+    """
+    return {
+        "id": f"series-{recurring.id}",
+        "title": equipment_names.get(recurring.equipment_id),
+        "color": "green",
+        "borderColor": "#ff9800",  # 循环预约使用特殊边框
+        "dtstart": series["dtstart"],
+        "endTime": recurring.end_time.isoformat(),
+        "rrule": series["rrule"],
+        "exdate": series["exdate"],
+        "instances": series["instances"],
+        "extendedProps": {
+            "status": "confirmed",
+            "userName": recurring.user_name,
+            "userDepartment": recurring.user_department,
+            "equipmentId": recurring.equipment_id,
+            "reservationCode": recurring.reservation_code,
+            "isRecurring": True,
+            "recurringReservationId": recurring.id,
+            "purpose": recurring.purpose,
+            "userEmail": recurring.user_email
+        }
+    }
+
+def build_calendar(
+    db: Session,
+    reservations: List[Reservation],
+    series_children: Dict[int, List[Reservation]],
+    start: datetime,
+    end: datetime
+) -> Tuple[List[dict], List[dict], List[int]]:
+    """
+    生成日历数据：普通预约逐条返回，循环预约按系列返回，只单独返回例外子预约
+    Build calendar data: plain reservations one by one, recurring reservations as series
+    with only their exception children returned individually
+
+    series_children为循环预约ID -> 范围内显示的子预约。返回(事件, 系列, 范围内没有实例的系列ID)。
+    series_children maps recurring id -> its displayed children in range. Returns
+    (events, series, ids of series without instances in range).
+    """
+    masters = {
+        recurring.id: recurring
+        for recurring in db.query(RecurringReservation).filter(
+            RecurringReservation.id.in_(list(series_children))
+        ).all()
+    } if series_children else {}
+
+    singles = list(reservations)
+    series_layouts = []
+    empty_series = []
+    for recurring_id, children in series_children.items():
+        recurring = masters.get(recurring_id)
+        if recurring is None:
+            singles.extend(children)
+            empty_series.append(recurring_id)
+            continue
+        series, exceptions = build_series_layout(recurring, children, SERIES_STATUSES, start, end)
+        singles.extend(exceptions)
+        if series is None:
+            empty_series.append(recurring_id)
+        else:
+            series_layouts.append((recurring, series))
+
+    equipment_names = get_equipment_names(
+        db,
+        [res.equipment_id for res in singles] + [recurring.equipment_id for recurring, _ in series_layouts]
+    )
+    events = [build_event(res, equipment_names) for res in singles]
+    series_events = [build_series_event(recurring, series, equipment_names) for recurring, series in series_layouts]
+    return events, series_events, empty_series
+
+def in_calendar_view(res: Reservation, start: datetime, end: datetime, equipment_id: Optional[int]) -> bool:
+    """
+    判断预约是否应显示在当前日历范围中
+    Whether a reservation belongs in the requested calendar range
+    """
+    return (
+        res.status in CALENDAR_STATUSES
+        and res.start_datetime >= start
+        and res.end_datetime <= end
+        and (equipment_id is None or res.equipment_id == equipment_id)
+    )
+
+def calendar_query(db: Session, start: datetime, end: datetime, equipment_id: Optional[int]):
+    """
+    查询范围内显示的预约
+    Query the reservations displayed in the range
+    """
+    query = db.query(Reservation).filter(
+        Reservation.start_datetime >= start,
+        Reservation.end_datetime <= end,
+        Reservation.status.in_(CALENDAR_STATUSES)  # 显示已确认和使用中的预约
+    )
+
+    # 如果提供了设备ID，添加设备筛选条件
+    if equipment_id is not None:
+        query = query.filter(Reservation.equipment_id == equipment_id)
+    return query
+
+def split_series(reservations: Iterable[Reservation]) -> Tuple[List[Reservation], Dict[int, List[Reservation]]]:
+    """
+    区分普通预约和循环预约的子预约
+    Split plain reservations from recurring children
+    """
+    singles = []
+    series_children = defaultdict(list)
+    for res in reservations:
+        if res.recurring_reservation_id is None:
+            singles.append(res)
+        else:
+            series_children[res.recurring_reservation_id].append(res)
+    return singles, series_children
+
+def get_virtual_series_ids(db: Session, start: datetime, end: datetime, equipment_id: Optional[int]) -> List[int]:
+    """
+    查询范围内有尚未生成发生的循环预约（这些日期还没有子预约，但由规则展开显示）
+    Find series with unmaterialized occurrences in the range (no children exist for those
+    dates yet, but they are displayed from the rule)
+    """
+    query = query_unmaterialized_series(db, [equipment_id] if equipment_id is not None else None).filter(
+        RecurringReservation.materialized_until < end.date(),
+        RecurringReservation.end_date >= start.date()
+    ).with_entities(RecurringReservation.id)
+    return [row.id for row in query.all()]
+
+def get_calendar_changes(
+    db: Session,
+    since_seq: int,
+    start: datetime,
+    end: datetime,
+    equipment_id: Optional[int]
+) -> Tuple[List[Reservation], List[int], Dict[int, List[Reservation]]]:
+    """
+    查询变更序号大于since_seq的预约和循环预约
+    Find reservations and series changed after since_seq
+
+    返回(需要新增或更新的普通预约, 需要移除的预约ID, 受影响的循环预约ID -> 范围内显示的子预约)。
+    取消、过期、移出范围及被删除的预约都作为移除返回，客户端没有的ID直接忽略即可；
+    受影响的循环预约（包括本身被创建、修改或取消、尚无子预约的系列）整体重新生成。
+    Returns (plain reservations to add or update, reservation ids to remove, affected
+    recurring id -> its displayed children in range). Cancelled, expired, moved-out and
+    deleted reservations are all reported as removed, and clients ignore ids they do not
+    have; affected series, including series created, edited or cancelled before any of
+    their children exist, are rebuilt as a whole.
+    """
+    changed = []
+    removed = []
+    affected_series = set()
+    for res in db.query(Reservation).filter(Reservation.updated_seq > since_seq).all():
+        if res.recurring_reservation_id is not None:
+            # 子预约先按ID移除，再随系列重新返回
+            affected_series.add(res.recurring_reservation_id)
+            removed.append(res.id)
+        elif in_calendar_view(res, start, end, equipment_id):
+            changed.append(res)
+        else:
+            removed.append(res.id)
+
+    tombstones = db.query(
+        ReservationTombstone.reservation_id,
+        ReservationTombstone.recurring_reservation_id
+    ).filter(ReservationTombstone.updated_seq > since_seq).all()
+    for reservation_id, recurring_reservation_id in tombstones:
+        removed.append(reservation_id)
+        if recurring_reservation_id is not None:
+            affected_series.add(recurring_reservation_id)
+
+    series_query = db.query(RecurringReservation.id).filter(RecurringReservation.updated_seq > since_seq)
+    if equipment_id is not None:
+        series_query = series_query.filter(RecurringReservation.equipment_id == equipment_id)
+    affected_series.update(row.id for row in series_query.all())
+
+    series_children = {recurring_id: [] for recurring_id in affected_series}
+    if affected_series:
+        children = calendar_query(db, start, end, equipment_id).filter(
+            Reservation.recurring_reservation_id.in_(list(affected_series))
+        ).all()
+        for res in children:
+            series_children[res.recurring_reservation_id].append(res)
+    return changed, removed, series_children
+
 @router.get("/api/reservations/calendar")
 async def get_calendar_reservations(
+    request: Request,
     start_date: str,
     end_date: str,
     equipment_id: Optional[int] = None,
+    since: Optional[str] = None,
     db: Session = Depends(get_db)
 ):
     """
@@ -29,62 +312,55 @@ async def get_calendar_reservations(
     - start_date: 开始日期
     - end_date: 结束日期
     - equipment_id: 可选的设备ID，用于筛选特定设备的预约
+    - since: 可选的同步令牌，提供时只返回该令牌之后新增、修改或移除的事件
+
+    响应中的token用于下一次增量请求；full为True表示返回的是完整事件列表。
+    循环预约以series返回（RRULE + EXDATE，由客户端展开），events中只包含普通预约和例外子预约；
+    增量响应中的series整体替换同ID的系列，removed_series为需要移除的系列。
+    响应带ETag，数据未变化时If-None-Match请求返回304。
+    The token in the response is used for the next delta request; full is True when the
+    complete event list was returned. Recurring reservations come back as series (RRULE +
+    EXDATE, expanded by the client) and events only hold plain reservations and exception
+    children; in a delta, each series replaces the one with the same id and removed_series
+    lists series to drop. Responses carry an ETag; unchanged data answers If-None-Match
+    requests with 304.
     """
     try:
         # 转换日期字符串为日期对象
         start = datetime.strptime(start_date, "%Y-%m-%d")
         end = datetime.strptime(end_date, "%Y-%m-%d")
 
-        # 构建查询 - 包括普通预约和循环预约的子预约
-        query = db.query(Reservation).filter(
-            Reservation.start_datetime >= start,
-            Reservation.end_datetime <= end,
-            Reservation.status.in_(["confirmed", "in_use"])  # 显示已确认和使用中的预约
-        )
-
-        # 如果提供了设备ID，添加设备筛选条件
-        if equipment_id is not None:
-            query = query.filter(Reservation.equipment_id == equipment_id)
-
-        reservations = query.all()
-
-        # 转换为日历事件格式
-        events = []
-        for res in reservations:
-            equipment = get_equipment(db, res.equipment_id)
-
-            # 确定事件颜色 - 基于状态
-            color = "blue" if res.status == "in_use" else "green"
-
-
-            # 构建事件标题 - 包含设备名称
-            title = equipment.name
-
-            # 检查是否为循环预约的子预约
-            is_recurring = res.recurring_reservation_id is not None
-
-            events.append({
-                "id": res.id,
-                "title": title,
-                "start": res.start_datetime.isoformat(),
-                "end": res.end_datetime.isoformat(),
-                "color": color,
-                "borderColor": "#ff9800" if is_recurring else color,  # 循环预约使用特殊边框
-                "extendedProps": {
-                    "status": res.status,
-                    "userName": res.user_name,
-                    "userDepartment": res.user_department,
-                    "equipmentId": res.equipment_id,
-                    "reservationCode": res.reservation_code,
-                    "reservationNumber": res.reservation_number,
-                    "isRecurring": is_recurring,
-                    "recurringReservationId": res.recurring_reservation_id,
-                    "purpose": res.purpose,
-                    "userEmail": res.user_email
-                }
-            })
-
-        return {"success": True, "events": events}
+        # 数据未变化时直接返回304，不再查询预约
+        token = get_sync_token(db)
+        etag_source = f"{start_date}|{end_date}|{equipment_id}|{since}|{token}"
+        etag = f'"{hashlib.sha1(etag_source.encode("utf-8")).hexdigest()}"'
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers=headers)
+
+        since_seq = parse_sync_token(since, token, get_oldest_tombstone_seq(db) if since else 0)
+        if since_seq is not None:
+            changed, removed, series_children = get_calendar_changes(db, since_seq, start, end, equipment_id)
+            full = False
+        else:
+            changed, series_children = split_series(calendar_query(db, start, end, equipment_id).all())
+            for recurring_id in get_virtual_series_ids(db, start, end, equipment_id):
+                series_children.setdefault(recurring_id, [])
+            removed = []
+            full = True
+
+        events, series, removed_series = build_calendar(db, changed, series_children, start, end)
+
+        # 事件列表可能很大，直接用orjson序列化
+        return FastJSONResponse({
+            "success": True,
+            "full": full,
+            "events": events,
+            "series": series,
+            "removed": removed,
+            "removed_series": [f"series-{recurring_id}" for recurring_id in removed_series],
+            "token": token
+        }, headers=headers)
     except Exception as e:
         logger.error(f"获取日历数据出错: {str(e)}")
         return {"success": False, "message": str(e)}
@@ -5,7 +5,7 @@ Email settings CRUD operations
 import logging
 from typing import List, Optional
 from fastapi import APIRouter, Depends, HTTPException, Query, Body
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, defer
 from sqlalchemy import desc
 
 from backend.database import get_db
@@ -16,6 +16,9 @@ from backend.schemas.email import (
     EmailLog as EmailLogSchema, PaginatedEmailLogs
 )
 from backend.routes.auth import get_current_admin
+from backend.utils.background_jobs import get_job
+from backend.utils.email_body import store_email_body, get_log_content, delete_orphan_email_bodies
+from backend.utils.log_purge import start_purge_job
 
 # 设置日志
 logger = logging.getLogger(__name__)
@@ -282,8 +285,8 @@ async def get_email_logs(
     db: Session = Depends(get_db),
     current_admin = Depends(get_current_admin)
 ):
-    """获取邮件日志列表"""
-    query = db.query(EmailLog)
+    """获取邮件日志列表（不含正文，正文通过日志详情接口获取）"""
+    query = db.query(EmailLog).options(defer(EmailLog.content_html))
 
     # 应用过滤条件
     if status:
@@ -303,6 +306,21 @@ async def get_email_logs(
 
     return {"items": logs, "total": total}
 
+@router.get("/logs/{log_id}", response_model=EmailLogSchema)
+async def get_email_log(
+    log_id: int,
+    db: Session = Depends(get_db),
+    current_admin = Depends(get_current_admin)
+):
+    """获取邮件日志详情，正文按哈希还原"""
+    log = db.query(EmailLog).filter(EmailLog.id == log_id).first()
+    if not log:
+        raise HTTPException(status_code=404, detail="邮件日志未找到")
+
+    data = {column.name: getattr(log, column.name) for column in EmailLog.__table__.columns}
+    data["content_html"] = get_log_content(db, log)
+    return data
+
 @router.delete("/logs/{log_id}")
 async def delete_email_log(
     log_id: int,
@@ -333,30 +351,37 @@ async def clear_email_logs(
     """清除邮件日志"""
     from datetime import datetime, timedelta
 
-    query = db.query(EmailLog)
-
     # 应用过滤条件
+    conditions = []
     if days:
         cutoff_date = datetime.now() - timedelta(days=days)
-        query = query.filter(EmailLog.created_at < cutoff_date)
+        conditions.append(EmailLog.created_at < cutoff_date)
 
     if status:
-        query = query.filter(EmailLog.status == status)
+        conditions.append(EmailLog.status == status)
 
     try:
-        # 获取要删除的日志数量
-        count = query.count()
-
-        # 执行删除
-        query.delete(synchronize_session=False)
-        db.commit()
-
-        return {"message": f"已清除 {count} 条邮件日志"}
+        # 分批删除在后台进行，不长时间占用写锁
+        job_id = start_purge_job(
+            "email_log_purge", EmailLog, conditions,
+            cleanup=delete_orphan_email_bodies, filters={"days": days, "status": status}
+        )
+        return {"message": "正在后台清除邮件日志，可通过任务ID查询进度", "job_id": job_id}
     except Exception as e:
-        db.rollback()
         logger.error(f"清除邮件日志失败: {e}")
         raise HTTPException(status_code=500, detail=f"清除邮件日志失败: {e}")
 
+@router.get("/logs/purge/{job_id}")
+async def get_email_log_purge_job(
+    job_id: str,
+    current_admin = Depends(get_current_admin)
+):
+    """查询邮件日志清理任务的进度和结果"""
+    job = get_job(job_id, "email_log_purge")
+    if not job:
+        raise HTTPException(status_code=404, detail="清理任务不存在或已过期")
+    return job
+
 # 其他有用的端点
 @router.get("/templates/by-key/{template_key}")
 async def get_template_by_key(
@@ -456,7 +481,7 @@ async def test_email_settings(
             event_type="test",
             status=status,
             error_message=error_message,
-            content_html="这是一封测试邮件（This is a test email）"
+            body_hash=store_email_body(db, "这是一封测试邮件（This is a test email）")
         )
         db.add(log)
         db.commit()
@@ -9,6 +9,8 @@ from sqlalchemy import func, or_
 
 from backend.models.equipment import Equipment
 from backend.schemas.equipment import EquipmentCreate, EquipmentUpdate
+from backend.utils.occupancy_index import occupancy_index
+from backend.utils.image_pipeline import apply_image_variants
 
 # 设置日志
 logger = logging.getLogger(__name__)
@@ -27,6 +29,8 @@ def create_equipment(db: Session, equipment: EquipmentCreate):
         description=equipment.description,
         image_path=equipment.image_path
     )
+    # 记录已生成的图片变体
+    apply_image_variants(db_equipment)
     db.add(db_equipment)
     db.commit()
     db.refresh(db_equipment)
@@ -120,9 +124,16 @@ def update_equipment(db: Session, equipment_id: int, equipment: EquipmentUpdate)
     update_data = equipment.dict(exclude_unset=True)
     for key, value in update_data.items():
         setattr(db_equipment, key, value)
+
+    # 图片变化时同步更新图片变体
+    if "image_path" in update_data:
+        apply_image_variants(db_equipment)
     
     db.commit()
     db.refresh(db_equipment)
+
+    # 同时预约设置可能已变化，清除该设备的占用索引
+    occupancy_index.invalidate(equipment_id)
     return db_equipment
 
 def delete_equipment(db: Session, equipment_id: int):
@@ -136,4 +147,5 @@ def delete_equipment(db: Session, equipment_id: int):
     
     db.delete(db_equipment)
     db.commit()
+    occupancy_index.invalidate(equipment_id)
     return True
@@ -4,18 +4,32 @@ Recurring Reservation CRUD operations
 """
 import logging
 import json
-from typing import List, Optional, Tuple, Dict, Any
+from collections import defaultdict
+from typing import List, Optional, Tuple, Dict, Any, Set, Union
 from datetime import datetime, date, time, timedelta
 from sqlalchemy.orm import Session
-from sqlalchemy import func, or_, and_
+from sqlalchemy import func, or_, and_, insert, select, literal, update
 
+from backend.database import begin_immediate
 from backend.models.recurring_reservation import RecurringReservation
-from backend.models.reservation import Reservation
+from backend.models.reservation import Reservation, next_updated_seq
+from backend.models.reservation_tombstone import ReservationTombstone
+from backend.models.reservation_archive import ReservationArchive
 from backend.models.equipment import Equipment
 from backend.schemas.recurring_reservation import RecurringReservationCreate, RecurringReservationUpdate
 from backend.utils.code_generator import generate_reservation_code, generate_reservation_number, generate_recurring_reservation_number
-from backend.utils.date_utils import combine_date_time, get_weekday, get_next_occurrence_date
+from backend.utils.date_utils import combine_date_time, get_next_occurrence_date
 from backend.routes.crud.reservation import is_time_available
+from backend.routes.crud.time_slot import ACTIVE_STATUSES, get_equipment_capacity, max_concurrent_overlap
+from backend.utils.db_utils import get_beijing_now
+from backend.utils.occupancy_index import occupancy_index
+from backend.utils.live_events import publish_reservations, publish_series
+from backend.utils.reservation_lookup import invalidate_reservation_codes
+from backend.utils.reservation_archive import get_archived_child_dates
+from backend.utils.recurrence import (
+    MASTER_FIELDS, iter_occurrence_dates, horizon_date, is_plain_instance, occurrence_bounds, get_virtual_intervals
+)
+from backend.utils.reservation_utils import update_ics_for_code
 
 # 设置日志
 logger = logging.getLogger(__name__)
@@ -77,8 +91,9 @@ def create_recurring_reservation(db: Session, recurring_reservation: RecurringRe
     db.commit()
     db.refresh(db_recurring_reservation)
 
-    # 生成所有子预约
+    # 生成滚动窗口内的子预约，之后的由后台任务逐步生成
     child_reservations = generate_child_reservations(db, db_recurring_reservation)
+    publish_series(db_recurring_reservation, "created")
 
     # 添加设备信息
     db_recurring_reservation.equipment_name = equipment.name
@@ -87,156 +102,165 @@ def create_recurring_reservation(db: Session, recurring_reservation: RecurringRe
 
     return db_recurring_reservation, "循环预约创建成功", child_reservations
 
-def generate_child_reservations(db: Session, recurring_reservation: RecurringReservation) -> List[Reservation]:
+def get_child_number_state(db: Session, recurring_reservation: RecurringReservation) -> Tuple[int, Optional[int]]:
+    """
+    返回续生成子预约时的下一个序号和基础编号（RN-YYYYMMDD-XXXX-N中的N和XXXX）
+    Return the next index and base number (N and XXXX in RN-YYYYMMDD-XXXX-N) for
+    continuing a series' child reservations
+    """
+    # 已归档的子预约也占用过序号
+    numbers = [
+        row.reservation_number for row in db.query(Reservation.reservation_number).filter(
+            Reservation.recurring_reservation_id == recurring_reservation.id
+        ).union_all(
+            db.query(ReservationArchive.reservation_number).filter(
+                ReservationArchive.recurring_reservation_id == recurring_reservation.id
+            )
+        ).all()
+    ]
+    reservation_index = 1
+    base_number = None
+    for reservation_number in numbers:
+        parts = (reservation_number or "").split("-")
+        if len(parts) == 4 and parts[2].isdigit() and parts[3].isdigit():
+            if int(parts[3]) >= reservation_index:
+                reservation_index = int(parts[3]) + 1
+                base_number = int(parts[2])
+    return reservation_index, base_number
+
+def generate_child_reservations(
+    db: Session,
+    recurring_reservation: RecurringReservation,
+    from_date: Optional[date] = None,
+    to_date: Optional[date] = None
+) -> List[Reservation]:
     """
     为循环预约生成子预约
     Generate child reservations for recurring reservation
+
+    只生成到滚动窗口（RECURRING_HORIZON_WEEKS周）为止，并记录到materialized_until；
+    之后的发生在冲突检查中按规则计算，由extend_recurring_reservations逐步生成。
+    提供from_date时为续生成：冲突和计数累加到已有值上，序号接着已有子预约编号。
+    Children are only materialized up to the rolling horizon (RECURRING_HORIZON_WEEKS
+    weeks) and recorded in materialized_until; later occurrences are computed from the
+    rule by conflict checks and materialized over time by extend_recurring_reservations.
+    With from_date this continues a series: conflicts and counts are added to the
+    existing values and numbering continues from the existing children.
     """
     try:
         # 解析必要的数据
         equipment_id = recurring_reservation.equipment_id
-        pattern_type = recurring_reservation.pattern_type
-        start_date = recurring_reservation.start_date
-        end_date = recurring_reservation.end_date
-        start_time = recurring_reservation.start_time
-        end_time = recurring_reservation.end_time
-
-        # 解析days_of_week和days_of_month
-        days_of_week = []
-        if recurring_reservation.days_of_week:
-            try:
-                if isinstance(recurring_reservation.days_of_week, str):
-                    days_of_week = json.loads(recurring_reservation.days_of_week)
-                else:
-                    days_of_week = recurring_reservation.days_of_week
-            except (json.JSONDecodeError, TypeError):
-                logger.error(f"无法解析days_of_week: {recurring_reservation.days_of_week}")
-
-        days_of_month = []
-        if recurring_reservation.days_of_month:
-            try:
-                if isinstance(recurring_reservation.days_of_month, str):
-                    days_of_month = json.loads(recurring_reservation.days_of_month)
-                else:
-                    days_of_month = recurring_reservation.days_of_month
-            except (json.JSONDecodeError, TypeError):
-                logger.error(f"无法解析days_of_month: {recurring_reservation.days_of_month}")
+
+        # 生成范围：默认从系列开始到滚动窗口截止
+        if to_date is None:
+            to_date = min(recurring_reservation.end_date, horizon_date())
+        extending = from_date is not None
 
         # 准备循环生成子预约
         child_reservations = []
-        current_date = start_date
 
         # 冲突信息收集
         conflicts = []
         total_planned = 0
         created_count = 0
 
+        if extending and recurring_reservation.conflicts:
+            conflicts = recurring_reservation.conflicts.split(',')
+        if extending:
+            total_planned = recurring_reservation.total_planned or 0
+            created_count = recurring_reservation.created_count or 0
+
         # 添加一个基础编号变量，用于生成关联的预约号
         base_number = None
         # 添加子预约序号计数
         reservation_index = 1
+        if extending:
+            reservation_index, base_number = get_child_number_state(db, recurring_reservation)
 
-        while current_date <= end_date:
-            should_create = False
-
-            if pattern_type == "daily":
-                should_create = True
-            elif pattern_type == "weekly":
-                # 检查当前日期是否是指定的星期几
-                weekday = get_weekday(current_date)  # 0-6, 0表示周日
-                should_create = weekday in days_of_week
-            elif pattern_type == "monthly":
-                # 检查当前日期是否是指定的月份日期
-                day = current_date.day
-                should_create = day in days_of_month
-            elif pattern_type == "custom":
-                # 自定义模式的处理逻辑
-                pass
-
-            if should_create:
-                total_planned += 1  # 计划创建的预约总数
-
-                # 创建预约的开始和结束时间
-                try:
-                    # 直接使用datetime构造函数创建日期时间对象
-                    start_time = recurring_reservation.start_time
-                    end_time = recurring_reservation.end_time
-
-                    # 创建开始日期时间
-                    start_datetime = datetime(
-                        year=current_date.year,
-                        month=current_date.month,
-                        day=current_date.day,
-                        hour=start_time.hour,
-                        minute=start_time.minute,
-                        second=start_time.second
-                    )
-
-                    # 创建结束日期时间
-                    end_datetime = datetime(
-                        year=current_date.year,
-                        month=current_date.month,
-                        day=current_date.day,
-                        hour=end_time.hour,
-                        minute=end_time.minute,
-                        second=end_time.second
-                    )
-
-                    # 打印调试信息
-                    print(f"成功创建日期时间 - 开始: {start_datetime}, 结束: {end_datetime}")
-
-                except Exception as e:
-                    print(f"创建日期时间对象失败: {e}")
-                    conflicts.append(current_date.strftime('%Y-%m-%d'))  # 记录失败的日期
-                    current_date += timedelta(days=1)  # 增加一天
-                    continue
-
-                # 检查该时间段是否可用
-                reservation_date = current_date.strftime('%Y-%m-%d')
-                is_available = is_time_available(db, equipment_id, start_datetime, end_datetime)
-
-                if not is_available:
-                    print(f"日期 {reservation_date} 的时间段不可用")
-                    conflicts.append(reservation_date)  # 记录冲突的日期
-                    current_date += timedelta(days=1)  # 增加一天
-                    continue
-
-                # 创建预约 - 使用父循环预约的预约码，而不是生成新的
-                reservation_code = recurring_reservation.reservation_code  # 直接使用父循环预约的预约码
-
-                # 生成预约序号 - 使用循环预约专用的序号生成函数
-                reservation_number, base_number = generate_recurring_reservation_number(
-                    current_date,
-                    reservation_index,
-                    base_number,
-                    db  # 传入数据库会话，用于检查编号唯一性
-                )
+        # 按循环规则逐个日期生成
+        for current_date in iter_occurrence_dates(recurring_reservation, from_date, to_date):
+            total_planned += 1  # 计划创建的预约总数
 
-                # 递增子预约序号
-                reservation_index += 1
-
-                # 创建子预约
-                child_reservation = Reservation(
-                    recurring_reservation_id=recurring_reservation.id,
-                    equipment_id=equipment_id,
-                    reservation_code=reservation_code,
-                    reservation_number=reservation_number,
-                    start_datetime=start_datetime,
-                    end_datetime=end_datetime,
-                    user_name=recurring_reservation.user_name,
-                    user_department=recurring_reservation.user_department,
-                    user_contact=recurring_reservation.user_contact,
-                    user_email=recurring_reservation.user_email,
-                    purpose=recurring_reservation.purpose,
-                    status='confirmed',
-                    is_exception=0
+            # 创建预约的开始和结束时间
+            try:
+                # 直接使用datetime构造函数创建日期时间对象
+                start_time = recurring_reservation.start_time
+                end_time = recurring_reservation.end_time
+
+                # 创建开始日期时间
+                start_datetime = datetime(
+                    year=current_date.year,
+                    month=current_date.month,
+                    day=current_date.day,
+                    hour=start_time.hour,
+                    minute=start_time.minute,
+                    second=start_time.second
                 )
 
-                db.add(child_reservation)
-                child_reservations.append(child_reservation)
-                created_count += 1  # 实际创建的预约数
+                # 创建结束日期时间
+                end_datetime = datetime(
+                    year=current_date.year,
+                    month=current_date.month,
+                    day=current_date.day,
+                    hour=end_time.hour,
+                    minute=end_time.minute,
+                    second=end_time.second
+                )
 
-            current_date += timedelta(days=1)  # 增加一天
+                # 打印调试信息
+                logger.debug("成功创建日期时间 - 开始: %s, 结束: %s", start_datetime, end_datetime)
+
+            except Exception as e:
+                logger.error("创建日期时间对象失败: %s", e)
+                conflicts.append(current_date.strftime('%Y-%m-%d'))  # 记录失败的日期
+                continue
+
+            # 检查该时间段是否可用
+            reservation_date = current_date.strftime('%Y-%m-%d')
+            is_available = is_time_available(
+                db, equipment_id, start_datetime, end_datetime,
+                exclude_recurring_reservation_id=recurring_reservation.id
+            )
+
+            if not is_available:
+                logger.debug("日期 %s 的时间段不可用", reservation_date)
+                conflicts.append(reservation_date)  # 记录冲突的日期
+                continue
+
+            # 创建预约 - 使用父循环预约的预约码，而不是生成新的
+            reservation_code = recurring_reservation.reservation_code  # 直接使用父循环预约的预约码
+
+            # 生成预约序号 - 使用循环预约专用的序号生成函数
+            reservation_number, base_number = generate_recurring_reservation_number(
+                current_date,
+                reservation_index,
+                base_number,
+                db  # 传入数据库会话，用于检查编号唯一性
+            )
+
+            # 递增子预约序号
+            reservation_index += 1
+
+            # 创建子预约
+            child_reservation = Reservation(
+                recurring_reservation_id=recurring_reservation.id,
+                equipment_id=equipment_id,
+                reservation_code=reservation_code,
+                reservation_number=reservation_number,
+                start_datetime=start_datetime,
+                end_datetime=end_datetime,
+                user_name=recurring_reservation.user_name,
+                user_department=recurring_reservation.user_department,
+                user_contact=recurring_reservation.user_contact,
+                user_email=recurring_reservation.user_email,
+                purpose=recurring_reservation.purpose,
+                status='confirmed',
+                is_exception=0
+            )
+
+            db.add(child_reservation)
+            child_reservations.append(child_reservation)
+            created_count += 1  # 实际创建的预约数
 
         # 记录冲突信息
         if conflicts:
@@ -245,10 +269,18 @@ def generate_child_reservations(db: Session, recurring_reservation: RecurringRes
         # 更新总计划数和实际创建数
         recurring_reservation.total_planned = total_planned
         recurring_reservation.created_count = created_count
+        recurring_reservation.materialized_until = max(to_date, recurring_reservation.start_date - timedelta(days=1))
 
         # 提交更改
         db.commit()
 
+        # 发生从规则变为子预约，重新加载该设备的占用索引，并推送实时事件
+        occupancy_index.invalidate(equipment_id)
+        publish_reservations(child_reservations, "created")
+
+        # 更新ics文件
+        update_ics_for_code(db, recurring_reservation.reservation_code)
+
         return child_reservations
 
     except Exception as e:
@@ -256,6 +288,48 @@ def generate_child_reservations(db: Session, recurring_reservation: RecurringRes
         logger.error(f"生成子预约失败: {str(e)}")
         raise
 
+def extend_recurring_reservations(db: Session) -> int:
+    """
+    将有效循环预约的子预约续生成到当前的滚动窗口，返回新生成的子预约数
+    Extend active series' children up to the current rolling horizon; returns the number
+    of children created
+
+    按创建顺序处理，先创建的循环预约优先占用时间段。每个系列在写事务中重新读取
+    materialized_until再生成，与其他进程或系列编辑并发时不会重复生成同一批子预约。
+    Series are processed in creation order, so earlier series keep their slots. Each
+    series' materialized_until is re-read inside the write transaction before generating,
+    so a concurrent run or series edit never creates the same children twice.
+    """
+    horizon = horizon_date()
+    pending_ids = [row.id for row in db.query(RecurringReservation.id).filter(
+        RecurringReservation.status == "active",
+        RecurringReservation.materialized_until.isnot(None),
+        RecurringReservation.materialized_until < RecurringReservation.end_date,
+        RecurringReservation.materialized_until < horizon
+    ).order_by(RecurringReservation.id).all()]
+    db.rollback()
+
+    created = 0
+    for recurring_reservation_id in pending_ids:
+        try:
+            begin_immediate(db)
+            recurring_reservation = db.query(RecurringReservation).populate_existing().filter(
+                RecurringReservation.id == recurring_reservation_id
+            ).first()
+            to_date = min(recurring_reservation.end_date, horizon) if recurring_reservation else None
+            if (recurring_reservation is None or recurring_reservation.status != "active"
+                    or recurring_reservation.materialized_until is None
+                    or recurring_reservation.materialized_until >= to_date):
+                # 已被其他进程续生成、编辑或取消
+                db.rollback()
+                continue
+            from_date = recurring_reservation.materialized_until + timedelta(days=1)
+            created += len(generate_child_reservations(db, recurring_reservation, from_date, to_date))
+        except Exception as e:
+            db.rollback()
+            logger.error(f"续生成循环预约 {recurring_reservation_id} 的子预约失败: {str(e)}")
+    return created
+
 def get_recurring_reservation(db: Session, recurring_reservation_id: int) -> Optional[RecurringReservation]:
     """
     获取循环预约
@@ -381,35 +455,241 @@ def update_recurring_reservation(
     if "days_of_month" in update_data:
         update_data["days_of_month"] = json.dumps(update_data["days_of_month"]) if update_data["days_of_month"] else None
 
-    # 更新循环预约
-    for key, value in update_data.items():
-        setattr(db_recurring_reservation, key, value)
+    # 处理子预约：只更新今天及以后的预约时，之前的子预约保持不变
+    from_date = datetime.now().date() if update_future_only == 1 else None
 
-    # 处理子预约
-    today = datetime.now().date()
+    # 在写事务中重新读取系列和子预约，与滚动生成任务串行执行
+    begin_immediate(db)
+    db.refresh(db_recurring_reservation)
 
-    # 获取所有子预约
     child_reservations = db.query(Reservation).filter(
-        Reservation.recurring_reservation_id == recurring_reservation_id,
-        Reservation.status == "confirmed"
+        Reservation.recurring_reservation_id == recurring_reservation_id
     )
+    if from_date:
+        child_reservations = child_reservations.filter(
+            Reservation.start_datetime >= datetime.combine(from_date, time.min)
+        )
 
-    if update_future_only == 1:
-        # 只更新今天及以后的预约
-        child_reservations = child_reservations.filter(func.date(Reservation.start_datetime) >= today)
-
-    # 删除现有子预约
+    # 修改规则前按原规则区分普通实例和例外（单独修改过、已取消、使用中的子预约保持不变）
+    plain_children = {}
+    exception_dates = set()
     for reservation in child_reservations.all():
-        db.delete(reservation)
+        occurrence_date = reservation.start_datetime.date()
+        if occurrence_date not in plain_children and is_plain_instance(
+            db_recurring_reservation, reservation, ("confirmed",)
+        ):
+            plain_children[occurrence_date] = reservation
+        else:
+            exception_dates.add(occurrence_date)
 
-    db.commit()
-    db.refresh(db_recurring_reservation)
+    # 已归档的子预约视为例外，同步时不会在这些日期重新生成
+    exception_dates.update(get_archived_child_dates(db, recurring_reservation_id, from_date))
 
-    # 重新生成子预约
-    generate_child_reservations(db, db_recurring_reservation)
+    # 更新循环预约
+    for key, value in update_data.items():
+        setattr(db_recurring_reservation, key, value)
+
+    # 按新旧发生日期的差集同步子预约
+    sync_child_reservations(db, db_recurring_reservation, plain_children, exception_dates, from_date)
+    publish_series(db_recurring_reservation, "updated")
 
     return db_recurring_reservation, "循环预约已更新"
 
+def sync_child_reservations(
+    db: Session,
+    recurring_reservation: RecurringReservation,
+    plain_children: Dict[date, Reservation],
+    exception_dates: Set[date],
+    from_date: Optional[date] = None
+) -> Tuple[int, int, int]:
+    """
+    规则修改后按日期差集同步子预约
+    Sync children with an edited rule by the set difference of occurrence dates
+
+    plain_children为修改前与原规则一致的子预约（日期 -> 子预约），exception_dates为有例外
+    子预约的日期。只删除新规则中不再出现的日期，只为新增日期生成子预约，保留的子预约
+    原地修改时间和用户信息，预约ID、序号和历史记录都不变；只有新增日期和时间改变的日期
+    才重新检查冲突。同步范围到滚动窗口或已生成的日期为止（取较晚者），已生成到窗口之后
+    的长系列不会因编辑而被删除重建。
+    plain_children are the children that matched the rule before the edit (date -> child)
+    and exception_dates the dates holding exception children. Only dates dropped by the new
+    rule are deleted, only added dates are materialized, and kept children are updated in
+    place, keeping their ids, numbers and history; conflicts are only rechecked for added
+    dates and dates whose times changed. The sync range reaches the rolling horizon or the
+    already materialized date, whichever is later, so long series materialized past the
+    horizon are not deleted and recreated by an edit.
+
+    返回值：(删除数, 更新数, 新增数)
+    Returns: (deleted, updated, created)
+    """
+    try:
+        equipment_id = recurring_reservation.equipment_id
+        to_date = min(recurring_reservation.end_date, horizon_date())
+        if recurring_reservation.materialized_until is not None:
+            # 已生成到窗口之后的子预约同样参与同步；结束日期提前时，之后的子预约不在新规则中而被删除
+            to_date = max(to_date, min(recurring_reservation.materialized_until, recurring_reservation.end_date))
+        new_dates = set(iter_occurrence_dates(recurring_reservation, from_date, to_date))
+
+        removed = [child for occurrence_date, child in plain_children.items() if occurrence_date not in new_dates]
+        kept = {
+            occurrence_date: child for occurrence_date, child in plain_children.items()
+            if occurrence_date in new_dates
+        }
+        added = sorted(
+            occurrence_date for occurrence_date in new_dates
+            if occurrence_date not in plain_children and occurrence_date not in exception_dates
+        )
+
+        sample = next(iter(kept.values()), None)
+        time_changed = sample is not None and (
+            sample.start_datetime.time() != recurring_reservation.start_time
+            or sample.end_datetime.time() != recurring_reservation.end_time
+        )
+
+        # 一次查询取出需要检查的日期范围内的占用（不含本系列的普通实例）
+        check_dates = sorted(added + (list(kept) if time_changed else []))
+        occupied = defaultdict(list)
+        if check_dates:
+            window_start = datetime.combine(check_dates[0], time.min)
+            window_end = datetime.combine(check_dates[-1] + timedelta(days=1), time.min)
+            rows = db.query(Reservation.start_datetime, Reservation.end_datetime).filter(
+                Reservation.equipment_id == equipment_id,
+                Reservation.status.in_(ACTIVE_STATUSES),
+                Reservation.start_datetime < window_end,
+                Reservation.end_datetime > window_start,
+                Reservation.id.notin_([child.id for child in plain_children.values()])
+            ).all()
+            intervals = [(row.start_datetime, row.end_datetime) for row in rows]
+            intervals += get_virtual_intervals(
+                db, [equipment_id], window_start, window_end, recurring_reservation.id
+            ).get(equipment_id, [])
+            for start, end in intervals:
+                day = start.date()
+                while datetime.combine(day, time.min) < end:
+                    occupied[day].append((start, end))
+                    day += timedelta(days=1)
+
+        equipment = db.query(Equipment).filter(Equipment.id == equipment_id).first()
+        capacity = get_equipment_capacity(equipment) if equipment else 1
+
+        def is_free(occurrence_date: date) -> bool:
+            start, end = occurrence_bounds(recurring_reservation, occurrence_date)
+            return max_concurrent_overlap(occupied[occurrence_date], start, end) < capacity
+
+        conflicts = []
+        if time_changed:
+            for occurrence_date in sorted(kept):
+                if not is_free(occurrence_date):
+                    removed.append(kept.pop(occurrence_date))
+                    conflicts.append(occurrence_date)
+
+        # 删除新规则中不再出现（或新时间有冲突）的子预约，批量写入删除记录
+        removed_ids = [child.id for child in removed]
+        if removed_ids:
+            db.execute(insert(ReservationTombstone).from_select(
+                ["reservation_id", "equipment_id", "recurring_reservation_id", "updated_seq", "deleted_at"],
+                select(
+                    Reservation.id,
+                    Reservation.equipment_id,
+                    Reservation.recurring_reservation_id,
+                    next_updated_seq(),
+                    literal(get_beijing_now())
+                ).where(Reservation.id.in_(removed_ids))
+            ))
+            db.query(Reservation).filter(Reservation.id.in_(removed_ids)).delete(synchronize_session=False)
+            # 已删除的对象脱离会话，保留加载的属性用于推送事件
+            for child in removed:
+                db.expunge(child)
+
+        # 原地更新保留的子预约：用户信息相同，用一条UPDATE修改；时间改变时按日期计算新的
+        # 开始和结束时间，按主键批量更新
+        values = {}
+        if sample is not None:
+            for field in MASTER_FIELDS:
+                if getattr(sample, field) != getattr(recurring_reservation, field):
+                    values[field] = getattr(recurring_reservation, field)
+        updated = []
+        if (values or time_changed) and kept:
+            values["updated_seq"] = next_updated_seq()
+            db.query(Reservation).filter(
+                Reservation.id.in_([child.id for child in kept.values()])
+            ).update(values, synchronize_session=False)
+            if time_changed:
+                db.execute(update(Reservation), [
+                    dict(zip(("start_datetime", "end_datetime"), occurrence_bounds(recurring_reservation, occurrence_date)), id=child.id)
+                    for occurrence_date, child in kept.items()
+                ])
+            updated = list(kept.values())
+
+        # 为新增日期生成子预约，序号接着已有子预约编号
+        created = []
+        reservation_index, base_number = get_child_number_state(db, recurring_reservation)
+        for occurrence_date in added:
+            if not is_free(occurrence_date):
+                conflicts.append(occurrence_date)
+                continue
+            start_datetime, end_datetime = occurrence_bounds(recurring_reservation, occurrence_date)
+            reservation_number, base_number = generate_recurring_reservation_number(
+                occurrence_date, reservation_index, base_number, db
+            )
+            reservation_index += 1
+            child_reservation = Reservation(
+                recurring_reservation_id=recurring_reservation.id,
+                equipment_id=equipment_id,
+                reservation_code=recurring_reservation.reservation_code,
+                reservation_number=reservation_number,
+                start_datetime=start_datetime,
+                end_datetime=end_datetime,
+                user_name=recurring_reservation.user_name,
+                user_department=recurring_reservation.user_department,
+                user_contact=recurring_reservation.user_contact,
+                user_email=recurring_reservation.user_email,
+                purpose=recurring_reservation.purpose,
+                status='confirmed',
+                is_exception=0
+            )
+            occupied[occurrence_date].append((start_datetime, end_datetime))
+            created.append(child_reservation)
+        db.add_all(created)
+
+        # 更新冲突信息和计数：范围之前的冲突保留，范围内的以本次检查为准
+        previous_conflicts = recurring_reservation.conflicts.split(',') if recurring_reservation.conflicts else []
+        kept_conflicts = [
+            conflict for conflict in previous_conflicts
+            if from_date is not None and conflict < from_date.strftime('%Y-%m-%d')
+        ]
+        all_conflicts = kept_conflicts + [conflict.strftime('%Y-%m-%d') for conflict in sorted(conflicts)]
+        recurring_reservation.conflicts = ','.join(all_conflicts) if all_conflicts else None
+        recurring_reservation.total_planned = sum(1 for _ in iter_occurrence_dates(recurring_reservation, None, to_date))
+        recurring_reservation.created_count = db.query(func.count(Reservation.id)).filter(
+            Reservation.recurring_reservation_id == recurring_reservation.id,
+            Reservation.status != "cancelled"
+        ).scalar() + len(created)
+        recurring_reservation.materialized_until = max(to_date, recurring_reservation.start_date - timedelta(days=1))
+
+        db.commit()
+        logger.info(
+            f"循环预约 {recurring_reservation.id} 子预约已同步: 删除 {len(removed)}, "
+            f"更新 {len(updated)}, 新增 {len(created)}, 冲突 {len(conflicts)}"
+        )
+
+        # 重新加载该设备的占用索引，失效预约查询缓存并推送实时事件
+        occupancy_index.invalidate(equipment_id)
+        invalidate_reservation_codes(recurring_reservation.reservation_code)
+        publish_reservations(removed, "deleted")
+        publish_reservations(updated, "updated")
+        publish_reservations(created, "created")
+
+        # 更新ics文件
+        update_ics_for_code(db, recurring_reservation.reservation_code)
+
+        return len(removed), len(updated), len(created)
+
+    except Exception as e:
+        db.rollback()
+        logger.error(f"同步子预约失败: {str(e)}")
+        raise
+
 def cancel_recurring_reservation(
     db: Session,
     recurring_reservation_id: int,
@@ -443,24 +723,33 @@ def cancel_recurring_reservation(
     )
 
     # 取消子预约
-    for reservation in child_reservations.all():
+    cancelled_reservations = child_reservations.all()
+    for reservation in cancelled_reservations:
         reservation.status = "cancelled"
 
     db.commit()
 
+    # 更新占用索引（系列尚未生成的发生同时释放）并推送实时事件
+    occupancy_index.invalidate(db_recurring_reservation.equipment_id)
+    publish_reservations(cancelled_reservations, "cancelled")
+    publish_series(db_recurring_reservation, "cancelled")
+
+    # 更新ics文件
+    update_ics_for_code(db, db_recurring_reservation.reservation_code)
+
     return True, "循环预约已取消"
 
 def get_child_reservations(
     db: Session,
     recurring_reservation_id: int,
     include_past: int = 0
-) -> List[Reservation]:
+) -> List[Union[Reservation, ReservationArchive]]:
     """
     获取循环预约的子预约
     Get child reservations of recurring reservation
 
     Args:
-        include_past: 0表示不包含过去的预约，1表示包含
+        include_past: 0表示不包含过去的预约，1表示包含（包括已归档的子预约）
     """
     query = db.query(Reservation).filter(Reservation.recurring_reservation_id == recurring_reservation_id)
 
@@ -468,5 +757,9 @@ def get_child_reservations(
         # 只获取今天及以后的预约
         today = datetime.now().date()
         query = query.filter(func.date(Reservation.start_datetime) >= today)
+        return query.order_by(Reservation.start_datetime).all()
 
-    return query.order_by(Reservation.start_datetime).all()
+    archived = db.query(ReservationArchive).filter(
+        ReservationArchive.recurring_reservation_id == recurring_reservation_id
+    ).all()
+    return sorted(archived + query.all(), key=lambda reservation: reservation.start_datetime)
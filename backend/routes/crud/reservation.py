@@ -6,24 +6,41 @@ import logging
 import traceback
 from typing import List, Optional, Tuple, Dict, Any, Union
 from datetime import datetime, timedelta
-from sqlalchemy.orm import Session
-from sqlalchemy import func, or_, and_
+from sqlalchemy.orm import Session, joinedload
+from sqlalchemy import func, or_, and_, literal, select, union_all
 
+from backend.database import begin_immediate
 from backend.models.equipment import Equipment
-from backend.models.equipment_time_slot import EquipmentTimeSlot
 from backend.models.reservation import Reservation
 from backend.models.reservation_history import ReservationHistory
-from backend.schemas.reservation import ReservationCreate, ReservationUpdate
+from backend.models.reservation_archive import ReservationArchive
+from backend.schemas.reservation import ReservationCreate, ReservationUpdate, ReservationBatchCreate
 from backend.schemas.reservation_history import ReservationHistoryCreate
-from backend.utils.code_generator import generate_reservation_code, generate_reservation_number
+from backend.utils.code_generator import (
+    generate_reservation_code, generate_reservation_number, generate_reservation_numbers
+)
 from backend.utils.date_utils import parse_datetime, format_datetime
-from backend.routes.crud.time_slot import decrement_time_slot_count
+from backend.routes.crud.time_slot import (
+    ACTIVE_STATUSES,
+    capacity_error_message,
+    check_time_slot_availability,
+    get_equipment_capacity,
+    get_max_concurrent_count,
+    max_concurrent_overlap
+)
+from backend.utils.occupancy_index import occupancy_index
+from backend.utils.live_events import publish_reservations
+from backend.utils.recurrence import get_virtual_intervals
+from backend.utils.reservation_lookup import resolve_reservation
+from backend.utils.reservation_archive import needs_archive
 from backend.utils.reservation_utils import (
     update_ics_for_reservation,
+    update_ics_for_code,
     generate_qrcode_for_reservation,
     check_reservation_calendar_sync_enabled,
     add_reservation_to_calendar,
     send_reservation_confirmation_email,
+    send_batch_confirmation_email,
     send_reservation_cancel_email
 )
 
@@ -48,23 +65,24 @@ def create_reservation(db: Session, reservation: ReservationCreate) -> Tuple[Opt
     if reservation.start_datetime >= reservation.end_datetime:
         return None, "开始时间必须早于结束时间"
 
-    # 添加调试日志 - 显示设备是否允许同时预约
-    print(f"[调试信息] 设备ID: {equipment.id}, 名称: {equipment.name}, 允许同时预约: {equipment.allow_simultaneous}, 最大同时预约数: {equipment.max_simultaneous}")
+    # 调试日志 - 显示设备是否允许同时预约
+    logger.debug("设备ID: %s, 名称: %s, 允许同时预约: %s, 最大同时预约数: %s", equipment.id, equipment.name, equipment.allow_simultaneous, equipment.max_simultaneous)
 
     try:
-        # 使用悲观锁锁定设备记录，防止并发问题
-        # 使用with_for_update锁定equipment表中的记录，直到事务结束
+        # 立即获取写锁：检查容量、分配编号、插入预约和历史记录在同一事务中完成，只提交一次
+        begin_immediate(db)
+
+        # 其他数据库使用悲观锁锁定设备记录，直到事务结束
         locked_equipment = db.query(Equipment).filter(
             Equipment.id == reservation.equipment_id
         ).with_for_update().first()
 
-        if not locked_equipment:
-            return None, "设备不存在或已被锁定"
+        if not locked_equipment or locked_equipment.status != "available":
+            db.rollback()
+            return None, "设备不存在或不可用"
 
-        # 使用时间段管理功能检查可用性
-        from backend.routes.crud.time_slot import check_time_slot_availability, create_time_slot, increment_time_slot_count
-
-        is_available, error_message, containing_slot = check_time_slot_availability(
+        # 持有写锁后重新检查容量，此时其他预约无法插入
+        is_available, error_message = check_time_slot_availability(
             db,
             reservation.equipment_id,
             reservation.start_datetime,
@@ -72,12 +90,13 @@ def create_reservation(db: Session, reservation: ReservationCreate) -> Tuple[Opt
         )
 
         if not is_available:
+            db.rollback()
             return None, error_message
 
         # 生成预约码
         reservation_code = generate_reservation_code()
 
-        # 生成预约编号
+        # 生成预约编号（写锁保证编号不会被并发请求重复分配）
         reservation_number = generate_reservation_number(db)
 
         # 创建预约记录
@@ -95,35 +114,29 @@ def create_reservation(db: Session, reservation: ReservationCreate) -> Tuple[Opt
             status="confirmed"
         )
 
-        # 处理时间段关联
-        if locked_equipment.allow_simultaneous:
-            if containing_slot:
-                # 如果找到包含的时间段，增加其计数并关联
-                current_count_before = containing_slot.current_count
-                db_reservation.time_slot_id = containing_slot.id
-                increment_time_slot_count(db, containing_slot.id)
-                # 获取更新后的时间段信息
-                updated_slot = db.query(EquipmentTimeSlot).filter(EquipmentTimeSlot.id == containing_slot.id).first()
-                print(f"[调试信息] 使用现有时间段 - 设备ID: {equipment.id}, 时间段ID: {containing_slot.id}")
-                print(f"[调试信息] 同时预约计数: {current_count_before} -> {updated_slot.current_count}/{equipment.max_simultaneous}")
-                print(f"[调试信息] 这是该时间段内的第 {updated_slot.current_count} 个预约 (最大允许: {equipment.max_simultaneous})")
-            else:
-                # 如果没有找到包含的时间段，创建新的时间段并关联
-                new_slot = create_time_slot(
-                    db,
-                    reservation.equipment_id,
-                    reservation.start_datetime,
-                    reservation.end_datetime
-                )
-                db_reservation.time_slot_id = new_slot.id
-                print(f"[调试信息] 创建新时间段 - 设备ID: {equipment.id}, 时间段ID: {new_slot.id}")
-                print(f"[调试信息] 同时预约计数: 1/{equipment.max_simultaneous}")
-                print(f"[调试信息] 这是该时间段内的第 1 个预约 (最大允许: {equipment.max_simultaneous})")
-
         db.add(db_reservation)
+        db.flush()
+
+        # 记录创建历史
+        db.add(ReservationHistory(
+            reservation_id=db_reservation.id,
+            reservation_code=db_reservation.reservation_code,
+            reservation_number=db_reservation.reservation_number,
+            user_type="user",
+            user_id=reservation.user_name,
+            action="create",
+            field_name="status",
+            old_value="",
+            new_value=db_reservation.status
+        ))
+
         db.commit()
         db.refresh(db_reservation)
 
+        # 更新占用索引并推送实时事件
+        occupancy_index.add_reservation(db_reservation)
+        publish_reservations([db_reservation], "created")
+
         # 更新ics文件
         update_ics_for_reservation(db, db_reservation)
 
@@ -141,9 +154,149 @@ def create_reservation(db: Session, reservation: ReservationCreate) -> Tuple[Opt
         return db_reservation, ""
     except Exception as e:
         db.rollback()
-        print(f"创建预约失败: {str(e)}")
+        logger.error("创建预约失败: %s", str(e))
         return None, f"创建预约失败: {str(e)}"
 
+def create_reservation_batch(
+    db: Session,
+    batch: ReservationBatchCreate
+) -> Tuple[List[Reservation], str, List[Dict[str, Any]]]:
+    """
+    批量创建预定：一次检查所有项目，全部可用时在同一事务中插入，任一项目不可用则全部不创建
+    Create reservations in bulk: validate all items in one pass and insert them in one
+    transaction; nothing is created if any item is unavailable
+
+    每个项目有自己的预约码（按预约码查看、修改、取消只涉及该项目），预约序号连续。
+    Each item gets its own reservation code, so viewing, updating or cancelling by code
+    touches that item only; reservation numbers are consecutive.
+
+    返回值：(预约列表, 错误信息, 逐项错误)
+    Returns: (reservations, error_message, per-item errors)
+    """
+    errors = []
+    for index, item in enumerate(batch.items):
+        if item.start_datetime >= item.end_datetime:
+            errors.append({"index": index, "equipment_id": item.equipment_id, "message": "开始时间必须早于结束时间"})
+    if errors:
+        return [], "批量预约校验失败", errors
+
+    try:
+        # 立即获取写锁，检查和插入在同一事务中完成
+        begin_immediate(db)
+
+        equipment_ids = sorted({item.equipment_id for item in batch.items})
+        equipments = {
+            equipment.id: equipment
+            for equipment in db.query(Equipment).filter(
+                Equipment.id.in_(equipment_ids)
+            ).with_for_update().all()
+        }
+
+        # 一次查询取出所有设备在整个批次时间范围内的有效预约
+        window_start = min(item.start_datetime for item in batch.items)
+        window_end = max(item.end_datetime for item in batch.items)
+        intervals = {equipment_id: [] for equipment_id in equipment_ids}
+        rows = db.query(
+            Reservation.equipment_id, Reservation.start_datetime, Reservation.end_datetime
+        ).filter(
+            Reservation.equipment_id.in_(equipment_ids),
+            Reservation.status.in_(ACTIVE_STATUSES),
+            Reservation.start_datetime < window_end,
+            Reservation.end_datetime > window_start
+        ).all()
+        for row in rows:
+            intervals[row.equipment_id].append((row.start_datetime, row.end_datetime))
+        # 循环预约尚未生成的发生同样占用设备
+        for equipment_id, occurrences in get_virtual_intervals(db, equipment_ids, window_start, window_end).items():
+            intervals[equipment_id].extend(occurrences)
+
+        for index, item in enumerate(batch.items):
+            equipment = equipments.get(item.equipment_id)
+            if not equipment:
+                errors.append({"index": index, "equipment_id": item.equipment_id, "message": "设备不存在"})
+                continue
+            if equipment.status != "available":
+                errors.append({"index": index, "equipment_id": item.equipment_id, "message": "设备不可用"})
+                continue
+
+            occupied = intervals[item.equipment_id]
+            if max_concurrent_overlap(occupied, item.start_datetime, item.end_datetime) >= get_equipment_capacity(equipment):
+                errors.append({"index": index, "equipment_id": item.equipment_id, "message": capacity_error_message(equipment)})
+                continue
+
+            # 同一批次中同一设备的后续项目也要计入已接受的项目
+            occupied.append((item.start_datetime, item.end_datetime))
+
+        if errors:
+            db.rollback()
+            return [], "部分设备在所选时间段不可用，未创建任何预约", errors
+
+        reservation_numbers = generate_reservation_numbers(db, len(batch.items))
+
+        reservations = [
+            Reservation(
+                reservation_number=reservation_number,
+                equipment_id=item.equipment_id,
+                reservation_code=generate_reservation_code(),
+                user_name=batch.user_name,
+                user_department=batch.user_department,
+                user_contact=batch.user_contact,
+                user_email=batch.user_email,
+                start_datetime=item.start_datetime,
+                end_datetime=item.end_datetime,
+                purpose=item.purpose or batch.purpose,
+                status="confirmed"
+            )
+            for item, reservation_number in zip(batch.items, reservation_numbers)
+        ]
+        db.add_all(reservations)
+        db.flush()
+
+        # 记录创建历史
+        db.add_all([
+            ReservationHistory(
+                reservation_id=reservation.id,
+                reservation_code=reservation.reservation_code,
+                reservation_number=reservation.reservation_number,
+                user_type="user",
+                user_id=batch.user_name,
+                action="create",
+                field_name="status",
+                old_value="",
+                new_value=reservation.status
+            )
+            for reservation in reservations
+        ])
+
+        reservation_ids = [reservation.id for reservation in reservations]
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.error(f"批量创建预约失败: {str(e)}")
+        return [], f"批量创建预约失败: {str(e)}", []
+
+    # 提交后用一次查询刷新所有预约及其设备，避免逐个懒加载
+    reservations = db.query(Reservation).options(
+        joinedload(Reservation.equipment)
+    ).filter(
+        Reservation.id.in_(reservation_ids)
+    ).order_by(Reservation.reservation_number).all()
+
+    # 更新占用索引并推送实时事件
+    for reservation in reservations:
+        occupancy_index.add_reservation(reservation)
+    publish_reservations(reservations, "created")
+
+    # 更新各预约码的ics文件
+    for reservation in reservations:
+        update_ics_for_code(db, reservation.reservation_code)
+
+    # 发送一封汇总确认邮件
+    if not batch.skip_email:
+        send_batch_confirmation_email(reservations, batch.lang or "zh_CN")
+
+    return reservations, "", []
+
 def get_reservation_by_id(db: Session, reservation_id: int) -> Optional[Reservation]:
     """
     通过ID获取预定
@@ -169,156 +322,34 @@ def get_reservation_by_code(db: Session, reservation_code: str, reservation_numb
         如果预约码属于循环预约，会在Reservation对象上添加is_recurring=True和recurring_id属性
     """
     try:
-        # 记录查询参数
-        logger.info(f"[数据库查询] 获取预约: 预约码={reservation_code}, 预约序号={reservation_number}")
-
-        # 首先检查这个预约码是否属于循环预约
-        # 导入RecurringReservation模型
-        from backend.models.recurring_reservation import RecurringReservation
-
-        # 查询循环预约表
-        recurring_reservation = db.query(RecurringReservation).filter(
-            RecurringReservation.reservation_code == reservation_code
-        ).first()
-
-        if recurring_reservation:
-            logger.info(f"[数据库查询] 预约码 {reservation_code} 属于循环预约，ID={recurring_reservation.id}")
-
-            # 如果提供了预约序号，则查询特定的子预约
-            if reservation_number:
-                logger.info(f"[数据库查询] 提供了预约序号 {reservation_number}，查询特定子预约")
-                reservation = db.query(Reservation).filter(
-                    Reservation.reservation_code == reservation_code,
-                    Reservation.reservation_number == reservation_number
-                ).first()
-
-                if reservation:
-                    # 标记这是循环预约的子预约
-                    reservation.is_recurring = True
-                    reservation.recurring_id = recurring_reservation.id
-
-                    # 添加设备信息
-                    equipment = db.query(Equipment).filter(Equipment.id == reservation.equipment_id).first()
-                    if equipment:
-                        reservation.equipment_name = equipment.name
-                        reservation.equipment_category = equipment.category
-                        reservation.equipment_location = equipment.location
-
-                    return reservation
+        logger.debug("[数据库查询] 获取预约: 预约码=%s, 预约序号=%s", reservation_code, reservation_number)
+        reservation, recurring_id = resolve_reservation(db, reservation_code, reservation_number)
 
+        if reservation is None:
+            if recurring_id is None:
+                logger.warning(f"[数据库查询] 未找到预约: 预约码/序号={reservation_code}")
+                return None
             # 创建一个特殊的Reservation对象，标记这是循环预约
             # 这将告诉前端这是一个循环预约，应该跳转到循环预约详情页面
             dummy_reservation = Reservation()
             dummy_reservation.is_recurring = True
-            dummy_reservation.recurring_id = recurring_reservation.id
+            dummy_reservation.recurring_id = recurring_id
             dummy_reservation.reservation_code = reservation_code
-
-            logger.info(f"[数据库查询] 返回标记为循环预约的对象，循环预约ID={recurring_reservation.id}")
+            logger.debug("[数据库查询] 返回标记为循环预约的对象，循环预约ID=%s", recurring_id)
             return dummy_reservation
 
-        # 首先检查reservation_code是否是预约序号格式（以RN-开头）
-        if reservation_code.startswith("RN-"):
-            logger.info(f"[数据库查询] 检测到预约序号格式: {reservation_code}")
-            # 直接通过预约序号查询
-            reservation = db.query(Reservation).filter(
-                Reservation.reservation_number == reservation_code
-            ).first()
-
-            if reservation:
-                logger.info(f"[数据库查询] 通过预约序号直接找到预约: ID={reservation.id}, 状态={reservation.status}")
-                # 添加设备信息
-                equipment = db.query(Equipment).filter(Equipment.id == reservation.equipment_id).first()
-                if equipment:
-                    reservation.equipment_name = equipment.name
-                    reservation.equipment_category = equipment.category
-                    reservation.equipment_location = equipment.location
-                return reservation
-            else:
-                logger.warning(f"[数据库查询] 通过预约序号直接查询未找到预约: {reservation_code}")
-
-        # 如果提供了预约序号，则优先使用预约序号查询
-        if reservation_number:
-            logger.info(f"[数据库查询] 使用预约序号查询: {reservation_number}")
-            reservation = db.query(Reservation).filter(
-                Reservation.reservation_code == reservation_code,
-                Reservation.reservation_number == reservation_number
-            ).first()
-
-            if reservation:
-                logger.info(f"[数据库查询] 通过预约序号找到预约: ID={reservation.id}, 状态={reservation.status}")
-                # 添加设备信息
-                equipment = db.query(Equipment).filter(Equipment.id == reservation.equipment_id).first()
-                if equipment:
-                    reservation.equipment_name = equipment.name
-                    reservation.equipment_category = equipment.category
-                    reservation.equipment_location = equipment.location
-                return reservation
-            else:
-                logger.warning(f"[数据库查询] 通过预约序号未找到预约: 预约码={reservation_code}, 预约序号={reservation_number}")
-
-        # 如果没有提供预约序号或通过预约序号未找到，则尝试通过预约码查询
-        logger.info(f"[数据库查询] 使用预约码查询: {reservation_code}")
-
-        # 先尝试通过预约序号查询
-        reservation = db.query(Reservation).filter(Reservation.reservation_number == reservation_code).first()
-        if reservation:
-            logger.info(f"[数据库查询] 通过预约序号直接找到预约: ID={reservation.id}, 状态={reservation.status}, 预约序号={reservation.reservation_number}")
-            return reservation
-
-        # 如果通过预约序号未找到，再尝试通过预约码查询
-        # 查询具有相同预约码的所有预约，按开始时间排序
-        reservations = db.query(Reservation).filter(
-            Reservation.reservation_code == reservation_code
-        ).order_by(Reservation.start_datetime).all()
-
-        if reservations:
-            logger.info(f"[数据库查询] 找到具有相同预约码的预约数量: {len(reservations)}")
-
-            # 记录所有找到的预约，帮助调试
-            for r in reservations:
-                logger.debug(f"[数据库查询] 预约详情: ID={r.id}, 状态={r.status}, 预约序号={r.reservation_number}, 开始时间={r.start_datetime}")
-
-            # 查找状态为confirmed的预约
-            confirmed_reservations = [r for r in reservations if r.status == "confirmed"]
-            if confirmed_reservations:
-                logger.info(f"[数据库查询] 找到已确认的预约: ID={confirmed_reservations[0].id}, 预约序号={confirmed_reservations[0].reservation_number}")
-                reservation = confirmed_reservations[0]
-            else:
-                # 如果没有confirmed状态的预约，则返回第一个预约
-                logger.info(f"[数据库查询] 未找到已确认的预约，返回第一个预约: ID={reservations[0].id}, 预约序号={reservations[0].reservation_number}")
-                reservation = reservations[0]
-
-        # 记录查询结果
-        if reservation:
-            logger.info(f"[数据库查询] 找到预约: 预约码/序号={reservation_code}, 状态={reservation.status}, ID={reservation.id}")
-        else:
-            logger.warning(f"[数据库查询] 未找到预约: 预约码/序号={reservation_code}")
-
-            # 尝试查询是否有相同预约码但不同时间段的预约（循环预约的子预约）
-            similar_reservations = db.query(Reservation).filter(
-                or_(
-                    Reservation.reservation_code == reservation_code,
-                    Reservation.reservation_number == reservation_code
-                )
-            ).all()
-
-            if similar_reservations:
-                logger.info(f"[数据库查询] 找到相似预约数量: {len(similar_reservations)}")
-                for r in similar_reservations:
-                    logger.info(f"[数据库查询] 相似预约: ID={r.id}, 状态={r.status}, 开始时间={r.start_datetime}, 结束时间={r.end_datetime}")
-
-            # 如果URL中包含时间参数，尝试使用预约码和时间段查询
-            # 这种情况通常出现在循环预约的子预约中
-            return None
+        if recurring_id is not None:
+            # 标记这是循环预约的子预约
+            reservation.is_recurring = True
+            reservation.recurring_id = recurring_id
 
         # 添加设备信息
-        if reservation:
-            equipment = db.query(Equipment).filter(Equipment.id == reservation.equipment_id).first()
-            if equipment:
-                reservation.equipment_name = equipment.name
-                reservation.equipment_category = equipment.category
-                reservation.equipment_location = equipment.location
+        if reservation.equipment:
+            reservation.equipment_name = reservation.equipment.name
+            reservation.equipment_category = reservation.equipment.category
+            reservation.equipment_location = reservation.equipment.location
 
+        logger.debug("[数据库查询] 找到预约: 预约码/序号=%s, 状态=%s, ID=%s", reservation_code, reservation.status, reservation.id)
         return reservation
     except Exception as e:
         logger.error(f"[数据库错误] 获取预约出错: 预约码/序号={reservation_code}, 错误={str(e)}")
@@ -358,46 +389,49 @@ def get_reservations(
         limit: 返回记录数
         sort_by: 排序字段，如'id', 'start_datetime', 'created_at'等
         sort_order: 排序方式，'asc'升序，'desc'降序
-    """
-    query = db.query(Reservation)
-
-    # 应用过滤条件
-    if equipment_id:
-        query = query.filter(Reservation.equipment_id == equipment_id)
-    if user_name:
-        query = query.filter(Reservation.user_name.ilike(f"%{user_name}%"))
-    if user_contact:
-        query = query.filter(Reservation.user_contact == user_contact)
-    if status:
-        query = query.filter(Reservation.status == status)
-    if from_date:
-        query = query.filter(Reservation.start_datetime >= from_date)
-    if to_date:
-        query = query.filter(Reservation.end_datetime <= to_date)
-    if reservation_code:
-        query = query.filter(Reservation.reservation_code == reservation_code)
 
-    # 如果指定了类别，需要联表查询
-    if category:
-        query = query.join(Equipment, Reservation.equipment_id == Equipment.id)
-        query = query.filter(Equipment.category == category)
+    Note:
+        筛选范围可能包含归档预约时（未限定开始时间或早于归档截止时间，且状态不限或为
+        已过期/已取消）同时查询归档表，归档预约以ReservationArchive对象返回
+    """
+    filters = (equipment_id, user_name, user_contact, status, from_date, to_date, category, reservation_code)
 
-    # 应用排序
+    # 排序字段和方向，未指定时按开始时间倒序
     if sort_by and hasattr(Reservation, sort_by):
-        # 获取排序字段
-        sort_field = getattr(Reservation, sort_by)
-
-        # 应用排序方向
-        if sort_order and sort_order.lower() == 'asc':
-            query = query.order_by(sort_field.asc())
-        else:
-            query = query.order_by(sort_field.desc())
+        sort_name = sort_by
+        descending = not (sort_order and sort_order.lower() == 'asc')
     else:
-        # 默认排序
-        query = query.order_by(Reservation.start_datetime.desc())
-
-    # 应用分页
-    reservations = query.offset(skip).limit(limit).all()
+        sort_name = "start_datetime"
+        descending = True
+
+    if needs_archive(from_date, status) and sort_name in ReservationArchive.__table__.columns:
+        # 请求范围可能包含归档预约：每张表先按同样的排序取前skip+limit条，合并后再排序分页，
+        # 最后按ID加载，两张表都只读取页内需要的行
+        branches = []
+        for source, model in enumerate((Reservation, ReservationArchive)):
+            sort_field = getattr(model, sort_name)
+            branch = _filter_reservations(
+                select(model.id, sort_field.label("sort_key"), literal(source).label("source")),
+                model, *filters
+            ).order_by(sort_field.desc() if descending else sort_field.asc(), model.id).limit(skip + limit)
+            branches.append(select(branch.subquery()))
+        pages = union_all(*branches).subquery()
+        sort_key = pages.c.sort_key.desc() if descending else pages.c.sort_key.asc()
+        page = db.execute(
+            select(pages.c.id, pages.c.source).order_by(sort_key, pages.c.id).offset(skip).limit(limit)
+        ).all()
+        loaded = {}
+        for source, model in enumerate((Reservation, ReservationArchive)):
+            ids = [row.id for row in page if row.source == source]
+            if ids:
+                loaded.update({(source, item.id): item for item in db.query(model).filter(model.id.in_(ids))})
+        reservations = [loaded[(row.source, row.id)] for row in page if (row.source, row.id) in loaded]
+    else:
+        query = _filter_reservations(db.query(Reservation), Reservation, *filters)
+        sort_field = getattr(Reservation, sort_name)
+        query = query.order_by(sort_field.desc() if descending else sort_field.asc())
+        # 应用分页
+        reservations = query.offset(skip).limit(limit).all()
 
     # 添加设备信息
     for reservation in reservations:
@@ -407,6 +441,10 @@ def get_reservations(
             reservation.equipment_category = equipment.category
             reservation.equipment_location = equipment.location
 
+        # 归档预约只读，不做下面的修复
+        if isinstance(reservation, ReservationArchive):
+            continue
+
         # 确保预约序号字段存在
         # 如果数据库中没有预约序号（旧数据），则生成一个临时序号
         if not hasattr(reservation, 'reservation_number') or not reservation.reservation_number:
@@ -459,30 +497,48 @@ def get_reservation_count(
     获取预定数量
     Get reservation count
     """
-    query = db.query(func.count(Reservation.id))
-
-    # 应用过滤条件
+    filters = (equipment_id, user_name, user_contact, status, from_date, to_date, category, reservation_code)
+    count = _filter_reservations(db.query(func.count(Reservation.id)), Reservation, *filters).scalar()
+    if needs_archive(from_date, status):
+        count += _filter_reservations(db.query(func.count(ReservationArchive.id)), ReservationArchive, *filters).scalar()
+    return count
+
+def _filter_reservations(
+    query,
+    model,
+    equipment_id: Optional[int] = None,
+    user_name: Optional[str] = None,
+    user_contact: Optional[str] = None,
+    status: Optional[str] = None,
+    from_date: Optional[datetime] = None,
+    to_date: Optional[datetime] = None,
+    category: Optional[str] = None,
+    reservation_code: Optional[str] = None
+):
+    """
+    为预约表或归档表的查询应用列表筛选条件
+    Apply the listing filters to a query on the reservation or archive table
+    """
     if equipment_id:
-        query = query.filter(Reservation.equipment_id == equipment_id)
+        query = query.filter(model.equipment_id == equipment_id)
     if user_name:
-        query = query.filter(Reservation.user_name.ilike(f"%{user_name}%"))
+        query = query.filter(model.user_name.ilike(f"%{user_name}%"))
     if user_contact:
-        query = query.filter(Reservation.user_contact == user_contact)
+        query = query.filter(model.user_contact == user_contact)
     if status:
-        query = query.filter(Reservation.status == status)
+        query = query.filter(model.status == status)
     if from_date:
-        query = query.filter(Reservation.start_datetime >= from_date)
+        query = query.filter(model.start_datetime >= from_date)
     if to_date:
-        query = query.filter(Reservation.end_datetime <= to_date)
+        query = query.filter(model.end_datetime <= to_date)
     if reservation_code:
-        query = query.filter(Reservation.reservation_code == reservation_code)
+        query = query.filter(model.reservation_code == reservation_code)
 
     # 如果指定了类别，需要联表查询
     if category:
-        query = query.join(Equipment, Reservation.equipment_id == Equipment.id)
+        query = query.join(Equipment, model.equipment_id == Equipment.id)
         query = query.filter(Equipment.category == category)
-
-    return query.scalar()
+    return query
 
 def get_equipment_reservations(
     db: Session,
@@ -586,64 +642,38 @@ def is_time_available(
     equipment_id: int,
     start_datetime: datetime,
     end_datetime: datetime,
-    exclude_reservation_id: Optional[int] = None
+    exclude_reservation_id: Optional[int] = None,
+    exclude_recurring_reservation_id: Optional[int] = None
 ) -> bool:
     """
     检查时间段是否可用
     Check if time slot is available
+
+    循环预约尚未生成的发生视为已有预约；生成某个循环预约的子预约时通过
+    exclude_recurring_reservation_id排除该循环预约自身。
+    Unmaterialized series occurrences count as existing reservations; when materializing
+    a series, exclude_recurring_reservation_id leaves out the series itself.
     """
     # 获取设备信息，检查是否允许同时预定
     equipment = db.query(Equipment).filter(Equipment.id == equipment_id).first()
     if not equipment:
         return False
 
-    print(f"[调试信息] 检查时间是否可用 - 设备ID: {equipment.id}, 名称: {equipment.name}")
-    print(f"[调试信息] 检查时间段: {start_datetime} 至 {end_datetime}")
-    print(f"[调试信息] 排除预定ID: {exclude_reservation_id}")
-    print(f"[调试信息] 允许同时预约: {equipment.allow_simultaneous}, 最大同时预约数: {equipment.max_simultaneous}")
+    logger.debug("检查时间是否可用 - 设备ID: %s, 名称: %s", equipment.id, equipment.name)
+    logger.debug("检查时间段: %s 至 %s", start_datetime, end_datetime)
+    logger.debug("排除预定ID: %s", exclude_reservation_id)
+    logger.debug("允许同时预约: %s, 最大同时预约数: %s", equipment.allow_simultaneous, equipment.max_simultaneous)
 
-    # 如果设备允许同时预定
+    # 如果设备允许同时预定，使用扫描线计算时间段内的最大并发预约数
     if equipment.allow_simultaneous:
-        # 构建查询来计算时间段内的预约数量
-        query = db.query(func.count(Reservation.id)).filter(
-            Reservation.equipment_id == equipment_id,
-            Reservation.status.in_(["confirmed", "in_use"]),  # 同时检查confirmed和in_use状态
-            # 时间重叠条件 - 包含所有四种可能的重叠情况
-            or_(
-                # 情况1：已有预约的结束时间在新预约的开始时间之后（部分重叠）
-                and_(
-                    Reservation.start_datetime <= start_datetime,
-                    Reservation.end_datetime > start_datetime
-                ),
-                # 情况2：已有预约的开始时间在新预约的结束时间之前（部分重叠）
-                and_(
-                    Reservation.start_datetime < end_datetime,
-                    Reservation.end_datetime >= end_datetime
-                ),
-                # 情况3：已有预约完全包含在新预约内（完全重叠）
-                and_(
-                    Reservation.start_datetime >= start_datetime,
-                    Reservation.end_datetime <= end_datetime
-                ),
-                # 情况4：新预约完全包含在已有预约内（完全重叠）
-                and_(
-                    Reservation.start_datetime <= start_datetime,
-                    Reservation.end_datetime >= end_datetime
-                )
-            )
+        peak = get_max_concurrent_count(
+            db, equipment_id, start_datetime, end_datetime, exclude_reservation_id, exclude_recurring_reservation_id
         )
+        logger.debug("时间段内最大并发预约数 %s，最大允许 %s 个", peak, equipment.max_simultaneous)
 
-        # 排除当前预定（用于更新预定时）
-        if exclude_reservation_id:
-            query = query.filter(Reservation.id != exclude_reservation_id)
-
-        # 获取重叠的预约数量
-        overlap_count = query.scalar()
-        print(f"[调试信息] 找到 {overlap_count} 个重叠的预约，最大允许 {equipment.max_simultaneous} 个")
-
-        # 如果数量小于最大同时预定数量，则时间段可用
-        is_available = overlap_count < equipment.max_simultaneous
-        print(f"[调试信息] 时间段可用: {is_available}")
+        # 如果最大并发数小于最大同时预定数量，则时间段可用
+        is_available = peak < equipment.max_simultaneous
+        logger.debug("时间段可用: %s", is_available)
         return is_available
 
     # 不允许同时预定，使用原有逻辑
@@ -656,7 +686,7 @@ def is_time_available(
 
         # 排除当前预定（用于更新预定时）
         if exclude_reservation_id:
-            print(f"[调试信息] 排除预定ID: {exclude_reservation_id}")
+            logger.debug("排除预定ID: %s", exclude_reservation_id)
             query = query.filter(Reservation.id != exclude_reservation_id)
 
         # 添加时间冲突条件 - 包含所有四种可能的重叠情况
@@ -685,21 +715,27 @@ def is_time_available(
             )
         )
 
-        # 获取所有重叠的预约并打印详细信息
+        # 获取所有重叠的预约，开启DEBUG时记录详细信息
         overlapping_reservations = query.all()
-        print(f"[调试信息] 排除后找到 {len(overlapping_reservations)} 个重叠的预约")
-
-        for res in overlapping_reservations:
-            print(f"[调试信息] 重叠预约 ID: {res.id}, 开始时间: {res.start_datetime}, 结束时间: {res.end_datetime}")
-            print(f"[调试信息] 重叠条件分析:")
-            print(f"  条件1 (已有预约结束>新预约开始): {res.start_datetime <= start_datetime and res.end_datetime > start_datetime}")
-            print(f"  条件2 (已有预约开始<新预约结束): {res.start_datetime < end_datetime and res.end_datetime >= end_datetime}")
-            print(f"  条件3 (已有预约包含在新预约内): {res.start_datetime >= start_datetime and res.end_datetime <= end_datetime}")
-            print(f"  条件4 (新预约包含在已有预约内): {res.start_datetime <= start_datetime and res.end_datetime >= end_datetime}")
+        logger.debug("排除后找到 %s 个重叠的预约", len(overlapping_reservations))
+
+        if logger.isEnabledFor(logging.DEBUG):
+            for res in overlapping_reservations:
+                logger.debug("重叠预约 ID: %s, 开始时间: %s, 结束时间: %s", res.id, res.start_datetime, res.end_datetime)
+                logger.debug("重叠条件分析:")
+                logger.debug("  条件1 (已有预约结束>新预约开始): %s", res.start_datetime <= start_datetime and res.end_datetime > start_datetime)
+                logger.debug("  条件2 (已有预约开始<新预约结束): %s", res.start_datetime < end_datetime and res.end_datetime >= end_datetime)
+                logger.debug("  条件3 (已有预约包含在新预约内): %s", res.start_datetime >= start_datetime and res.end_datetime <= end_datetime)
+                logger.debug("  条件4 (新预约包含在已有预约内): %s", res.start_datetime <= start_datetime and res.end_datetime >= end_datetime)
+
+        # 循环预约尚未生成的发生
+        virtual_intervals = get_virtual_intervals(
+            db, [equipment_id], start_datetime, end_datetime, exclude_recurring_reservation_id
+        ).get(equipment_id, [])
 
         # 如果找到任何冲突的预定，则时间段不可用
-        is_available = len(overlapping_reservations) == 0
-        print(f"[调试信息] 时间段可用: {is_available}")
+        is_available = len(overlapping_reservations) == 0 and not virtual_intervals
+        logger.debug("时间段可用: %s", is_available)
         return is_available
 
 def is_equipment_currently_reserved(db: Session, equipment_id: int) -> bool:
@@ -731,14 +767,14 @@ def is_equipment_available(
     Get equipment availability
     """
     # 添加调试日志
-    print(f"[调试信息] 检查设备可用性 - 设备ID: {equipment_id}")
-    print(f"[调试信息] 开始日期时间: {start_date}, 结束日期时间: {end_date}")
+    logger.debug("检查设备可用性 - 设备ID: %s", equipment_id)
+    logger.debug("开始日期时间: %s, 结束日期时间: %s", start_date, end_date)
 
     # 解析日期时间 - 保留完整的时间信息
     start = parse_datetime(start_date)
     end = parse_datetime(end_date)
 
-    print(f"[调试信息] 解析后的开始日期时间: {start}, 结束日期时间: {end}")
+    logger.debug("解析后的开始日期时间: %s, 结束日期时间: %s", start, end)
 
     # 检查是否包含具体时间
     has_specific_time = True
@@ -746,17 +782,17 @@ def is_equipment_available(
     # 如果没有具体时间，或者只有日期部分，则使用整天
     if start and (start.hour == 0 and start.minute == 0 and start.second == 0) and \
        end and (end.hour == 0 and end.minute == 0 and end.second == 0):
-        print(f"[调试信息] 没有具体时间，使用整天检查")
+        logger.debug("没有具体时间，使用整天检查")
         has_specific_time = False
 
     # 检查日期顺序
     if start and end and start > end:
-        print(f"[调试信息] 警告: 开始日期时间晚于结束日期时间! 交换日期时间...")
+        logger.debug("开始日期时间晚于结束日期时间，交换日期时间")
         start, end = end, start
-        print(f"[调试信息] 交换后: 开始日期时间: {start}, 结束日期时间: {end}")
+        logger.debug("交换后: 开始日期时间: %s, 结束日期时间: %s", start, end)
 
     if not start or not end:
-        print(f"[调试信息] 错误: 无法解析日期时间")
+        logger.debug("无法解析日期时间")
         return {
             "equipment_id": equipment_id,
             "dates": [],
@@ -766,18 +802,18 @@ def is_equipment_available(
     # 获取设备信息
     equipment = db.query(Equipment).filter(Equipment.id == equipment_id).first()
     if not equipment:
-        print(f"[调试信息] 错误: 设备不存在")
+        logger.debug("设备不存在")
         return {
             "equipment_id": equipment_id,
             "dates": [],
             "available": []
         }
 
-    print(f"[调试信息] 设备名称: {equipment.name}, 允许同时预约: {equipment.allow_simultaneous}")
+    logger.debug("设备名称: %s, 允许同时预约: %s", equipment.name, equipment.allow_simultaneous)
 
     # 如果有具体时间，直接检查这个时间段是否可用
     if has_specific_time:
-        print(f"[调试信息] 检查具体时间段: {start} 至 {end}")
+        logger.debug("检查具体时间段: %s 至 %s", start, end)
 
         # 直接使用is_time_available函数检查，排除指定的预定ID
         is_available = is_time_available(db, equipment_id, start, end, exclude_reservation_id)
@@ -802,7 +838,7 @@ def is_equipment_available(
             result["allow_simultaneous"] = True
             result["max_simultaneous"] = equipment.max_simultaneous
 
-        print(f"[调试信息] 具体时间段可用性结果: {result}")
+        logger.debug("具体时间段可用性结果: %s", result)
         return result
 
     # 以下是原来的按日期检查的逻辑（当没有具体时间时使用）
@@ -818,7 +854,7 @@ def is_equipment_available(
         dates.append(current_date)
         current_date += timedelta(days=1)
 
-    print(f"[调试信息] 日期范围: {[d.strftime('%Y-%m-%d') for d in dates]}")
+    logger.debug("日期范围: %s 至 %s", dates[0], dates[-1])
 
     # 获取设备预定
     reservations = get_equipment_reservations(
@@ -828,9 +864,18 @@ def is_equipment_available(
         status=["confirmed", "in_use"]  # 包括confirmed和in_use状态
     )
 
-    print(f"[调试信息] 找到 {len(reservations)} 个预约")
-    for r in reservations:
-        print(f"[调试信息] 预约ID: {r.id}, 开始时间: {r.start_datetime}, 结束时间: {r.end_datetime}, 状态: {r.status}")
+    logger.debug("找到 %s 个预约", len(reservations))
+    if logger.isEnabledFor(logging.DEBUG):
+        for r in reservations:
+            logger.debug("预约ID: %s, 开始时间: %s, 结束时间: %s, 状态: %s", r.id, r.start_datetime, r.end_datetime, r.status)
+
+    # 占用区间：已有预约加上循环预约尚未生成的发生
+    occupied = [(r.start_datetime, r.end_datetime) for r in reservations]
+    occupied += get_virtual_intervals(
+        db, [equipment_id],
+        datetime.combine(start_date, datetime.min.time()),
+        datetime.combine(end_date, datetime.max.time())
+    ).get(equipment_id, [])
 
     # 检查每天的可用性
     availability = []
@@ -840,32 +885,32 @@ def is_equipment_available(
         date_start = datetime.combine(date, datetime.min.time())
         date_end = datetime.combine(date, datetime.max.time())
 
-        print(f"[调试信息] 检查日期: {date.strftime('%Y-%m-%d')}, 开始时间: {date_start}, 结束时间: {date_end}")
+        logger.debug("检查日期: %s, 开始时间: %s, 结束时间: %s", date, date_start, date_end)
 
-        # 如果允许同时预定，计算每天的预约数量
+        # 如果允许同时预定，计算每天的预约数量及最大并发数
         if equipment.allow_simultaneous:
             # 计算当天重叠的预约数量
-            day_reservations = [r for r in reservations if
-                               (r.start_datetime <= date_end and
-                                r.end_datetime >= date_start)]
+            day_intervals = [(r_start, r_end) for r_start, r_end in occupied if
+                             (r_start <= date_end and
+                              r_end >= date_start)]
 
-            count = len(day_reservations)
+            count = len(day_intervals)
             reservation_counts.append(count)
 
-            # 如果数量小于最大同时预定数量，则日期可用
-            is_available = count < equipment.max_simultaneous
-            print(f"[调试信息] 同时预约: 当天预约数量: {count}, 最大允许: {equipment.max_simultaneous}, 可用: {is_available}")
+            # 互不重叠的预约不会同时占用容量，按当天的最大并发数判断
+            peak = max_concurrent_overlap(day_intervals, date_start, date_end)
+            is_available = peak < equipment.max_simultaneous
+            logger.debug("同时预约: 当天预约数量: %s, 最大并发: %s, 最大允许: %s, 可用: %s", count, peak, equipment.max_simultaneous, is_available)
         else:
             # 检查是否有预定冲突
             is_available = True
-            for reservation in reservations:
-                if (reservation.start_datetime <= date_end and
-                    reservation.end_datetime >= date_start):
+            for r_start, r_end in occupied:
+                if r_start <= date_end and r_end >= date_start:
                     is_available = False
-                    print(f"[调试信息] 发现冲突预约: ID: {reservation.id}, 开始: {reservation.start_datetime}, 结束: {reservation.end_datetime}")
+                    logger.debug("发现冲突预约: 开始: %s, 结束: %s", r_start, r_end)
                     break
 
-            print(f"[调试信息] 不允许同时预约: 可用: {is_available}")
+            logger.debug("不允许同时预约: 可用: %s", is_available)
 
         availability.append(is_available)
 
@@ -882,7 +927,7 @@ def is_equipment_available(
         result["max_simultaneous"] = equipment.max_simultaneous
         result["reservation_counts"] = reservation_counts
 
-    print(f"[调试信息] 可用性结果: {result}")
+    logger.debug("可用性结果: %s", result)
     return result
 
 def update_reservation(
@@ -909,16 +954,8 @@ def update_reservation(
         (更新后的预定对象, 消息)
     """
     # 获取预定 - 优先使用预约序号
-    if reservation_number:
-        logger.info(f"[更新预约] 使用预约序号查询: {reservation_number}")
-        db_reservation = db.query(Reservation).filter(
-            Reservation.reservation_number == reservation_number
-        ).first()
-    else:
-        logger.info(f"[更新预约] 使用预约码查询: {reservation_code}")
-        db_reservation = db.query(Reservation).filter(
-            Reservation.reservation_code == reservation_code
-        ).first()
+    logger.debug("[更新预约] 查询预约: 预约码=%s, 预约序号=%s", reservation_code, reservation_number)
+    db_reservation, _ = resolve_reservation(db, reservation_code, reservation_number, exact=True)
 
     if not db_reservation:
         return None, "预定不存在"
@@ -999,9 +1036,12 @@ def update_reservation(
         # 提交历史记录
         db.flush()
     except Exception as e:
-        print(f"记录修改历史失败: {str(e)}")
+        logger.error("记录修改历史失败: %s", str(e))
         # 继续执行，不因历史记录失败而中断更新操作
 
+    # 记录更新前的占用区间，用于增量维护占用索引
+    old_occupancy = (db_reservation.start_datetime, db_reservation.end_datetime, db_reservation.status)
+
     # 更新字段
     for key, value in update_data.items():
         setattr(db_reservation, key, value)
@@ -1009,6 +1049,16 @@ def update_reservation(
     db.commit()
     db.refresh(db_reservation)
 
+    # 更新占用索引
+    old_start, old_end, old_status = old_occupancy
+    if old_status in ("confirmed", "in_use"):
+        occupancy_index.remove(db_reservation.equipment_id, old_start, old_end)
+    occupancy_index.add_reservation(db_reservation)
+    publish_reservations([db_reservation], "updated")
+
+    # 更新ics文件
+    update_ics_for_reservation(db, db_reservation)
+
     # 注意：邮件发送已在API路由处理函数中处理
     # 这里不需要发送邮件，因为在reservation.py的update_reservation_api函数中已经处理了邮件发送
     # 如果在这里发送邮件，会导致重复发送
@@ -1025,52 +1075,34 @@ def cancel_reservation(db: Session, reservation_id: int, user_cancel: bool = Tru
     if not reservation:
         return False, "预约不存在"
 
-    # 添加调试日志 - 取消预约时的时间段信息
-    if reservation.time_slot_id:
-        time_slot = db.query(EquipmentTimeSlot).filter(EquipmentTimeSlot.id == reservation.time_slot_id).first()
-        equipment = db.query(Equipment).filter(Equipment.id == reservation.equipment_id).first()
-        if time_slot and equipment:
-            print(f"[调试信息] 取消预约 - 设备ID: {equipment.id}, 名称: {equipment.name}, 时间段ID: {time_slot.id}")
-            print(f"[调试信息] 同时预约计数取消前: {time_slot.current_count}/{equipment.max_simultaneous}")
-
     # 如果是循环预约的子预约，需要特殊处理
     if reservation.recurring_reservation_id and user_cancel:
         # 设置为例外
+        was_active = reservation.status in ("confirmed", "in_use")
         reservation.is_exception = 1
         reservation.status = "cancelled"
         db.commit()
         db.refresh(reservation)
+        if was_active:
+            occupancy_index.remove_reservation(reservation)
+        publish_reservations([reservation], "cancelled")
+        update_ics_for_reservation(db, reservation)
         return True, "预约已取消"
 
     # 如果是普通预约，直接更新状态
-    from backend.routes.crud.time_slot import decrement_time_slot_count
-
     try:
         # 更新预约状态
+        was_active = reservation.status in ("confirmed", "in_use")
         reservation.status = "cancelled"
 
-        # 如果有关联的时间段，减少时间段的计数
-        if reservation.time_slot_id:
-            old_count = None
-            time_slot = db.query(EquipmentTimeSlot).filter(EquipmentTimeSlot.id == reservation.time_slot_id).first()
-            if time_slot:
-                old_count = time_slot.current_count
-
-            decrement_time_slot_count(db, reservation.time_slot_id)
-
-            # 添加调试日志 - 显示时间段计数减少情况
-            if old_count:
-                # 检查时间段是否仍然存在
-                time_slot = db.query(EquipmentTimeSlot).filter(EquipmentTimeSlot.id == reservation.time_slot_id).first()
-                equipment = db.query(Equipment).filter(Equipment.id == reservation.equipment_id).first()
-                if time_slot:
-                    print(f"[调试信息] 同时预约计数取消后: {time_slot.current_count}/{equipment.max_simultaneous}")
-                else:
-                    print(f"[调试信息] 时间段已删除 (计数为0)")
-
         db.commit()
         db.refresh(reservation)
 
+        # 更新占用索引并推送实时事件
+        if was_active:
+            occupancy_index.remove_reservation(reservation)
+        publish_reservations([reservation], "cancelled")
+
         # 更新ICS文件
         update_ics_for_reservation(db, reservation)
 
@@ -1086,7 +1118,7 @@ def cancel_reservation(db: Session, reservation_id: int, user_cancel: bool = Tru
         return True, "预约已取消"
     except Exception as e:
         db.rollback()
-        print(f"取消预约失败: {str(e)}")
+        logger.error("取消预约失败: %s", str(e))
         return False, f"取消预约失败: {str(e)}"
 
 def cancel_reservation_by_code(db: Session, reservation_code: str, reservation_number: Optional[str] = None) -> Tuple[bool, str]:
@@ -1103,21 +1135,11 @@ def cancel_reservation_by_code(db: Session, reservation_code: str, reservation_n
         (成功标志, 消息)
     """
     try:
-        # 构建查询条件
-        query = db.query(Reservation)
-
-        # 先尝试使用预约序号（如果提供）
-        if reservation_number:
-            query = query.filter(Reservation.reservation_number == reservation_number)
-        else:
-            # 如果没有提供预约序号，则使用预约码
-            query = query.filter(Reservation.reservation_code == reservation_code)
-
-        # 获取预约
-        reservation = query.first()
+        # 获取预约：优先使用预约序号，否则取预约码下最匹配的预约
+        reservation, _ = resolve_reservation(db, reservation_code, reservation_number, exact=True)
 
         if not reservation:
-            print(f"[调试信息] 未找到要取消的预约: 预约码={reservation_code}, 预约序号={reservation_number}")
+            logger.debug("未找到要取消的预约: 预约码=%s, 预约序号=%s", reservation_code, reservation_number)
             return False, "预约不存在"
 
         # 获取到预约ID后，调用原有的取消预约函数
@@ -1125,5 +1147,5 @@ def cancel_reservation_by_code(db: Session, reservation_code: str, reservation_n
 
     except Exception as e:
         db.rollback()
-        print(f"通过预约码取消预约失败: {str(e)}")
+        logger.error("通过预约码取消预约失败: %s", str(e))
         return False, f"取消预约失败: {str(e)}"
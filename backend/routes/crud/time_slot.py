@@ -1,236 +1,174 @@
 """
 时间段管理模块
 Time slot management module
+
+同时预约容量通过扫描线算法计算：将请求时间段内所有重叠预约的开始/结束事件排序，
+扫描得到区间内的最大并发占用数，与设备的max_simultaneous比较。
+Simultaneous-booking capacity is computed with a sweep line: the start/end events of
+all reservations overlapping the requested window are sorted and scanned to find the
+peak concurrent occupancy, which is compared with the equipment's max_simultaneous.
 """
-from typing import List, Optional, Tuple, Dict, Any, Union
+import logging
+from typing import List, Optional, Tuple, Dict, Any, Iterable
 from datetime import datetime
-from sqlalchemy import and_, or_, func
 from sqlalchemy.orm import Session
-from sqlalchemy.exc import IntegrityError
 
-from backend.models.equipment_time_slot import EquipmentTimeSlot
 from backend.models.equipment import Equipment
 from backend.models.reservation import Reservation
+from backend.utils.recurrence import get_virtual_intervals
 
-def find_overlapping_time_slots(
-    db: Session,
-    equipment_id: int,
-    start_datetime: datetime,
-    end_datetime: datetime
-) -> List[EquipmentTimeSlot]:
-    """
-    查找与指定时间段重叠的时间段
-    Find time slots that overlap with the specified time range
-    """
-    return db.query(EquipmentTimeSlot).filter(
-        EquipmentTimeSlot.equipment_id == equipment_id,
-        # 重叠条件：包含所有四种可能的重叠情况
-        or_(
-            # 情况1：已有预约的结束时间在新预约的开始时间之后（部分重叠）
-            and_(
-                EquipmentTimeSlot.start_datetime <= start_datetime,
-                EquipmentTimeSlot.end_datetime > start_datetime
-            ),
-            # 情况2：已有预约的开始时间在新预约的结束时间之前（部分重叠）
-            and_(
-                EquipmentTimeSlot.start_datetime < end_datetime,
-                EquipmentTimeSlot.end_datetime >= end_datetime
-            ),
-            # 情况3：已有预约完全包含在新预约内（完全重叠）
-            and_(
-                EquipmentTimeSlot.start_datetime >= start_datetime,
-                EquipmentTimeSlot.end_datetime <= end_datetime
-            ),
-            # 情况4：新预约完全包含在已有预约内（完全重叠）
-            and_(
-                EquipmentTimeSlot.start_datetime <= start_datetime,
-                EquipmentTimeSlot.end_datetime >= end_datetime
-            )
-        )
-    ).all()
-
-def find_containing_time_slot(
+# 设置日志
+logger = logging.getLogger(__name__)
+
+# 占用设备的预约状态
+ACTIVE_STATUSES = ("confirmed", "in_use")
+
+def _sweep_events(
+    intervals: Iterable[Tuple[datetime, datetime]],
+    window_start: datetime,
+    window_end: datetime
+) -> List[Tuple[datetime, int]]:
+    """
+    生成裁剪到窗口内的排序事件列表，同一时刻结束事件排在开始事件之前（区间左闭右开）
+    Build sorted events clipped to the window; at equal instants ends sort before starts (half-open intervals)
+    """
+    events = []
+    for start, end in intervals:
+        start = max(start, window_start)
+        end = min(end, window_end)
+        if start < end:
+            events.append((start, 1))
+            events.append((end, -1))
+    events.sort()
+    return events
+
+def max_concurrent_overlap(
+    intervals: Iterable[Tuple[datetime, datetime]],
+    window_start: datetime,
+    window_end: datetime
+) -> int:
+    """
+    计算窗口内的最大并发占用数
+    Compute the peak concurrent occupancy inside the window
+    """
+    current = peak = 0
+    for _, delta in _sweep_events(intervals, window_start, window_end):
+        current += delta
+        if current > peak:
+            peak = current
+    return peak
+
+def occupancy_segments(
+    intervals: Iterable[Tuple[datetime, datetime]],
+    window_start: datetime,
+    window_end: datetime
+) -> List[Tuple[datetime, datetime, int]]:
+    """
+    将窗口划分为占用数恒定的连续区间 (开始, 结束, 占用数)，只返回占用数大于0的区间
+    Split the window into segments of constant occupancy (start, end, count), count > 0 only
+    """
+    segments = []
+    current = 0
+    previous = None
+    for instant, delta in _sweep_events(intervals, window_start, window_end):
+        if previous is not None and instant > previous and current > 0:
+            if segments and segments[-1][1] == previous and segments[-1][2] == current:
+                segments[-1] = (segments[-1][0], instant, current)
+            else:
+                segments.append((previous, instant, current))
+        current += delta
+        previous = instant
+    return segments
+
+def get_overlapping_intervals(
     db: Session,
     equipment_id: int,
     start_datetime: datetime,
-    end_datetime: datetime
-) -> Optional[EquipmentTimeSlot]:
+    end_datetime: datetime,
+    exclude_reservation_id: Optional[int] = None,
+    exclude_recurring_reservation_id: Optional[int] = None
+) -> List[Tuple[datetime, datetime]]:
     """
-    查找完全包含指定时间段的时间段（如果存在）
-    Find a time slot that completely contains the specified time range (if exists)
+    查询与指定时间段重叠的有效预约区间（只读取开始和结束时间两列），包括循环预约尚未生成的发生
+    Fetch (start, end) of active reservations overlapping the range (two columns only),
+    including unmaterialized series occurrences
     """
-    return db.query(EquipmentTimeSlot).filter(
-        EquipmentTimeSlot.equipment_id == equipment_id,
-        EquipmentTimeSlot.start_datetime <= start_datetime,
-        EquipmentTimeSlot.end_datetime >= end_datetime
-    ).first()
+    query = db.query(Reservation.start_datetime, Reservation.end_datetime).filter(
+        Reservation.equipment_id == equipment_id,
+        Reservation.status.in_(ACTIVE_STATUSES),
+        # 区间左闭右开：已有预约开始早于新预约结束，且结束晚于新预约开始
+        Reservation.start_datetime < end_datetime,
+        Reservation.end_datetime > start_datetime
+    )
+
+    if exclude_reservation_id:
+        query = query.filter(Reservation.id != exclude_reservation_id)
 
-def create_time_slot(
+    intervals = [(row.start_datetime, row.end_datetime) for row in query.all()]
+    virtual = get_virtual_intervals(
+        db, [equipment_id], start_datetime, end_datetime, exclude_recurring_reservation_id
+    )
+    return intervals + virtual.get(equipment_id, [])
+
+def get_max_concurrent_count(
     db: Session,
     equipment_id: int,
     start_datetime: datetime,
-    end_datetime: datetime
-) -> EquipmentTimeSlot:
+    end_datetime: datetime,
+    exclude_reservation_id: Optional[int] = None,
+    exclude_recurring_reservation_id: Optional[int] = None
+) -> int:
     """
-    创建新的时间段
-    Create a new time slot
+    获取设备在指定时间段内的最大并发预约数
+    Get the peak number of concurrent reservations for the equipment in the range
     """
-    db_time_slot = EquipmentTimeSlot(
-        equipment_id=equipment_id,
-        start_datetime=start_datetime,
-        end_datetime=end_datetime,
-        current_count=1
+    intervals = get_overlapping_intervals(
+        db, equipment_id, start_datetime, end_datetime, exclude_reservation_id, exclude_recurring_reservation_id
     )
-    db.add(db_time_slot)
-    db.commit()
-    db.refresh(db_time_slot)
-    return db_time_slot
+    return max_concurrent_overlap(intervals, start_datetime, end_datetime)
 
-def increment_time_slot_count(
-    db: Session,
-    time_slot_id: int
-) -> Optional[EquipmentTimeSlot]:
+def get_equipment_capacity(equipment: Equipment) -> int:
     """
-    增加时间段的使用计数
-    Increment the usage count of a time slot
+    获取设备的同时预约容量，不允许同时预约的设备容量为1
+    Get the simultaneous-booking capacity; exclusive equipment has capacity 1
     """
-    time_slot = db.query(EquipmentTimeSlot).filter(EquipmentTimeSlot.id == time_slot_id).first()
-    if time_slot:
-        # 获取设备信息用于调试
-        equipment = db.query(Equipment).filter(Equipment.id == time_slot.equipment_id).first()
-        old_count = time_slot.current_count
-
-        time_slot.current_count += 1
+    return (equipment.max_simultaneous or 1) if equipment.allow_simultaneous else 1
 
-        print(f"[调试信息] 时间段使用计数增加 - 时间段ID: {time_slot.id}, 计数: {old_count} -> {time_slot.current_count}")
-        if equipment:
-            print(f"[调试信息] 设备: {equipment.name}, 最大同时预约数: {equipment.max_simultaneous}")
-
-        db.commit()
-        db.refresh(time_slot)
-    return time_slot
-
-def decrement_time_slot_count(
-    db: Session,
-    time_slot_id: int
-) -> Optional[EquipmentTimeSlot]:
+def capacity_error_message(equipment: Equipment) -> str:
     """
-    减少时间段的使用计数，如果计数为0则删除该时间段
-    Decrement the usage count of a time slot, delete it if count becomes 0
+    容量已满时的错误信息
+    Error message when the capacity is exhausted
     """
-    time_slot = db.query(EquipmentTimeSlot).filter(EquipmentTimeSlot.id == time_slot_id).first()
-    if time_slot:
-        # 获取设备信息用于调试
-        equipment = db.query(Equipment).filter(Equipment.id == time_slot.equipment_id).first()
-        old_count = time_slot.current_count
-
-        time_slot.current_count -= 1
-        print(f"[调试信息] 时间段使用计数减少 - 时间段ID: {time_slot.id}, 计数: {old_count} -> {time_slot.current_count}")
-
-        if time_slot.current_count <= 0:
-            print(f"[调试信息] 时间段计数为0，删除时间段 - 时间段ID: {time_slot.id}")
-            db.delete(time_slot)
-        db.commit()
-    return time_slot
+    if equipment.allow_simultaneous:
+        return f"该时间段已达到最大同时预约数({equipment.max_simultaneous})"
+    return "该时间段已被预约"
 
 def check_time_slot_availability(
     db: Session,
     equipment_id: int,
     start_datetime: datetime,
-    end_datetime: datetime
-) -> Tuple[bool, str, Optional[EquipmentTimeSlot]]:
+    end_datetime: datetime,
+    exclude_reservation_id: Optional[int] = None
+) -> Tuple[bool, str]:
     """
     检查指定设备在指定时间段内是否可以预约
     Check if the equipment is available for reservation during the specified time range
 
-    返回值：(是否可用, 错误信息, 包含该时间段的时间槽)
-    Returns: (is_available, error_message, containing_time_slot)
+    返回值：(是否可用, 错误信息)
+    Returns: (is_available, error_message)
     """
     # 获取设备信息
     equipment = db.query(Equipment).filter(Equipment.id == equipment_id).first()
     if not equipment:
-        return False, "设备不存在", None
-
-    print(f"[调试信息] 检查时间段可用性 - 设备ID: {equipment.id}, 名称: {equipment.name}")
-    print(f"[调试信息] 检查时间段: {start_datetime} 至 {end_datetime}")
-
-    # 如果设备不允许同时预约，则检查是否有任何重叠的预约
-    if not equipment.allow_simultaneous:
-        # 查询所有可能重叠的预约
-        overlapping_reservations_query = db.query(Reservation).filter(
-            Reservation.equipment_id == equipment_id,
-            Reservation.status.in_(["confirmed", "in_use"]),
-            or_(
-                # 情况1：已有预约的结束时间在新预约的开始时间之后（部分重叠）
-                and_(
-                    Reservation.start_datetime <= start_datetime,
-                    Reservation.end_datetime > start_datetime
-                ),
-                # 情况2：已有预约的开始时间在新预约的结束时间之前（部分重叠）
-                and_(
-                    Reservation.start_datetime < end_datetime,
-                    Reservation.end_datetime >= end_datetime
-                ),
-                # 情况3：已有预约完全包含在新预约内（完全重叠）
-                and_(
-                    Reservation.start_datetime >= start_datetime,
-                    Reservation.end_datetime <= end_datetime
-                ),
-                # 情况4：新预约完全包含在已有预约内（完全重叠）
-                and_(
-                    Reservation.start_datetime <= start_datetime,
-                    Reservation.end_datetime >= end_datetime
-                )
-            )
-        )
-
-        # 获取所有重叠的预约并打印详细信息
-        overlapping_reservations = overlapping_reservations_query.all()
-        print(f"[调试信息] 找到 {len(overlapping_reservations)} 个重叠的预约")
-
-        for res in overlapping_reservations:
-            print(f"[调试信息] 重叠预约 ID: {res.id}, 开始时间: {res.start_datetime}, 结束时间: {res.end_datetime}")
-            print(f"[调试信息] 重叠条件分析:")
-            print(f"  条件1 (已有预约结束>新预约开始): {res.start_datetime <= start_datetime and res.end_datetime > start_datetime}")
-            print(f"  条件2 (已有预约开始<新预约结束): {res.start_datetime < end_datetime and res.end_datetime >= end_datetime}")
-            print(f"  条件3 (已有预约包含在新预约内): {res.start_datetime >= start_datetime and res.end_datetime <= end_datetime}")
-            print(f"  条件4 (新预约包含在已有预约内): {res.start_datetime <= start_datetime and res.end_datetime >= end_datetime}")
-
-        if overlapping_reservations:
-            print(f"[调试信息] 设备不允许同时预约，发现重叠预约数: {len(overlapping_reservations)}")
-            return False, "该时间段已被预约", None
-
-        print(f"[调试信息] 设备不允许同时预约，没有重叠预约，可以预约")
-        return True, "", None
-
-    # 如果设备允许同时预约
-    print(f"[调试信息] 设备允许同时预约，最大同时预约数: {equipment.max_simultaneous}")
-
-    # 首先查找完全包含目标时间段的现有时间段
-    containing_slot = find_containing_time_slot(db, equipment_id, start_datetime, end_datetime)
-
-    if containing_slot:
-        print(f"[调试信息] 找到包含的时间段 ID: {containing_slot.id}, 当前计数: {containing_slot.current_count}/{equipment.max_simultaneous}")
-        # 如果找到包含的时间段，检查是否达到最大同时预约数
-        if containing_slot.current_count >= equipment.max_simultaneous:
-            print(f"[调试信息] 已达到最大同时预约数，无法再预约")
-            return False, f"该时间段已达到最大同时预约数({equipment.max_simultaneous})", containing_slot
-        # 未达到最大数量，可以继续预约
-        print(f"[调试信息] 未达到最大同时预约数，可以预约，将是第 {containing_slot.current_count + 1} 个预约")
-        return True, "", containing_slot
-
-    # 如果没有找到完全包含的时间段，检查是否有部分重叠的时间段
-    overlapping_slots = find_overlapping_time_slots(db, equipment_id, start_datetime, end_datetime)
-
-    if overlapping_slots:
-        print(f"[调试信息] 发现 {len(overlapping_slots)} 个部分重叠时间段，当前实现不允许部分重叠")
-        # 如果有重叠的时间段，当前实现不允许部分重叠
-        # 未来可以考虑处理部分重叠的复杂情况，例如创建新的时间段并合并
-        return False, "该时间段与现有预约部分重叠，请选择其他时间", None
-
-    # 如果没有任何重叠，可以创建新的时间段
-    print(f"[调试信息] 没有找到任何重叠时间段，将创建新的时间段")
-    return True, "", None
+        return False, "设备不存在"
+
+    capacity = get_equipment_capacity(equipment)
+    peak = get_max_concurrent_count(db, equipment_id, start_datetime, end_datetime, exclude_reservation_id)
+    logger.debug(f"容量检查 - 设备ID: {equipment_id}, 时间段: {start_datetime} 至 {end_datetime}, 最大并发: {peak}/{capacity}")
+
+    if peak < capacity:
+        return True, ""
+    return False, capacity_error_message(equipment)
 
 def get_time_slots_for_equipment(
     db: Session,
@@ -239,10 +177,37 @@ def get_time_slots_for_equipment(
     end_date: Optional[datetime] = None
 ) -> List[Dict[str, Any]]:
     """
-    获取设备的时间段列表及其当前使用情况
-    Get the list of time slots for an equipment and their current usage
+    获取设备的时间段列表及其当前使用情况（由有效预约实时计算）
+    Get the list of time slots for an equipment and their current usage (computed from active reservations)
     """
-    query = db.query(EquipmentTimeSlot).filter(EquipmentTimeSlot.equipment_id == equipment_id)
+    equipment = db.query(Equipment).filter(Equipment.id == equipment_id).first()
+    if not equipment:
+        return []
 
+    query = db.query(Reservation.start_datetime, Reservation.end_datetime).filter(
+        Reservation.equipment_id == equipment_id,
+        Reservation.status.in_(ACTIVE_STATUSES)
+    )
     if start_date:
-        query = query.filter(EquipmentTimeSlot.end_datetime >= start_date)
\ No newline at end of file
+        query = query.filter(Reservation.end_datetime > start_date)
+    if end_date:
+        query = query.filter(Reservation.start_datetime < end_date)
+
+    intervals = [(row.start_datetime, row.end_datetime) for row in query.all()]
+    if not intervals:
+        return []
+
+    window_start = start_date or min(start for start, _ in intervals)
+    window_end = end_date or max(end for _, end in intervals)
+    max_count = equipment.max_simultaneous or 1
+
+    return [
+        {
+            "start_datetime": segment_start.isoformat(),
+            "end_datetime": segment_end.isoformat(),
+            "current_count": count,
+            "max_count": max_count,
+            "available": count < max_count
+        }
+        for segment_start, segment_end, count in occupancy_segments(intervals, window_start, window_end)
+    ]
@@ -1,123 +1,263 @@
-import sqlite3
+"""
+数据库表查看路由
+Database table browser routes
+
+表名和字段结构按进程缓存，以SQLite的PRAGMA schema_version作为缓存版本，迁移或其他进程
+修改表结构后自动重新反射；大表的总行数取自sqlite_stat1或rowid范围的估算值；翻页可使用
+rowid游标，避免OFFSET扫描整张表。接口为同步函数，在线程池中执行，不阻塞事件循环。
+
+Table names and columns are cached per process, versioned by SQLite's PRAGMA schema_version,
+so a migration or a schema change from another process triggers a fresh reflection. Row
+counts of large tables are estimated from sqlite_stat1 or the rowid range, and pages can be
+fetched with a rowid cursor instead of an OFFSET scan. The endpoints are plain functions run
+in the thread pool, so browsing a large table never blocks the event loop.
+"""
+import logging
+import threading
+from datetime import datetime, date, time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
 from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy import inspect, text
 from sqlalchemy.orm import Session
+from sqlalchemy.types import Date, DateTime, LargeBinary, Time
+
+from config import DB_BROWSER_EXACT_COUNT_LIMIT
 from backend.database import get_db
 from backend.routes.auth import get_current_admin
-from backend.utils.date_utils import convert_to_beijing_time
-from datetime import datetime, date, time
+from backend.utils.db_maintenance import get_maintenance_metrics
+from backend.utils.fast_json import FastJSONResponse
+
+# 设置日志
+logger = logging.getLogger(__name__)
 
 router = APIRouter(
     prefix="/api/db",
     tags=["db_admin"],
 )
 
+# 反射结果缓存：schema_version变化时整体失效
+_schema_lock = threading.Lock()
+_schema_cache: Dict[str, Any] = {"version": None, "tables": None, "columns": {}}
+
+# 游标列的别名，避免与表中的列重名
+CURSOR_COLUMN = "__cursor__"
+
+
+def _get_schema(db: Session) -> Dict[str, Any]:
+    """
+    返回当前schema_version下的缓存，版本变化时清空重建
+    Return the cache for the current schema_version, resetting it when the version changed
+    """
+    version = db.execute(text("PRAGMA schema_version")).scalar()
+    with _schema_lock:
+        if _schema_cache["version"] != version:
+            logger.debug(f"数据库结构版本变为 {version}，重新反射表结构")
+            _schema_cache.update(version=version, tables=None, columns={})
+        return _schema_cache
+
+
+def get_table_names(db: Session) -> List[str]:
+    """
+    获取所有表名（缓存）
+    Get all table names (cached)
+    """
+    schema = _get_schema(db)
+    if schema["tables"] is None:
+        tables = inspect(db.bind).get_table_names()
+        with _schema_lock:
+            schema["tables"] = tables
+    return schema["tables"]
+
+
+def get_columns(db: Session, table_name: str) -> List[Dict[str, Any]]:
+    """
+    获取表的字段结构（缓存），表不存在时抛出404
+    Get a table's columns (cached); raises 404 when the table does not exist
+    """
+    if table_name not in get_table_names(db):
+        raise HTTPException(status_code=404, detail=f"表不存在: {table_name}")
+    schema = _get_schema(db)
+    columns = schema["columns"].get(table_name)
+    if columns is None:
+        columns = inspect(db.bind).get_columns(table_name)
+        with _schema_lock:
+            schema["columns"][table_name] = columns
+    return columns
+
+
+def _stat_row_count(db: Session, table_name: str) -> Optional[int]:
+    """
+    从sqlite_stat1读取ANALYZE时记录的行数，没有统计信息时返回None
+    Read the row count recorded by ANALYZE in sqlite_stat1; returns None without statistics
+    """
+    has_stats = db.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'")
+    ).first()
+    if not has_stats:
+        return None
+    stat = db.execute(
+        text("SELECT stat FROM sqlite_stat1 WHERE tbl = :table LIMIT 1"), {"table": table_name}
+    ).scalar()
+    if not stat:
+        return None
+    return int(stat.split()[0])
+
+
+def count_rows(db: Session, table_name: str, exact: bool = False) -> Tuple[int, bool]:
+    """
+    返回(行数, 是否为估算值)
+    Return (row count, whether it is an estimate)
+
+    先取sqlite_stat1的统计行数，没有时用rowid范围估算（走主键，不扫描表）；
+    估算值不超过DB_BROWSER_EXACT_COUNT_LIMIT或要求精确时才执行COUNT(*)。
+    The estimate comes from sqlite_stat1, falling back to the rowid range (a primary-key
+    lookup, no scan); COUNT(*) only runs when the estimate is at most
+    DB_BROWSER_EXACT_COUNT_LIMIT or an exact count is requested.
+    """
+    estimate = None
+    if not exact:
+        estimate = _stat_row_count(db, table_name)
+        if estimate is None:
+            low, high = db.execute(text(f'SELECT MIN(rowid), MAX(rowid) FROM "{table_name}"')).one()
+            estimate = 0 if low is None else high - low + 1
+    if estimate is not None and estimate > DB_BROWSER_EXACT_COUNT_LIMIT:
+        return estimate, True
+    return db.execute(text(f'SELECT COUNT(*) FROM "{table_name}"')).scalar(), False
+
+
+def _format_temporal(value: Any) -> Any:
+    """格式化日期时间对象，驱动返回的文本保持原样"""
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%d %H:%M:%S")
+    if isinstance(value, date):
+        return value.strftime("%Y-%m-%d")
+    if isinstance(value, time):
+        return value.strftime("%H:%M:%S")
+    return value
+
+
+def _strip_date(value: Any) -> Any:
+    """循环预约的日期字段只保留日期部分"""
+    if isinstance(value, str):
+        try:
+            return datetime.strptime(value, "%Y-%m-%d %H:%M:%S").strftime("%Y-%m-%d")
+        except ValueError:
+            return value
+    return _format_temporal(value)
+
+
+def _strip_time(value: Any) -> Any:
+    """循环预约的时间字段去掉微秒部分，如 "09:00:00 000000" """
+    if isinstance(value, str):
+        return value.split(' ')[0]
+    return _format_temporal(value)
+
+
+def _describe_blob(value: Any) -> Any:
+    """二进制内容只显示大小"""
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return f"<{len(value)} bytes>"
+    return value
+
+
+def _column_converter(table_name: str, column: Dict[str, Any]) -> Optional[Callable[[Any], Any]]:
+    """
+    按字段类型选定整列使用的转换函数，不需要转换时返回None
+    Pick the converter applied to a whole column from its type; None when values pass through
+    """
+    if table_name == 'recurring_reservation' and column["name"] in ('start_date', 'end_date'):
+        return _strip_date
+    if table_name == 'recurring_reservation' and column["name"] in ('start_time', 'end_time'):
+        return _strip_time
+    if isinstance(column["type"], (DateTime, Date, Time)):
+        return _format_temporal
+    if isinstance(column["type"], LargeBinary):
+        return _describe_blob
+    return None
+
+
+def convert_rows(table_name: str, columns: List[Dict[str, Any]], names: List[str], raw_rows: List[Tuple]) -> List[Dict[str, Any]]:
+    """
+    按列转换查询结果：每列只判断一次类型，再对整列应用转换函数
+    Convert query results column by column: each column's type is checked once and its
+    converter mapped over the whole column
+    """
+    if not raw_rows:
+        return []
+    by_name = {column["name"]: column for column in columns}
+    values = []
+    for name, column_values in zip(names, zip(*raw_rows)):
+        converter = _column_converter(table_name, by_name[name]) if name in by_name else None
+        values.append(list(map(converter, column_values)) if converter else column_values)
+    return [dict(zip(names, row)) for row in zip(*values)]
+
+
 # 获取所有表名
 @router.get("/tables")
-async def list_tables(db: Session = Depends(get_db), admin=Depends(get_current_admin)):
+def list_tables(db: Session = Depends(get_db), admin=Depends(get_current_admin)):
     try:
-        inspector = inspect(db.bind)
-        tables = inspector.get_table_names()
-        return {"tables": tables}
+        return {"tables": get_table_names(db)}
     except Exception as e:
-        import logging
-        logger = logging.getLogger(__name__)
         logger.error(f"获取数据库表名失败: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"获取数据库表名失败: {e}")
 
 # 获取表字段结构
 @router.get("/table/{table_name}/columns")
-async def get_table_columns(table_name: str, db: Session = Depends(get_db), admin=Depends(get_current_admin)):
-    inspector = inspect(db.bind)
-    try:
-        columns = inspector.get_columns(table_name)
-        return {"columns": columns}
-    except Exception as e:
-        raise HTTPException(status_code=404, detail=f"表不存在: {table_name}")
+def get_table_columns(table_name: str, db: Session = Depends(get_db), admin=Depends(get_current_admin)):
+    return {"columns": get_columns(db, table_name)}
 
 # 分页获取表数据
 @router.get("/table/{table_name}/rows")
-async def get_table_rows(
+def get_table_rows(
     table_name: str,
     skip: int = Query(0, ge=0),
     limit: int = Query(20, ge=1, le=100),
+    after: Optional[int] = Query(None, description="上一页返回的next_cursor，提供时按rowid游标翻页并忽略skip"),
+    exact_count: bool = Query(False, description="是否返回精确总行数"),
     db: Session = Depends(get_db),
     admin=Depends(get_current_admin)
 ):
+    # 检查表是否存在并获取列信息，用于判断列类型
+    columns = get_columns(db, table_name)
     try:
-        # 检查表是否存在
-        inspector = inspect(db.bind)
-        available_tables = inspector.get_table_names()
-        if table_name not in available_tables:
-            raise HTTPException(status_code=404, detail=f"表不存在: {table_name}")
-
-        # 获取表的总行数
-        count_sql = text(f'SELECT COUNT(*) FROM "{table_name}"')
-        count_result = db.execute(count_sql).fetchone()
-        total = count_result[0]
-
-        # 获取表的列信息，用于判断列类型
-        columns_info = inspector.get_columns(table_name)
-        column_types = {col['name']: col['type'] for col in columns_info}
-
-        # 使用双引号包裹表名，避免 SQLite 关键字冲突
-        sql = text(f'SELECT * FROM "{table_name}" LIMIT :limit OFFSET :skip')
-        result = db.execute(sql, {"limit": limit, "skip": skip})
-        # 处理不同版本 SQLAlchemy 的结果集转换
-        rows = []
-        # 获取列名
-        column_names = result.keys()
-        for row in result:
-            # 使用列名和值创建字典
-            row_dict = {}
-            for idx, column_name in enumerate(column_names):
-                value = row[idx]
-
-                # 特殊处理各种日期时间类型
-                if isinstance(value, datetime):
-                    # 对于更新时间字段，直接显示数据库中的值，不做时区转换
-                    # 因为数据库中已经存储了北京时间
-                    if column_name in ['updated_at', 'created_at']:
-                        value = value.strftime("%Y-%m-%d %H:%M:%S")
-                    # 对于预约的开始和结束时间，也不做时区转换
-                    elif column_name in ['start_datetime', 'end_datetime']:
-                        value = value.strftime("%Y-%m-%d %H:%M:%S")
-                    else:
-                        # 其他datetime字段，保持原样
-                        value = value.strftime("%Y-%m-%d %H:%M:%S")
-                # 特殊处理日期类型
-                elif isinstance(value, date) and not isinstance(value, datetime):
-                    # 日期类型，只显示日期部分
-                    value = value.strftime("%Y-%m-%d")
-                # 特殊处理时间类型
-                elif isinstance(value, time):
-                    # 时间类型，只显示时间部分，不显示微秒
-                    value = value.strftime("%H:%M:%S")
-                # 处理SQLite的日期时间文本格式
-                elif isinstance(value, str):
-                    # 尝试检测日期时间字符串
-                    if table_name == 'recurring_reservation' and column_name in ['start_date', 'end_date']:
-                        try:
-                            # 如果是日期字符串，只保留日期部分
-                            dt = datetime.strptime(value, "%Y-%m-%d %H:%M:%S")
-                            value = dt.strftime("%Y-%m-%d")
-                        except:
-                            pass
-                    elif table_name == 'recurring_reservation' and column_name in ['start_time', 'end_time']:
-                        try:
-                            # 如果是时间字符串，只保留时间部分，去掉微秒
-                            if ' ' in value:  # 格式如 "09:00:00 000000"
-                                value = value.split(' ')[0]
-                        except:
-                            pass
-
-                row_dict[column_name] = value
-            rows.append(row_dict)
-        return {"rows": rows, "total": total}
-    except HTTPException:
-        raise
+        total, approximate = count_rows(db, table_name, exact_count)
+
+        # 使用双引号包裹表名，避免 SQLite 关键字冲突；按rowid排序，游标翻页与OFFSET翻页顺序一致
+        if after is not None:
+            sql = text(
+                f'SELECT rowid AS {CURSOR_COLUMN}, * FROM "{table_name}" '
+                f'WHERE rowid > :after ORDER BY rowid LIMIT :limit'
+            )
+            result = db.execute(sql, {"after": after, "limit": limit})
+        else:
+            sql = text(f'SELECT rowid AS {CURSOR_COLUMN}, * FROM "{table_name}" ORDER BY rowid LIMIT :limit OFFSET :skip')
+            result = db.execute(sql, {"limit": limit, "skip": skip})
+
+        names = list(result.keys())[1:]
+        raw_rows = result.fetchall()
+        next_cursor = raw_rows[-1][0] if len(raw_rows) == limit else None
+        rows = convert_rows(table_name, columns, names, [row[1:] for row in raw_rows])
+        return FastJSONResponse({
+            "rows": rows,
+            "total": total,
+            "total_approximate": approximate,
+            "next_cursor": next_cursor
+        })
     except Exception as e:
-        import logging
-        logger = logging.getLogger(__name__)
         logger.error(f"查询表数据失败: {table_name}, 错误: {e}", exc_info=True)
-        raise HTTPException(status_code=500, detail=f"查询表数据失败: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"查询表数据失败: {str(e)}")
+
+# 查看数据库例行维护记录
+@router.get("/maintenance")
+def get_maintenance_status(db: Session = Depends(get_db), admin=Depends(get_current_admin)):
+    """
+    返回最近一次例行维护各步骤的耗时和结果，以及当前的空闲页数和文件页数
+    Return the timings and results of the latest maintenance steps with the current
+    free-page and total-page counts
+    """
+    return {
+        **get_maintenance_metrics(),
+        "page_count": db.execute(text("PRAGMA page_count")).scalar(),
+        "freelist_count": db.execute(text("PRAGMA freelist_count")).scalar()
+    }
@@ -3,15 +3,18 @@
 Equipment API routes
 """
 import os
+import asyncio
 import logging
-import shutil
 from typing import Optional, List
-from datetime import datetime
+from datetime import datetime, timedelta
 from fastapi import APIRouter, Depends, HTTPException, Query, UploadFile, File, Form, Request
 from fastapi.responses import JSONResponse, HTMLResponse, StreamingResponse
 from sqlalchemy.orm import Session
 from fastapi.templating import Jinja2Templates
 from io import BytesIO
+import anyio
+
+from config import EQUIPMENT_IMPORT_BACKGROUND_BYTES
 
 from backend.database import get_db
 from backend.models.equipment import Equipment
@@ -22,7 +25,11 @@ from backend.routes.crud.equipment import (
     update_equipment, delete_equipment
 )
 from backend.routes.crud.reservation import get_equipment_reservations, is_equipment_available
-from backend.utils.excel_handler import parse_equipment_excel, generate_equipment_template, export_equipment_data
+from backend.utils.equipment_import import save_import_upload, estimate_row_count, import_equipment_file, run_import_job
+from backend.utils.background_jobs import create_job, get_job, spawn_job
+from backend.utils.date_utils import get_weekday
+from backend.utils.occupancy_index import occupancy_index
+from backend.utils.image_pipeline import save_upload, generate_variants, apply_image_variants
 from backend.routes.auth import get_current_admin
 
 router = APIRouter(
@@ -197,6 +204,78 @@ async def get_equipment_availability_api(
         logger.error(f"获取设备可用性出错: {str(e)}")
         raise HTTPException(status_code=500, detail=f"获取设备可用性出错: {str(e)}")
 
+@router.get("/availability/search")
+async def search_available_equipment_api(
+    start_date: str,
+    end_date: str,
+    start_time: str,
+    end_time: str,
+    equipment_ids: Optional[str] = None,
+    category: Optional[str] = None,
+    weekdays: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    """
+    批量查询在日期范围内每天指定时间段都可用的设备（基于占用位图索引）
+    Find equipment that is free in the given time window on every date in the range (uses the occupancy bitmap index)
+
+    Args:
+        start_date: 开始日期 YYYY-MM-DD
+        end_date: 结束日期 YYYY-MM-DD
+        start_time: 每天的开始时间 HH:MM
+        end_time: 每天的结束时间 HH:MM
+        equipment_ids: 逗号分隔的设备ID，不提供则查询所有可用设备
+        category: 设备类别（可选）
+        weekdays: 逗号分隔的星期几 (0-6, 0表示周日)，不提供则包含每一天
+    """
+    try:
+        try:
+            first_date = datetime.strptime(start_date, "%Y-%m-%d").date()
+            last_date = datetime.strptime(end_date, "%Y-%m-%d").date()
+            window_start = datetime.strptime(start_time, "%H:%M").time()
+            window_end = datetime.strptime(end_time, "%H:%M").time()
+            weekday_filter = {int(day) for day in weekdays.split(",") if day.strip()} if weekdays else None
+            ids = [int(eid) for eid in equipment_ids.split(",") if eid.strip()] if equipment_ids else None
+        except ValueError:
+            raise HTTPException(status_code=400, detail="参数格式错误")
+
+        if first_date > last_date or window_start >= window_end:
+            raise HTTPException(status_code=400, detail="日期或时间范围无效")
+        if (last_date - first_date).days > 366:
+            raise HTTPException(status_code=400, detail="日期范围不能超过一年")
+
+        # 展开日期范围
+        dates = []
+        current_date = first_date
+        while current_date <= last_date:
+            if weekday_filter is None or get_weekday(current_date) in weekday_filter:
+                dates.append(current_date)
+            current_date += timedelta(days=1)
+
+        # 候选设备：仅包含状态为可用的设备
+        query = db.query(Equipment.id).filter(Equipment.status == "available")
+        if ids is not None:
+            query = query.filter(Equipment.id.in_(ids))
+        if category:
+            query = query.filter(Equipment.category == category)
+        candidate_ids = [row.id for row in query.order_by(Equipment.id).all()]
+
+        available_ids = occupancy_index.find_available(db, candidate_ids, dates, window_start, window_end)
+
+        return {
+            "success": True,
+            "data": {
+                "available_ids": available_ids,
+                "checked_equipment": len(candidate_ids),
+                "checked_dates": len(dates)
+            }
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"批量查询设备可用性出错: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"批量查询设备可用性出错: {str(e)}")
+
 @router.post("/upload-image", response_model=dict)
 async def upload_equipment_image(
     file: UploadFile = File(...),
@@ -217,47 +296,13 @@ async def upload_equipment_image(
             logger.warning(f"文件类型错误: {file.content_type}")
             raise HTTPException(status_code=400, detail="只允许上传图片文件")
 
-        # 检查文件大小（限制为8MB）
-        contents = await file.read()
-        size = len(contents)
-        logger.info(f"文件大小: {size} bytes ({size/1024/1024:.2f} MB)")
+        # 流式保存（限制为8MB），相同内容的图片复用已有文件
+        image_url, content_hash, size = await save_upload(file, "equipment", 8 * 1024 * 1024)
+        filename = os.path.basename(image_url)
+        logger.info(f"图片URL: {image_url}, 大小: {size/1024/1024:.2f} MB")
 
-        if size > 8 * 1024 * 1024:  # 8MB
-            logger.warning(f"文件过大: {size/1024/1024:.2f} MB")
-            raise HTTPException(status_code=400, detail="图片大小不能超过8MB")
-
-        # 重置文件指针
-        await file.seek(0)
-
-        # 创建上传目录（如果不存在）
-        from config import BASE_DIR
-        upload_dir = os.path.join(BASE_DIR, "backend", "static", "uploads", "equipment")
-        os.makedirs(upload_dir, exist_ok=True)
-        logger.info(f"上传目录: {upload_dir}")
-
-        # 生成唯一文件名
-        timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-        filename = f"{timestamp}_{file.filename}"
-        file_path = os.path.join(upload_dir, filename)
-
-        # 保存文件
-        try:
-            logger.info(f"尝试保存文件到: {file_path}")
-            logger.info(f"文件路径是否存在: {os.path.exists(os.path.dirname(file_path))}")
-
-            with open(file_path, "wb") as buffer:
-                shutil.copyfileobj(file.file, buffer)
-
-            logger.info(f"文件保存成功: {file_path}")
-            logger.info(f"文件是否存在: {os.path.exists(file_path)}")
-            logger.info(f"文件大小: {os.path.getsize(file_path) if os.path.exists(file_path) else 'N/A'} bytes")
-        except Exception as save_error:
-            logger.error(f"保存文件失败: {str(save_error)}")
-            raise HTTPException(status_code=500, detail=f"保存文件失败: {str(save_error)}")
-
-        # 生成URL路径
-        image_url = f"/static/uploads/equipment/{filename}"
-        logger.info(f"图片URL: {image_url}")
+        # 在进程池中生成缩略图和WebP/AVIF变体
+        variants = await generate_variants(image_url)
 
         # 如果提供了设备ID，更新设备的图片URL
         if equipment_id:
@@ -265,15 +310,19 @@ async def upload_equipment_image(
             if not equipment:
                 raise HTTPException(status_code=404, detail="设备不存在")
 
-            # 更新设备图片URL
+            # 更新设备图片URL及变体URL
             equipment.image_path = image_url
+            apply_image_variants(equipment)
             db.commit()
 
         return {
             "success": True,
             "data": {
                 "image_url": image_url,
-                "filename": filename
+                "filename": filename,
+                "thumbnail_url": variants["thumbnail"],
+                "webp_url": variants["webp"],
+                "avif_url": variants["avif"]
             }
         }
     except HTTPException:
@@ -300,7 +349,8 @@ async def export_equipment_api(
         # 获取所有设备数据
         equipments = get_equipments(db, 0, 1000, category, status)
 
-        # 导出数据
+        # 导出数据（openpyxl较重，首次导出时才加载）
+        from backend.utils.excel_handler import export_equipment_data
         excel_bytes = export_equipment_data(equipments)
 
         # 设置文件名
@@ -328,6 +378,7 @@ async def get_equipment_template_api(
     """
     try:
         # 生成模板
+        from backend.utils.excel_handler import generate_equipment_template
         template_bytes = generate_equipment_template()
 
         # 设置文件名
@@ -346,60 +397,64 @@ async def get_equipment_template_api(
 @router.post("/import")
 async def import_equipment_api(
     file: UploadFile = File(...),
+    dry_run: bool = Query(False, description="只校验并返回导入计划，不写入数据"),
+    skip_invalid: bool = Query(False, description="跳过校验失败的行，导入其余行"),
+    background: Optional[bool] = Query(None, description="是否作为后台任务运行，默认按文件大小决定"),
     db: Session = Depends(get_db),
     current_admin = Depends(get_current_admin)
 ):
     """
     导入设备数据（需要管理员权限）
     Import equipment data (admin required)
+
+    以(名称, 类别, 型号, 位置)识别设备：已存在的更新，其余新建，全部在一个事务中写入。
+    大文件作为后台任务运行，返回job_id，通过 /import/jobs/{job_id} 查询进度。
+    Equipment is keyed by (name, category, model, location): existing rows are updated and
+    the rest created, all in one transaction. Large files run as a background job; the
+    response carries a job_id to poll at /import/jobs/{job_id}.
     """
+    path = None
     try:
         # 检查文件类型
-        filename = file.filename.lower()
-        if not (filename.endswith('.xlsx') or filename.endswith('.xls')):
-            raise ValueError("文件类型不支持，请上传Excel文件（.xlsx或.xls）")
-
-        # 读取文件内容
-        try:
-            contents = await file.read()
-            if not contents:
-                raise ValueError("文件内容为空")
-        except Exception as read_error:
-            logger.error(f"读取文件内容失败: {str(read_error)}")
-            raise ValueError(f"读取文件内容失败: {str(read_error)}")
-
-        # 解析Excel文件
-        try:
-            equipment_data = parse_equipment_excel(contents)
-        except ValueError as ve:
-            # 直接抛出用户可读的错误
-            raise ve
-        except Exception as parse_error:
-            logger.error(f"解析Excel文件失败: {str(parse_error)}")
-            raise ValueError(f"解析Excel文件失败: {str(parse_error)}")
-
-        # 导入设备数据
-        imported_count = 0
-        try:
-            for item in equipment_data:
-                equipment = EquipmentCreate(**item)
-                create_equipment(db, equipment)
-                imported_count += 1
-        except Exception as import_error:
-            logger.error(f"导入设备数据失败: {str(import_error)}")
-            if imported_count > 0:
-                return {
-                    "success": True,
-                    "message": f"部分导入成功，已导入 {imported_count} 个设备，但在导入过程中出现错误: {str(import_error)}",
-                    "count": imported_count
-                }
-            else:
-                raise ValueError(f"导入设备数据失败: {str(import_error)}")
+        filename = (file.filename or "").lower()
+        if filename.endswith('.xls'):
+            raise ValueError("不支持旧的.xls格式，请另存为.xlsx后上传")
+        if not filename.endswith('.xlsx'):
+            raise ValueError("文件类型不支持，请上传Excel文件（.xlsx）")
+
+        # 流式保存上传文件
+        path, size = await save_import_upload(file)
+        if not size:
+            raise ValueError("文件内容为空")
+
+        # 大文件转为后台任务
+        if background is None:
+            background = size > EQUIPMENT_IMPORT_BACKGROUND_BYTES
+        if background:
+            job_id = create_job("equipment_import", filename=file.filename, dry_run=dry_run, total=estimate_row_count(path))
+            spawn_job(job_id, asyncio.to_thread(run_import_job, job_id, path, dry_run, skip_invalid))
+            path = None
+            return {
+                "success": True,
+                "message": "导入任务已开始，请查询任务进度",
+                "job_id": job_id
+            }
 
+        report = await anyio.to_thread.run_sync(import_equipment_file, db, path, dry_run, skip_invalid)
+        count = report["created"] + report["updated"]
+        if report["error_count"] and not skip_invalid:
+            message = f"有 {report['error_count']} 行数据校验失败，未导入任何设备"
+        elif dry_run:
+            message = f"试运行完成，将新建 {report['created']} 个、更新 {report['updated']} 个设备"
+        else:
+            message = f"成功导入 {count} 个设备（新建 {report['created']} 个，更新 {report['updated']} 个）"
+            if report["error_count"]:
+                message += f"，跳过 {report['error_count']} 行无效数据"
         return {
-            "success": True,
-            "message": f"成功导入 {imported_count} 个设备",
-            "count": imported_count
+            "success": not (report["error_count"] and not skip_invalid),
+            "message": message,
+            "count": count,
+            "data": report
         }
     except ValueError as ve:
         # 直接抛出用户可读的错误
@@ -408,4 +463,20 @@ async def import_equipment_api(
     except Exception as e:
         logger.error(f"导入设备数据出错: {str(e)}")
         raise HTTPException(status_code=500, detail=f"导入设备数据出错: {str(e)}")
+    finally:
+        if path:
+            os.remove(path)
 
+@router.get("/import/jobs/{job_id}")
+async def get_import_job_api(
+    job_id: str,
+    current_admin = Depends(get_current_admin)
+):
+    """
+    查询后台导入任务的进度和结果（需要管理员权限）
+    Get the progress and result of a background import job (admin required)
+    """
+    job = get_job(job_id, "equipment_import")
+    if not job:
+        raise HTTPException(status_code=404, detail="导入任务不存在或已过期")
+    return {"success": True, "data": job}
@@ -0,0 +1,92 @@
+"""
+实时事件路由
+Live event routes
+"""
+import asyncio
+import logging
+from typing import List, Optional, Set
+
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+
+from backend.database import SessionLocal
+from backend.models.equipment import Equipment
+from backend.utils.fast_json import dumps
+from backend.utils.live_events import event_bus
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+router = APIRouter(
+    prefix="/api/events",
+    tags=["events"],
+)
+
+# 心跳间隔（秒），防止代理因连接空闲而断开
+HEARTBEAT_INTERVAL = 15
+# 断线后客户端的重连间隔（毫秒）
+RETRY_MILLISECONDS = 5000
+
+
+def get_category_equipment_ids(category: str) -> Set[int]:
+    """
+    查询类别下的设备ID；使用独立的短会话，不让数据库连接在整个事件流期间被占用
+    Look up the equipment ids of a category with a short-lived session, so no pooled
+    connection is held for the lifetime of the event stream
+    """
+    db = SessionLocal()
+    try:
+        return {row[0] for row in db.query(Equipment.id).filter(Equipment.category == category).all()}
+    finally:
+        db.close()
+
+
+@router.get("/stream")
+async def stream_events(
+    request: Request,
+    equipment_id: Optional[List[int]] = Query(None),
+    category: Optional[str] = None
+):
+    """
+    以Server-Sent Events推送预约变更（新增、修改、取消、状态变化）和循环预约变更（新增、修改、取消）
+    Push reservation changes (created, updated, cancelled, status) and series changes
+    (created, updated, cancelled) as Server-Sent Events
+
+    参数:
+    - equipment_id: 可选，可重复，只接收这些设备的事件
+    - category: 可选，只接收该类别设备的事件（按连接时的设备列表）
+    """
+    equipment_ids = set(equipment_id) if equipment_id else None
+    if category:
+        category_ids = await asyncio.to_thread(get_category_equipment_ids, category)
+        equipment_ids = category_ids if equipment_ids is None else equipment_ids & category_ids
+
+    subscription = event_bus.subscribe(equipment_ids)
+    if subscription is None:
+        raise HTTPException(status_code=503, detail="实时连接数已达上限，请稍后重试")
+
+    async def event_stream():
+        try:
+            yield f"retry: {RETRY_MILLISECONDS}\n\n"
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscription.queue.get(), timeout=HEARTBEAT_INTERVAL)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield ": heartbeat\n\n"
+                    continue
+
+                if event is None:
+                    # 客户端处理过慢已被丢弃，通知其重新同步
+                    yield "event: dropped\ndata: {}\n\n"
+                    break
+                yield f"event: {event['type']}\ndata: {dumps(event).decode('utf-8')}\n\n"
+        finally:
+            event_bus.unsubscribe(subscription)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
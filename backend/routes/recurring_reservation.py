@@ -5,7 +5,7 @@ Recurring Reservation API routes
 import logging
 from typing import Optional
 from datetime import date, time, datetime
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Header
 from sqlalchemy.orm import Session
 
 from backend.database import get_db
@@ -27,6 +27,8 @@ from backend.utils.email_sender import (
 )
 from backend.routes.auth import get_current_admin, optional_admin
 from backend.utils.date_utils import format_datetime
+from backend.utils.idempotency import run_idempotent_async
+from backend.utils.recurrence import build_series_layout
 
 router = APIRouter(
     prefix="/api/recurring-reservation",
@@ -38,11 +40,25 @@ logger = logging.getLogger(__name__)
 @router.post("/", response_model=RecurringReservationResponse)
 async def create_recurring_reservation_api(
     recurring_reservation: RecurringReservationCreate,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
     db: Session = Depends(get_db)
 ):
     """
-    创建新循环预约
-    Create new recurring reservation
+    创建新循环预约，携带Idempotency-Key时重试返回首次结果
+    Create new recurring reservation; retries carrying an Idempotency-Key return the first result
+    """
+    return await run_idempotent_async(
+        db, idempotency_key, "recurring_reservation.create", recurring_reservation.dict(),
+        lambda: _create_recurring_reservation_response(recurring_reservation, db)
+    )
+
+async def _create_recurring_reservation_response(
+    recurring_reservation: RecurringReservationCreate,
+    db: Session
+) -> RecurringReservationResponse:
+    """
+    创建循环预约并构建响应
+    Create the recurring reservation and build the response
     """
     try:
         # 检查设备是否存在
@@ -277,7 +293,28 @@ async def cancel_recurring_reservation_api(
     recurring_reservation_id: int,
     user_email: Optional[str] = None,
     lang: str = "zh_CN",
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
     db: Session = Depends(get_db)
+):
+    """
+    取消循环预约，携带Idempotency-Key时重试返回首次结果
+    Cancel recurring reservation; retries carrying an Idempotency-Key return the first result
+    """
+    payload = {
+        "recurring_reservation_id": recurring_reservation_id,
+        "user_email": user_email,
+        "lang": lang
+    }
+    return await run_idempotent_async(
+        db, idempotency_key, "recurring_reservation.cancel", payload,
+        lambda: _cancel_recurring_reservation(recurring_reservation_id, user_email, lang, db)
+    )
+
+async def _cancel_recurring_reservation(
+    recurring_reservation_id: int,
+    user_email: Optional[str],
+    lang: str,
+    db: Session
 ):
     """
     取消循环预约
@@ -393,11 +430,16 @@ async def get_recurring_reservation_by_code_api(
 async def get_child_reservations_api(
     recurring_reservation_id: int,
     include_past: int = 0,
+    compact: int = 0,
     db: Session = Depends(get_db)
 ):
     """
     获取循环预约的子预约
     Get child reservations of recurring reservation
+
+    compact=1时返回series（RRULE + EXDATE + 实例ID/序号），reservations中只包含例外和已取消的子预约。
+    With compact=1, series (RRULE + EXDATE + instance ids/numbers) is returned and
+    reservations only holds exception and cancelled children.
     """
     try:
         # 检查循环预约是否存在
@@ -408,6 +450,15 @@ async def get_child_reservations_api(
         # 获取子预约
         reservations = get_child_reservations(db, recurring_reservation_id, include_past)
 
+        series = None
+        if compact == 1:
+            range_start = None
+            if include_past == 0:
+                range_start = datetime.combine(datetime.now().date(), time.min)
+            series, reservations = build_series_layout(
+                db_recurring_reservation, reservations, ("confirmed",), range_start=range_start
+            )
+
         # 格式化返回数据
         reservation_list = []
         for reservation in reservations:
@@ -421,11 +472,14 @@ async def get_child_reservations_api(
                 "is_exception": reservation.is_exception
             })
 
-        return {
+        response = {
             "success": True,
             "message": "获取子预约成功",
             "reservations": reservation_list
         }
+        if compact == 1:
+            response["series"] = series
+        return response
     except Exception as e:
         logger.error(f"获取子预约出错: {str(e)}")
         return {"success": False, "message": f"获取子预约出错: {str(e)}", "reservations": []}
@@ -7,23 +7,24 @@ import asyncio
 from typing import Optional
 from datetime import datetime, timedelta
 import traceback
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Header
 from sqlalchemy.orm import Session
-from sqlalchemy import func
 
 from backend.database import get_db
+from backend.utils.db_backup import get_snapshot_db
 from backend.models.reservation import Reservation
 from backend.models.equipment import Equipment
 from backend.models.reservation_history import ReservationHistory
+from backend.models.reservation_archive import ReservationArchive, ReservationHistoryArchive
 from backend.schemas.reservation import (
-    ReservationCreate, ReservationUpdate,
+    ReservationCreate, ReservationUpdate, ReservationBatchCreate,
     ReservationList, Reservation as ReservationSchema,
     ReservationResponse, ReservationCancel, ReservationExportRequest
 )
 from backend.routes.crud.reservation import (
-    create_reservation, get_reservation_by_code, get_reservation_by_id,
+    create_reservation, create_reservation_batch, get_reservation_by_code, get_reservation_by_id,
     get_reservations, get_reservation_count,
-    update_reservation, cancel_reservation, cancel_reservation_by_code, is_equipment_available
+    update_reservation, cancel_reservation, is_equipment_available
 )
 from backend.routes.crud.equipment import get_equipment
 from backend.utils.date_utils import format_datetime, parse_datetime
@@ -33,6 +34,9 @@ from backend.utils.email_sender import (
 )
 from backend.routes.auth import get_current_admin, optional_admin, get_current_user
 from backend.routes.crud.time_slot import get_time_slots_for_equipment
+from backend.utils.idempotency import run_idempotent, run_idempotent_async
+from backend.utils.fast_json import FastJSONResponse
+from backend.utils.reservation_lookup import lookup_reservation, normalize_reservation_number, resolve_reservation
 
 router = APIRouter(
     prefix="/api/reservation",
@@ -42,18 +46,32 @@ router = APIRouter(
 logger = logging.getLogger(__name__)
 
 @router.post("/")
-def create_reservation_endpoint(reservation: ReservationCreate, db: Session = Depends(get_db)):
+def create_reservation_endpoint(
+    reservation: ReservationCreate,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+    db: Session = Depends(get_db)
+):
+    """
+    创建预约，携带Idempotency-Key时重试返回首次结果
+    Create reservation; retries carrying an Idempotency-Key return the first result
+    """
+    return run_idempotent(
+        db, idempotency_key, "reservation.create", reservation.dict(),
+        lambda: _create_reservation_response(db, reservation)
+    )
+
+def _create_reservation_response(db: Session, reservation: ReservationCreate):
     """
-    创建预约
-    Create reservation
+    创建预约并构建响应
+    Create the reservation and build the response
     """
     try:
-        print(f"[调试信息] 收到预约请求数据: {reservation.dict()}")
+        logger.debug("收到预约请求数据: %s", reservation)
 
         # 处理API调用的预约创建
         db_reservation, message = create_reservation(db, reservation)
         if db_reservation is None:
-            print(f"[调试信息] 创建预约失败: {message}")
+            logger.debug("创建预约失败: %s", message)
             return {
                 "success": False,
                 "message": message
@@ -76,30 +94,101 @@ def create_reservation_endpoint(reservation: ReservationCreate, db: Session = De
             }
         }
     except Exception as e:
-        import traceback
-        error_details = traceback.format_exc()
-        print(f"[调试信息] 预约创建过程中出现异常: {str(e)}")
-        print(f"[调试信息] 异常详情: {error_details}")
+        logger.error("预约创建过程中出现异常: %s", str(e), exc_info=True)
 
         return {
             "success": False,
             "message": f"创建预约失败: {str(e)}"
         }
 
+@router.post("/batch")
+def create_reservation_batch_endpoint(
+    batch: ReservationBatchCreate,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+    db: Session = Depends(get_db)
+):
+    """
+    批量创建预约：全部成功或全部不创建，每个项目返回自己的预约码
+    Create reservations in bulk: all or nothing, each item gets its own reservation code
+    """
+    def create():
+        reservations, message, errors = create_reservation_batch(db, batch)
+        if not reservations:
+            logger.warning(f"批量创建预约失败: {message}")
+            return {
+                "success": False,
+                "message": message,
+                "data": {"errors": errors}
+            }
+
+        return {
+            "success": True,
+            "message": f"批量预约创建成功，共{len(reservations)}个预约",
+            "data": {
+                "items": [
+                    {
+                        "id": reservation.id,
+                        "reservation_code": reservation.reservation_code,
+                        "reservation_number": reservation.reservation_number,
+                        "equipment_id": reservation.equipment_id,
+                        "equipment_name": reservation.equipment.name if reservation.equipment else None,
+                        "start_datetime": reservation.start_datetime.isoformat(),
+                        "end_datetime": reservation.end_datetime.isoformat(),
+                        "status": reservation.status
+                    }
+                    for reservation in reservations
+                ]
+            }
+        }
+
+    return run_idempotent(db, idempotency_key, "reservation.batch_create", batch.dict(), create)
+
 @router.delete("/{reservation_id}")
-def cancel_reservation_endpoint(reservation_id: int, db: Session = Depends(get_db)):
+def cancel_reservation_endpoint(
+    reservation_id: int,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+    db: Session = Depends(get_db)
+):
     """
     取消预约
     Cancel reservation
     """
-    # 调用取消预约函数
-    success, message = cancel_reservation(db, reservation_id, user_cancel=True)
-    if not success:
-        raise HTTPException(status_code=400, detail=message)
+    def cancel():
+        # 调用取消预约函数
+        success, message = cancel_reservation(db, reservation_id, user_cancel=True)
+        if not success:
+            raise HTTPException(status_code=400, detail=message)
+
+        return {
+            "success": True,
+            "message": message
+        }
 
+    return run_idempotent(db, idempotency_key, "reservation.cancel", {"reservation_id": reservation_id}, cancel)
+
+def _reservation_list_item(reservation: Reservation) -> dict:
+    """
+    按ReservationSchema的字段构建预约列表项
+    Build a reservation list item with the fields of ReservationSchema
+    """
     return {
-        "success": True,
-        "message": message
+        "id": reservation.id,
+        "equipment_id": reservation.equipment_id,
+        "user_name": reservation.user_name,
+        "user_department": reservation.user_department,
+        "user_contact": reservation.user_contact,
+        "start_datetime": reservation.start_datetime,
+        "end_datetime": reservation.end_datetime,
+        "purpose": reservation.purpose,
+        "reservation_number": reservation.reservation_number,
+        "reservation_code": reservation.reservation_code,
+        "status": reservation.status,
+        "created_at": reservation.created_at,
+        "equipment_name": getattr(reservation, "equipment_name", None),
+        "equipment_category": getattr(reservation, "equipment_category", None),
+        "equipment_location": getattr(reservation, "equipment_location", None),
+        "user_email": reservation.user_email,
+        "qrcode_url": getattr(reservation, "qrcode_url", None)
     }
 
 @router.get("/", response_model=ReservationList)
@@ -144,7 +233,8 @@ async def get_reservations_api(
             db, equipment_id, user_name, user_contact, status,
             from_date, to_date, category, effective_reservation_code
         )
-        return {"items": items, "total": total}
+        # 直接构建响应字典并用orjson序列化，跳过response_model的重复校验
+        return FastJSONResponse({"items": [_reservation_list_item(item) for item in items], "total": total})
     except HTTPException:
         raise
     except Exception as e:
@@ -167,45 +257,13 @@ async def get_reservation_by_number_api(
     try:
         logger.info(f"[API调用] 通过预约序号获取预约详情: 预约序号={reservation_number}")
 
-        # 记录所有预约序号，用于调试
-        all_reservations = db.query(Reservation).all()
-        logger.debug(f"[数据库调试] 数据库中的所有预约序号: {[r.reservation_number for r in all_reservations]}")
-
-        # 直接通过预约序号查询
-        logger.debug(f"[数据库查询] 执行查询: Reservation.reservation_number == {reservation_number}")
-        reservation = db.query(Reservation).filter(
-            Reservation.reservation_number == reservation_number
-        ).first()
-
-        if not reservation:
+        result = lookup_reservation(db, None, reservation_number)
+        if result is None:
             logger.warning(f"[数据库查询] 未找到预约: 预约序号={reservation_number}")
-
-            # 尝试模糊匹配
-            similar_reservations = db.query(Reservation).filter(
-                Reservation.reservation_number.like(f"%{reservation_number}%")
-            ).all()
-
-            if similar_reservations:
-                logger.info(f"[数据库查询] 找到类似的预约: {[(r.id, r.reservation_number) for r in similar_reservations]}")
-
             return ReservationResponse(success=False, message="预约不存在", data=None)
 
-        logger.info(f"[数据库查询] 通过预约序号找到预约: ID={reservation.id}, 状态={reservation.status}, 预约序号={reservation.reservation_number}")
-
-        # 获取设备信息
-        equipment = get_equipment(db, reservation.equipment_id)
-        if equipment:
-            reservation.equipment_name = equipment.name
-            reservation.equipment_category = equipment.category
-            reservation.equipment_location = equipment.location
-            logger.debug(f"[数据库查询] 获取设备信息: ID={equipment.id}, 名称={equipment.name}")
-
-        # 创建返回对象
-        reservation_dict = reservation.__dict__.copy()
-        if '_sa_instance_state' in reservation_dict:
-            del reservation_dict['_sa_instance_state']
-
-        logger.info(f"[API响应] 成功获取预约: ID={reservation.id}, 状态={reservation.status}, 开始时间={reservation.start_datetime}, 结束时间={reservation.end_datetime}, 预约序号={reservation.reservation_number}")
+        reservation_dict = dict(result["reservation"])
+        logger.info(f"[API响应] 成功获取预约: ID={reservation_dict['id']}, 状态={reservation_dict['status']}, 预约序号={reservation_dict['reservation_number']}")
         return ReservationResponse(success=True, message="获取预约成功", data=reservation_dict)
     except Exception as e:
         logger.error(f"获取预约详情出错: {str(e)}")
@@ -216,6 +274,15 @@ async def get_reservation_by_number_api(
             data=None
         )
 
+def _parse_query_datetime(value: str) -> datetime:
+    """
+    解析查询参数中的时间，支持ISO格式和"YYYY-MM-DD HH:MM:SS"
+    Parse a datetime query parameter in ISO or "YYYY-MM-DD HH:MM:SS" format
+    """
+    if 'T' in value:
+        return datetime.fromisoformat(value.replace('Z', '+00:00'))
+    return datetime.strptime(value, "%Y-%m-%d %H:%M:%S")
+
 @router.get("/code/{reservation_code}", response_model=ReservationResponse)
 async def get_reservation_by_code_api(
     reservation_code: str,
@@ -228,6 +295,12 @@ async def get_reservation_by_code_api(
     通过预定码获取预定详情
     Get reservation details by reservation code
 
+    预约序号优先；预约码属于循环预约且序号未匹配时返回循环预约标记；提供开始时间时
+    优先返回同一天、其次同星期几的预约。整个解析只有一条查询，结果会被缓存。
+    The reservation number wins; a series code without a number match returns the
+    recurring marker; with a start time the same day, then the same weekday, is
+    preferred. Resolution takes a single query and the result is cached.
+
     Args:
         reservation_code: 预约码
         start_time: 开始时间（可选）
@@ -237,361 +310,52 @@ async def get_reservation_by_code_api(
     """
     try:
         logger.info(f"获取预约详情: 预约码={reservation_code}, 开始时间={start_time}, 结束时间={end_time}, 预约序号={reservation_number}")
+        reservation_number = normalize_reservation_number(reservation_number)
 
-        # 如果提供了预约序号，优先使用预约序号查询
-        if reservation_number:
-            logger.info(f"提供了预约序号 {reservation_number}，优先使用预约序号查询")
-
-            # 检查预约序号是否是RN-开头的格式
-            if isinstance(reservation_number, str) and reservation_number.startswith("RN-"):
-                logger.info(f"使用预约序号查询: {reservation_number}")
-
-                # 直接通过预约序号查询，不依赖于预约码
-                direct_reservation = db.query(Reservation).filter(
-                    Reservation.reservation_number == reservation_number
-                ).first()
-
-                if direct_reservation:
-                    logger.info(f"通过预约序号直接找到预约: ID={direct_reservation.id}, 状态={direct_reservation.status}")
-                    reservation = direct_reservation
-
-                    # 添加设备信息
-                    equipment = db.query(Equipment).filter(Equipment.id == reservation.equipment_id).first()
-                    if equipment:
-                        reservation.equipment_name = equipment.name
-                        reservation.equipment_category = equipment.category
-                        reservation.equipment_location = equipment.location
-
-                    # 如果是通过预约序号查询，直接返回结果
-                    logger.info(f"通过预约序号查询成功，返回预约详情: ID={reservation.id}, 状态={reservation.status}")
-                    # 将对象转换为字典
-                    reservation_dict = {
-                        "id": reservation.id,
-                        "equipment_id": reservation.equipment_id,
-                        "user_name": reservation.user_name,
-                        "user_contact": reservation.user_contact,
-                        "user_department": reservation.user_department,
-                        "user_email": reservation.user_email,
-                        "start_datetime": reservation.start_datetime.isoformat() if reservation.start_datetime else None,
-                        "end_datetime": reservation.end_datetime.isoformat() if reservation.end_datetime else None,
-                        "status": reservation.status,
-                        "purpose": reservation.purpose,
-                        "reservation_code": reservation.reservation_code,
-                        "reservation_number": reservation.reservation_number,
-                        "equipment_name": reservation.equipment_name if hasattr(reservation, "equipment_name") else None,
-                        "equipment_category": reservation.equipment_category if hasattr(reservation, "equipment_category") else None,
-                        "equipment_location": reservation.equipment_location if hasattr(reservation, "equipment_location") else None,
-                        "created_at": reservation.created_at.isoformat() if hasattr(reservation, "created_at") and reservation.created_at else None
-                    }
-
-                    # 添加updated_at字段（如果存在）
-                    if hasattr(reservation, "updated_at") and reservation.updated_at:
-                        reservation_dict["updated_at"] = reservation.updated_at.isoformat()
-                    return ReservationResponse(success=True, message="获取预定成功", data=reservation_dict)
-
-        # 首先检查这个预约码是否属于循环预约
-        from backend.models.recurring_reservation import RecurringReservation
-
-        # 查询循环预约表
-        recurring_reservation = db.query(RecurringReservation).filter(
-            RecurringReservation.reservation_code == reservation_code
-        ).first()
-
-        if recurring_reservation:
-            logger.info(f"预约码 {reservation_code} 属于循环预约，ID={recurring_reservation.id}")
-
-            # 如果提供了预约序号，尝试查找特定的子预约
-            if reservation_number:
-                logger.info(f"尝试查找循环预约的子预约: 预约码={reservation_code}, 预约序号={reservation_number}")
-
-                # 查询特定的子预约
-                child_reservation = db.query(Reservation).filter(
-                    Reservation.reservation_code == reservation_code,
-                    Reservation.reservation_number == reservation_number
-                ).first()
-
-                if child_reservation:
-                    logger.info(f"找到循环预约的子预约: ID={child_reservation.id}, 状态={child_reservation.status}")
-
-                    # 添加设备信息
-                    equipment = db.query(Equipment).filter(Equipment.id == child_reservation.equipment_id).first()
-                    if equipment:
-                        child_reservation.equipment_name = equipment.name
-                        child_reservation.equipment_category = equipment.category
-                        child_reservation.equipment_location = equipment.location
-
-                    # 将对象转换为字典
-                    reservation_dict = {
-                        "id": child_reservation.id,
-                        "equipment_id": child_reservation.equipment_id,
-                        "user_name": child_reservation.user_name,
-                        "user_contact": child_reservation.user_contact,
-                        "user_department": child_reservation.user_department,
-                        "user_email": child_reservation.user_email,
-                        "start_datetime": child_reservation.start_datetime.isoformat() if child_reservation.start_datetime else None,
-                        "end_datetime": child_reservation.end_datetime.isoformat() if child_reservation.end_datetime else None,
-                        "status": child_reservation.status,
-                        "purpose": child_reservation.purpose,
-                        "reservation_code": child_reservation.reservation_code,
-                        "reservation_number": child_reservation.reservation_number,
-                        "equipment_name": child_reservation.equipment_name if hasattr(child_reservation, "equipment_name") else None,
-                        "equipment_category": child_reservation.equipment_category if hasattr(child_reservation, "equipment_category") else None,
-                        "equipment_location": child_reservation.equipment_location if hasattr(child_reservation, "equipment_location") else None,
-                        "created_at": child_reservation.created_at.isoformat() if hasattr(child_reservation, "created_at") and child_reservation.created_at else None,
-                        "is_child_of_recurring": True,
-                        "recurring_id": recurring_reservation.id
-                    }
+        # 解析时间参数
+        start_datetime = None
+        end_datetime = None
+        if start_time:
+            try:
+                start_datetime = _parse_query_datetime(start_time)
+                if end_time:
+                    end_datetime = _parse_query_datetime(end_time)
+            except ValueError as e:
+                logger.error(f"解析时间参数出错: {str(e)}")
 
-                    return ReservationResponse(success=True, message="获取预定成功", data=reservation_dict)
-                else:
-                    logger.warning(f"未找到循环预约的子预约: 预约码={reservation_code}, 预约序号={reservation_number}")
+        start_date = start_datetime.date() if start_datetime else None
+        result = lookup_reservation(db, reservation_code, reservation_number, start_date)
+        if result is None:
+            return ReservationResponse(success=False, message="预定不存在", data=None)
 
+        if result["is_recurring"]:
+            logger.info(f"预约码 {reservation_code} 属于循环预约，ID={result['recurring_id']}")
             # 返回特殊响应，告诉前端这是一个循环预约
             return {
                 "success": False,  # 设置为False，让前端知道这不是普通预约
                 "message": "这是一个循环预约",
                 "data": {
                     "is_recurring": True,
-                    "recurring_id": recurring_reservation.id,
+                    "recurring_id": result["recurring_id"],
                     "reservation_code": reservation_code
                 }
             }
 
-        # 如果提供了时间参数，使用时间参数查询特定的预定
-        reservation = None
-        start_date = None
-        end_date = None
-        date_matches = False
-        exact_datetime_matches = False
-
-        # 解析时间参数
-        if start_time:
-            logger.info(f"使用时间参数查询特定预定: {start_time} - {end_time}")
-
-            try:
-                # 解析时间参数，支持多种格式
-                if 'T' in start_time:
-                    start_datetime = datetime.fromisoformat(start_time.replace('Z', '+00:00'))
-                else:
-                    start_datetime = datetime.strptime(start_time, "%Y-%m-%d %H:%M:%S")
-
-                # 提取日期部分
-                start_date = start_datetime.date()
-                logger.info(f"解析的开始日期: {start_date}")
-
-                # 查找与这个日期匹配的预约
-                date_match_query = db.query(Reservation).filter(
-                    Reservation.reservation_code == reservation_code,
-                    func.date(Reservation.start_datetime) == start_date
-                )
-
-                # 记录SQL查询语句用于调试
-                logger.debug(f"日期匹配SQL查询: {str(date_match_query)}")
-
-                # 获取匹配查询结果
-                date_match_reservation = date_match_query.first()
-
-                if date_match_reservation:
-                    logger.info(f"找到日期匹配的预约: ID={date_match_reservation.id}, 状态={date_match_reservation.status}")
-                    reservation = date_match_reservation
-                    date_matches = True
-
-                    # 进一步检查确切的时间是否匹配
-                    if end_time:
-                        try:
-                            if 'T' in end_time:
-                                end_datetime = datetime.fromisoformat(end_time.replace('Z', '+00:00'))
-                            else:
-                                end_datetime = datetime.strptime(end_time, "%Y-%m-%d %H:%M:%S")
-
-                            # 获取预约的时间
-                            res_start_time = date_match_reservation.start_datetime
-                            res_end_time = date_match_reservation.end_datetime
-
-                            # 检查小时和分钟是否匹配
-                            if (res_start_time.hour == start_datetime.hour and
-                                res_start_time.minute == start_datetime.minute and
-                                res_end_time.hour == end_datetime.hour and
-                                res_end_time.minute == end_datetime.minute):
-                                exact_datetime_matches = True
-                                logger.info("找到精确的时间匹配！")
-                            else:
-                                logger.info(f"日期匹配但时间不完全匹配: 预约时间={res_start_time.hour}:{res_start_time.minute}-{res_end_time.hour}:{res_end_time.minute}, 查询时间={start_datetime.hour}:{start_datetime.minute}-{end_datetime.hour}:{end_datetime.minute}")
-                        except Exception as e:
-                            logger.error(f"解析结束时间出错: {str(e)}")
-                else:
-                    logger.warning(f"未找到日期 {start_date} 的精确匹配预约")
-            except Exception as e:
-                logger.error(f"解析时间参数出错: {str(e)}")
-                logger.error(traceback.format_exc())
-
-        # 如果提供了预约序号，则优先使用预约序号查询
-        if reservation_number:
-            logger.info(f"提供了预约序号参数: {reservation_number}, 类型: {type(reservation_number)}")
-
-            # 确保reservation_number是字符串，处理可能的JSON对象
-            try:
-                # 如果是字符串但看起来像JSON
-                if isinstance(reservation_number, str) and (reservation_number.startswith('{') or reservation_number.startswith('[')):
-                    logger.warning(f"预约序号参数是JSON格式，尝试解析: {reservation_number}")
-                    import json
-                    try:
-                        parsed_number = json.loads(reservation_number)
-                        if isinstance(parsed_number, dict) and 'reservation_number' in parsed_number:
-                            reservation_number = parsed_number['reservation_number']
-                            logger.info(f"从JSON对象中提取预约序号: {reservation_number}")
-                        elif isinstance(parsed_number, dict) and '$oid' in parsed_number:
-                            reservation_number = parsed_number['$oid']
-                            logger.info(f"从JSON对象中提取$oid: {reservation_number}")
-                        # 处理时间戳参数，如果JSON对象只包含_t字段，则忽略这个参数
-                        elif isinstance(parsed_number, dict) and '_t' in parsed_number and len(parsed_number) == 1:
-                            logger.info(f"检测到时间戳参数 _t，忽略此参数: {parsed_number}")
-                            reservation_number = None
-                            # 如果只有时间戳参数，则不将其视为预约序号
-                    except json.JSONDecodeError:
-                        logger.error(f"无法解析JSON格式的预约序号: {reservation_number}")
-
-                # 确保最终的reservation_number是字符串
-                if not isinstance(reservation_number, str):
-                    reservation_number = str(reservation_number)
-                    logger.info(f"将预约序号转换为字符串: {reservation_number}")
-
-            except Exception as e:
-                logger.error(f"处理预约序号参数时出错: {str(e)}")
-                logger.error(traceback.format_exc())
-
-            # 检查预约序号是否是RN-开头的格式
-            if isinstance(reservation_number, str) and reservation_number.startswith("RN-"):
-                logger.info(f"使用预约序号查询: {reservation_number}")
-
-                # 直接通过预约序号查询，不依赖于预约码
-                direct_reservation = db.query(Reservation).filter(
-                    Reservation.reservation_number == reservation_number
-                ).first()
-
-                if direct_reservation:
-                    logger.info(f"通过预约序号直接找到预约: ID={direct_reservation.id}, 状态={direct_reservation.status}")
-                    reservation = direct_reservation
-
-                    # 添加设备信息
-                    equipment = db.query(Equipment).filter(Equipment.id == reservation.equipment_id).first()
-                    if equipment:
-                        reservation.equipment_name = equipment.name
-                        reservation.equipment_category = equipment.category
-                        reservation.equipment_location = equipment.location
-
-                    # 如果是通过预约序号查询，直接返回结果
-                    logger.info(f"通过预约序号查询成功，返回预约详情: ID={reservation.id}, 状态={reservation.status}")
-                    return ReservationResponse(success=True, message="获取预定成功", data=reservation.__dict__)
-            else:
-                logger.warning(f"预约序号格式不正确，忽略: {reservation_number}")
-                direct_reservation = None
-
-            if direct_reservation:
-                logger.info(f"通过预约序号直接找到预约: ID={direct_reservation.id}, 状态={direct_reservation.status}")
-                reservation = direct_reservation
-
-                # 添加设备信息
-                equipment = db.query(Equipment).filter(Equipment.id == reservation.equipment_id).first()
-                if equipment:
-                    reservation.equipment_name = equipment.name
-                    reservation.equipment_category = equipment.category
-                    reservation.equipment_location = equipment.location
-            else:
-                # 如果直接查询失败，尝试使用预约码和预约序号组合查询
-                logger.info(f"通过预约序号直接查询未找到预约，尝试使用预约码和预约序号组合查询")
-                reservation = get_reservation_by_code(db, reservation_code, reservation_number)
-                if reservation:
-                    logger.info(f"通过预约码和预约序号组合查询找到预约: ID={reservation.id}, 状态={reservation.status}")
-                else:
-                    logger.warning(f"通过预约序号未找到预约: 预约码={reservation_code}, 预约序号={reservation_number}")
-
-        # 如果没有找到预约或没有时间参数，尝试获取最近的预约
-        if not reservation:
-            logger.info(f"尝试获取与预约码匹配的预约")
-
-            # 构建基本查询
-            base_query = db.query(Reservation).filter(
-                Reservation.reservation_code == reservation_code
-            )
-
-            if start_date:
-                # 如果有日期参数但没找到精确匹配，尝试找最近的日期
-                logger.info(f"尝试查找接近 {start_date} 的预约")
-
-                # 首先尝试找同一个星期几的预约（对于循环预约）
-                weekday_query = base_query.filter(
-                    func.strftime('%w', Reservation.start_datetime) == func.strftime('%w', start_date.strftime("%Y-%m-%d"))
-                ).order_by(Reservation.start_datetime)
-
-                weekday_reservation = weekday_query.first()
-                if weekday_reservation:
-                    logger.info(f"找到同星期几的预约: ID={weekday_reservation.id}, 状态={weekday_reservation.status}")
-                    reservation = weekday_reservation
-                else:
-                    # 如果找不到同星期几的，尝试找最近的日期
-                    logger.info("未找到同星期几的预约，尝试找最近的预约")
-
-                    # 查找最接近的预约
-                    # 优先选择状态为"confirmed"的预约
-                    confirmed_reservation = base_query.filter(
-                        Reservation.status == "confirmed"
-                    ).order_by(Reservation.start_datetime).first()
-
-                    if confirmed_reservation:
-                        logger.info(f"找到已确认的预约: ID={confirmed_reservation.id}")
-                        reservation = confirmed_reservation
-                    else:
-                        # 如果没有找到confirmed状态的预约，获取第一个匹配的预约
-                        any_reservation = base_query.order_by(Reservation.start_datetime).first()
-
-                        if any_reservation:
-                            logger.info(f"找到预约: ID={any_reservation.id}, 状态={any_reservation.status}")
-                            reservation = any_reservation
-                        else:
-                            logger.warning(f"未找到与预约码匹配的预约: {reservation_code}")
-            else:
-                # 如果没有日期参数，直接找最近的预约
-                logger.info("没有日期参数，直接查找最近的预约")
-
-                # 优先选择状态为"confirmed"的预约
-                confirmed_reservation = base_query.filter(
-                    Reservation.status == "confirmed"
-                ).order_by(Reservation.start_datetime).first()
-
-                if confirmed_reservation:
-                    logger.info(f"找到已确认的预约: ID={confirmed_reservation.id}")
-                    reservation = confirmed_reservation
-                else:
-                    # 如果没有找到confirmed状态的预约，获取第一个匹配的预约
-                    any_reservation = base_query.order_by(Reservation.start_datetime).first()
-
-                    if any_reservation:
-                        logger.info(f"找到预约: ID={any_reservation.id}, 状态={any_reservation.status}")
-                        reservation = any_reservation
-                    else:
-                        logger.warning(f"未找到与预约码匹配的预约: {reservation_code}")
-
-        if not reservation:
-            return ReservationResponse(success=False, message="预定不存在", data=None)
-
-        # 获取设备信息
-        equipment = get_equipment(db, reservation.equipment_id)
-        if equipment:
-            reservation.equipment_name = equipment.name
-            reservation.equipment_category = equipment.category
-            reservation.equipment_location = equipment.location
-
-        # 创建返回对象
-        reservation_dict = reservation.__dict__.copy()
-        if '_sa_instance_state' in reservation_dict:
-            del reservation_dict['_sa_instance_state']
+        # 缓存中的结果是共享的，复制后再添加显示字段
+        reservation_dict = dict(result["reservation"])
 
         # 如果提供了时间参数，保存原始时间并添加显示时间
         if start_time and end_time:
-            logger.info(f"保存原始时间并添加显示时间")
-            reservation_dict['original_start_datetime'] = reservation.start_datetime.isoformat() if hasattr(reservation.start_datetime, 'isoformat') else reservation.start_datetime
-            reservation_dict['original_end_datetime'] = reservation.end_datetime.isoformat() if hasattr(reservation.end_datetime, 'isoformat') else reservation.end_datetime
+            res_start = reservation_dict["start_datetime"]
+            res_end = reservation_dict["end_datetime"]
+            date_matches = start_date is not None and res_start.date() == start_date
+            exact_datetime_matches = (
+                date_matches and end_datetime is not None
+                and (res_start.hour, res_start.minute) == (start_datetime.hour, start_datetime.minute)
+                and (res_end.hour, res_end.minute) == (end_datetime.hour, end_datetime.minute)
+            )
+            reservation_dict['original_start_datetime'] = res_start.isoformat()
+            reservation_dict['original_end_datetime'] = res_end.isoformat()
             reservation_dict['display_start_time'] = start_time
             reservation_dict['display_end_time'] = end_time
 
@@ -602,17 +366,16 @@ async def get_reservation_by_code_api(
 
             # 添加日期比较信息用于调试
             if start_date:
-                res_date = reservation.start_datetime.date() if hasattr(reservation.start_datetime, 'date') else None
+                res_date = res_start.date()
                 reservation_dict['debug_info'] = {
                     'query_date': start_date.isoformat(),
-                    'reservation_date': res_date.isoformat() if res_date else None,
-                    'dates_equal': start_date == res_date if res_date else False,
-                    'weekday_query': start_date.weekday() if start_date else None,
-                    'res_weekday': res_date.weekday() if res_date else None
+                    'reservation_date': res_date.isoformat(),
+                    'dates_equal': start_date == res_date,
+                    'weekday_query': start_date.weekday(),
+                    'res_weekday': res_date.weekday()
                 }
-                logger.info(f"日期比较信息: {reservation_dict['debug_info']}")
 
-        logger.info(f"成功获取预约: ID={reservation.id}, 状态={reservation.status}, 开始时间={reservation.start_datetime}, 结束时间={reservation.end_datetime}, 预约序号={reservation.reservation_number}")
+        logger.info(f"成功获取预约: ID={reservation_dict['id']}, 状态={reservation_dict['status']}, 开始时间={reservation_dict['start_datetime']}, 结束时间={reservation_dict['end_datetime']}, 预约序号={reservation_dict['reservation_number']}")
         return ReservationResponse(success=True, message="获取预定成功", data=reservation_dict)
     except Exception as e:
         logger.error(f"获取预定详情出错: {str(e)}")
@@ -767,9 +530,7 @@ async def update_reservation_by_number_api(
         logger.info(f"[通过预约序号更新预约API] 预约序号={reservation_number}")
 
         # 直接通过预约序号查询预约
-        db_reservation = db.query(Reservation).filter(
-            Reservation.reservation_number == reservation_number
-        ).first()
+        db_reservation, _ = resolve_reservation(db, None, reservation_number, exact=True)
 
         if not db_reservation:
             return ReservationResponse(success=False, message="预定不存在", data=None)
@@ -875,7 +636,32 @@ async def cancel_reservation_api(
     user_email: Optional[str] = None,
     reservation_number: Optional[str] = None,
     lang: str = "zh_CN",
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
     db: Session = Depends(get_db)
+):
+    """
+    取消预定，携带Idempotency-Key时重试返回首次结果
+    Cancel reservation; retries carrying an Idempotency-Key return the first result
+    """
+    payload = {
+        "reservation_code": reservation_code,
+        "cancel_data": cancel_data.dict() if cancel_data else None,
+        "user_email": user_email,
+        "reservation_number": reservation_number,
+        "lang": lang
+    }
+    return await run_idempotent_async(
+        db, idempotency_key, "reservation.cancel_by_code", payload,
+        lambda: _cancel_reservation_by_code(reservation_code, cancel_data, user_email, reservation_number, lang, db)
+    )
+
+async def _cancel_reservation_by_code(
+    reservation_code: str,
+    cancel_data: Optional[ReservationCancel],
+    user_email: Optional[str],
+    reservation_number: Optional[str],
+    lang: str,
+    db: Session
 ):
     """
     取消预定
@@ -903,44 +689,15 @@ async def cancel_reservation_api(
         # 记录API调用信息
         logger.info(f"[API调用] 取消预约API: 预约码={reservation_code}, 用户邮箱={user_email}, 预约序号={reservation_number}, 语言={lang}")
 
-        # 处理reservation_number参数
+        # 处理reservation_number参数，兼容JSON包装的值
+        reservation_number = normalize_reservation_number(reservation_number)
         if reservation_number:
-            # 确保reservation_number是字符串，处理可能的JSON对象
-            try:
-                if isinstance(reservation_number, str) and (reservation_number.startswith('{') or reservation_number.startswith('[')):
-                    logger.warning(f"[API参数] 预约序号参数是JSON格式，尝试解析: {reservation_number}")
-                    import json
-                    try:
-                        parsed_number = json.loads(reservation_number)
-                        if isinstance(parsed_number, dict) and 'reservation_number' in parsed_number:
-                            reservation_number = parsed_number['reservation_number']
-                            logger.info(f"[API参数] 从JSON对象中提取预约序号: {reservation_number}")
-                        elif isinstance(parsed_number, dict) and '$oid' in parsed_number:
-                            reservation_number = parsed_number['$oid']
-                            logger.info(f"[API参数] 从JSON对象中提取$oid: {reservation_number}")
-                        # 处理时间戳参数，如果JSON对象只包含_t字段，则忽略这个参数
-                        elif isinstance(parsed_number, dict) and '_t' in parsed_number and len(parsed_number) == 1:
-                            logger.info(f"[API参数] 检测到时间戳参数 _t，忽略此参数: {parsed_number}")
-                            reservation_number = None
-                    except json.JSONDecodeError:
-                        logger.error(f"[API参数] 无法解析JSON格式的预约序号: {reservation_number}")
-            except Exception as e:
-                logger.error(f"[API参数] 处理预约序号参数时出错: {str(e)}")
-                logger.error(traceback.format_exc())
-
             logger.info(f"[API参数] 预约序号参数存在: {reservation_number}")
         else:
-            logger.warning(f"[API参数] 预约序号参数不存在，将取消所有具有相同预约码的预约")
-
-        # 构建查询条件
-        query = db.query(Reservation)
-        if reservation_number:
-            query = query.filter(Reservation.reservation_number == reservation_number)
-        else:
-            query = query.filter(Reservation.reservation_code == reservation_code)
+            logger.warning(f"[API参数] 预约序号参数不存在，将按预约码取消最匹配的预约")
 
-        # 获取预定信息（用于邮件发送）
-        db_reservation = query.first()
+        # 获取预定信息（用于邮件发送），设备信息随查询一起加载
+        db_reservation, _ = resolve_reservation(db, reservation_code, reservation_number, exact=True)
         if not db_reservation:
             error_msg = f"[API错误] 预定不存在: 预约码={reservation_code}" + (f", 预约序号={reservation_number}" if reservation_number else "")
             logger.error(error_msg)
@@ -952,25 +709,19 @@ async def cancel_reservation_api(
             return {"success": False, "message": "预定已取消"}
 
         # 获取设备信息
-        equipment = get_equipment(db, db_reservation.equipment_id)
+        equipment = db_reservation.equipment
         logger.info(f"[API信息] 设备信息: ID={equipment.id if equipment else 'None'}, 名称={equipment.name if equipment else 'None'}")
 
         # 记录取消前的状态
         logger.info(f"[API状态] 取消预约前状态: 预约码={reservation_code}, ID={db_reservation.id}, 预约序号={db_reservation.reservation_number}, 状态={db_reservation.status}")
 
-        # 使用新函数取消预约 - 通过预约码和预约序号
-        success, message = cancel_reservation_by_code(db, reservation_code, reservation_number)
+        # 已解析到具体预约，直接按ID取消
+        success, message = cancel_reservation(db, db_reservation.id, True)
         logger.info(f"[API结果] 取消预约结果: 成功={success}, 消息={message}")
 
         # 记录取消后的状态
         if success:
-            # 重新获取预约以确认状态已更新
-            updated_query = db.query(Reservation).filter(Reservation.reservation_code == reservation_code)
-            if reservation_number:
-                updated_query = updated_query.filter(Reservation.reservation_number == reservation_number)
-            updated_reservation = updated_query.first()
-
-            logger.info(f"[API验证] 取消预约后状态: 预约码={reservation_code}, ID={updated_reservation.id if updated_reservation else 'None'}, 预约序号={updated_reservation.reservation_number if updated_reservation else 'None'}, 状态={updated_reservation.status if updated_reservation else 'unknown'}")
+            logger.info(f"[API验证] 取消预约后状态: 预约码={reservation_code}, ID={db_reservation.id}, 预约序号={db_reservation.reservation_number}, 状态={db_reservation.status}")
         else:
             logger.error(f"[API错误] 取消预约失败: 预约码={reservation_code}, 消息={message}")
 
@@ -1126,17 +877,24 @@ def get_reservation_history_api(
         if not reservation:
             return {"success": False, "message": "预定不存在", "data": None}
 
-        # 构建查询条件
-        query = db.query(ReservationHistory).filter(
-            ReservationHistory.reservation_code == reservation_code
-        )
+        # 已归档的预约从归档表读取历史；循环预约的部分子预约可能已归档，两张表都查询
+        if isinstance(reservation, ReservationArchive):
+            history_models = [ReservationHistoryArchive]
+        elif getattr(reservation, "is_recurring", False):
+            history_models = [ReservationHistory, ReservationHistoryArchive]
+        else:
+            history_models = [ReservationHistory]
 
-        # 如果提供了预约序号，则添加预约序号过滤条件
-        if reservation_number:
-            query = query.filter(ReservationHistory.reservation_number == reservation_number)
+        history_records = []
+        for model in history_models:
+            # 构建查询条件
+            query = db.query(model).filter(model.reservation_code == reservation_code)
 
-        # 执行查询
-        history_records = query.order_by(ReservationHistory.created_at.desc()).all()
+            # 如果提供了预约序号，则添加预约序号过滤条件
+            if reservation_number:
+                query = query.filter(model.reservation_number == reservation_number)
+            history_records.extend(query.all())
+        history_records.sort(key=lambda record: record.created_at or datetime.min, reverse=True)
 
         # 转换为响应格式
         history_data = []
@@ -1184,7 +942,7 @@ async def export_reservations_options():
 @router.post("/export")
 async def export_reservations(
     export_request: ReservationExportRequest,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_snapshot_db),
     current_admin = Depends(optional_admin)  # 暂时使用optional_admin以便调试
 ):
     """
@@ -1332,7 +1090,7 @@ async def simple_export_reservations(
     status: str = None,
     from_date: str = None,
     to_date: str = None,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_snapshot_db),
     current_admin = Depends(optional_admin)
 ):
     """
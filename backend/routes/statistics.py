@@ -10,14 +10,17 @@ from sqlalchemy.orm import Session
 from sqlalchemy import func, and_, or_
 
 from backend.database import get_db
+from backend.utils.db_backup import get_snapshot_db
+from backend.i18n import translate_many
 from backend.models.equipment import Equipment
 from backend.models.reservation import Reservation
+from backend.models.reservation_archive import ReservationArchive
 from backend.routes.auth import get_current_admin
 
 # 设置日志
 logger = logging.getLogger(__name__)
 
-# 创建路由
+# 创建路由（聚合统计读取只读快照，不与预约写入争用数据库锁；仪表盘的实时计数读取在线数据库）
 router = APIRouter(
     prefix="/api/statistics",
     tags=["statistics"],
@@ -41,8 +44,9 @@ async def get_dashboard_statistics(
             Equipment.status == "available"
         ).scalar()
 
-        # 获取预定总数
+        # 获取预定总数（包括已归档的预约）
         total_reservation = db.query(func.count(Reservation.id)).scalar()
+        total_reservation += db.query(func.count(ReservationArchive.id)).scalar()
 
         # 获取活跃预定数量（状态为confirmed且未结束的预定）
         active_reservation = db.query(func.count(Reservation.id)).filter(
@@ -87,7 +91,7 @@ async def get_dashboard_statistics(
 async def get_equipment_usage(
     time_range: str = Query("week", description="时间范围: week, month, year"),
     category: Optional[str] = Query(None, description="设备类别"),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_snapshot_db)
 ):
     """
     获取设备使用率统计
@@ -189,7 +193,7 @@ async def get_equipment_usage(
 
 @router.get("/category-distribution")
 async def get_category_distribution(
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_snapshot_db)
 ):
     """
     获取设备类别分布统计
@@ -242,7 +246,7 @@ async def get_category_distribution(
 @router.get("/reservation-status")
 async def get_reservation_status(
     time_range: str = Query("week", description="时间范围: week, month, year"),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_snapshot_db)
 ):
     """
     获取预定状态统计
@@ -268,14 +272,12 @@ async def get_reservation_status(
             Reservation.created_at >= start_date
         ).group_by(Reservation.status).all()
 
-        # 构建图表数据
-        status_map = {
-            "confirmed": "已确认",
-            "cancelled": "已取消",
-            "completed": "已完成"
-        }
-
-        labels = [status_map.get(stat[0], stat[0]) for stat in status_stats]
+        # 构建图表数据，状态名称按当前语言批量翻译；没有翻译的状态显示原值
+        keys = [f"reservation_status.{stat[0]}" for stat in status_stats]
+        labels = [
+            stat[0] if label == key else label
+            for stat, key, label in zip(status_stats, keys, translate_many(keys))
+        ]
         data = [stat[1] for stat in status_stats]
 
         # 生成颜色
@@ -305,7 +307,7 @@ async def get_reservation_status(
 async def get_popular_equipment(
     time_range: str = Query("month", description="时间范围: week, month, year"),
     limit: int = Query(5, description="返回数量"),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_snapshot_db)
 ):
     """
     获取热门设备统计
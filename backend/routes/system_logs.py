@@ -9,11 +9,13 @@ from sqlalchemy.orm import Session
 from sqlalchemy import desc
 from datetime import datetime, timedelta
 
-from backend.database import get_db
+from backend.database import get_db, SessionLocal
 from backend.models.system_log import SystemLog
 from backend.schemas.system_log import SystemLogOut, PaginatedSystemLogs
 from backend.routes.auth import get_current_admin
 from backend.services.log_service import log_operation
+from backend.utils.background_jobs import get_job
+from backend.utils.log_purge import start_purge_job
 
 # 设置日志
 logger = logging.getLogger(__name__)
@@ -95,51 +97,59 @@ async def clear_system_logs(
             detail="只有超级管理员可以清除系统日志"
         )
 
-    query = db.query(SystemLog)
-
     # 应用过滤条件
+    conditions = []
     if days:
         cutoff_date = datetime.now() - timedelta(days=days)
-        query = query.filter(SystemLog.created_at < cutoff_date)
+        conditions.append(SystemLog.created_at < cutoff_date)
 
     if user_type:
-        query = query.filter(SystemLog.user_type == user_type)
+        conditions.append(SystemLog.user_type == user_type)
 
     if module:
-        query = query.filter(SystemLog.module == module)
+        conditions.append(SystemLog.module == module)
 
     if status:
-        query = query.filter(SystemLog.status == status)
-
-    # 获取要删除的日志数量
-    count = query.count()
+        conditions.append(SystemLog.status == status)
+
+    filters = {
+        "days": days,
+        "user_type": user_type,
+        "module": module,
+        "status": status
+    }
+    admin_username, admin_name = current_admin.username, current_admin.name
+
+    async def record_purge(result):
+        # 清理完成后记录清理日志
+        log_db = SessionLocal()
+        try:
+            await log_operation(
+                db=log_db,
+                user_type="admin",
+                user_id=admin_username,
+                user_name=admin_name,
+                action="delete",
+                module="system",
+                description=f"管理员 {admin_name} 清除了 {result['deleted']} 条系统日志",
+                status="success",
+                details=dict(filters, count=result["deleted"])
+            )
+        finally:
+            log_db.close()
 
     try:
-        # 删除日志
-        query.delete(synchronize_session=False)
-        db.commit()
-
-        # 记录清理日志
-        await log_operation(
-            db=db,
-            user_type="admin",
-            user_id=current_admin.username,
-            user_name=current_admin.name,
-            action="delete",
-            module="system",
-            description=f"管理员 {current_admin.name} 清除了 {count} 条系统日志",
-            status="success",
-            details={
-                "days": days,
-                "user_type": user_type,
-                "module": module,
-                "status": status,
-                "count": count
-            }
-        )
-
-        return {"message": f"成功清除 {count} 条系统日志"}
+        # 分批删除在后台进行，不长时间占用写锁
+        job_id = start_purge_job("system_log_purge", SystemLog, conditions, on_complete=record_purge, filters=filters)
+        return {"message": "正在后台清除系统日志，可通过任务ID查询进度", "job_id": job_id}
     except Exception as e:
-        db.rollback()
         logger.error(f"清除系统日志失败: {e}")
         raise HTTPException(status_code=500, detail=f"清除系统日志失败: {e}")
+
+@router.get("/purge/{job_id}")
+async def get_system_log_purge_job(job_id: str):
+    """查询系统日志清理任务的进度和结果"""
+    job = get_job(job_id, "system_log_purge")
+    if not job:
+        raise HTTPException(status_code=404, detail="清理任务不存在或已过期")
+    return job
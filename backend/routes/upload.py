@@ -4,14 +4,13 @@ File upload API routes
 """
 import os
 import logging
-import shutil
-from datetime import datetime
 from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
 from fastapi.responses import JSONResponse
 from sqlalchemy.orm import Session
 
 from backend.database import get_db
 from backend.routes.auth import get_current_admin, optional_admin
+from backend.utils.image_pipeline import save_upload, generate_variants
 
 # 设置日志
 logger = logging.getLogger(__name__)
@@ -42,42 +41,22 @@ async def upload_image(
         if not file.content_type.startswith('image/'):
             raise HTTPException(status_code=400, detail="只允许上传图片文件")
         
-        # 检查文件大小（限制为5MB）
-        contents = await file.read()
-        size = len(contents)
-        if size > 5 * 1024 * 1024:  # 5MB
-            raise HTTPException(status_code=400, detail="图片大小不能超过5MB")
-        
-        # 重置文件指针
-        await file.seek(0)
-        
         # 根据类型确定上传目录
-        if type == "equipment":
-            upload_dir = os.path.join("backend", "static", "uploads", "equipment")
-        elif type == "guide":
-            upload_dir = os.path.join("backend", "static", "uploads", "guide")
-        else:
-            upload_dir = os.path.join("backend", "static", "uploads", "general")
-        
-        # 创建上传目录（如果不存在）
-        os.makedirs(upload_dir, exist_ok=True)
-        
-        # 生成唯一文件名
-        timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-        filename = f"{timestamp}_{file.filename}"
-        file_path = os.path.join(upload_dir, filename)
-        
-        # 保存文件
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
-        # 生成URL路径
-        url_path = f"/static/uploads/{type}/{filename}"
-        
+        if type not in ("equipment", "guide"):
+            type = "general"
+
+        # 流式保存（限制为5MB），相同内容的图片复用已有文件
+        url_path, content_hash, size = await save_upload(file, type, 5 * 1024 * 1024)
+        filename = os.path.basename(url_path)
+
+        # 设备图片额外生成缩略图和WebP/AVIF变体
+        variants = await generate_variants(url_path) if type == "equipment" else {}
+
         return {
             "success": True,
             "url": url_path,
-            "filename": filename
+            "filename": filename,
+            "variants": variants
         }
     except HTTPException:
         raise
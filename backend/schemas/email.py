@@ -66,18 +66,21 @@ class EmailLogBase(BaseModel):
     error_message: Optional[str] = None
     reservation_code: Optional[str] = None
     reservation_number: Optional[str] = None
-    content_html: Optional[str] = None
 
-class EmailLog(EmailLogBase):
-    """邮件日志响应模型"""
+class EmailLogSummary(EmailLogBase):
+    """邮件日志列表项模型（不含正文）"""
     id: int
     created_at: datetime
 
     class Config:
         orm_mode = True
 
+class EmailLog(EmailLogSummary):
+    """邮件日志详情模型（含还原后的正文）"""
+    content_html: Optional[str] = None
+
 # 用于列表查询的分页响应模型
 class PaginatedEmailLogs(BaseModel):
     """分页邮件日志响应模型"""
-    items: List[EmailLog]
+    items: List[EmailLogSummary]
     total: int
\ No newline at end of file
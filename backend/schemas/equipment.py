@@ -44,6 +44,9 @@ class Equipment(EquipmentBase):
     created_at: datetime
     updated_at: datetime
     currently_reserved: Optional[bool] = False
+    thumbnail_path: Optional[str] = None
+    image_webp_path: Optional[str] = None
+    image_avif_path: Optional[str] = None
 
     class Config:
         from_attributes = True
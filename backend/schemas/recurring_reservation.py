@@ -105,6 +105,8 @@ class RecurringReservation(RecurringReservationBase):
     total_planned: Optional[int] = None
     created_count: Optional[int] = None
     conflict_dates: Optional[List[str]] = None
+    # 子预约已生成到的日期，之后的发生由后台任务逐步生成
+    materialized_until: Optional[date] = None
 
     class Config:
         from_attributes = True
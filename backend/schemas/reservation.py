@@ -22,6 +22,24 @@ class ReservationCreate(ReservationBase):
     lang: Optional[str] = Field("zh_CN", title="语言")
     skip_email: Optional[bool] = Field(False, title="跳过发送邮件")
 
+# 批量预定中的单个项目
+class ReservationBatchItem(BaseModel):
+    equipment_id: int = Field(..., title="设备ID", gt=0)
+    start_datetime: datetime = Field(..., title="开始时间")
+    end_datetime: datetime = Field(..., title="结束时间")
+    purpose: Optional[str] = Field(None, title="使用目的", description="为空时使用批量请求的使用目的")
+
+# 批量创建预定请求（所有项目共享预约人信息，各自生成预约码）
+class ReservationBatchCreate(BaseModel):
+    user_name: str = Field(..., title="用户姓名", max_length=100)
+    user_department: str = Field(..., title="用户部门", max_length=100)
+    user_contact: str = Field(..., title="联系方式", max_length=100)
+    user_email: Optional[str] = Field(None, title="用户邮箱", max_length=100)
+    purpose: Optional[str] = Field(None, title="使用目的")
+    items: List[ReservationBatchItem] = Field(..., title="预定项目", min_items=1, max_items=200)
+    lang: Optional[str] = Field("zh_CN", title="语言")
+    skip_email: Optional[bool] = Field(False, title="跳过发送邮件")
+
 # 更新预定请求
 class ReservationUpdate(BaseModel):
     start_datetime: Optional[datetime] = Field(None, title="开始时间")
@@ -0,0 +1,122 @@
+"""
+后台任务登记表
+Background job registry
+
+导入、清理等耗时操作在后台运行，接口立即返回任务ID，前端按ID轮询进度和结果。
+任务状态只保存在当前进程内存中，结束超过BACKGROUND_JOB_TTL秒后清除。
+
+Long operations such as imports and purges run in the background; the API returns a job id
+right away and the frontend polls it for progress and the result. Job state lives in this
+process's memory and is dropped BACKGROUND_JOB_TTL seconds after the job finishes.
+"""
+import time
+import uuid
+import asyncio
+import logging
+import threading
+from typing import Any, Awaitable, Dict, Optional, Set
+
+from config import BACKGROUND_JOB_TTL
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+# 任务ID -> 任务状态
+_jobs: Dict[str, Dict[str, Any]] = {}
+_jobs_lock = threading.Lock()
+
+# 运行中的asyncio任务，保持引用避免被垃圾回收
+_tasks: Set[asyncio.Task] = set()
+
+
+def _prune_jobs():
+    """清除结束超过BACKGROUND_JOB_TTL秒的任务"""
+    now = time.time()
+    for job_id in [
+        job_id for job_id, job in _jobs.items()
+        if job["finished_at"] is not None and now - job["finished_at"] > BACKGROUND_JOB_TTL
+    ]:
+        del _jobs[job_id]
+
+
+def create_job(kind: str, **info: Any) -> str:
+    """
+    登记一个后台任务，返回任务ID
+    Register a background job and return its id
+    """
+    job_id = uuid.uuid4().hex
+    with _jobs_lock:
+        _prune_jobs()
+        _jobs[job_id] = dict(
+            info,
+            job_id=job_id,
+            kind=kind,
+            status="pending",
+            phase=None,
+            processed=0,
+            total=None,
+            progress=None,
+            result=None,
+            error=None,
+            created_at=time.time(),
+            finished_at=None
+        )
+    return job_id
+
+
+def get_job(job_id: str, kind: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """
+    返回任务状态的副本，kind不匹配时视为不存在
+    Return a copy of a job's state; a job of another kind counts as missing
+    """
+    with _jobs_lock:
+        _prune_jobs()
+        job = _jobs.get(job_id)
+        if job is None or (kind is not None and job["kind"] != kind):
+            return None
+        return dict(job)
+
+
+def update_job(job_id: str, **values: Any):
+    """
+    更新任务状态（可在任意线程调用）
+    Update a job's state (safe from any thread)
+    """
+    with _jobs_lock:
+        if job_id in _jobs:
+            _jobs[job_id].update(values)
+
+
+def complete_job(job_id: str, result: Any):
+    """
+    标记任务成功完成
+    Mark a job as completed
+    """
+    update_job(job_id, status="completed", phase="done", result=result, finished_at=time.time())
+
+
+def fail_job(job_id: str, error: str):
+    """
+    标记任务失败
+    Mark a job as failed
+    """
+    update_job(job_id, status="failed", error=error, finished_at=time.time())
+
+
+def spawn_job(job_id: str, coroutine: Awaitable[Any]) -> asyncio.Task:
+    """
+    在事件循环中运行任务协程，协程的返回值作为任务结果
+    Run a job coroutine on the event loop; its return value becomes the job result
+    """
+    async def runner():
+        update_job(job_id, status="running")
+        try:
+            complete_job(job_id, await coroutine)
+        except Exception as e:
+            logger.error(f"后台任务 {job_id} 失败: {str(e)}", exc_info=True)
+            fail_job(job_id, str(e))
+
+    task = asyncio.create_task(runner())
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+    return task
@@ -118,6 +118,43 @@ def generate_reservation_number(db=None):
 
     return reservation_number
 
+def generate_reservation_numbers(db, count):
+    """
+    一次分配一组连续的预约编号（调用方需持有写锁）
+    Allocate a block of consecutive reservation numbers (caller must hold the write lock)
+
+    格式与generate_reservation_number相同：RN-YYYYMMDD-####
+    Same format as generate_reservation_number: RN-YYYYMMDD-####
+    """
+    from backend.models.reservation import Reservation
+
+    if count <= 0:
+        return []
+
+    # 第一个编号沿用单个编号的分配规则，其后顺序递增
+    first_number = generate_reservation_number(db)
+    prefix, _, first = first_number.rpartition('-')
+    try:
+        start = int(first)
+    except ValueError:
+        # 备用格式无法递增，逐个生成
+        return [first_number] + [generate_reservation_number(db) for _ in range(count - 1)]
+
+    while True:
+        numbers = [f"{prefix}-{start + i}" for i in range(count)]
+        existing = {
+            row.reservation_number for row in db.query(Reservation.reservation_number).filter(
+                Reservation.reservation_number.in_(numbers)
+            )
+        }
+        if not existing:
+            break
+        # 编号段中有已占用的编号，从占用的最大编号之后重新分配
+        start = max(int(number.rpartition('-')[2]) for number in existing) + 1
+
+    logger.info(f"批量生成预约编号: {numbers[0]} ~ {numbers[-1]}")
+    return numbers
+
 def generate_recurring_reservation_number(current_date, index, base_number=None, db=None):
     """
     生成循环预约的子预约编号
@@ -0,0 +1,365 @@
+"""
+数据库在线备份与只读快照
+Online database backups and read-only snapshots
+
+直接复制正在写入的SQLite文件会阻塞写入或得到不一致的副本。这里使用SQLite在线备份API，
+每步只复制少量页并在步与步之间暂停，写入只会在单步复制期间短暂等待：
+
+- 定时备份：由维护进程调用create_backup()，复制后做完整性检查再gzip压缩，保留最近N份；
+- 恢复：restore_backup()先解压到临时文件并做完整性检查，通过后备份当前数据库，再用同样的
+  在线备份API写回，应在停止服务后执行；
+- 只读快照：统计、导出等重查询读取定期刷新的快照文件，不与预约写入争用锁。
+
+Copying a live SQLite file either blocks writers or produces a torn copy. This module uses the
+SQLite online backup API, copying a few pages per step and pausing between steps, so writers
+only ever wait for a single step:
+
+- scheduled backups: the maintenance worker calls create_backup(), which integrity-checks the
+  copy, gzips it and keeps the newest N generations;
+- restore: restore_backup() decompresses to a temp file and integrity-checks it, saves the
+  current database, then writes the backup back through the same API; run it with the
+  service stopped;
+- read-only snapshot: heavy reads such as statistics and exports use a periodically
+  refreshed snapshot file and never contend with booking writes for locks.
+"""
+import os
+import gzip
+import time
+import shutil
+import sqlite3
+import logging
+import threading
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional
+
+from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import NullPool
+
+from config import (
+    DB_BACKUP_DIR, DB_BACKUP_INTERVAL_HOURS, DB_BACKUP_KEEP,
+    DB_BACKUP_PAGES_PER_STEP, DB_BACKUP_STEP_PAUSE, DB_BACKUP_MAX_RESTARTS,
+    DB_SNAPSHOT_MAX_AGE
+)
+from backend.database import engine, SessionLocal
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+# 备份文件名前缀和后缀
+BACKUP_PREFIX = "equipment_reservation-"
+BACKUP_SUFFIX = ".db.gz"
+
+# 只读快照文件
+SNAPSHOT_PATH = os.path.join(DB_BACKUP_DIR, "snapshot.db")
+
+# 复制文件时每次读写的块大小
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+class BackupError(Exception):
+    """
+    备份或恢复失败
+    Backup or restore failed
+    """
+
+
+def get_database_path() -> str:
+    """
+    返回应用数据库文件的路径
+    Return the path of the application database file
+    """
+    return engine.url.database
+
+
+class _CopyRestarted(Exception):
+    """复制期间数据库被其他连接修改，SQLite从头开始复制"""
+
+
+def _copy_once(source: sqlite3.Connection, target: sqlite3.Connection, pages: int):
+    """按给定步长复制一次，检测到重新开始时抛出_CopyRestarted"""
+    state = {"remaining": None}
+
+    def progress(status, remaining, total):
+        # 重新开始后剩余页数会回到与之前相同或更大的值
+        if state["remaining"] is not None and remaining >= state["remaining"]:
+            raise _CopyRestarted()
+        state["remaining"] = remaining
+        if remaining:
+            time.sleep(DB_BACKUP_STEP_PAUSE)
+
+    source.backup(target, pages=pages, progress=progress)
+
+
+def online_copy(source_path: str, target_path: str):
+    """
+    用SQLite在线备份API把source_path分步复制到target_path
+    Copy source_path to target_path step by step with the SQLite online backup API
+
+    每复制一步暂停DB_BACKUP_STEP_PAUSE秒。复制期间其他连接写入时SQLite会从头开始，
+    每次重新开始后步长加倍；重试DB_BACKUP_MAX_RESTARTS次后一步复制完成，保证备份一定结束。
+    Pauses DB_BACKUP_STEP_PAUSE seconds after each step. SQLite starts over when another
+    connection writes during the copy, so every restart doubles the step size; after
+    DB_BACKUP_MAX_RESTARTS restarts the copy is done in a single step so it always finishes.
+    """
+    source = sqlite3.connect(source_path, timeout=30)
+    try:
+        target = sqlite3.connect(target_path)
+        try:
+            pages = DB_BACKUP_PAGES_PER_STEP
+            for attempt in range(DB_BACKUP_MAX_RESTARTS):
+                try:
+                    _copy_once(source, target, pages)
+                    return
+                except _CopyRestarted:
+                    pages *= 2
+                    logger.debug(f"复制期间数据库被修改，步长增加到 {pages} 页后重试")
+            # 持续有写入时一步复制完成，写入只等待这一步
+            source.backup(target, pages=-1)
+        finally:
+            target.close()
+    finally:
+        source.close()
+
+
+def check_integrity(path: str):
+    """
+    对数据库文件执行PRAGMA integrity_check，不通过时抛出BackupError
+    Run PRAGMA integrity_check on a database file; raises BackupError when it fails
+    """
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        result = conn.execute("PRAGMA integrity_check").fetchall()
+        tables = conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'table'").fetchone()[0]
+    except sqlite3.DatabaseError as e:
+        raise BackupError(f"不是有效的数据库文件: {e}")
+    finally:
+        conn.close()
+    if result != [("ok",)]:
+        raise BackupError(f"完整性检查失败: {result[:5]}")
+    if not tables:
+        raise BackupError("数据库中没有任何表")
+
+
+def list_backups() -> List[Dict[str, object]]:
+    """
+    列出已有的压缩备份，最新的在前
+    List the compressed backups, newest first
+    """
+    if not os.path.isdir(DB_BACKUP_DIR):
+        return []
+    backups = []
+    for name in os.listdir(DB_BACKUP_DIR):
+        if not (name.startswith(BACKUP_PREFIX) and name.endswith(BACKUP_SUFFIX)):
+            continue
+        stat = os.stat(os.path.join(DB_BACKUP_DIR, name))
+        backups.append({
+            "name": name,
+            "size": stat.st_size,
+            "created_at": datetime.fromtimestamp(stat.st_mtime)
+        })
+    backups.sort(key=lambda backup: backup["name"], reverse=True)
+    return backups
+
+
+def prune_backups(keep: int = DB_BACKUP_KEEP) -> int:
+    """
+    只保留最近keep份备份，返回删除的文件数
+    Keep only the newest `keep` backups; returns the number of files deleted
+    """
+    deleted = 0
+    for backup in list_backups()[keep:]:
+        try:
+            os.remove(os.path.join(DB_BACKUP_DIR, backup["name"]))
+            deleted += 1
+        except OSError as e:
+            logger.error(f"删除旧备份失败: {backup['name']}, {e}")
+    return deleted
+
+
+def create_backup(label: Optional[str] = None) -> str:
+    """
+    在线备份数据库：分步复制、完整性检查、gzip压缩并清理旧备份，返回备份文件路径
+    Back up the database online: stepped copy, integrity check, gzip and pruning of old
+    generations; returns the backup path
+
+    文件读写较多，应在后台线程中调用。
+    I/O heavy; call it from a background thread.
+    """
+    os.makedirs(DB_BACKUP_DIR, exist_ok=True)
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    name = f"{BACKUP_PREFIX}{stamp}{'-' + label if label else ''}{BACKUP_SUFFIX}"
+    backup_path = os.path.join(DB_BACKUP_DIR, name)
+    copy_path = f"{backup_path}.{os.getpid()}.tmp"
+    started = time.perf_counter()
+    try:
+        online_copy(get_database_path(), copy_path)
+        check_integrity(copy_path)
+        with open(copy_path, "rb") as source, gzip.open(f"{backup_path}.part", "wb") as target:
+            shutil.copyfileobj(source, target, COPY_CHUNK_SIZE)
+        os.replace(f"{backup_path}.part", backup_path)
+    finally:
+        for path in (copy_path, f"{backup_path}.part"):
+            if os.path.exists(path):
+                os.remove(path)
+
+    deleted = prune_backups()
+    logger.info(
+        f"数据库备份完成: {name}，{os.path.getsize(backup_path) / 1024:.1f}KB，"
+        f"耗时 {time.perf_counter() - started:.1f} 秒，删除旧备份 {deleted} 份"
+    )
+    return backup_path
+
+
+def backup_due() -> bool:
+    """
+    最近一份备份是否已超过DB_BACKUP_INTERVAL_HOURS小时（或还没有备份）
+    Whether the newest backup is older than DB_BACKUP_INTERVAL_HOURS hours (or none exists)
+    """
+    backups = list_backups()
+    if not backups:
+        return True
+    age = datetime.now() - backups[0]["created_at"]
+    return age.total_seconds() >= DB_BACKUP_INTERVAL_HOURS * 3600
+
+
+def _extract_backup(name: str, restore_path: str) -> str:
+    """把压缩备份解压到restore_path并做完整性检查，返回备份文件路径"""
+    backup_path = name if os.path.isabs(name) else os.path.join(DB_BACKUP_DIR, name)
+    if not os.path.isfile(backup_path):
+        raise BackupError(f"备份不存在: {name}")
+    try:
+        with gzip.open(backup_path, "rb") as source, open(restore_path, "wb") as target:
+            shutil.copyfileobj(source, target, COPY_CHUNK_SIZE)
+    except (OSError, EOFError) as e:
+        raise BackupError(f"解压备份失败: {e}")
+    check_integrity(restore_path)
+    return backup_path
+
+
+def verify_backup(name: str):
+    """
+    解压备份并做完整性检查，不通过时抛出BackupError
+    Decompress a backup and integrity-check it; raises BackupError when it fails
+    """
+    os.makedirs(DB_BACKUP_DIR, exist_ok=True)
+    restore_path = os.path.join(DB_BACKUP_DIR, f".verify-{os.getpid()}.db")
+    try:
+        _extract_backup(name, restore_path)
+    finally:
+        if os.path.exists(restore_path):
+            os.remove(restore_path)
+
+
+def restore_backup(name: str) -> str:
+    """
+    从压缩备份恢复数据库，返回恢复前自动保存的当前数据库备份路径
+    Restore the database from a compressed backup; returns the path of the safety backup
+    taken of the current database first
+
+    备份先解压到临时文件并通过完整性检查才会写回；应在停止服务后执行。
+    The backup is decompressed to a temp file and must pass the integrity check before it
+    is written back; run it with the service stopped.
+    """
+    os.makedirs(DB_BACKUP_DIR, exist_ok=True)
+    restore_path = os.path.join(DB_BACKUP_DIR, f".restore-{os.getpid()}.db")
+    try:
+        backup_path = _extract_backup(name, restore_path)
+
+        # 写回前保存当前数据库，恢复出错时可以回退
+        safety_path = create_backup(label="pre-restore")
+        online_copy(restore_path, get_database_path())
+        check_integrity(get_database_path())
+    finally:
+        if os.path.exists(restore_path):
+            os.remove(restore_path)
+
+    logger.info(f"已从 {os.path.basename(backup_path)} 恢复数据库，恢复前的数据库已备份到 {safety_path}")
+    return safety_path
+
+
+# 只读快照：按文件修改时间判断是否过期，刷新在后台线程中进行且同一时间只有一个
+_snapshot_lock = threading.Lock()
+_snapshot_refreshing = threading.Event()
+_snapshot_engine: Optional[Engine] = None
+
+
+def refresh_snapshot() -> str:
+    """
+    重新生成只读快照：复制到临时文件后原子替换，正在读取旧快照的连接不受影响
+    Rebuild the read-only snapshot: copy to a temp file, then atomically replace it;
+    connections still reading the old snapshot are unaffected
+    """
+    os.makedirs(DB_BACKUP_DIR, exist_ok=True)
+    temp_path = f"{SNAPSHOT_PATH}.{os.getpid()}.tmp"
+    try:
+        online_copy(get_database_path(), temp_path)
+        try:
+            os.replace(temp_path, SNAPSHOT_PATH)
+        except PermissionError:
+            # Windows上快照仍被打开时无法替换，保留旧快照，下次再刷新
+            logger.warning("只读快照正在使用，暂不替换")
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    logger.debug("只读快照已刷新")
+    return SNAPSHOT_PATH
+
+
+def refresh_snapshot_in_background():
+    """
+    在后台线程中刷新快照，已有刷新在进行时直接返回；应用启动时调用以预先生成快照
+    Refresh the snapshot in a background thread, returning at once if a refresh is already
+    running; called at startup so the snapshot is built ahead of the first request
+    """
+    with _snapshot_lock:
+        if _snapshot_refreshing.is_set():
+            return
+        _snapshot_refreshing.set()
+
+    def run():
+        try:
+            refresh_snapshot()
+        except Exception as e:
+            logger.error(f"刷新只读快照失败: {e}", exc_info=True)
+        finally:
+            _snapshot_refreshing.clear()
+
+    threading.Thread(target=run, name="snapshot-refresh", daemon=True).start()
+
+
+def _get_snapshot_engine() -> Optional[Engine]:
+    """返回只读快照的引擎；快照不存在时在后台生成并返回None，过期时在后台刷新并继续使用旧快照"""
+    global _snapshot_engine
+    if not os.path.exists(SNAPSHOT_PATH):
+        refresh_snapshot_in_background()
+        return None
+    if time.time() - os.path.getmtime(SNAPSHOT_PATH) > DB_SNAPSHOT_MAX_AGE:
+        refresh_snapshot_in_background()
+
+    if _snapshot_engine is None:
+        # 每次会话新开连接（NullPool），快照替换后的查询读取新文件
+        _snapshot_engine = create_engine(
+            f"sqlite:///file:{SNAPSHOT_PATH}?mode=ro&uri=true",
+            connect_args={"check_same_thread": False},
+            poolclass=NullPool
+        )
+    return _snapshot_engine
+
+
+def get_snapshot_db() -> Iterator[Session]:
+    """
+    获取只读快照的数据库会话（可作为FastAPI依赖），数据最多落后DB_SNAPSHOT_MAX_AGE秒加一次刷新的时间
+    Get a database session on the read-only snapshot (usable as a FastAPI dependency);
+    data lags by at most DB_SNAPSHOT_MAX_AGE seconds plus one refresh
+
+    快照尚未生成时（如启动后的首次刷新完成前）读取在线数据库。
+    Until the first snapshot exists (e.g. right after startup) the live database is read.
+    """
+    snapshot_engine = _get_snapshot_engine()
+    db = Session(bind=snapshot_engine, autoflush=False) if snapshot_engine is not None else SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
@@ -0,0 +1,226 @@
+"""
+数据库例行维护
+Routine database maintenance
+
+由后台任务定期执行：分批清理已结束且无预约引用的设备时间段、过期的幂等键和超过保留期的
+预约删除记录；
+执行PRAGMA optimize，并按DB_ANALYZE_INTERVAL_HOURS定期完整ANALYZE，保持sqlite_stat1
+统计信息新鲜，查询计划不随数据增长变差；在DB_VACUUM_WINDOW空闲时段内分步执行
+incremental_vacuum归还空闲页。每一步的耗时和结果记录在进程内，供管理接口查看。
+
+Run periodically by a background task: ended equipment time slots no reservation refers to,
+expired idempotency keys and reservation tombstones past their retention are purged in
+batches; PRAGMA optimize runs every time and a
+full ANALYZE every DB_ANALYZE_INTERVAL_HOURS, keeping sqlite_stat1 fresh so query plans do
+not degrade as data grows; within the DB_VACUUM_WINDOW quiet hours, incremental_vacuum
+returns free pages in steps. Each step's duration and result are recorded in process for
+the admin endpoint.
+"""
+import time
+import asyncio
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Dict, Optional
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from config import (
+    DB_ANALYZE_INTERVAL_HOURS, DB_VACUUM_WINDOW, DB_VACUUM_PAGES_PER_STEP,
+    TIME_SLOT_RETENTION_DAYS, TOMBSTONE_RETENTION_DAYS, LOG_PURGE_BATCH_PAUSE
+)
+from backend.database import SessionLocal, incremental_vacuum
+from backend.models.equipment_time_slot import EquipmentTimeSlot
+from backend.models.idempotency_key import IdempotencyKey
+from backend.models.reservation import Reservation
+from backend.models.reservation_tombstone import ReservationTombstone
+from backend.utils.db_utils import get_beijing_now
+from backend.utils.log_purge import purge_rows
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+# 维护记录：最近一次运行及各步骤的耗时和结果
+_metrics_lock = threading.Lock()
+_metrics: Dict[str, Any] = {
+    "runs": 0,
+    "last_run_at": None,
+    "last_duration_ms": None,
+    "last_analyze_at": None,
+    "steps": {}
+}
+
+
+def get_maintenance_metrics() -> Dict[str, Any]:
+    """
+    返回维护记录的副本
+    Return a copy of the maintenance record
+    """
+    with _metrics_lock:
+        return {**_metrics, "steps": {name: dict(step) for name, step in _metrics["steps"].items()}}
+
+
+def _record_step(name: str, seconds: float, result: Any = None, error: Optional[str] = None):
+    """记录一个维护步骤的耗时和结果"""
+    with _metrics_lock:
+        _metrics["steps"][name] = {
+            "at": get_beijing_now(),
+            "duration_ms": round(seconds * 1000, 1),
+            "result": result,
+            "error": error
+        }
+
+
+async def _timed_step(name: str, step: Awaitable[Any]) -> Any:
+    """
+    执行并计时一个维护步骤；单个步骤失败只记录错误，不影响后续步骤
+    Run and time one maintenance step; a failing step is recorded without stopping the others
+    """
+    start = time.perf_counter()
+    try:
+        result = await step
+    except Exception as e:
+        logger.error(f"数据库维护步骤 {name} 出错: {e}", exc_info=True)
+        _record_step(name, time.perf_counter() - start, error=str(e))
+        return None
+    _record_step(name, time.perf_counter() - start, result)
+    return result
+
+
+def analyze_due(now: datetime) -> bool:
+    """
+    判断是否需要完整ANALYZE：本进程尚未执行过或距上次超过DB_ANALYZE_INTERVAL_HOURS小时
+    Whether a full ANALYZE is due: none ran in this process yet or the last one is older
+    than DB_ANALYZE_INTERVAL_HOURS
+    """
+    with _metrics_lock:
+        last = _metrics["last_analyze_at"]
+    return last is None or now - last >= timedelta(hours=DB_ANALYZE_INTERVAL_HOURS)
+
+
+def optimize_database(db: Session, analyze: bool = False) -> str:
+    """
+    更新查询规划器的统计信息，返回执行的语句
+    Refresh the query planner's statistics; returns the statement that ran
+
+    analyze为True或还没有sqlite_stat1时完整ANALYZE，否则执行PRAGMA optimize，
+    只重新分析统计信息明显过期的表。
+    A full ANALYZE runs when analyze is set or sqlite_stat1 does not exist yet; otherwise
+    PRAGMA optimize re-analyzes only the tables whose statistics have clearly drifted.
+    """
+    connection = db.connection()
+    if connection.dialect.name != "sqlite":
+        return "skipped"
+    if not analyze:
+        has_stats = connection.exec_driver_sql(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'"
+        ).first()
+        analyze = has_stats is None
+    statement = "ANALYZE" if analyze else "PRAGMA optimize"
+    connection.exec_driver_sql(statement)
+    db.commit()
+    return statement
+
+
+def in_vacuum_window(now: datetime) -> bool:
+    """
+    判断当前是否处于DB_VACUUM_WINDOW空闲时段，支持跨零点的时段如(23, 5)
+    Whether now falls within the DB_VACUUM_WINDOW quiet hours; windows may wrap midnight, e.g. (23, 5)
+    """
+    if DB_VACUUM_WINDOW is None:
+        return True
+    start, end = DB_VACUUM_WINDOW
+    if start <= end:
+        return start <= now.hour < end
+    return now.hour >= start or now.hour < end
+
+
+async def vacuum_in_steps() -> int:
+    """
+    每步回收DB_VACUUM_PAGES_PER_STEP页，步与步之间让出写锁，直到没有空闲页，返回回收的总页数
+    Reclaim DB_VACUUM_PAGES_PER_STEP pages at a time, releasing the write lock between steps,
+    until no free pages remain; returns the total pages freed
+    """
+    db = SessionLocal()
+    try:
+        freed = 0
+        while True:
+            pages = await asyncio.to_thread(incremental_vacuum, db, DB_VACUUM_PAGES_PER_STEP)
+            freed += pages
+            if pages < DB_VACUUM_PAGES_PER_STEP:
+                return freed
+            await asyncio.sleep(LOG_PURGE_BATCH_PAUSE)
+    finally:
+        db.close()
+
+
+async def _optimize(analyze: bool) -> str:
+    """在后台线程中执行optimize_database"""
+    db = SessionLocal()
+    try:
+        return await asyncio.to_thread(optimize_database, db, analyze)
+    finally:
+        db.close()
+
+
+async def run_maintenance(now: Optional[datetime] = None, force_analyze: bool = False) -> Dict[str, Any]:
+    """
+    执行一轮数据库维护，返回各步骤的结果
+    Run one round of database maintenance; returns each step's result
+
+    先清理数据再更新统计信息，最后在空闲时段回收清理和日志保留策略留下的空闲页。
+    Data is purged before statistics are refreshed, and the free pages left by the purges and
+    the log retention policy are reclaimed last, within the quiet hours.
+    """
+    now = now or get_beijing_now()
+    started = time.perf_counter()
+    results: Dict[str, Any] = {}
+
+    if TIME_SLOT_RETENTION_DAYS:
+        # 旧的设备时间段可能仍被预约的time_slot_id引用，只删除无人引用的
+        referenced = select(Reservation.time_slot_id).where(Reservation.time_slot_id.isnot(None))
+        purged = await _timed_step("time_slots", purge_rows(
+            EquipmentTimeSlot,
+            [
+                EquipmentTimeSlot.end_datetime < now - timedelta(days=TIME_SLOT_RETENTION_DAYS),
+                EquipmentTimeSlot.id.not_in(referenced)
+            ],
+            vacuum=False
+        ))
+        results["time_slots"] = purged["deleted"] if purged else None
+
+    purged = await _timed_step("idempotency_keys", purge_rows(
+        IdempotencyKey, [IdempotencyKey.expires_at <= now], vacuum=False
+    ))
+    results["idempotency_keys"] = purged["deleted"] if purged else None
+
+    if TOMBSTONE_RETENTION_DAYS:
+        # 始终保留序号最大的删除记录，变更序号不会因清理而回退
+        newest = select(func.max(ReservationTombstone.updated_seq)).scalar_subquery()
+        purged = await _timed_step("tombstones", purge_rows(
+            ReservationTombstone,
+            [
+                ReservationTombstone.deleted_at < now - timedelta(days=TOMBSTONE_RETENTION_DAYS),
+                ReservationTombstone.updated_seq < newest
+            ],
+            vacuum=False
+        ))
+        results["tombstones"] = purged["deleted"] if purged else None
+
+    analyze = force_analyze or analyze_due(now)
+    results["optimize"] = await _timed_step("analyze" if analyze else "optimize", _optimize(analyze))
+    if results["optimize"] == "ANALYZE":
+        with _metrics_lock:
+            _metrics["last_analyze_at"] = now
+
+    if in_vacuum_window(now):
+        results["freed_pages"] = await _timed_step("incremental_vacuum", vacuum_in_steps())
+
+    duration = time.perf_counter() - started
+    with _metrics_lock:
+        _metrics["runs"] += 1
+        _metrics["last_run_at"] = now
+        _metrics["last_duration_ms"] = round(duration * 1000, 1)
+    logger.info(f"数据库维护完成，耗时 {duration * 1000:.0f} ms: {results}")
+    return results
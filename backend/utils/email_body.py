@@ -0,0 +1,88 @@
+"""
+邮件正文存储
+Email body storage
+
+邮件日志不再逐条保存渲染后的HTML，而是按内容的SHA-256把正文压缩后存入email_bodies表，
+日志只记录哈希。循环预约的确认、取消邮件正文几乎相同，去重后同一正文只保存一份；
+查看日志时再按哈希解压还原原始HTML。
+
+Email logs no longer store the rendered HTML per row. Bodies are compressed and stored once
+in email_bodies keyed by the SHA-256 of the content, and each log keeps only the hash.
+Confirmations and cancellations for recurring series render near-identical bodies, so
+identical HTML is kept once; the log viewer decompresses the exact body on demand.
+"""
+import zlib
+import hashlib
+import logging
+from typing import Optional
+
+from sqlalchemy import exists, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from backend.database import begin_immediate
+from backend.models.email import EmailBody, EmailLog
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+
+def store_email_body(db: Session, html: Optional[str]) -> Optional[str]:
+    """
+    保存邮件正文并返回其哈希，相同正文只保存一次（不提交事务）
+    Store an email body and return its hash; identical bodies are stored once (does not commit)
+    """
+    if not html:
+        return None
+    data = html.encode("utf-8")
+    digest = hashlib.sha256(data).hexdigest()
+    # 其他进程可能同时写入同一正文，主键冲突时忽略
+    db.execute(
+        sqlite_insert(EmailBody)
+        .values(hash=digest, content=zlib.compress(data, 9), size=len(data))
+        .on_conflict_do_nothing(index_elements=["hash"])
+    )
+    return digest
+
+
+def load_email_body(db: Session, body_hash: Optional[str]) -> Optional[str]:
+    """
+    按哈希还原邮件正文，不存在时返回None
+    Restore an email body by its hash; returns None when it is missing
+    """
+    if not body_hash:
+        return None
+    content = db.execute(select(EmailBody.content).where(EmailBody.hash == body_hash)).scalar()
+    if content is None:
+        logger.warning(f"邮件正文 {body_hash} 不存在")
+        return None
+    return zlib.decompress(content).decode("utf-8")
+
+
+def get_log_content(db: Session, log: EmailLog) -> Optional[str]:
+    """
+    返回邮件日志的HTML内容，兼容仍直接保存content_html的旧日志
+    Return the HTML of an email log, including older logs that still store content_html inline
+    """
+    if log.body_hash:
+        return load_email_body(db, log.body_hash)
+    return log.content_html
+
+
+def delete_orphan_email_bodies(db: Session) -> int:
+    """
+    删除已没有日志引用的邮件正文，返回删除的行数
+    Delete email bodies no longer referenced by any log; returns rows deleted
+    """
+    try:
+        begin_immediate(db)
+        deleted = db.query(EmailBody).filter(
+            ~exists().where(EmailLog.body_hash == EmailBody.hash)
+        ).delete(synchronize_session=False)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    if deleted:
+        logger.info(f"已删除 {deleted} 条无引用的邮件正文")
+    return deleted
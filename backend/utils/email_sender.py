@@ -26,6 +26,7 @@ from config import (
 # 导入数据库模型
 from backend.models.email import EmailSettings, EmailTemplate, EmailLog
 from backend.database import get_db
+from backend.utils.email_body import store_email_body
 
 # 设置Jinja2环境
 templates_dir = os.path.join(BASE_DIR, "backend", "templates", "emails")
@@ -121,7 +122,7 @@ async def send_email(to_email, subject, html_content, text_content=None, db: Ses
                     status="success",
                     reservation_code=reservation_code,
                     reservation_number=reservation_number,
-                    content_html=html_content
+                    body_hash=store_email_body(db, html_content)
                 )
                 db.add(email_log)
                 db.commit()
@@ -145,7 +146,7 @@ async def send_email(to_email, subject, html_content, text_content=None, db: Ses
                     error_message=error_message,
                     reservation_code=reservation_code,
                     reservation_number=reservation_number,
-                    content_html=html_content
+                    body_hash=store_email_body(db, html_content)
                 )
                 db.add(email_log)
                 db.commit()
@@ -231,6 +232,41 @@ async def send_reservation_confirmation(to_email, reservation_data, lang="zh_CN"
         logger.error(f"发送预定确认邮件失败: {e}")
         return False
 
+async def send_batch_reservation_confirmation(to_email, reservation_data, lang="zh_CN", db: Session = None):
+    """
+    发送批量预约确认邮件，reservation_data["items"]中的每个预约单独列出预约码、设备和起止时间
+    Send a batch reservation confirmation; each reservation in reservation_data["items"] is
+    listed with its own code, equipment and start/end time
+    """
+    try:
+        template_key = "reservation_batch_created"
+        subject = None
+        html_content = None
+        if db:
+            subject, html_content = await get_email_template(template_key, lang, db)
+        if not html_content:
+            template_name = f"{template_key}_{lang}.html"
+            if not os.path.exists(os.path.join(templates_dir, template_name)):
+                template_name = f"{template_key}.html"
+            template = env.get_template(template_name)
+            html_content = template.render(reservation=reservation_data)
+            subject = "批量预约创建 / Batch Reservation Created"
+        else:
+            template = env.from_string(html_content)
+            html_content = template.render(reservation=reservation_data)
+        return await send_email(
+            to_email,
+            subject,
+            html_content,
+            db=db,
+            event_type=template_key,
+            reservation_code=reservation_data.get("reservation_code"),
+            reservation_number=reservation_data.get("reservation_number")
+        )
+    except Exception as e:
+        logger.error(f"发送批量预约确认邮件失败: {e}")
+        return False
+
 async def send_reservation_update(to_email, reservation_data, lang="zh_CN", db: Session = None):
     """
     发送预定更新邮件
@@ -418,12 +454,12 @@ async def send_reservation_cancellation(to_email, reservation_data, lang="zh_CN"
                 subject = "单次预约取消 / Single Reservation Cancelled"
         else:
             # 这里增加debug log
-            print("DEBUG: 渲染前模板内容:", repr(html_content))
-            print("DEBUG: 渲染变量 reservation:", reservation_data)
-            print("DEBUG: 渲染变量 parent:", parent_info)
+            logger.debug("渲染前模板内容: %r", html_content)
+            logger.debug("渲染变量 reservation: %s", reservation_data)
+            logger.debug("渲染变量 parent: %s", parent_info)
             template = env.from_string(html_content)
             html_content = template.render(reservation=reservation_data, parent=parent_info)
-            print("DEBUG: 渲染后邮件内容:", html_content)
+            logger.debug("渲染后邮件内容: %s", html_content)
         result = await send_email(
             to_email,
             subject,
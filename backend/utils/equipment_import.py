@@ -0,0 +1,414 @@
+"""
+设备批量导入
+Bulk equipment import
+
+- 上传文件按块写入临时文件，用openpyxl只读模式逐行读取，不把整个工作簿载入内存
+- 按EQUIPMENT_IMPORT_CHUNK_SIZE分批校验，每行的错误汇总成逐行错误报告
+- 设备类别用一次查询对照equipment_category解析，缺少的类别随导入一起创建
+- 以(名称, 类别, 型号, 位置)为键：已存在的设备更新，其余新建，
+  全部用bulk_insert_mappings/bulk_update_mappings在一个事务中写入
+- 支持只校验不写入的试运行；大文件作为后台任务运行，可轮询进度
+
+- uploads are streamed to a temp file and read row by row with openpyxl's read-only mode,
+  so the workbook is never loaded into memory as a whole
+- rows are validated in chunks of EQUIPMENT_IMPORT_CHUNK_SIZE and every problem is
+  collected into a per-row error report
+- categories are resolved against equipment_category in one query; missing categories
+  are created as part of the import
+- rows are keyed by (name, category, model, location): existing equipment is updated, the
+  rest is created, all through bulk_insert_mappings/bulk_update_mappings in one transaction
+- a dry run validates and plans without writing; large files run as a background job whose
+  progress can be polled
+
+只支持.xlsx：旧的.xls格式无法流式读取。
+Only .xlsx is supported: the legacy .xls format cannot be streamed.
+"""
+import os
+import logging
+import tempfile
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import aiofiles
+from fastapi import UploadFile
+from pydantic import ValidationError
+from sqlalchemy.orm import Session
+
+from config import EQUIPMENT_IMPORT_CHUNK_SIZE, EQUIPMENT_IMPORT_MAX_ERRORS
+from backend.database import SessionLocal, begin_immediate
+from backend.models.equipment import Equipment
+from backend.models.equipment_category import EquipmentCategory
+from backend.schemas.equipment import EquipmentCreate
+from backend.utils.background_jobs import update_job
+from backend.utils.db_utils import get_beijing_now
+from backend.utils.occupancy_index import occupancy_index
+from backend.utils.reservation_lookup import lookup_cache
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+# 每次读取上传文件的块大小
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# 可导入的列
+IMPORT_FIELDS = (
+    "name", "category", "model", "location", "status", "description",
+    "user_guide", "video_tutorial", "allow_simultaneous", "max_simultaneous"
+)
+
+# 识别同一设备的列
+KEY_FIELDS = ("name", "category", "model", "location")
+
+# 已存在设备可被更新的列
+UPDATE_FIELDS = ("status", "description", "user_guide", "video_tutorial", "allow_simultaneous", "max_simultaneous")
+
+# 允许的设备状态
+EQUIPMENT_STATUSES = ("available", "maintenance")
+
+TRUE_VALUES = {"1", "true", "yes", "y", "是"}
+FALSE_VALUES = {"0", "false", "no", "n", "否"}
+
+
+async def save_import_upload(file: UploadFile) -> Tuple[str, int]:
+    """
+    把上传的工作簿按块写入临时文件
+    Stream an uploaded workbook to a temp file
+
+    返回值：(临时文件路径, 文件大小)
+    Returns: (temp file path, size)
+    """
+    fd, path = tempfile.mkstemp(prefix="equipment-import-", suffix=".xlsx")
+    os.close(fd)
+    size = 0
+    try:
+        async with aiofiles.open(path, "wb") as buffer:
+            while True:
+                chunk = await file.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                await buffer.write(chunk)
+    except Exception:
+        os.remove(path)
+        raise
+    return path, size
+
+
+def iter_workbook_rows(path: str) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    """
+    逐行读取工作簿第一个工作表，按表头返回(行号, {列名: 值})，跳过空行
+    Stream the first worksheet and yield (row number, {column: value}) by header, skipping blank rows
+    """
+    # openpyxl较重，首次导入时才加载
+    from openpyxl import load_workbook
+
+    try:
+        workbook = load_workbook(path, read_only=True, data_only=True)
+    except Exception as e:
+        raise ValueError(f"读取Excel文件失败: {str(e)}")
+
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        if not header:
+            raise ValueError("文件中没有数据")
+
+        columns = [str(cell).strip().lower() if cell is not None else None for cell in header]
+        missing = [field for field in ("name", "category") if field not in columns]
+        if missing:
+            raise ValueError(f"缺少必填列: {', '.join(missing)}")
+        indexes = [(index, column) for index, column in enumerate(columns) if column in IMPORT_FIELDS]
+
+        for row_number, values in enumerate(rows, start=2):
+            row = {column: values[index] for index, column in indexes if index < len(values)}
+            if all(value is None or (isinstance(value, str) and not value.strip()) for value in row.values()):
+                continue
+            yield row_number, row
+    finally:
+        workbook.close()
+
+
+def estimate_row_count(path: str) -> Optional[int]:
+    """
+    根据工作表尺寸估算数据行数，用于显示进度
+    Estimate the number of data rows from the sheet dimensions, for progress display
+    """
+    from openpyxl import load_workbook
+
+    try:
+        workbook = load_workbook(path, read_only=True)
+        try:
+            max_row = workbook.worksheets[0].max_row
+        finally:
+            workbook.close()
+    except Exception:
+        return None
+    return max(max_row - 1, 0) if max_row else None
+
+
+def _clean_text(value: Any) -> Optional[str]:
+    """单元格转字符串，空白视为空值"""
+    if value is None:
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    text = str(value).strip()
+    return text or None
+
+
+def _parse_bool(value: Any) -> bool:
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in TRUE_VALUES:
+        return True
+    if text in FALSE_VALUES:
+        return False
+    raise ValueError(f"无法识别的布尔值: {value}")
+
+
+def _parse_int(value: Any) -> int:
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, int):
+        return value
+    return int(str(value).strip())
+
+
+def equipment_key(name: Any, category: Any, model: Any, location: Any) -> Tuple:
+    """
+    识别同一设备的键
+    Key identifying the same piece of equipment
+    """
+    return tuple(_clean_text(value) for value in (name, category, model, location))
+
+
+def validate_row(row: Dict[str, Any]) -> Tuple[Optional[Dict[str, Any]], List[str]]:
+    """
+    校验一行数据，返回(只包含表格中已填写的列的设备数据, 错误列表)
+    Validate one row; returns (equipment data with only the filled-in columns, errors)
+    """
+    errors = []
+    data = {}
+    for field, value in row.items():
+        if field == "allow_simultaneous":
+            if value is None or (isinstance(value, str) and not value.strip()):
+                continue
+            try:
+                data[field] = _parse_bool(value)
+            except ValueError as e:
+                errors.append(f"{field}: {str(e)}")
+        elif field == "max_simultaneous":
+            if value is None or (isinstance(value, str) and not value.strip()):
+                continue
+            try:
+                data[field] = _parse_int(value)
+            except ValueError:
+                errors.append(f"{field}: 必须是整数")
+        else:
+            text = _clean_text(value)
+            if text is not None:
+                data[field] = text
+
+    for field in ("name", "category"):
+        if field not in data:
+            errors.append(f"{field}: 必填字段为空")
+    if "status" in data and data["status"] not in EQUIPMENT_STATUSES:
+        errors.append(f"status: 无效的设备状态 {data['status']}，可选值: {', '.join(EQUIPMENT_STATUSES)}")
+    if data.get("max_simultaneous") is not None and data["max_simultaneous"] < 1:
+        errors.append("max_simultaneous: 必须大于0")
+    if errors:
+        return None, errors
+
+    try:
+        equipment = EquipmentCreate(**data)
+    except ValidationError as e:
+        return None, [
+            f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}"
+            for error in e.errors()
+        ]
+    return equipment.dict(exclude_unset=True), []
+
+
+def _resolve_categories(db: Session, names: List[str], create: bool) -> Tuple[Dict[str, int], List[str]]:
+    """
+    用一次查询把类别名解析为类别ID，create为True时创建缺少的类别
+    Resolve category names to ids in one query, creating missing ones when create is True
+
+    返回值：({类别名: 类别ID}, 缺少的类别名)
+    Returns: ({name: id}, missing names)
+    """
+    category_ids = dict(
+        db.query(EquipmentCategory.name, EquipmentCategory.id).filter(EquipmentCategory.name.in_(names)).all()
+    ) if names else {}
+    missing = [name for name in names if name not in category_ids]
+    if create and missing:
+        categories = [EquipmentCategory(name=name) for name in missing]
+        db.add_all(categories)
+        db.flush()
+        category_ids.update((category.name, category.id) for category in categories)
+    return category_ids, missing
+
+
+def _plan_rows(db: Session, rows: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    对照现有设备把校验通过的行分成新建和更新两组
+    Split validated rows into creates and updates against the existing catalog
+    """
+    existing = {}
+    for equipment in db.query(
+        Equipment.id, Equipment.name, Equipment.category, Equipment.model, Equipment.location
+    ).order_by(Equipment.id):
+        existing.setdefault(equipment_key(equipment.name, equipment.category, equipment.model, equipment.location), equipment.id)
+
+    creates, updates = [], []
+    for data in rows:
+        equipment_id = existing.get(equipment_key(*(data.get(field) for field in KEY_FIELDS)))
+        if equipment_id is None:
+            creates.append(data)
+        else:
+            updates.append(dict(data, id=equipment_id))
+    return creates, updates
+
+
+def import_equipment_file(
+    db: Session,
+    path: str,
+    dry_run: bool = False,
+    skip_invalid: bool = False,
+    progress: Optional[Callable[[str, int], None]] = None
+) -> Dict[str, Any]:
+    """
+    导入设备工作簿，返回导入报告
+    Import an equipment workbook and return the import report
+
+    有任何行校验失败且skip_invalid为False时不写入任何数据；写入在一个事务中完成，
+    失败时整体回滚，不会留下导入了一半的设备目录。
+    Nothing is written when any row fails validation unless skip_invalid is set; writes
+    happen in a single transaction that is rolled back as a whole on failure, so a failed
+    import never leaves a half-imported catalog.
+    """
+    report = {
+        "dry_run": dry_run,
+        "committed": False,
+        "total": 0,
+        "valid": 0,
+        "created": 0,
+        "updated": 0,
+        "new_categories": [],
+        "error_count": 0,
+        "errors": []
+    }
+
+    def add_errors(row_number: int, errors: List[str]):
+        report["error_count"] += 1
+        if len(report["errors"]) < EQUIPMENT_IMPORT_MAX_ERRORS:
+            report["errors"].append({"row": row_number, "errors": errors})
+
+    # 逐批校验
+    valid_rows = []
+    seen = {}
+    chunk = []
+
+    def flush_chunk():
+        for row_number, row in chunk:
+            data, errors = validate_row(row)
+            if errors:
+                add_errors(row_number, errors)
+                continue
+            key = equipment_key(*(data.get(field) for field in KEY_FIELDS))
+            if key in seen:
+                add_errors(row_number, [f"与第 {seen[key]} 行是同一设备"])
+                continue
+            seen[key] = row_number
+            valid_rows.append(data)
+        report["total"] += len(chunk)
+        chunk.clear()
+        if progress:
+            progress("validating", report["total"])
+
+    for row_number, row in iter_workbook_rows(path):
+        chunk.append((row_number, row))
+        if len(chunk) >= EQUIPMENT_IMPORT_CHUNK_SIZE:
+            flush_chunk()
+    flush_chunk()
+
+    report["valid"] = len(valid_rows)
+    if report["total"] == 0:
+        raise ValueError("文件中没有数据")
+    if report["error_count"] and not skip_invalid:
+        return report
+
+    if dry_run:
+        creates, updates = _plan_rows(db, valid_rows)
+        _, report["new_categories"] = _resolve_categories(db, sorted({data["category"] for data in valid_rows}), create=False)
+        report["created"], report["updated"] = len(creates), len(updates)
+        db.rollback()
+        return report
+
+    if progress:
+        progress("writing", report["total"])
+    try:
+        begin_immediate(db)
+        creates, updates = _plan_rows(db, valid_rows)
+        category_ids, report["new_categories"] = _resolve_categories(
+            db, sorted({data["category"] for data in valid_rows}), create=True
+        )
+
+        # 新建设备的键集合保持一致，便于executemany批量插入；未填写的列使用模式默认值
+        defaults = EquipmentCreate(name="-", category="-").dict(include=set(IMPORT_FIELDS))
+        for start in range(0, len(creates), EQUIPMENT_IMPORT_CHUNK_SIZE):
+            db.bulk_insert_mappings(Equipment, [
+                dict(defaults, **data, category_id=category_ids[data["category"]])
+                for data in creates[start:start + EQUIPMENT_IMPORT_CHUNK_SIZE]
+            ])
+
+        # 已存在的设备只更新表格中填写了的列
+        updated_at = get_beijing_now()
+        for start in range(0, len(updates), EQUIPMENT_IMPORT_CHUNK_SIZE):
+            db.bulk_update_mappings(Equipment, [
+                dict(
+                    {field: data[field] for field in UPDATE_FIELDS if field in data},
+                    id=data["id"],
+                    category_id=category_ids[data["category"]],
+                    updated_at=updated_at
+                )
+                for data in updates[start:start + EQUIPMENT_IMPORT_CHUNK_SIZE]
+            ])
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.error(f"导入设备数据失败，已回滚: {str(e)}")
+        raise
+
+    # 批量写入不触发ORM事件，手动失效缓存
+    if updates:
+        if len(updates) > EQUIPMENT_IMPORT_CHUNK_SIZE:
+            occupancy_index.invalidate()
+        else:
+            for data in updates:
+                occupancy_index.invalidate(data["id"])
+        lookup_cache.clear()
+
+    report["committed"] = True
+    report["created"], report["updated"] = len(creates), len(updates)
+    logger.info(f"设备导入完成: 新建 {report['created']} 个，更新 {report['updated']} 个，错误 {report['error_count']} 行")
+    return report
+
+
+def run_import_job(job_id: str, path: str, dry_run: bool, skip_invalid: bool) -> Dict[str, Any]:
+    """
+    在工作线程中执行后台导入任务并返回导入报告，结束后删除临时文件
+    Run a background import job on a worker thread and return its report, removing the temp file when done
+    """
+    db = SessionLocal()
+    try:
+        return import_equipment_file(
+            db, path, dry_run=dry_run, skip_invalid=skip_invalid,
+            progress=lambda phase, processed: update_job(job_id, phase=phase, processed=processed)
+        )
+    finally:
+        db.close()
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -2,98 +2,27 @@
 Excel处理工具
 Excel Handler
 """
-import os
-import pandas as pd
 import logging
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any
 from datetime import datetime
 from io import BytesIO
 
+from backend.i18n import translate_many
+
 # 设置日志
 logger = logging.getLogger(__name__)
 
-def read_excel(file_path: str, sheet_name: Optional[str] = None) -> List[Dict[str, Any]]:
-    """
-    读取Excel文件
-    Read Excel file
-
-    Args:
-        file_path (str): Excel文件路径
-        sheet_name (str, optional): 工作表名称. Defaults to None.
-
-    Returns:
-        List[Dict[str, Any]]: 数据列表
-    """
-    try:
-        # 读取Excel文件
-        if sheet_name:
-            df = pd.read_excel(file_path, sheet_name=sheet_name)
-        else:
-            df = pd.read_excel(file_path)
-
-        # 将DataFrame转换为字典列表
-        data = df.to_dict(orient="records")
+# 预约状态，导出时翻译为当前语言的名称
+RESERVATION_STATUSES = ("confirmed", "in_use", "expired", "cancelled")
 
-        return data
-    except Exception as e:
-        logger.error(f"读取Excel文件失败: {str(e)}")
-        raise e
-
-def read_excel_from_bytes(file_bytes: bytes, sheet_name: Optional[str] = None) -> List[Dict[str, Any]]:
+def reservation_status_labels() -> Dict[str, str]:
     """
-    从字节流读取Excel文件
-    Read Excel file from bytes
-
-    Args:
-        file_bytes (bytes): Excel文件字节流
-        sheet_name (str, optional): 工作表名称. Defaults to None.
-
-    Returns:
-        List[Dict[str, Any]]: 数据列表
-    """
-    try:
-        # 从字节流读取Excel文件
-        # 明确指定Excel引擎，防止自动检测失败
-        if sheet_name:
-            df = pd.read_excel(BytesIO(file_bytes), sheet_name=sheet_name, engine='openpyxl')
-        else:
-            df = pd.read_excel(BytesIO(file_bytes), engine='openpyxl')
-
-        # 将DataFrame转换为字典列表
-        data = df.to_dict(orient="records")
-
-        return data
-    except Exception as e:
-        logger.error(f"从字节流读取Excel文件失败: {str(e)}")
-        raise e
-
-def write_excel(data: List[Dict[str, Any]], file_path: str, sheet_name: str = "Sheet1") -> str:
-    """
-    将数据写入Excel文件
-    Write data to Excel file
-
-    Args:
-        data (List[Dict[str, Any]]): 数据列表
-        file_path (str): Excel文件路径
-        sheet_name (str, optional): 工作表名称. Defaults to "Sheet1".
-
-    Returns:
-        str: Excel文件路径
+    返回预约状态到当前语言名称的映射
+    Map reservation statuses to their names in the current locale
     """
-    try:
-        # 确保目录存在
-        os.makedirs(os.path.dirname(file_path), exist_ok=True)
-
-        # 将字典列表转换为DataFrame
-        df = pd.DataFrame(data)
-
-        # 写入Excel文件
-        df.to_excel(file_path, sheet_name=sheet_name, index=False)
-
-        return file_path
-    except Exception as e:
-        logger.error(f"写入Excel文件失败: {str(e)}")
-        raise e
+    return dict(zip(RESERVATION_STATUSES, translate_many(
+        f"reservation_status.{status}" for status in RESERVATION_STATUSES
+    )))
 
 def write_excel_to_bytes(data: List[Dict[str, Any]], sheet_name: str = "Sheet1") -> bytes:
     """
@@ -101,81 +30,33 @@ def write_excel_to_bytes(data: List[Dict[str, Any]], sheet_name: str = "Sheet1")
     Write data to Excel file and return bytes
 
     Args:
-        data (List[Dict[str, Any]]): 数据列表
+        data (List[Dict[str, Any]]): 数据列表，各行键的并集按首次出现的顺序作为表头
         sheet_name (str, optional): 工作表名称. Defaults to "Sheet1".
 
     Returns:
         bytes: Excel文件字节流
     """
     try:
-        # 将字典列表转换为DataFrame
-        df = pd.DataFrame(data)
+        # openpyxl较重，首次导出时才加载
+        from openpyxl import Workbook
 
-        # 写入Excel文件
-        output = BytesIO()
-        df.to_excel(output, sheet_name=sheet_name, index=False, engine='openpyxl')
+        columns = list(dict.fromkeys(key for row in data for key in row))
+
+        # 只写模式逐行写入，不在内存中保留单元格对象
+        workbook = Workbook(write_only=True)
+        worksheet = workbook.create_sheet(title=sheet_name)
+        worksheet.append(columns)
+        for row in data:
+            worksheet.append([row.get(column) for column in columns])
 
         # 获取字节流
-        output.seek(0)
+        output = BytesIO()
+        workbook.save(output)
         return output.getvalue()
     except Exception as e:
         logger.error(f"将数据写入Excel文件并返回字节流失败: {str(e)}")
         raise e
 
-def parse_equipment_excel(file_bytes: bytes) -> List[Dict[str, Any]]:
-    """
-    解析设备Excel文件
-    Parse equipment Excel file
-
-    Args:
-        file_bytes (bytes): Excel文件字节流
-
-    Returns:
-        List[Dict[str, Any]]: 设备数据列表
-    """
-    try:
-        # 检查文件内容是否为空
-        if not file_bytes:
-            raise ValueError("文件内容为空")
-
-        # 从字节流读取Excel文件
-        try:
-            data = read_excel_from_bytes(file_bytes)
-        except Exception as excel_error:
-            logger.error(f"读取Excel文件失败: {str(excel_error)}")
-            raise ValueError(f"读取Excel文件失败: {str(excel_error)}")
-
-        # 检查数据是否为空
-        if not data:
-            raise ValueError("文件中没有数据")
-
-        # 验证必填字段
-        required_fields = ["name", "category"]
-        for i, item in enumerate(data):
-            for field in required_fields:
-                if field not in item or pd.isna(item[field]):
-                    raise ValueError(f"第 {i+1} 行缺少必填字段: {field}")
-
-        # 处理数据
-        for item in data:
-            # 设置默认值
-            if "status" not in item or pd.isna(item["status"]):
-                item["status"] = "available"
-
-            # 处理NaN值
-            for key, value in item.items():
-                if pd.isna(value):
-                    item[key] = None
-
-        return data
-    except ValueError as ve:
-        # 直接抛出用户可读的错误
-        logger.error(f"解析设备Excel文件失败: {str(ve)}")
-        raise ve
-    except Exception as e:
-        logger.error(f"解析设备Excel文件失败: {str(e)}")
-        raise ValueError(f"解析设备Excel文件失败: {str(e)}")
-
 def generate_equipment_template() -> bytes:
     """
     生成设备导入模板
@@ -246,8 +127,8 @@ def export_equipment_data(equipment_list: List[Dict[str, Any]]) -> bytes:
 
 def export_reservation_data_simple(reservation_list: List[Dict[str, Any]], selected_fields: List[str] = None, export_format: str = "csv") -> bytes:
     """
-    导出预定数据（简化版，不依赖pandas）
-    Export reservation data (simplified version without pandas dependency)
+    导出预定数据（简化版，不依赖openpyxl）
+    Export reservation data (simplified version without openpyxl dependency)
 
     Args:
         reservation_list (List[Dict[str, Any]]): 预定数据列表
@@ -284,6 +165,9 @@ def export_reservation_data_simple(reservation_list: List[Dict[str, Any]], selec
         if not selected_fields:
             selected_fields = list(field_mapping.keys())
 
+        # 状态名称只翻译一次，逐行查表
+        status_labels = reservation_status_labels()
+
         # 处理数据
         export_data = []
         for reservation in reservation_list:
@@ -296,14 +180,8 @@ def export_reservation_data_simple(reservation_list: List[Dict[str, Any]], selec
 
                     # 处理特殊字段
                     if field == "status":
-                        # 状态字段转换为中文
-                        status_mapping = {
-                            "confirmed": "已确认",
-                            "in_use": "使用中",
-                            "expired": "已过期",
-                            "cancelled": "已取消"
-                        }
-                        value = status_mapping.get(value, value)
+                        # 状态字段转换为当前语言的名称
+                        value = status_labels.get(value, value)
                     elif field in ["start_datetime", "end_datetime", "created_at"] and value:
                         # 时间字段格式化
                         if isinstance(value, str):
@@ -353,14 +231,12 @@ def export_reservation_data(reservation_list: List[Dict[str, Any]], selected_fie
         bytes: Excel/CSV文件字节流
     """
     try:
-        # 如果是CSV格式或者pandas不可用，使用简化版本
+        # 如果是CSV格式或者openpyxl不可用，使用简化版本
         if export_format.lower() == "csv":
             return export_reservation_data_simple(reservation_list, selected_fields, "csv")
 
-        # 尝试使用pandas导出Excel
+        # 尝试使用openpyxl导出Excel，未安装时write_excel_to_bytes抛出ImportError
         try:
-            import pandas as pd
-
             # 定义所有可用字段及其中文名称
             field_mapping = {
                 "id": "ID",
@@ -384,6 +260,9 @@ def export_reservation_data(reservation_list: List[Dict[str, Any]], selected_fie
             if not selected_fields:
                 selected_fields = list(field_mapping.keys())
 
+            # 状态名称只翻译一次，逐行查表
+            status_labels = reservation_status_labels()
+
             # 处理数据
             export_data = []
             for reservation in reservation_list:
@@ -396,14 +275,8 @@ def export_reservation_data(reservation_list: List[Dict[str, Any]], selected_fie
 
                         # 处理特殊字段
                         if field == "status":
-                            # 状态字段转换为中文
-                            status_mapping = {
-                                "confirmed": "已确认",
-                                "in_use": "使用中",
-                                "expired": "已过期",
-                                "cancelled": "已取消"
-                            }
-                            value = status_mapping.get(value, value)
+                            # 状态字段转换为当前语言的名称
+                            value = status_labels.get(value, value)
                         elif field in ["start_datetime", "end_datetime", "created_at"] and value:
                             # 时间字段格式化
                             if isinstance(value, str):
@@ -424,8 +297,8 @@ def export_reservation_data(reservation_list: List[Dict[str, Any]], selected_fie
             return write_excel_to_bytes(export_data, sheet_name=f"预约数据_{timestamp}")
 
         except ImportError:
-            # 如果pandas不可用，回退到CSV格式
-            logger.warning("pandas不可用，回退到CSV格式导出")
+            # 如果openpyxl不可用，回退到CSV格式
+            logger.warning("openpyxl不可用，回退到CSV格式导出")
             return export_reservation_data_simple(reservation_list, selected_fields, "csv")
 
     except Exception as e:
@@ -0,0 +1,72 @@
+"""
+快速JSON响应
+Fast JSON responses
+
+用于返回大量行数据的列表接口：接口直接构建好字典后返回FastJSONResponse，
+FastAPI不会再按response_model重新校验；序列化使用orjson（未安装时回退到标准库json）。
+For list endpoints that return many rows: the endpoint builds plain dicts and returns
+a FastJSONResponse, so FastAPI skips response_model re-validation; serialization uses
+orjson (falling back to the standard json module when it is not installed).
+"""
+import json
+from datetime import date, datetime, time
+from decimal import Decimal
+from typing import Any
+
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _default(obj: Any) -> Any:
+    """
+    处理orjson不能直接序列化的类型
+    Handle types orjson cannot serialize natively
+    """
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if isinstance(obj, bytes):
+        return obj.decode("utf-8", errors="replace")
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    if hasattr(obj, "model_dump"):
+        return obj.model_dump()
+    if hasattr(obj, "dict"):
+        return obj.dict()
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def _json_default(obj: Any) -> Any:
+    """
+    标准库json的回退序列化，日期时间使用ISO格式
+    Fallback for the standard json module; dates and times use ISO format
+    """
+    if isinstance(obj, (datetime, date, time)):
+        return obj.isoformat()
+    return _default(obj)
+
+
+def dumps(content: Any) -> bytes:
+    """
+    将内容序列化为UTF-8编码的JSON
+    Serialize content to UTF-8 encoded JSON
+    """
+    if orjson is not None:
+        return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(
+        content, default=_json_default, ensure_ascii=False, separators=(",", ":")
+    ).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    使用orjson序列化的JSON响应
+    JSON response serialized with orjson
+    """
+    media_type = "application/json; charset=utf-8"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
@@ -0,0 +1,210 @@
+"""
+ICS日历文件
+ICS calendar files
+
+每个预约码对应一个ICS文件（static/ics/<预约码>.ics），用户可以订阅或导入。
+循环预约写成一个带RRULE/EXDATE的VEVENT，例外子预约和普通预约各写一个VEVENT。
+
+One ICS file per reservation code (static/ics/<code>.ics) that users can subscribe to
+or import. A recurring series is written as one VEVENT with RRULE/EXDATE; exception
+children and plain reservations get a VEVENT each.
+"""
+import os
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+
+from sqlalchemy.orm import Session, joinedload
+
+from config import BASE_DIR
+from backend.models.recurring_reservation import RecurringReservation
+from backend.models.reservation import Reservation
+from backend.utils.recurrence import build_series_layout, format_datetime
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+# ICS文件目录及对应的URL前缀
+ICS_DIR = os.path.join(BASE_DIR, "backend", "static", "ics")
+ICS_URL_PREFIX = "/static/ics"
+
+# 预约时间均为北京时间
+TIMEZONE_ID = "Asia/Shanghai"
+UID_DOMAIN = "equipment-reservation"
+UTC_OFFSET = timedelta(hours=8)
+
+# ICS中视为已发生/将发生的子预约状态
+ICS_STATUSES = ("confirmed", "in_use", "expired")
+
+VTIMEZONE = [
+    "BEGIN:VTIMEZONE",
+    f"TZID:{TIMEZONE_ID}",
+    "BEGIN:STANDARD",
+    "DTSTART:19700101T000000",
+    "TZOFFSETFROM:+0800",
+    "TZOFFSETTO:+0800",
+    "TZNAME:CST",
+    "END:STANDARD",
+    "END:VTIMEZONE",
+]
+
+
+def escape_text(value: Optional[str]) -> str:
+    """
+    转义TEXT类型的值
+    Escape a TEXT value
+    """
+    if not value:
+        return ""
+    return (
+        value.replace("\\", "\\\\")
+        .replace(";", "\\;")
+        .replace(",", "\\,")
+        .replace("\r\n", "\\n")
+        .replace("\n", "\\n")
+    )
+
+
+def fold_line(line: str) -> str:
+    """
+    按75字节折行（不拆开多字节字符）
+    Fold a content line at 75 octets without splitting multi-byte characters
+    """
+    if len(line.encode("utf-8")) <= 75:
+        return line
+    parts = []
+    current = ""
+    limit = 75
+    for char in line:
+        if len((current + char).encode("utf-8")) > limit:
+            parts.append(current)
+            current = char
+            limit = 74  # 续行以一个空格开头
+        else:
+            current += char
+    parts.append(current)
+    return "\r\n ".join(parts)
+
+
+def utc_until(rrule: str) -> str:
+    """
+    DTSTART带TZID时RFC 5545要求UNTIL使用UTC时间，将北京时间的UNTIL转换为UTC
+    RFC 5545 requires a UTC UNTIL when DTSTART has a TZID; convert the Beijing-time UNTIL
+    """
+    parts = []
+    for part in rrule.split(";"):
+        if part.startswith("UNTIL="):
+            until = datetime.strptime(part[len("UNTIL="):], "%Y%m%dT%H%M%S") - UTC_OFFSET
+            part = f"UNTIL={format_datetime(until)}Z"
+        parts.append(part)
+    return ";".join(parts)
+
+
+def _event_lines(
+    uid: str,
+    start: datetime,
+    end: datetime,
+    summary: str,
+    reservation,
+    status: str,
+    stamp: str
+) -> List[str]:
+    lines = [
+        "BEGIN:VEVENT",
+        f"UID:{uid}",
+        f"DTSTAMP:{stamp}",
+        f"DTSTART;TZID={TIMEZONE_ID}:{format_datetime(start)}",
+        f"DTEND;TZID={TIMEZONE_ID}:{format_datetime(end)}",
+        f"SUMMARY:{escape_text(summary)}",
+        f"STATUS:{status}",
+    ]
+    equipment = reservation.equipment
+    if equipment is not None and equipment.location:
+        lines.append(f"LOCATION:{escape_text(equipment.location)}")
+    description = f"{reservation.user_name} ({reservation.user_department})"
+    if reservation.purpose:
+        description += f"\n{reservation.purpose}"
+    lines.append(f"DESCRIPTION:{escape_text(description)}")
+    return lines
+
+
+def render_ics(db: Session, reservation_code: str) -> Optional[str]:
+    """
+    生成预约码对应的ICS内容，预约码不存在时返回None
+    Render the ICS content for a reservation code; returns None for unknown codes
+    """
+    reservations = db.query(Reservation).options(
+        joinedload(Reservation.equipment)
+    ).filter(
+        Reservation.reservation_code == reservation_code
+    ).order_by(Reservation.start_datetime).all()
+    recurring_reservation = db.query(RecurringReservation).options(
+        joinedload(RecurringReservation.equipment)
+    ).filter(
+        RecurringReservation.reservation_code == reservation_code
+    ).first()
+    if not reservations and recurring_reservation is None:
+        return None
+
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    lines = [
+        "BEGIN:VCALENDAR",
+        "VERSION:2.0",
+        "PRODID:-//Equipment Reservation System//CN",
+        "CALSCALE:GREGORIAN",
+        "METHOD:PUBLISH",
+        f"X-WR-TIMEZONE:{TIMEZONE_ID}",
+    ] + VTIMEZONE
+
+    singles = [reservation for reservation in reservations if reservation.recurring_reservation_id is None]
+    if recurring_reservation is not None:
+        children = [
+            reservation for reservation in reservations
+            if reservation.recurring_reservation_id == recurring_reservation.id
+        ]
+        series, exceptions = build_series_layout(recurring_reservation, children, ICS_STATUSES)
+        summary = recurring_reservation.equipment.name if recurring_reservation.equipment else reservation_code
+        if series is not None:
+            first_start = datetime.strptime(series["dtstart"], "%Y%m%dT%H%M%S")
+            first_end = datetime.combine(first_start.date(), recurring_reservation.end_time)
+            # 系列只包含未取消的实例，已取消的日期都在EXDATE中
+            lines += _event_lines(
+                f"series-{recurring_reservation.id}@{UID_DOMAIN}",
+                first_start, first_end, summary, recurring_reservation, "CONFIRMED", stamp
+            )
+            lines.append(f"RRULE:{utc_until(series['rrule'])}")
+            if series["exdate"]:
+                lines.append(f"EXDATE;TZID={TIMEZONE_ID}:{','.join(series['exdate'])}")
+            lines.append("END:VEVENT")
+        # 已取消的子预约只体现在EXDATE中
+        singles.extend(reservation for reservation in exceptions if reservation.status in ICS_STATUSES)
+
+    for reservation in singles:
+        status = "CANCELLED" if reservation.status == "cancelled" else "CONFIRMED"
+        summary = reservation.equipment.name if reservation.equipment else reservation.reservation_code
+        lines += _event_lines(
+            f"{reservation.reservation_number}@{UID_DOMAIN}",
+            reservation.start_datetime, reservation.end_datetime, summary, reservation, status, stamp
+        )
+        lines.append("END:VEVENT")
+
+    lines.append("END:VCALENDAR")
+    return "\r\n".join(fold_line(line) for line in lines) + "\r\n"
+
+
+def write_ics_file(db: Session, reservation_code: str) -> Optional[str]:
+    """
+    生成并写入预约码对应的ICS文件，返回文件URL
+    Render and write the ICS file for a reservation code; returns its URL
+    """
+    content = render_ics(db, reservation_code)
+    if content is None:
+        return None
+
+    os.makedirs(ICS_DIR, exist_ok=True)
+    file_path = os.path.join(ICS_DIR, f"{reservation_code}.ics")
+    temp_path = file_path + ".part"
+    with open(temp_path, "w", encoding="utf-8", newline="") as ics_file:
+        ics_file.write(content)
+    os.replace(temp_path, file_path)
+    return f"{ICS_URL_PREFIX}/{reservation_code}.ics"
@@ -0,0 +1,187 @@
+"""
+幂等键工具
+Idempotency key utilities
+
+客户端在创建/取消预约时可以携带Idempotency-Key请求头。首次请求执行时预占该键，
+成功后保存响应；在有效期内使用同一个键重试时，只需一次索引查询即可返回首次响应，
+不会重复执行冲突检查、编号分配和邮件发送。失败的响应不会保存，重试会重新执行。
+Clients may send an Idempotency-Key header when creating or cancelling reservations.
+The first request claims the key and its successful response is stored; a retry with
+the same key within the TTL returns that response from a single indexed lookup instead
+of re-running conflict checks, number allocation and emails. Failed responses are not
+stored, so a retry runs again.
+"""
+import json
+import hashlib
+import logging
+from datetime import timedelta
+from typing import Any, Awaitable, Callable, Optional
+
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from backend.models.idempotency_key import IdempotencyKey
+from backend.utils.db_utils import get_beijing_now
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+# 保存响应的有效期
+IDEMPOTENCY_TTL = timedelta(hours=24)
+# 预占后超过该时间仍未完成的请求视为已中断，允许重新执行
+PROCESSING_TIMEOUT = timedelta(minutes=5)
+# 幂等键最大长度
+MAX_KEY_LENGTH = 128
+
+def hash_request(payload: Any) -> str:
+    """
+    计算请求参数的摘要，用于识别同一个键被用于不同请求
+    Hash the request payload to detect a key reused for a different request
+    """
+    data = json.dumps(jsonable_encoder(payload), sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+def begin_request(db: Session, key: str, scope: str, payload: Any) -> Optional[Any]:
+    """
+    查询幂等键：已完成则返回保存的响应，否则预占该键并返回None
+    Look up the key: return the stored response if completed, otherwise claim it and return None
+    """
+    if len(key) > MAX_KEY_LENGTH:
+        raise HTTPException(status_code=400, detail=f"Idempotency-Key长度不能超过{MAX_KEY_LENGTH}")
+
+    request_hash = hash_request(payload)
+    now = get_beijing_now()
+
+    record = db.query(IdempotencyKey).filter(IdempotencyKey.idempotency_key == key).first()
+    if record and record.expires_at > now:
+        if record.scope != scope or record.request_hash != request_hash:
+            raise HTTPException(status_code=422, detail="Idempotency-Key已用于其他请求")
+
+        if record.status == "completed":
+            logger.info(f"幂等键命中，返回已保存的响应: {scope} {key}")
+            return json.loads(record.response_body)
+
+        if record.created_at > now - PROCESSING_TIMEOUT:
+            raise HTTPException(status_code=409, detail="相同Idempotency-Key的请求正在处理中")
+
+        logger.warning(f"幂等键处理超时，重新执行请求: {scope} {key}")
+
+    if record:
+        # 过期或处理中断的键直接复用
+        record.scope = scope
+        record.request_hash = request_hash
+        record.status = "processing"
+        record.response_body = None
+        record.created_at = now
+        record.expires_at = now + IDEMPOTENCY_TTL
+    else:
+        db.add(IdempotencyKey(
+            idempotency_key=key,
+            scope=scope,
+            request_hash=request_hash,
+            status="processing",
+            created_at=now,
+            expires_at=now + IDEMPOTENCY_TTL
+        ))
+
+    try:
+        db.commit()
+    except IntegrityError:
+        # 并发的重试刚刚预占了同一个键
+        db.rollback()
+        raise HTTPException(status_code=409, detail="相同Idempotency-Key的请求正在处理中")
+    return None
+
+def finish_request(db: Session, key: str, response: Any) -> None:
+    """
+    保存成功的响应；失败的响应释放该键，以便重试重新执行
+    Store a successful response; release the key for failed ones so a retry runs again
+    """
+    try:
+        body = jsonable_encoder(response)
+        record = db.query(IdempotencyKey).filter(IdempotencyKey.idempotency_key == key).first()
+        if not record:
+            return
+
+        if isinstance(body, dict) and body.get("success") is False:
+            db.delete(record)
+        else:
+            record.status = "completed"
+            record.response_body = json.dumps(body, ensure_ascii=False)
+        db.commit()
+    except Exception as e:
+        # 保存失败不影响已完成的请求，处理超时后该键可重新使用
+        db.rollback()
+        logger.error(f"保存幂等响应失败: {key}, {str(e)}")
+
+def release_request(db: Session, key: str) -> None:
+    """
+    请求异常时释放幂等键
+    Release the key when the request raised
+    """
+    try:
+        db.rollback()
+        db.query(IdempotencyKey).filter(
+            IdempotencyKey.idempotency_key == key,
+            IdempotencyKey.status == "processing"
+        ).delete(synchronize_session=False)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.error(f"释放幂等键失败: {key}, {str(e)}")
+
+def run_idempotent(
+    db: Session,
+    key: Optional[str],
+    scope: str,
+    payload: Any,
+    handler: Callable[[], Any]
+) -> Any:
+    """
+    以幂等方式执行同步处理函数，未提供键时直接执行
+    Run a sync handler idempotently; runs it directly when no key is given
+    """
+    if not key:
+        return handler()
+
+    stored = begin_request(db, key, scope, payload)
+    if stored is not None:
+        return stored
+
+    try:
+        response = handler()
+    except Exception:
+        release_request(db, key)
+        raise
+
+    finish_request(db, key, response)
+    return response
+
+async def run_idempotent_async(
+    db: Session,
+    key: Optional[str],
+    scope: str,
+    payload: Any,
+    handler: Callable[[], Awaitable[Any]]
+) -> Any:
+    """
+    以幂等方式执行异步处理函数，未提供键时直接执行
+    Run an async handler idempotently; runs it directly when no key is given
+    """
+    if not key:
+        return await handler()
+
+    stored = begin_request(db, key, scope, payload)
+    if stored is not None:
+        return stored
+
+    try:
+        response = await handler()
+    except Exception:
+        release_request(db, key)
+        raise
+
+    finish_request(db, key, response)
+    return response
@@ -0,0 +1,244 @@
+"""
+图片上传处理流水线
+Image upload pipeline
+
+- 上传文件按块流式写入磁盘，边写边计算SHA-256并检查大小上限
+- 文件以内容摘要命名，相同图片重复上传时直接复用已有文件
+- 在进程池中生成缩略图和WebP/AVIF变体，文件系统操作在线程中执行，不阻塞事件循环
+
+- uploads are streamed to disk in chunks, hashed with SHA-256 and size-checked as they arrive
+- files are named by content hash, so identical uploads reuse the existing file
+- thumbnails and WebP/AVIF variants are generated in a process pool and file system calls
+  run in threads, off the event loop
+
+变体依赖Pillow；未安装Pillow或编码器不支持AVIF时跳过对应变体，只保留原图。
+Variants need Pillow; without it (or without an AVIF encoder) the variant is skipped
+and only the original is kept.
+"""
+import os
+import asyncio
+import hashlib
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional, Tuple
+
+import aiofiles
+from fastapi import HTTPException, UploadFile
+
+from config import BASE_DIR
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+# 上传文件根目录及对应的URL前缀
+UPLOAD_ROOT = os.path.join(BASE_DIR, "backend", "static", "uploads")
+UPLOAD_URL_PREFIX = "/static/uploads"
+
+# 每次读取的块大小
+CHUNK_SIZE = 1024 * 1024
+
+# 允许的图片扩展名
+ALLOWED_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".webp", ".bmp", ".avif"}
+
+# 变体定义：名称 -> (最长边像素, 格式, 文件后缀)
+VARIANTS = {
+    "thumbnail": (400, "WEBP", "_400.webp"),
+    "webp": (1280, "WEBP", "_1280.webp"),
+    "avif": (1280, "AVIF", "_1280.avif"),
+}
+
+# 进程池（首次使用时创建）
+_executor: Optional[ProcessPoolExecutor] = None
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    """
+    获取图片处理进程池
+    Get the image processing process pool
+    """
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=max(1, min(2, os.cpu_count() or 1)))
+    return _executor
+
+
+def shutdown_executor() -> None:
+    """
+    关闭图片处理进程池
+    Shut down the image processing process pool
+    """
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False)
+        _executor = None
+
+
+def url_to_path(url: str) -> Optional[str]:
+    """
+    将上传文件URL转换为磁盘路径
+    Convert an upload URL to its path on disk
+    """
+    if not url or not url.startswith(UPLOAD_URL_PREFIX + "/"):
+        return None
+    relative = url[len(UPLOAD_URL_PREFIX) + 1:]
+    return os.path.join(UPLOAD_ROOT, *relative.split("/"))
+
+
+def _remove_if_exists(path: str) -> None:
+    """删除文件（如果存在）"""
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def _store_upload(temp_path: str, file_path: str) -> bool:
+    """
+    将临时文件移动到最终位置；相同内容的文件已存在时删除临时文件，返回True
+    Move the temp file into place; if a file with the same content exists the temp file
+    is deleted instead and True is returned
+    """
+    if os.path.exists(file_path):
+        os.remove(temp_path)
+        return True
+    os.replace(temp_path, file_path)
+    return False
+
+
+async def save_upload(file: UploadFile, category: str, max_size: int) -> Tuple[str, str, int]:
+    """
+    流式保存上传文件并按内容摘要去重
+    Stream an upload to disk and deduplicate it by content hash
+
+    返回值：(文件URL, SHA-256, 文件大小)
+    Returns: (file URL, SHA-256, size)
+    """
+    extension = os.path.splitext(file.filename or "")[1].lower()
+    if extension not in ALLOWED_EXTENSIONS:
+        raise HTTPException(status_code=400, detail="不支持的图片格式")
+
+    upload_dir = os.path.join(UPLOAD_ROOT, category)
+    await asyncio.to_thread(os.makedirs, upload_dir, exist_ok=True)
+
+    digest = hashlib.sha256()
+    size = 0
+    temp_path = os.path.join(upload_dir, f".upload-{os.getpid()}-{id(file)}.part")
+
+    try:
+        async with aiofiles.open(temp_path, "wb") as buffer:
+            while True:
+                chunk = await file.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_size:
+                    raise HTTPException(
+                        status_code=400,
+                        detail=f"图片大小不能超过{max_size // (1024 * 1024)}MB"
+                    )
+                digest.update(chunk)
+                await buffer.write(chunk)
+
+        if size == 0:
+            raise HTTPException(status_code=400, detail="上传的文件为空")
+
+        content_hash = digest.hexdigest()
+        filename = f"{content_hash[:32]}{extension}"
+        file_path = os.path.join(upload_dir, filename)
+
+        if await asyncio.to_thread(_store_upload, temp_path, file_path):
+            # 相同内容已上传过，复用已有文件
+            logger.info(f"图片已存在，复用文件: {filename}")
+        else:
+            logger.info(f"图片保存成功: {filename}, 大小: {size} bytes")
+    except BaseException:
+        await asyncio.to_thread(_remove_if_exists, temp_path)
+        raise
+
+    return f"{UPLOAD_URL_PREFIX}/{category}/{filename}", content_hash, size
+
+
+def variant_urls(image_url: str) -> Dict[str, Optional[str]]:
+    """
+    返回图片已生成的变体URL，未生成的变体为None
+    Return URLs of the variants that exist for an image; missing ones are None
+    """
+    urls = {name: None for name in VARIANTS}
+    source_path = url_to_path(image_url)
+    if not source_path:
+        return urls
+
+    stem_url = os.path.splitext(image_url)[0]
+    stem_path = os.path.splitext(source_path)[0]
+    for name, (_, _, suffix) in VARIANTS.items():
+        if os.path.exists(stem_path + suffix):
+            urls[name] = stem_url + suffix
+    return urls
+
+
+def _render_variants(source_path: str) -> Dict[str, bool]:
+    """
+    在子进程中生成图片变体，已存在的变体直接跳过
+    Render image variants in a worker process, skipping ones that already exist
+    """
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        return {}
+
+    # 注册全部格式插件，以便判断WebP/AVIF编码器是否可用
+    Image.init()
+
+    results = {}
+    stem_path = os.path.splitext(source_path)[0]
+    with Image.open(source_path) as image:
+        # 按EXIF方向旋转，并转换为WebP/AVIF支持的颜色模式
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+
+        for name, (max_edge, image_format, suffix) in VARIANTS.items():
+            target_path = stem_path + suffix
+            if os.path.exists(target_path):
+                results[name] = True
+                continue
+            if image_format not in Image.SAVE:
+                results[name] = False
+                continue
+
+            variant = image.copy()
+            variant.thumbnail((max_edge, max_edge))
+            temp_path = target_path + ".part"
+            variant.save(temp_path, format=image_format, quality=80)
+            os.replace(temp_path, target_path)
+            results[name] = True
+    return results
+
+
+async def generate_variants(image_url: str) -> Dict[str, Optional[str]]:
+    """
+    在进程池中生成缩略图和WebP/AVIF变体，返回变体URL
+    Generate the thumbnail and WebP/AVIF variants in the process pool and return their URLs
+    """
+    source_path = url_to_path(image_url)
+    if not source_path or not await asyncio.to_thread(os.path.exists, source_path):
+        return await asyncio.to_thread(variant_urls, image_url)
+
+    try:
+        loop = asyncio.get_running_loop()
+        results = await loop.run_in_executor(_get_executor(), _render_variants, source_path)
+        if not results:
+            logger.warning("未安装Pillow，跳过图片变体生成")
+    except Exception as e:
+        logger.error(f"生成图片变体失败: {image_url}, {str(e)}")
+
+    return await asyncio.to_thread(variant_urls, image_url)
+
+
+def apply_image_variants(equipment) -> None:
+    """
+    根据设备的image_path设置已生成的变体路径
+    Set the variant paths of an equipment from its image_path
+    """
+    urls = variant_urls(equipment.image_path) if equipment.image_path else {}
+    equipment.thumbnail_path = urls.get("thumbnail")
+    equipment.image_webp_path = urls.get("webp")
+    equipment.image_avif_path = urls.get("avif")
@@ -0,0 +1,183 @@
+"""
+实时变更事件
+Live change events
+
+进程内的发布/订阅：预约CRUD函数和状态更新任务在提交后发布精简的变更事件，
+SSE接口为每个连接订阅一个有界队列。慢客户端的队列写满后直接断开该连接，
+而不是无限缓存事件；客户端重连后用日历的since令牌补齐错过的变更。
+
+In-process pub/sub: the reservation CRUD functions and the status updater publish
+compact change events after committing, and each SSE connection subscribes with a
+bounded queue. A slow client whose queue fills up is disconnected instead of being
+buffered without limit; after reconnecting it catches up with the calendar since token.
+"""
+import asyncio
+import logging
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+# 每个订阅者最多缓存的事件数
+SUBSCRIBER_QUEUE_SIZE = 100
+# 最大同时订阅数
+MAX_SUBSCRIBERS = 200
+
+
+class Subscription:
+    """
+    单个SSE连接的订阅，equipment_ids为None表示接收所有设备的事件
+    A single SSE connection's subscription; equipment_ids None means all equipment
+    """
+
+    def __init__(self, equipment_ids: Optional[Set[int]] = None):
+        self.equipment_ids = equipment_ids
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.dropped = False
+
+    def wants(self, event: Dict[str, Any]) -> bool:
+        return self.equipment_ids is None or event.get("equipment_id") in self.equipment_ids
+
+
+class EventBus:
+    """
+    进程内事件总线，可以从任意线程发布
+    In-process event bus; events may be published from any thread
+    """
+
+    def __init__(self):
+        self._subscribers: List[Subscription] = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+    def subscribe(self, equipment_ids: Optional[Iterable[int]] = None) -> Optional[Subscription]:
+        """
+        添加订阅，超过最大订阅数时返回None；必须在事件循环中调用
+        Add a subscription, or return None when the limit is reached; call from the event loop
+        """
+        if len(self._subscribers) >= MAX_SUBSCRIBERS:
+            return None
+        self._loop = asyncio.get_running_loop()
+        subscription = Subscription(set(equipment_ids) if equipment_ids is not None else None)
+        self._subscribers.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        """
+        移除订阅
+        Remove a subscription
+        """
+        if subscription in self._subscribers:
+            self._subscribers.remove(subscription)
+
+    def publish(self, events: List[Dict[str, Any]]) -> None:
+        """
+        发布事件；没有订阅者时直接返回，其他线程发布时转交事件循环分发
+        Publish events; returns immediately without subscribers, and hands off to the
+        event loop when called from another thread
+        """
+        if not self._subscribers or not events or self._loop is None or self._loop.is_closed():
+            return
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+
+        if running_loop is self._loop:
+            self._dispatch(events)
+        else:
+            self._loop.call_soon_threadsafe(self._dispatch, events)
+
+    def _dispatch(self, events: List[Dict[str, Any]]) -> None:
+        for subscription in list(self._subscribers):
+            if subscription.dropped:
+                continue
+            for event in events:
+                if not subscription.wants(event):
+                    continue
+                try:
+                    subscription.queue.put_nowait(event)
+                except asyncio.QueueFull:
+                    self._drop(subscription)
+                    break
+
+    def _drop(self, subscription: Subscription) -> None:
+        """
+        丢弃跟不上的订阅：清空队列并放入结束标记
+        Drop a subscription that fell behind: clear its queue and enqueue the end marker
+        """
+        subscription.dropped = True
+        while not subscription.queue.empty():
+            subscription.queue.get_nowait()
+        subscription.queue.put_nowait(None)
+        self.unsubscribe(subscription)
+        logger.warning("SSE客户端处理过慢，已断开连接")
+
+
+# 全局事件总线
+event_bus = EventBus()
+
+
+def reservation_event(reservation, action: str, status: Optional[str] = None) -> Dict[str, Any]:
+    """
+    构建精简的预约变更事件
+    Build a compact reservation change event
+
+    action: created, updated, cancelled, deleted, status
+    """
+    return {
+        "type": f"reservation.{action}",
+        "id": reservation.id,
+        "equipment_id": reservation.equipment_id,
+        "status": status or reservation.status,
+        "start": reservation.start_datetime.isoformat(),
+        "end": reservation.end_datetime.isoformat(),
+        "recurring_reservation_id": reservation.recurring_reservation_id,
+    }
+
+
+def series_event(recurring_reservation, action: str) -> Dict[str, Any]:
+    """
+    构建精简的循环预约变更事件
+    Build a compact series change event
+
+    action: created, updated, cancelled
+    """
+    return {
+        "type": f"series.{action}",
+        "id": recurring_reservation.id,
+        "equipment_id": recurring_reservation.equipment_id,
+        "status": recurring_reservation.status,
+        "start_date": recurring_reservation.start_date.isoformat(),
+        "end_date": recurring_reservation.end_date.isoformat(),
+    }
+
+
+def publish_reservations(reservations: Iterable, action: str, status: Optional[str] = None) -> None:
+    """
+    发布预约变更事件，发布失败只记录日志
+    Publish reservation change events; failures are only logged
+    """
+    if not event_bus.subscriber_count:
+        return
+    try:
+        event_bus.publish([reservation_event(reservation, action, status) for reservation in reservations])
+    except Exception as e:
+        logger.error(f"发布预约变更事件失败: {str(e)}")
+
+
+def publish_series(recurring_reservation, action: str) -> None:
+    """
+    发布循环预约变更事件，系列尚无子预约时客户端也能得知变更；发布失败只记录日志
+    Publish a series change event, so clients learn about series without children yet;
+    failures are only logged
+    """
+    if not event_bus.subscriber_count:
+        return
+    try:
+        event_bus.publish([series_event(recurring_reservation, action)])
+    except Exception as e:
+        logger.error(f"发布循环预约变更事件失败: {str(e)}")
@@ -0,0 +1,146 @@
+"""
+日志分批清理
+Chunked log purge
+
+按主键范围分批删除系统日志、邮件日志等只追加的表：每批是一个很短的写事务，
+批与批之间释放写锁并让出事件循环，删除大量日志时预约写入不会被长时间阻塞。
+清理结束后执行PRAGMA incremental_vacuum归还空闲页。管理员手动清理和定时保留策略
+使用同一套逻辑。
+
+Append-only tables such as system and email logs are purged in primary-key range batches:
+each batch is a short write transaction, and the write lock and the event loop are released
+between batches, so purging a large table never blocks bookings for long. A
+PRAGMA incremental_vacuum follows to return freed pages. Manual purges by admins and the
+scheduled retention policies share this engine.
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from sqlalchemy import delete, func
+from sqlalchemy.orm import Session
+
+from config import (
+    LOG_PURGE_BATCH_SIZE, LOG_PURGE_BATCH_PAUSE,
+    SYSTEM_LOG_RETENTION_DAYS, EMAIL_LOG_RETENTION_DAYS
+)
+from backend.database import SessionLocal, begin_immediate, incremental_vacuum
+from backend.models.email import EmailLog
+from backend.models.system_log import SystemLog
+from backend.utils.background_jobs import create_job, spawn_job, update_job
+from backend.utils.email_body import delete_orphan_email_bodies
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+
+def _delete_range(db: Session, model, conditions: List[Any], low: int, high: int) -> int:
+    """在一个写事务中删除主键位于[low, high)且满足条件的行"""
+    try:
+        begin_immediate(db)
+        deleted = db.execute(
+            delete(model).where(model.id >= low, model.id < high, *conditions)
+        ).rowcount
+        db.commit()
+        return deleted
+    except Exception:
+        db.rollback()
+        raise
+
+
+async def purge_rows(
+    model,
+    conditions: List[Any],
+    batch_size: int = LOG_PURGE_BATCH_SIZE,
+    progress: Optional[Callable[[int, float], None]] = None,
+    cleanup: Optional[Callable[[Session], Any]] = None,
+    vacuum: bool = True
+) -> Dict[str, int]:
+    """
+    按主键范围分批删除满足条件的行，返回{"deleted": 删除行数, "freed_pages": 回收页数}
+    Delete matching rows in primary-key range batches; returns {"deleted", "freed_pages"}
+
+    只处理开始时满足条件的行所在的主键范围（按保留期限清理时通常只是表的开头一段），
+    清理期间新写入的日志不受影响。
+    progress(已删除行数, 已处理的主键范围比例)在每批之后调用；cleanup(db)在回收空间前调用，
+    用于清理随之失去引用的关联数据。
+    Only the id range spanned by the rows matching at the start is scanned (usually just the
+    head of the table for a retention cutoff), so rows written during the purge are never
+    touched. progress(deleted, fraction of the id range done) is called after each batch;
+    cleanup(db) runs before the vacuum to drop dependent rows the purge left unreferenced.
+    vacuum=False跳过空间回收，由调用方在合适的时间统一回收。
+    vacuum=False skips reclaiming space so the caller can do it at a better time.
+    """
+    db = SessionLocal()
+    try:
+        low, max_id = db.query(func.min(model.id), func.max(model.id)).filter(*conditions).one()
+        db.rollback()
+        deleted = 0
+        if low is not None:
+            start = low
+            span = max_id - start + 1
+            while low <= max_id:
+                high = min(low + batch_size, max_id + 1)
+                deleted += await asyncio.to_thread(_delete_range, db, model, conditions, low, high)
+                low = high
+                if progress:
+                    progress(deleted, (low - start) / span)
+                # 释放写锁，让等待中的预约写入先执行
+                await asyncio.sleep(LOG_PURGE_BATCH_PAUSE)
+
+        if deleted and cleanup:
+            await asyncio.to_thread(cleanup, db)
+        freed_pages = await asyncio.to_thread(incremental_vacuum, db) if deleted and vacuum else 0
+        logger.info(f"已清理 {model.__tablename__} 表 {deleted} 行，回收 {freed_pages} 页")
+        return {"deleted": deleted, "freed_pages": freed_pages}
+    finally:
+        db.close()
+
+
+def start_purge_job(
+    kind: str,
+    model,
+    conditions: List[Any],
+    on_complete: Optional[Callable[[Dict[str, int]], Awaitable[None]]] = None,
+    cleanup: Optional[Callable[[Session], Any]] = None,
+    **info: Any
+) -> str:
+    """
+    把清理作为后台任务运行并返回任务ID，完成后调用on_complete(结果)
+    Run a purge as a background job and return its id; on_complete(result) runs when it finishes
+    """
+    job_id = create_job(kind, **info)
+
+    async def run():
+        update_job(job_id, phase="deleting")
+        result = await purge_rows(
+            model, conditions,
+            progress=lambda deleted, fraction: update_job(job_id, processed=deleted, progress=round(fraction, 4)),
+            cleanup=cleanup
+        )
+        if on_complete:
+            await on_complete(result)
+        return result
+
+    spawn_job(job_id, run())
+    return job_id
+
+
+async def apply_log_retention(now: Optional[datetime] = None) -> Dict[str, int]:
+    """
+    按保留天数清理过期的系统日志和邮件日志，返回各表删除的行数
+    Purge system and email logs past their retention period; returns rows deleted per table
+    """
+    now = now or datetime.now()
+    results = {}
+    policies = (
+        (SystemLog, SYSTEM_LOG_RETENTION_DAYS, None),
+        (EmailLog, EMAIL_LOG_RETENTION_DAYS, delete_orphan_email_bodies),
+    )
+    for model, days, cleanup in policies:
+        if not days:
+            continue
+        result = await purge_rows(model, [model.created_at < now - timedelta(days=days)], cleanup=cleanup)
+        results[model.__tablename__] = result["deleted"]
+    return results
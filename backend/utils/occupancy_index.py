@@ -0,0 +1,333 @@
+"""
+设备占用位图索引
+Equipment occupancy bitmap index
+
+按设备、按天以15分钟为粒度缓存占用情况：
+- 每台设备用array('H')保存每个时间格的预约数
+- 不允许同时预约的设备另外维护由计数派生的96位整数位图，每一位表示一个15分钟时间格，
+  查询时直接按位运算；相邻预约向外取整后可能共用同一时间格，计数保证移除其中一个时
+  不会释放另一个仍占用的时间格
+
+Occupancy is cached per equipment per day at 15-minute resolution:
+- every equipment keeps an array('H') of reservation counts per slot
+- exclusive equipment also keeps a 96-bit integer bitmap derived from the counts, one bit
+  per slot, so queries are plain bit operations; adjacent bookings rounded outwards can
+  share a slot, and the counts make sure removing one never frees a slot the other holds
+
+索引从Reservation表按需加载，并由预约CRUD函数增量维护。时间格按"向外取整"
+的方式标记，因此索引判断为空闲的时间段一定没有重叠预约；最终预约仍以数据库
+检查为准。
+The index is loaded lazily from the Reservation table and kept up to date by the
+reservation CRUD functions. Slots are rounded outwards, so a range reported as
+free never overlaps an active reservation; bookings are still validated against
+the database.
+
+循环预约尚未生成的发生不写入位图，而是缓存其规则，查询时按天叠加；循环预约的
+生成范围变化时调用方使该设备的缓存失效。
+Unmaterialized series occurrences are not written into the bitmaps; their rules are
+cached and overlaid per day at query time, and callers invalidate the equipment when a
+series' materialized range changes.
+"""
+import logging
+import threading
+from array import array
+from datetime import date, datetime, time, timedelta
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from backend.models.equipment import Equipment
+from backend.models.reservation import Reservation
+from backend.utils.recurrence import SeriesRule, occurrence_bounds, query_unmaterialized_series
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+# 时间格长度（分钟）及每天的时间格数量
+SLOT_MINUTES = 15
+SLOTS_PER_DAY = 24 * 60 // SLOT_MINUTES
+
+# 占用设备的预约状态
+ACTIVE_STATUSES = ("confirmed", "in_use")
+
+
+def iter_day_slots(start_datetime: datetime, end_datetime: datetime) -> Iterator[Tuple[date, int, int]]:
+    """
+    将时间段按天拆分为时间格区间 (日期, 起始格, 结束格)，结束格不包含在内
+    Split a time range into per-day slot ranges (day, first_slot, stop_slot), stop exclusive
+    """
+    current = start_datetime
+    while current < end_datetime:
+        day = current.date()
+        day_end = datetime.combine(day + timedelta(days=1), time.min)
+        segment_end = min(end_datetime, day_end)
+
+        first = (current.hour * 60 + current.minute) // SLOT_MINUTES
+        if segment_end == day_end:
+            stop = SLOTS_PER_DAY
+        else:
+            minutes = segment_end.hour * 60 + segment_end.minute
+            if segment_end.second or segment_end.microsecond:
+                minutes += 1
+            stop = -(-minutes // SLOT_MINUTES)
+
+        if stop > first:
+            yield day, first, stop
+        current = segment_end
+
+
+def slot_mask(first: int, stop: int) -> int:
+    """
+    生成覆盖[first, stop)时间格的位掩码
+    Build a bit mask covering slots [first, stop)
+    """
+    return ((1 << (stop - first)) - 1) << first
+
+
+class OccupancyIndex:
+    """
+    设备占用索引（进程内缓存）
+    Equipment occupancy index (per-process cache)
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        # equipment_id -> (allow_simultaneous, max_simultaneous)
+        self._equipment: Dict[int, Tuple[bool, int]] = {}
+        # equipment_id -> {date: array('H')计数}
+        self._days: Dict[int, Dict[date, array]] = {}
+        # 独占设备: equipment_id -> {date: 由计数派生的int位图}
+        self._bitmaps: Dict[int, Dict[date, int]] = {}
+        # equipment_id -> 仍有未生成发生的循环规则
+        self._series: Dict[int, List[SeriesRule]] = {}
+
+    def ensure_loaded(self, db: Session, equipment_ids: Iterable[int]) -> None:
+        """
+        加载尚未缓存的设备占用数据（每批只执行三次查询）
+        Load occupancy for equipment not cached yet (three queries per batch)
+        """
+        # 加载期间持有锁：并发的add()会在加载完成后再执行，最多重复计数（偏保守），不会漏计
+        with self._lock:
+            missing = [eid for eid in set(equipment_ids) if eid not in self._equipment]
+            if not missing:
+                return
+
+            equipments = db.query(
+                Equipment.id, Equipment.allow_simultaneous, Equipment.max_simultaneous
+            ).filter(Equipment.id.in_(missing)).all()
+
+            rows = db.query(
+                Reservation.equipment_id, Reservation.start_datetime, Reservation.end_datetime
+            ).filter(
+                Reservation.equipment_id.in_(missing),
+                Reservation.status.in_(ACTIVE_STATUSES)
+            ).all()
+
+            series = query_unmaterialized_series(db, missing).all()
+
+            for equipment in equipments:
+                self._equipment[equipment.id] = (
+                    bool(equipment.allow_simultaneous),
+                    equipment.max_simultaneous or 1
+                )
+                self._days[equipment.id] = {}
+                if not equipment.allow_simultaneous:
+                    self._bitmaps[equipment.id] = {}
+                self._series[equipment.id] = []
+            for row in rows:
+                self._apply(row.equipment_id, row.start_datetime, row.end_datetime, 1)
+            for recurring_reservation in series:
+                if recurring_reservation.equipment_id in self._series:
+                    self._series[recurring_reservation.equipment_id].append(SeriesRule(recurring_reservation))
+
+        logger.debug(f"占用索引已加载: 设备数={len(equipments)}, 预约数={len(rows)}")
+
+    def invalidate(self, equipment_id: Optional[int] = None) -> None:
+        """
+        清除缓存，下次查询时重新加载
+        Drop cached data so it is reloaded on next use
+        """
+        with self._lock:
+            if equipment_id is None:
+                self._equipment.clear()
+                self._days.clear()
+                self._bitmaps.clear()
+                self._series.clear()
+            else:
+                self._equipment.pop(equipment_id, None)
+                self._days.pop(equipment_id, None)
+                self._bitmaps.pop(equipment_id, None)
+                self._series.pop(equipment_id, None)
+
+    def add_reservation(self, reservation) -> None:
+        """
+        将预约计入索引
+        Record a reservation in the index
+        """
+        if reservation.status in ACTIVE_STATUSES:
+            self.add(reservation.equipment_id, reservation.start_datetime, reservation.end_datetime)
+
+    def remove_reservation(self, reservation) -> None:
+        """
+        从索引中移除预约
+        Remove a reservation from the index
+        """
+        self.remove(reservation.equipment_id, reservation.start_datetime, reservation.end_datetime)
+
+    def add(self, equipment_id: int, start_datetime: datetime, end_datetime: datetime) -> None:
+        """
+        增量标记占用（未加载的设备将在首次查询时从数据库加载）
+        Mark a range as occupied (equipment not loaded yet is read from the DB on first query)
+        """
+        with self._lock:
+            if equipment_id in self._days:
+                self._apply(equipment_id, start_datetime, end_datetime, 1)
+
+    def remove(self, equipment_id: int, start_datetime: datetime, end_datetime: datetime) -> None:
+        """
+        增量释放占用
+        Release an occupied range
+        """
+        with self._lock:
+            if equipment_id in self._days:
+                self._apply(equipment_id, start_datetime, end_datetime, -1)
+
+    def _apply(self, equipment_id: int, start_datetime: datetime, end_datetime: datetime, delta: int) -> None:
+        """
+        更新计数数组及独占设备的位图，调用方需持有锁
+        Update the count arrays and, for exclusive equipment, the bitmaps; caller must hold the lock
+        """
+        days = self._days[equipment_id]
+        bitmaps = self._bitmaps.get(equipment_id)
+
+        for day, first, stop in iter_day_slots(start_datetime, end_datetime):
+            counts = days.get(day)
+            if counts is None:
+                if delta < 0:
+                    continue
+                counts = days[day] = array('H', bytes(2 * SLOTS_PER_DAY))
+            for slot in range(first, stop):
+                counts[slot] = max(0, counts[slot] + delta)
+
+            if bitmaps is not None:
+                # 位图只反映计数是否大于0，与计数同步更新受影响的时间格
+                bitmap = bitmaps.get(day, 0) & ~slot_mask(first, stop)
+                for slot in range(first, stop):
+                    if counts[slot]:
+                        bitmap |= 1 << slot
+                if bitmap:
+                    bitmaps[day] = bitmap
+                else:
+                    bitmaps.pop(day, None)
+
+            if delta < 0 and not any(counts):
+                del days[day]
+
+    def _day_occupancy(self, equipment_id: int, day: date):
+        """
+        返回某天的占用（位图或计数），叠加循环预约尚未生成的发生，调用方需持有锁
+        Return a day's occupancy (bitmap or counts) with unmaterialized series occurrences
+        overlaid; caller must hold the lock
+        """
+        allow_simultaneous, _ = self._equipment[equipment_id]
+        if allow_simultaneous:
+            occupancy = self._days[equipment_id].get(day)
+        else:
+            occupancy = self._bitmaps[equipment_id].get(day)
+        rules = [rule for rule in self._series.get(equipment_id, ()) if rule.occurs_virtually_on(day)]
+        if not rules:
+            return occupancy
+
+        if allow_simultaneous:
+            occupancy = array('H', occupancy) if occupancy is not None else array('H', bytes(2 * SLOTS_PER_DAY))
+        else:
+            occupancy = occupancy or 0
+        for rule in rules:
+            for _, first, stop in iter_day_slots(*occurrence_bounds(rule, day)):
+                if allow_simultaneous:
+                    for slot in range(first, stop):
+                        occupancy[slot] += 1
+                else:
+                    occupancy |= slot_mask(first, stop)
+        return occupancy
+
+    def is_free(self, equipment_id: int, start_datetime: datetime, end_datetime: datetime) -> bool:
+        """
+        判断设备在指定时间段是否还有空余容量（需先调用ensure_loaded）
+        Whether the equipment has spare capacity in the range (call ensure_loaded first)
+        """
+        with self._lock:
+            if equipment_id not in self._equipment:
+                return False
+            allow_simultaneous, capacity = self._equipment[equipment_id]
+
+            for day, first, stop in iter_day_slots(start_datetime, end_datetime):
+                occupancy = self._day_occupancy(equipment_id, day)
+                if occupancy is None:
+                    continue
+                if allow_simultaneous:
+                    if max(occupancy[first:stop]) >= capacity:
+                        return False
+                elif occupancy & slot_mask(first, stop):
+                    return False
+            return True
+
+    def find_available(
+        self,
+        db: Session,
+        equipment_ids: List[int],
+        dates: List[date],
+        start_time: time,
+        end_time: time
+    ) -> List[int]:
+        """
+        返回在所有指定日期的[start_time, end_time)时间段内都可用的设备ID
+        Return equipment IDs that are free in [start_time, end_time) on every given date
+        """
+        self.ensure_loaded(db, equipment_ids)
+
+        first = (start_time.hour * 60 + start_time.minute) // SLOT_MINUTES
+        end_minutes = end_time.hour * 60 + end_time.minute + (1 if end_time.second else 0)
+        stop = -(-end_minutes // SLOT_MINUTES) if end_time != time.min else SLOTS_PER_DAY
+        if stop <= first:
+            return []
+        mask = slot_mask(first, stop)
+
+        available = []
+        with self._lock:
+            for equipment_id in equipment_ids:
+                if equipment_id not in self._equipment:
+                    continue
+                allow_simultaneous, capacity = self._equipment[equipment_id]
+                occupancies = [self._day_occupancy(equipment_id, day) for day in dates]
+
+                if allow_simultaneous:
+                    is_free = all(
+                        occupancy is None or max(occupancy[first:stop]) < capacity
+                        for occupancy in occupancies
+                    )
+                else:
+                    # 将所有日期的位图按位或后与查询掩码按位与
+                    combined = 0
+                    for occupancy in occupancies:
+                        combined |= occupancy or 0
+                    is_free = not (combined & mask)
+
+                if is_free:
+                    available.append(equipment_id)
+        return available
+
+    def stats(self) -> Dict[str, int]:
+        """
+        返回索引规模信息
+        Return index size information
+        """
+        with self._lock:
+            return {
+                "equipment": len(self._equipment),
+                "days": sum(len(days) for days in self._days.values())
+            }
+
+
+# 进程内共享的占用索引
+occupancy_index = OccupancyIndex()
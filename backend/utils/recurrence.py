@@ -0,0 +1,379 @@
+"""
+循环规则工具
+Recurrence rule utilities
+
+把循环预约（daily/weekly/monthly）转换为RFC 5545的RRULE，并把子预约整理为
+"主规则 + EXDATE + 例外子预约"的紧凑形式，供日历接口和ICS文件共用。
+
+Converts recurring reservations (daily/weekly/monthly) into RFC 5545 RRULEs and lays
+out their children as "master rule + EXDATE + exception children"; shared by the
+calendar API and the ICS files.
+
+与主规则完全一致的子预约（日期符合规则、时间和用户信息与主预约相同、状态在给定
+范围内）称为普通实例，由客户端按规则展开；规则日期上没有普通实例的记为EXDATE，
+其余子预约作为例外单独返回。
+
+Children that match the master exactly (date on the rule, same times and user fields,
+status in the given set) are plain instances the client expands from the rule; rule
+dates without a plain instance become EXDATEs, and every other child is returned on
+its own as an exception.
+
+子预约按滚动窗口生成：只生成到materialized_until为止，之后的发生日期是"虚拟"
+占用，冲突检查通过get_virtual_intervals把它们当作预约区间处理。
+
+Children are materialized over a rolling horizon: only up to materialized_until; later
+occurrences are "virtual" occupancy, which conflict checks treat as reservation
+intervals through get_virtual_intervals.
+"""
+import json
+import logging
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from sqlalchemy.orm import Session
+
+from config import RECURRING_HORIZON_WEEKS
+from backend.models.recurring_reservation import RecurringReservation
+from backend.utils.date_utils import get_weekday
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+# RFC 5545星期代码，下标与get_weekday一致（0表示周日）
+WEEKDAY_CODES = ["SU", "MO", "TU", "WE", "TH", "FR", "SA"]
+
+# 与主预约比较的子预约字段
+MASTER_FIELDS = ("user_name", "user_department", "user_contact", "user_email", "purpose")
+
+
+def parse_day_list(value: Any) -> List[int]:
+    """
+    解析days_of_week/days_of_month（JSON字符串或列表）
+    Parse days_of_week / days_of_month (JSON string or list)
+    """
+    if not value:
+        return []
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except (json.JSONDecodeError, TypeError):
+            logger.error(f"无法解析日期列表: {value}")
+            return []
+    return [int(day) for day in value]
+
+
+def format_datetime(value: datetime) -> str:
+    """
+    格式化为RFC 5545本地时间（不带时区后缀）
+    Format as an RFC 5545 local date-time (no zone suffix)
+    """
+    return value.strftime("%Y%m%dT%H%M%S")
+
+
+def iter_occurrence_dates(
+    recurring_reservation,
+    from_date: Optional[date] = None,
+    to_date: Optional[date] = None
+) -> Iterator[date]:
+    """
+    按循环规则依次返回发生日期，可限制在[from_date, to_date]范围内
+    Yield the dates the rule occurs on, optionally limited to [from_date, to_date]
+
+    custom模式没有可展开的规则，不返回任何日期。
+    The custom pattern has no expandable rule and yields nothing.
+    """
+    pattern_type = recurring_reservation.pattern_type
+    days_of_week = parse_day_list(recurring_reservation.days_of_week)
+    days_of_month = parse_day_list(recurring_reservation.days_of_month)
+
+    current_date = recurring_reservation.start_date
+    end_date = recurring_reservation.end_date
+    if from_date and from_date > current_date:
+        current_date = from_date
+    if to_date and to_date < end_date:
+        end_date = to_date
+
+    while current_date <= end_date:
+        if pattern_type == "daily":
+            yield current_date
+        elif pattern_type == "weekly":
+            # 检查当前日期是否是指定的星期几
+            if get_weekday(current_date) in days_of_week:
+                yield current_date
+        elif pattern_type == "monthly":
+            # 检查当前日期是否是指定的月份日期
+            if current_date.day in days_of_month:
+                yield current_date
+        current_date += timedelta(days=1)
+
+
+def horizon_date(today: Optional[date] = None) -> date:
+    """
+    返回滚动窗口的截止日期（今天起RECURRING_HORIZON_WEEKS周）
+    Return the last date of the rolling horizon (RECURRING_HORIZON_WEEKS weeks from today)
+    """
+    return (today or datetime.now().date()) + timedelta(weeks=RECURRING_HORIZON_WEEKS)
+
+
+def unmaterialized_from(recurring_reservation) -> Optional[date]:
+    """
+    返回第一个尚未生成子预约的日期，已全部生成时返回None
+    Return the first date without materialized children, or None when fully materialized
+    """
+    materialized_until = recurring_reservation.materialized_until
+    if materialized_until is None or materialized_until >= recurring_reservation.end_date:
+        return None
+    return max(recurring_reservation.start_date, materialized_until + timedelta(days=1))
+
+
+class SeriesRule:
+    """
+    循环规则快照，不依赖数据库会话，供占用索引缓存
+    Snapshot of a series rule, detached from the session so the occupancy index can cache it
+    """
+
+    def __init__(self, recurring_reservation):
+        self.id = recurring_reservation.id
+        self.equipment_id = recurring_reservation.equipment_id
+        self.pattern_type = recurring_reservation.pattern_type
+        self.days_of_week = parse_day_list(recurring_reservation.days_of_week)
+        self.days_of_month = parse_day_list(recurring_reservation.days_of_month)
+        self.start_date = recurring_reservation.start_date
+        self.end_date = recurring_reservation.end_date
+        self.start_time = recurring_reservation.start_time
+        self.end_time = recurring_reservation.end_time
+        self.materialized_until = recurring_reservation.materialized_until
+
+    def occurs_virtually_on(self, day: date) -> bool:
+        """
+        该日期是否有尚未生成的发生
+        Whether an unmaterialized occurrence falls on the day
+        """
+        first = unmaterialized_from(self)
+        if first is None or not first <= day <= self.end_date:
+            return False
+        if self.pattern_type == "daily":
+            return True
+        if self.pattern_type == "weekly":
+            return get_weekday(day) in self.days_of_week
+        if self.pattern_type == "monthly":
+            return day.day in self.days_of_month
+        return False
+
+
+def iter_virtual_intervals(
+    recurring_reservation,
+    start_datetime: datetime,
+    end_datetime: datetime
+) -> Iterator[Tuple[datetime, datetime]]:
+    """
+    返回与[start_datetime, end_datetime)重叠的未生成发生区间
+    Yield the unmaterialized occurrences overlapping [start_datetime, end_datetime)
+    """
+    first = unmaterialized_from(recurring_reservation)
+    if first is None:
+        return
+    from_date = max(first, start_datetime.date())
+    for occurrence_date in iter_occurrence_dates(recurring_reservation, from_date, end_datetime.date()):
+        start, end = occurrence_bounds(recurring_reservation, occurrence_date)
+        if start < end_datetime and end > start_datetime:
+            yield start, end
+
+
+def query_unmaterialized_series(db: Session, equipment_ids: Optional[Iterable[int]] = None):
+    """
+    查询仍有未生成发生日期的有效循环预约，可限制设备
+    Query active series that still have unmaterialized occurrences, optionally per equipment
+    """
+    query = db.query(RecurringReservation).filter(
+        RecurringReservation.status == "active",
+        RecurringReservation.materialized_until.isnot(None),
+        RecurringReservation.materialized_until < RecurringReservation.end_date
+    )
+    if equipment_ids is not None:
+        query = query.filter(RecurringReservation.equipment_id.in_(list(equipment_ids)))
+    return query
+
+
+def get_virtual_intervals(
+    db: Session,
+    equipment_ids: Iterable[int],
+    start_datetime: datetime,
+    end_datetime: datetime,
+    exclude_recurring_reservation_id: Optional[int] = None
+) -> Dict[int, List[Tuple[datetime, datetime]]]:
+    """
+    查询设备在时间段内的虚拟占用区间（循环预约尚未生成的发生）
+    Fetch virtual occupancy (unmaterialized series occurrences) of the equipment in the range
+
+    返回值：设备ID -> [(开始, 结束)]
+    Returns: equipment id -> [(start, end)]
+    """
+    query = query_unmaterialized_series(db, equipment_ids).filter(
+        RecurringReservation.materialized_until < end_datetime.date(),
+        RecurringReservation.end_date >= start_datetime.date()
+    )
+    if exclude_recurring_reservation_id:
+        query = query.filter(RecurringReservation.id != exclude_recurring_reservation_id)
+
+    intervals: Dict[int, List[Tuple[datetime, datetime]]] = {}
+    for recurring_reservation in query.all():
+        occurrences = list(iter_virtual_intervals(recurring_reservation, start_datetime, end_datetime))
+        if occurrences:
+            intervals.setdefault(recurring_reservation.equipment_id, []).extend(occurrences)
+    return intervals
+
+
+def occurrence_bounds(recurring_reservation, occurrence_date: date) -> Tuple[datetime, datetime]:
+    """
+    返回某个发生日期的开始和结束时间
+    Return the start and end datetimes of an occurrence
+    """
+    return (
+        datetime.combine(occurrence_date, recurring_reservation.start_time),
+        datetime.combine(occurrence_date, recurring_reservation.end_time)
+    )
+
+
+def build_rrule(recurring_reservation, until_date: Optional[date] = None) -> Optional[str]:
+    """
+    生成RRULE，custom模式返回None
+    Build the RRULE; returns None for the custom pattern
+    """
+    until_date = until_date or recurring_reservation.end_date
+    until = format_datetime(datetime.combine(until_date, recurring_reservation.start_time))
+    pattern_type = recurring_reservation.pattern_type
+
+    if pattern_type == "daily":
+        return f"FREQ=DAILY;UNTIL={until}"
+    if pattern_type == "weekly":
+        days = sorted(set(parse_day_list(recurring_reservation.days_of_week)))
+        byday = ",".join(WEEKDAY_CODES[day] for day in days if 0 <= day <= 6)
+        return f"FREQ=WEEKLY;BYDAY={byday};UNTIL={until}" if byday else None
+    if pattern_type == "monthly":
+        days = sorted(set(parse_day_list(recurring_reservation.days_of_month)))
+        bymonthday = ",".join(str(day) for day in days if 1 <= day <= 31)
+        return f"FREQ=MONTHLY;BYMONTHDAY={bymonthday};UNTIL={until}" if bymonthday else None
+    return None
+
+
+def is_plain_instance(recurring_reservation, reservation, statuses: Sequence[str]) -> bool:
+    """
+    判断子预约是否与主预约完全一致，可由规则展开
+    Whether a child matches its master exactly and can be expanded from the rule
+    """
+    if reservation.status not in statuses or reservation.is_exception:
+        return False
+    if reservation.equipment_id != recurring_reservation.equipment_id:
+        return False
+    if reservation.reservation_code != recurring_reservation.reservation_code:
+        return False
+    start, end = occurrence_bounds(recurring_reservation, reservation.start_datetime.date())
+    if reservation.start_datetime != start or reservation.end_datetime != end:
+        return False
+    return all(
+        getattr(reservation, field) == getattr(recurring_reservation, field)
+        for field in MASTER_FIELDS
+    )
+
+
+def build_series_layout(
+    recurring_reservation,
+    children: Iterable,
+    statuses: Sequence[str],
+    range_start: Optional[datetime] = None,
+    range_end: Optional[datetime] = None
+) -> Tuple[Optional[Dict[str, Any]], List[Any]]:
+    """
+    将子预约整理为紧凑的系列表示
+    Lay out children as a compact series
+
+    statuses为可以作为普通实例的状态。返回值：(系列, 例外子预约)，例外子预约为范围内
+    所有非普通实例的子预约，由调用方按需要的状态过滤。系列为None表示范围内没有普通实例。
+    statuses are the statuses a plain instance may have. Returns (series, exception
+    children): every non-plain child within the range, for the caller to filter by status.
+    series is None when no plain instance falls within the range.
+
+    系列包含：
+    - dtstart: 范围内第一个普通实例的开始时间
+    - rrule: 截止到范围内最后一个普通实例的RRULE
+    - exdate: 规则日期中没有普通实例的开始时间
+    - instances: 普通实例开始时间 -> (预约ID, 预约序号)，客户端操作单个实例时使用；
+      尚未生成的实例为(None, None)
+
+    The series holds:
+    - dtstart: start of the first plain instance in range
+    - rrule: the RRULE, ending at the last plain instance in range
+    - exdate: starts of rule dates without a plain instance
+    - instances: plain instance start -> (reservation id, number), used by the client to
+      act on a single instance; (None, None) for unmaterialized instances
+    """
+    def in_range(start: datetime, end: datetime) -> bool:
+        return (range_start is None or start >= range_start) and (range_end is None or end <= range_end)
+
+    # 每个规则日期上的普通实例
+    plain = {}
+    exceptions = []
+    for reservation in children:
+        occurrence_date = reservation.start_datetime.date()
+        if (
+            occurrence_date not in plain
+            and is_plain_instance(recurring_reservation, reservation, statuses)
+            and recurring_reservation.start_date <= occurrence_date <= recurring_reservation.end_date
+        ):
+            plain[occurrence_date] = reservation
+        elif in_range(reservation.start_datetime, reservation.end_datetime):
+            exceptions.append(reservation)
+
+    from_date = range_start.date() if range_start else None
+    to_date = range_end.date() if range_end else None
+    rule_dates = [
+        occurrence_date
+        for occurrence_date in iter_occurrence_dates(recurring_reservation, from_date, to_date)
+        if in_range(*occurrence_bounds(recurring_reservation, occurrence_date))
+    ]
+    # 不在规则日期上的普通实例（例如规则修改前生成的）作为例外返回
+    rule_date_set = set(rule_dates)
+    for occurrence_date, reservation in list(plain.items()):
+        if occurrence_date not in rule_date_set:
+            del plain[occurrence_date]
+            if in_range(reservation.start_datetime, reservation.end_datetime):
+                exceptions.append(reservation)
+
+    # 尚未生成的发生日期同样由规则展开，这些实例没有预约ID和序号
+    virtual_from = unmaterialized_from(recurring_reservation) if recurring_reservation.status == "active" else None
+    if virtual_from is not None:
+        for occurrence_date in rule_dates:
+            if occurrence_date >= virtual_from and occurrence_date not in plain:
+                plain[occurrence_date] = None
+
+    plain_dates = [occurrence_date for occurrence_date in rule_dates if occurrence_date in plain]
+    if not plain_dates:
+        return None, exceptions
+
+    first_date, last_date = plain_dates[0], plain_dates[-1]
+    rrule = build_rrule(recurring_reservation, last_date)
+    if rrule is None:
+        # 没有可展开的规则，全部作为例外返回
+        return None, exceptions + [plain[occurrence_date] for occurrence_date in plain_dates]
+
+    def start_of(occurrence_date: date) -> str:
+        return format_datetime(occurrence_bounds(recurring_reservation, occurrence_date)[0])
+
+    series = {
+        "dtstart": start_of(first_date),
+        "rrule": rrule,
+        "exdate": [
+            start_of(occurrence_date)
+            for occurrence_date in rule_dates
+            if first_date <= occurrence_date <= last_date and occurrence_date not in plain
+        ],
+        "instances": {
+            start_of(occurrence_date): (
+                [plain[occurrence_date].id, plain[occurrence_date].reservation_number]
+                if plain[occurrence_date] is not None else [None, None]
+            )
+            for occurrence_date in plain_dates
+        },
+    }
+    return series, exceptions
@@ -0,0 +1,161 @@
+"""
+预约冷热分离归档
+Hot/cold reservation archival
+
+结束超过RESERVATION_ARCHIVE_AFTER_DAYS天的已过期/已取消预约连同历史记录分批移入
+reservation_archive / reservation_history_archive，reservation表只保留仍可能被
+重叠检查、状态扫描和日常列表用到的预约。列表和查询接口只在请求的范围可能包含
+归档数据时才查询归档表。
+
+Expired/cancelled reservations that ended more than RESERVATION_ARCHIVE_AFTER_DAYS days
+ago are moved in batches, together with their history, into reservation_archive /
+reservation_history_archive, so the reservation table only holds rows that overlap checks,
+status scans and day-to-day listings can still touch. Listing and lookup APIs only read
+the archive when the requested range may contain archived rows.
+"""
+import logging
+from datetime import date, datetime, timedelta
+from typing import Optional, Set
+
+from sqlalchemy import delete, func, insert, literal, select, text
+from sqlalchemy.orm import Session
+
+from config import RESERVATION_ARCHIVE_AFTER_DAYS, RESERVATION_ARCHIVE_BATCH_SIZE
+from backend.database import begin_immediate
+from backend.models.reservation import Reservation
+from backend.models.reservation_history import ReservationHistory
+from backend.models.reservation_archive import ReservationArchive, ReservationHistoryArchive
+from backend.utils.db_utils import get_beijing_now
+from backend.utils.reservation_lookup import invalidate_reservation_codes
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+# 可以归档的预约状态
+ARCHIVE_STATUSES = ("expired", "cancelled")
+
+# 两张表共有的列
+RESERVATION_COLUMNS = [column.name for column in Reservation.__table__.columns]
+HISTORY_COLUMNS = [column.name for column in ReservationHistory.__table__.columns if column.name != "id"]
+
+
+def archive_cutoff(now: Optional[datetime] = None) -> datetime:
+    """
+    返回归档截止时间，结束时间早于该时间的已过期/已取消预约会被归档
+    Return the archive cutoff; expired/cancelled reservations ending before it are archived
+    """
+    return (now or datetime.now()) - timedelta(days=RESERVATION_ARCHIVE_AFTER_DAYS)
+
+
+def needs_archive(from_date: Optional[datetime] = None, status: Optional[str] = None) -> bool:
+    """
+    判断按开始时间下限和状态筛选的查询是否可能包含归档数据
+    Whether a query filtered by a start-time lower bound and a status may match archived rows
+    """
+    if status and status not in ARCHIVE_STATUSES:
+        return False
+    # 归档预约的结束时间都早于截止时间，开始时间不早于截止时间的查询不会包含它们
+    return from_date is None or from_date < archive_cutoff()
+
+
+def get_archived_child_dates(db: Session, recurring_reservation_id: int, from_date: Optional[date] = None) -> Set[date]:
+    """
+    返回循环预约已归档的子预约日期，同步子预约时这些日期不能被重新生成
+    Return the dates of a series' archived children; syncing must not recreate them
+    """
+    if from_date is not None and datetime.combine(from_date, datetime.min.time()) >= archive_cutoff():
+        return set()
+    query = db.query(func.date(ReservationArchive.start_datetime)).filter(
+        ReservationArchive.recurring_reservation_id == recurring_reservation_id
+    )
+    if from_date is not None:
+        query = query.filter(ReservationArchive.start_datetime >= datetime.combine(from_date, datetime.min.time()))
+    return {date.fromisoformat(row[0]) for row in query.all()}
+
+
+def ids_never_reused(db: Session) -> bool:
+    """
+    判断预约ID是否不会被重新分配：SQLite需要为reservation表启用AUTOINCREMENT，否则新预约可能
+    复用已归档预约的ID（运行migrations/add_reservation_autoincrement.py启用）
+    Whether reservation ids are never handed out again: on SQLite the reservation table needs
+    AUTOINCREMENT, otherwise new reservations may reuse archived ids (enable it with
+    migrations/add_reservation_autoincrement.py)
+    """
+    if db.get_bind().dialect.name != "sqlite":
+        return True
+    table_sql = db.execute(
+        text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'reservation'")
+    ).scalar()
+    return bool(table_sql) and "AUTOINCREMENT" in table_sql.upper()
+
+
+def archive_reservations(
+    db: Session,
+    cutoff: Optional[datetime] = None,
+    batch_size: int = RESERVATION_ARCHIVE_BATCH_SIZE,
+    max_batches: Optional[int] = None
+) -> int:
+    """
+    分批归档结束时间早于cutoff的已过期/已取消预约及其历史记录，返回归档数量
+    Archive expired/cancelled reservations ending before cutoff, with their history, in
+    batches; returns the number archived
+
+    每批在一个写事务中完成：INSERT ... SELECT复制到归档表，再删除原记录，批与批之间
+    释放写锁，不会长时间阻塞预约写入。归档不写删除记录：这些预约不在日历中显示。
+    Each batch is one write transaction: copy with INSERT ... SELECT, then delete the hot
+    rows; the write lock is released between batches so bookings are never blocked for
+    long. No tombstones are written, since archived statuses are not shown in calendars.
+
+    预约ID可能被重新分配时（reservation表没有AUTOINCREMENT）不归档，避免ID冲突。
+    Nothing is archived while reservation ids can be reused (no AUTOINCREMENT on the
+    reservation table), to avoid id conflicts.
+    """
+    if not ids_never_reused(db):
+        db.rollback()
+        logger.warning("reservation表未启用AUTOINCREMENT，跳过归档；请运行migrations/add_reservation_autoincrement.py")
+        return 0
+
+    cutoff = cutoff or archive_cutoff()
+    archived = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        try:
+            begin_immediate(db)
+            rows = db.query(Reservation.id, Reservation.reservation_code).filter(
+                Reservation.status.in_(ARCHIVE_STATUSES),
+                Reservation.end_datetime < cutoff
+            ).order_by(Reservation.id).limit(batch_size).all()
+            if not rows:
+                db.rollback()
+                break
+
+            ids = [row.id for row in rows]
+            archived_at = get_beijing_now()
+            db.execute(insert(ReservationArchive).from_select(
+                RESERVATION_COLUMNS + ["archived_at"],
+                select(*[getattr(Reservation, name) for name in RESERVATION_COLUMNS], literal(archived_at)).where(
+                    Reservation.id.in_(ids)
+                )
+            ))
+            db.execute(insert(ReservationHistoryArchive).from_select(
+                HISTORY_COLUMNS,
+                select(*[getattr(ReservationHistory, name) for name in HISTORY_COLUMNS]).where(
+                    ReservationHistory.reservation_id.in_(ids)
+                ).order_by(ReservationHistory.id)
+            ))
+            db.execute(delete(ReservationHistory).where(ReservationHistory.reservation_id.in_(ids)))
+            db.execute(delete(Reservation).where(Reservation.id.in_(ids)))
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.error(f"归档预约失败: {str(e)}")
+            raise
+
+        # 失效这些预约码的查询缓存
+        invalidate_reservation_codes(*{row.reservation_code for row in rows})
+        archived += len(ids)
+        batches += 1
+        logger.info(f"已归档 {len(ids)} 个预约（累计 {archived}）")
+        if len(ids) < batch_size:
+            break
+    return archived
@@ -0,0 +1,341 @@
+"""
+预约查询解析
+Reservation lookup resolver
+
+预约码/预约序号到预约（或循环预约系列）的解析集中在这里，用一条连接查询完成：
+预约序号匹配、预约码匹配、设备信息和循环预约ID一次取回，再按
+"序号匹配 > 日期匹配 > 同星期几 > 已确认 > 开始时间" 排序取第一条。
+
+Resolving a reservation code/number to a reservation (or a recurring series) lives here
+and takes one joined query: number matches, code matches, the equipment and the series
+ID come back together, ordered "number match > date match > same weekday > confirmed >
+start time" and the first row wins.
+
+"查看我的预约"页面的序列化结果缓存在进程内的LRU中，预约新增/修改/删除时按预约码
+失效，设备修改时整体清空；TTL兜底其他进程的写入。
+Serialized results for the "view my booking" page are kept in a per-process LRU,
+invalidated by reservation code on insert/update/delete and cleared on equipment
+updates; the TTL bounds staleness from writes made by other processes.
+"""
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import date
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Set, Tuple, Union
+
+from sqlalchemy import Integer, case, event, literal, or_, select, func
+from sqlalchemy.orm import Session, contains_eager, joinedload
+
+from config import RESERVATION_LOOKUP_CACHE_SIZE, RESERVATION_LOOKUP_CACHE_TTL
+from backend.models.equipment import Equipment
+from backend.models.recurring_reservation import RecurringReservation
+from backend.models.reservation import Reservation
+from backend.models.reservation_archive import ReservationArchive
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+# 会话中待提交后再次失效的预约码
+SESSION_CODES_KEY = "reservation_lookup_codes"
+
+
+class LookupCache:
+    """
+    带TTL的LRU缓存，按预约码反向索引以便精确失效
+    LRU cache with a TTL and a reverse index by reservation code for targeted invalidation
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, Tuple[float, Set[str], Any]]" = OrderedDict()
+        self._by_code: Dict[str, Set[Hashable]] = {}
+        self._lock = threading.Lock()
+        # 每次失效递增，查询开始后发生过失效的结果不写入缓存
+        self._generation = 0
+
+    @property
+    def generation(self) -> int:
+        return self._generation
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                self._discard(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[2]
+
+    def put(self, key: Hashable, codes: Iterable[str], value: Any, generation: int):
+        codes = {code for code in codes if code}
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._discard(key)
+            self._entries[key] = (time.monotonic() + self.ttl, codes, value)
+            for code in codes:
+                self._by_code.setdefault(code, set()).add(key)
+            while len(self._entries) > self.max_size:
+                self._discard(next(iter(self._entries)))
+
+    def invalidate_codes(self, codes: Iterable[str]):
+        with self._lock:
+            self._generation += 1
+            for code in codes:
+                for key in self._by_code.pop(code, ()):
+                    self._discard(key)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._by_code.clear()
+
+    def _discard(self, key: Hashable):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for code in entry[1]:
+            keys = self._by_code.get(code)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_code[code]
+
+
+lookup_cache = LookupCache(RESERVATION_LOOKUP_CACHE_SIZE, RESERVATION_LOOKUP_CACHE_TTL)
+
+
+def invalidate_reservation_codes(*codes: Optional[str]):
+    """
+    使预约码相关的查询缓存失效，用于绕过ORM的批量更新/删除
+    Invalidate cached lookups for reservation codes; used after bulk updates/deletes that
+    bypass the ORM
+    """
+    lookup_cache.invalidate_codes(code for code in codes if code)
+
+
+def normalize_reservation_number(reservation_number: Optional[Any]) -> Optional[str]:
+    """
+    规范化前端传来的预约序号：兼容JSON包装的值，忽略只含时间戳_t的对象
+    Normalize a reservation number sent by the frontend: unwrap JSON-wrapped values and
+    ignore objects that only carry the _t cache-buster
+    """
+    if reservation_number is None:
+        return None
+    if isinstance(reservation_number, str) and reservation_number.startswith(("{", "[")):
+        try:
+            parsed = json.loads(reservation_number)
+        except json.JSONDecodeError:
+            logger.warning(f"无法解析JSON格式的预约序号: {reservation_number}")
+            parsed = None
+        if isinstance(parsed, dict):
+            if "reservation_number" in parsed:
+                reservation_number = parsed["reservation_number"]
+            elif "$oid" in parsed:
+                reservation_number = parsed["$oid"]
+            elif "_t" in parsed and len(parsed) == 1:
+                return None
+    if reservation_number is None:
+        return None
+    reservation_number = str(reservation_number).strip()
+    return reservation_number or None
+
+
+def _candidate_numbers(reservation_code: Optional[str], reservation_number: Optional[str]) -> List[str]:
+    numbers = []
+    if reservation_number:
+        numbers.append(reservation_number)
+    # 预约码本身是预约序号格式时也按序号匹配
+    if reservation_code and reservation_code.startswith("RN-") and reservation_code not in numbers:
+        numbers.append(reservation_code)
+    return numbers
+
+
+def resolve_reservation(
+    db: Session,
+    reservation_code: Optional[str],
+    reservation_number: Optional[str] = None,
+    target_date: Optional[date] = None,
+    exact: bool = False
+) -> Tuple[Optional[Union[Reservation, ReservationArchive]], Optional[int]]:
+    """
+    用一条查询解析预约码/预约序号，返回 (预约, 循环预约ID)
+
+    - 预约序号匹配时返回该预约，循环预约ID为其所属系列（如有）
+    - 预约码属于循环预约且序号未匹配时返回 (None, 循环预约ID)，由调用方跳转到系列
+    - 否则返回预约码下最匹配的预约，均未找到时返回 (None, None)
+
+    exact用于修改/取消：提供了预约序号时必须匹配该序号，未提供时循环预约也返回
+    排序最前的子预约而不是系列。
+
+    热表中找不到时才查询归档表，返回只读的ReservationArchive。返回的预约已加载equipment关系。
+
+    Resolve a reservation code/number with a single query, returning
+    (reservation, recurring_id):
+
+    - a number match returns that reservation plus its series ID, if any
+    - a series code without a number match returns (None, recurring_id) so the caller
+      can redirect to the series
+    - otherwise the best-ranked reservation for the code, or (None, None)
+
+    exact is for update/cancel paths: a given number must match, and without a number a
+    series code yields its best-ranked child instead of the series.
+
+    The archive is only read when the hot table has no match, returning a read-only
+    ReservationArchive. The returned reservation has its equipment relationship loaded.
+    """
+    numbers = _candidate_numbers(reservation_code, reservation_number)
+    conditions = _match_conditions(Reservation, reservation_code, numbers)
+    if not conditions:
+        return None, None
+
+    if reservation_code:
+        recurring_id = select(RecurringReservation.id).where(
+            RecurringReservation.reservation_code == reservation_code
+        ).limit(1).scalar_subquery()
+    else:
+        recurring_id = literal(None, Integer)
+
+    # 以单行锚点外连接预约，预约码只属于尚无子预约的系列时也能在同一条查询中取回系列ID
+    anchor = select(literal(1).label("anchor")).subquery()
+    row = db.query(Reservation, recurring_id.label("recurring_id")).select_from(anchor).outerjoin(
+        Reservation, or_(*conditions)
+    ).outerjoin(Reservation.equipment).options(
+        contains_eager(Reservation.equipment)
+    ).order_by(*_ranking(Reservation, numbers, target_date)).first()
+
+    reservation, series_id = (row[0], row[1]) if row is not None else (None, None)
+    number_matched = reservation is not None and reservation.reservation_number in numbers
+    if exact:
+        # 修改/取消只作用于热表中的预约
+        if reservation_number and not number_matched:
+            return None, None
+    elif (reservation_number and not number_matched) or (reservation is None and series_id is None):
+        # 热表中没有匹配时才查询归档表：序号未匹配时只按序号查，什么都没找到时按相同条件查
+        archive_code = reservation_code if reservation is None and series_id is None else None
+        archive_conditions = _match_conditions(ReservationArchive, archive_code, numbers)
+        archived = db.query(ReservationArchive).options(joinedload(ReservationArchive.equipment)).filter(
+            or_(*archive_conditions)
+        ).order_by(*_ranking(ReservationArchive, numbers, target_date)).first()
+        if archived is not None:
+            return archived, series_id or archived.recurring_reservation_id
+
+    if not exact and series_id is not None and not number_matched:
+        return None, series_id
+    if reservation is None:
+        return None, series_id
+    return reservation, series_id or reservation.recurring_reservation_id
+
+
+def _match_conditions(model, reservation_code: Optional[str], numbers: List[str]) -> list:
+    conditions = []
+    if numbers:
+        conditions.append(model.reservation_number.in_(numbers))
+    if reservation_code:
+        conditions.append(model.reservation_code == reservation_code)
+    return conditions
+
+
+def _ranking(model, numbers: List[str], target_date: Optional[date]) -> list:
+    """序号匹配 > 日期匹配 > 同星期几 > 已确认 > 开始时间"""
+    ordering = []
+    if numbers:
+        ordering.append(case((model.reservation_number.in_(numbers), 0), else_=1))
+    if target_date is not None:
+        ordering.append(case((func.date(model.start_datetime) == target_date.isoformat(), 0), else_=1))
+        # SQLite的%w与Python一致，周日为0
+        ordering.append(case((func.strftime("%w", model.start_datetime) == target_date.strftime("%w"), 0), else_=1))
+    ordering.append(case((model.status == "confirmed", 0), else_=1))
+    ordering.append(model.start_datetime)
+    return ordering
+
+
+def serialize_reservation(reservation: Union[Reservation, ReservationArchive], recurring_id: Optional[int] = None) -> Dict[str, Any]:
+    """
+    将预约序列化为"查看预约"页面使用的字典，附带设备信息
+    Serialize a reservation for the "view my booking" page, including equipment fields
+    """
+    data = {column.name: getattr(reservation, column.name) for column in Reservation.__table__.columns}
+    if isinstance(reservation, ReservationArchive):
+        data["is_archived"] = True
+    equipment = reservation.equipment
+    data["equipment_name"] = equipment.name if equipment else None
+    data["equipment_category"] = equipment.category if equipment else None
+    data["equipment_location"] = equipment.location if equipment else None
+    if recurring_id is not None:
+        data["is_child_of_recurring"] = True
+        data["recurring_id"] = recurring_id
+    return data
+
+
+def lookup_reservation(
+    db: Session,
+    reservation_code: Optional[str],
+    reservation_number: Optional[str] = None,
+    target_date: Optional[date] = None
+) -> Optional[Dict[str, Any]]:
+    """
+    带缓存的预约查询，返回序列化结果：
+    {"is_recurring": True, "recurring_id": ...} 表示预约码属于循环预约系列，
+    {"is_recurring": False, "reservation": {...}} 表示找到预约，未找到时返回None。
+    返回值为缓存共享对象，调用方修改前需复制。
+
+    Cached reservation lookup returning a serialized result:
+    {"is_recurring": True, "recurring_id": ...} for a series code,
+    {"is_recurring": False, "reservation": {...}} for a reservation, None when not found.
+    The result is shared with the cache; callers must copy before mutating.
+    """
+    key = (reservation_code, reservation_number, target_date)
+    cached = lookup_cache.get(key)
+    if cached is not None:
+        return cached
+
+    generation = lookup_cache.generation
+    reservation, recurring_id = resolve_reservation(db, reservation_code, reservation_number, target_date)
+    if reservation is None and recurring_id is None:
+        return None
+
+    if reservation is None:
+        result = {"is_recurring": True, "recurring_id": recurring_id}
+        codes = [reservation_code]
+    else:
+        result = {"is_recurring": False, "reservation": serialize_reservation(reservation, recurring_id)}
+        codes = [reservation_code, reservation.reservation_code]
+    lookup_cache.put(key, codes, result, generation)
+    return result
+
+
+@event.listens_for(Reservation, "after_insert")
+@event.listens_for(Reservation, "after_update")
+@event.listens_for(Reservation, "after_delete")
+def _invalidate_reservation(mapper, connection, target):
+    """预约新增/修改/删除时失效其预约码，提交后再失效一次，避免其他会话在提交前读到旧数据写入缓存"""
+    lookup_cache.invalidate_codes([target.reservation_code])
+    session = Session.object_session(target)
+    if session is not None:
+        session.info.setdefault(SESSION_CODES_KEY, set()).add(target.reservation_code)
+
+
+@event.listens_for(Equipment, "after_update")
+@event.listens_for(Equipment, "after_delete")
+def _invalidate_equipment(mapper, connection, target):
+    """设备信息变化时清空缓存"""
+    lookup_cache.clear()
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_committed(session):
+    codes = session.info.pop(SESSION_CODES_KEY, None)
+    if codes:
+        lookup_cache.invalidate_codes(codes)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_pending(session):
+    session.info.pop(SESSION_CODES_KEY, None)
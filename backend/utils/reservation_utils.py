@@ -12,20 +12,27 @@ from datetime import datetime
 # 导入配置
 from config import BASE_DIR
 from backend.database import get_db
-from backend.utils.email_sender import send_reservation_confirmation
+from backend.utils.email_sender import send_reservation_confirmation, send_batch_reservation_confirmation
+from backend.utils.ics import write_ics_file
 
 # 设置日志
 logger = logging.getLogger(__name__)
 
 def update_ics_for_reservation(db: Session, reservation) -> None:
     """
-    为预约更新ICS文件
-    Update ICS file for reservation
+    为预约更新ICS文件（按预约码，循环预约的所有子预约共用一个文件）
+    Update ICS file for reservation (per reservation code; a recurring series shares one file)
+    """
+    update_ics_for_code(db, reservation.reservation_code)
+
+def update_ics_for_code(db: Session, reservation_code: str) -> None:
+    """
+    为预约码更新ICS文件
+    Update ICS file for a reservation code
     """
     try:
-        # 实现ICS文件生成的逻辑
-        # 但由于这是一个模拟功能，所以只记录日志
-        logger.info(f"更新ICS文件: 预约ID={reservation.id}")
+        url = write_ics_file(db, reservation_code)
+        logger.info(f"更新ICS文件: 预约码={reservation_code}, 文件={url}")
     except Exception as e:
         logger.error(f"更新ICS文件失败: {str(e)}")
 
@@ -127,6 +134,78 @@ def send_reservation_confirmation_email(reservation) -> None:
     except Exception as e:
         logger.error(f"发送预约确认邮件失败: {str(e)}")
 
+def send_batch_confirmation_email(reservations, lang: str = "zh_CN") -> None:
+    """
+    为批量预约发送一封确认邮件，逐项列出每个预约的预约码、设备和起止时间
+    Send one confirmation email for a batch of reservations, listing each reservation's
+    code, equipment and start/end time
+    """
+    db = None
+    try:
+        if not reservations:
+            return
+
+        first = reservations[0]
+        logger.info(f"发送批量预约确认邮件: 预约序号={first.reservation_number}, 数量={len(reservations)}, 邮箱={first.user_email}")
+
+        # 如果没有邮箱，就不发送
+        if not first.user_email:
+            logger.warning(f"批量预约{first.reservation_number}没有提供邮箱，无法发送确认邮件")
+            return
+
+        # 获取数据库会话
+        db = next(get_db())
+
+        items = [
+            {
+                "reservation_code": reservation.reservation_code,
+                "reservation_number": reservation.reservation_number,
+                "equipment_name": reservation.equipment.name if reservation.equipment else "",
+                "location": reservation.equipment.location if reservation.equipment else "",
+                "start_datetime": reservation.start_datetime.strftime("%Y-%m-%d %H:%M"),
+                "end_datetime": reservation.end_datetime.strftime("%Y-%m-%d %H:%M")
+            }
+            for reservation in reservations
+        ]
+
+        # 各预约的日期和时间可能不同，由批量模板逐项列出；预约码和序号汇总后记录到邮件日志
+        reservation_data = {
+            "reservation_code": "、".join(item["reservation_code"] for item in items),
+            "reservation_number": f"{items[0]['reservation_number']} ~ {items[-1]['reservation_number']}" if len(items) > 1 else items[0]["reservation_number"],
+            "user_name": first.user_name,
+            "purpose": first.purpose or "",
+            "site_url": "http://localhost:8000",  # 应该从配置中获取
+            "status": "已确认 / Confirmed",
+            "items": items
+        }
+
+        # 创建异步事件循环
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+
+        result = loop.run_until_complete(
+            send_batch_reservation_confirmation(
+                to_email=first.user_email,
+                reservation_data=reservation_data,
+                lang=lang,
+                db=db
+            )
+        )
+
+        # 关闭事件循环
+        loop.close()
+
+        if result:
+            logger.info(f"批量预约确认邮件发送成功: 预约序号={first.reservation_number}")
+        else:
+            logger.error(f"批量预约确认邮件发送失败: 预约序号={first.reservation_number}")
+
+    except Exception as e:
+        logger.error(f"发送批量预约确认邮件失败: {str(e)}")
+    finally:
+        if db is not None:
+            db.close()
+
 def send_reservation_cancel_email(reservation) -> None:
     """
     发送预约取消邮件
@@ -0,0 +1,73 @@
+"""
+启动耗时统计
+Startup timing
+
+记录应用启动各阶段（模块导入、路由注册、数据库检查等）的耗时，启动完成后输出一份
+按耗时排序的报告，用于排查冷启动变慢的原因。
+
+Records how long each startup stage takes (module imports, router registration, the
+database check, ...) and logs a report sorted by duration once startup completes, to
+track down cold-start regressions.
+"""
+import time
+import logging
+import importlib
+from contextlib import contextmanager
+from types import ModuleType
+from typing import Iterator, List, Tuple
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+
+class StartupTimer:
+    """
+    启动阶段计时器
+    Startup stage timer
+    """
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.timings: List[Tuple[str, float]] = []
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """
+        统计一个阶段的耗时
+        Time one startup stage
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings.append((name, time.perf_counter() - start))
+
+    def import_module(self, module_name: str) -> ModuleType:
+        """
+        导入模块并记录耗时
+        Import a module and record how long it took
+        """
+        with self.stage(f"import {module_name}"):
+            return importlib.import_module(module_name)
+
+    def report(self) -> str:
+        """
+        生成按耗时降序排列的报告
+        Build the report, slowest stage first
+        """
+        total = time.perf_counter() - self.started_at
+        lines = [f"启动耗时 {total * 1000:.0f} ms / Startup took {total * 1000:.0f} ms"]
+        for name, seconds in sorted(self.timings, key=lambda item: item[1], reverse=True):
+            lines.append(f"  {seconds * 1000:8.1f} ms  {name}")
+        return "\n".join(lines)
+
+    def log_report(self):
+        """
+        输出启动耗时报告
+        Log the startup timing report
+        """
+        logger.info(self.report())
+
+
+# 全局启动计时器，在main.py最先导入，以便从进程启动开始计时
+startup_timer = StartupTimer()
@@ -0,0 +1,252 @@
+"""
+静态文件服务
+Static file serving
+
+在Starlette的StaticFiles基础上增加：
+- 预压缩：启动时为前端构建产物生成.gz/.br文件，按Accept-Encoding选择编码
+- 缓存：文件名带内容哈希的资源使用一年的immutable缓存，其余资源每次用ETag重新验证
+- 零拷贝：服务器支持http.response.zerocopysend扩展时直接交给服务器发送文件
+
+On top of Starlette's StaticFiles this adds:
+- precompression: .gz/.br siblings are built for the frontend bundle at startup and
+  chosen by Accept-Encoding
+- caching: content-hashed filenames get a one-year immutable Cache-Control, everything
+  else is revalidated with ETag / If-Modified-Since
+- zero-copy: files are handed to the server via http.response.zerocopysend when supported
+"""
+import os
+import re
+import gzip
+import stat
+import logging
+from mimetypes import guess_type
+from typing import Dict, List, Optional, Tuple
+
+import anyio
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+from starlette.types import Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+# 需要预压缩的文本类资源
+COMPRESSIBLE_EXTENSIONS = {".js", ".css", ".html", ".svg", ".json", ".map", ".txt", ".xml", ".ico"}
+# 小于该大小的文件不压缩
+MIN_COMPRESS_SIZE = 1024
+
+# 文件名中的内容哈希，例如 app.3f2a1b4c.js、chunk-vendors.2fe5bf15.js 或上传图片的SHA-256文件名
+HASHED_NAME_PATTERN = re.compile(r"(^|[.\-_])[0-9a-f]{8,}([.\-_]|$)")
+
+# 内容会被原地更新的文件类型（如按预约码命名的ICS文件），不论文件名都每次重新验证
+MUTABLE_EXTENSIONS = {".ics"}
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+# 支持的预压缩编码：(Accept-Encoding中的名称, 文件后缀)，按优先级排列
+ENCODINGS: List[Tuple[str, str]] = [("br", ".br"), ("gzip", ".gz")]
+
+
+def _needs_update(source_path: str, target_path: str) -> bool:
+    """
+    压缩文件不存在或早于源文件时需要重新生成
+    A compressed sibling must be rebuilt if missing or older than the source
+    """
+    try:
+        return os.path.getmtime(target_path) < os.path.getmtime(source_path)
+    except FileNotFoundError:
+        return True
+
+
+def precompress_directory(directory: str) -> int:
+    """
+    为目录下的文本资源生成.gz和.br（需要brotli模块）文件，返回新生成的文件数
+    Build .gz and (with the brotli module) .br siblings for text assets; returns the number built
+    """
+    if not os.path.isdir(directory):
+        return 0
+
+    built = 0
+    for root, _, files in os.walk(directory):
+        for name in files:
+            extension = os.path.splitext(name)[1].lower()
+            if extension not in COMPRESSIBLE_EXTENSIONS:
+                continue
+            source_path = os.path.join(root, name)
+            if os.path.getsize(source_path) < MIN_COMPRESS_SIZE:
+                continue
+
+            with open(source_path, "rb") as source:
+                data = None
+
+                gzip_path = source_path + ".gz"
+                if _needs_update(source_path, gzip_path):
+                    data = source.read()
+                    with open(gzip_path + ".part", "wb") as target:
+                        target.write(gzip.compress(data, compresslevel=9, mtime=0))
+                    os.replace(gzip_path + ".part", gzip_path)
+                    built += 1
+
+                brotli_path = source_path + ".br"
+                if brotli is not None and _needs_update(source_path, brotli_path):
+                    if data is None:
+                        data = source.read()
+                    with open(brotli_path + ".part", "wb") as target:
+                        target.write(brotli.compress(data, quality=11))
+                    os.replace(brotli_path + ".part", brotli_path)
+                    built += 1
+
+    if brotli is None:
+        logger.info("未安装brotli模块，仅生成gzip预压缩文件")
+    logger.info(f"静态资源预压缩完成: {directory}, 新生成 {built} 个文件")
+    return built
+
+
+def parse_accept_encoding(accept_encoding: str) -> Dict[str, float]:
+    """
+    解析Accept-Encoding，返回编码名称 -> q值；无法解析的q值按0（拒绝）处理
+    Parse Accept-Encoding into encoding name -> q-value; unparsable q-values count as 0 (refused)
+    """
+    qualities = {}
+    for part in accept_encoding.split(","):
+        name, *params = [item.strip() for item in part.split(";")]
+        if not name:
+            continue
+        quality = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    quality = float(value.strip())
+                except ValueError:
+                    quality = 0.0
+        qualities[name.lower()] = quality
+    return qualities
+
+
+def accepts_encoding(accept_encoding: str, encoding: str) -> bool:
+    """
+    判断客户端是否接受该编码：明确列出时按其q值，否则按通配符*的q值；q=0表示拒绝
+    Whether the client accepts the encoding: an explicit entry decides by its q-value,
+    otherwise the * wildcard does; q=0 means refused
+    """
+    qualities = parse_accept_encoding(accept_encoding)
+    return qualities.get(encoding, qualities.get("*", 0.0)) > 0
+
+
+class ZeroCopyFileResponse(FileResponse):
+    """
+    服务器支持zerocopysend扩展时由服务器直接发送文件，否则按较大的块读取发送
+    Let the server send the file when it supports zerocopysend, otherwise stream larger chunks
+    """
+    chunk_size = 256 * 1024
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if self.send_header_only or "http.response.zerocopysend" not in scope.get("extensions", {}):
+            await super().__call__(scope, receive, send)
+            return
+
+        await send({
+            "type": "http.response.start",
+            "status": self.status_code,
+            "headers": self.raw_headers,
+        })
+        with open(self.path, "rb") as file:
+            await send({
+                "type": "http.response.zerocopysend",
+                "file": file,
+                "more_body": False,
+            })
+        if self.background is not None:
+            await self.background()
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """
+    支持预压缩文件、缓存策略和零拷贝发送的静态文件服务
+    Static files with precompressed variants, cache policy and zero-copy sending
+    """
+
+    def file_response(
+        self,
+        full_path: str,
+        stat_result: os.stat_result,
+        scope: Scope,
+        status_code: int = 200,
+    ) -> Response:
+        request_headers = Headers(scope=scope)
+        media_type = guess_type(full_path)[0] or "text/plain"
+        extension = os.path.splitext(full_path)[1].lower()
+
+        headers = {"Cache-Control": self.cache_control(full_path)}
+        path, path_stat = full_path, stat_result
+
+        if extension in COMPRESSIBLE_EXTENSIONS:
+            # 可压缩资源的响应随Accept-Encoding变化
+            headers["Vary"] = "Accept-Encoding"
+            compressed = self.find_compressed(full_path, request_headers.get("accept-encoding", ""))
+            if compressed:
+                encoding, path, path_stat = compressed
+                headers["Content-Encoding"] = encoding
+
+        response = ZeroCopyFileResponse(
+            path,
+            status_code=status_code,
+            headers=headers,
+            media_type=media_type,
+            stat_result=path_stat,
+            method=scope["method"],
+        )
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
+
+    @staticmethod
+    def cache_control(full_path: str) -> str:
+        """
+        文件名带内容哈希的资源永久缓存，其余资源每次重新验证
+        Content-hashed files are cached forever, others are revalidated
+        """
+        name, extension = os.path.splitext(os.path.basename(full_path))
+        if extension.lower() not in MUTABLE_EXTENSIONS and HASHED_NAME_PATTERN.search(name):
+            return IMMUTABLE_CACHE_CONTROL
+        return REVALIDATE_CACHE_CONTROL
+
+    @staticmethod
+    def find_compressed(full_path: str, accept_encoding: str) -> Optional[Tuple[str, str, os.stat_result]]:
+        """
+        查找客户端可接受且不早于源文件的预压缩文件
+        Find a precompressed sibling the client accepts that is not older than the source
+        """
+        if not accept_encoding:
+            return None
+
+        source_mtime = os.stat(full_path).st_mtime
+        for encoding, suffix in ENCODINGS:
+            if not accepts_encoding(accept_encoding, encoding):
+                continue
+            try:
+                compressed_stat = os.stat(full_path + suffix)
+            except FileNotFoundError:
+                continue
+            if stat.S_ISREG(compressed_stat.st_mode) and compressed_stat.st_mtime >= source_mtime:
+                return encoding, full_path + suffix, compressed_stat
+        return None
+
+
+async def precompress_static_assets(directory: str) -> None:
+    """
+    在线程中预压缩静态资源，失败时只记录日志
+    Precompress static assets in a worker thread; failures are only logged
+    """
+    try:
+        await anyio.to_thread.run_sync(precompress_directory, directory)
+    except Exception as e:
+        logger.error(f"静态资源预压缩失败: {str(e)}")
@@ -7,7 +7,10 @@ from datetime import datetime
 from sqlalchemy import text
 from sqlalchemy.orm import Session
 
-from backend.models.reservation import Reservation
+from backend.models.reservation import Reservation, next_updated_seq
+from backend.utils.occupancy_index import occupancy_index
+from backend.utils.live_events import publish_reservations
+from backend.utils.reservation_lookup import invalidate_reservation_codes
 
 logger = logging.getLogger(__name__)
 
@@ -25,34 +28,10 @@ def update_reservation_statuses(db: Session):
     """
     try:
         now = datetime.now()
-        logger.info(f"当前时间: {now}")
-
-        # 记录当前时间的详细信息，用于调试
-        logger.info(f"当前时间详细信息: 年={now.year}, 月={now.month}, 日={now.day}, 时={now.hour}, 分={now.minute}, 秒={now.second}")
-
-        # 查找并记录一些预约的日期时间格式，用于调试
-        sample_reservations = db.query(
-            Reservation.id,
-            Reservation.reservation_number,
-            Reservation.start_datetime,
-            Reservation.end_datetime,
-            Reservation.status
-        ).order_by(Reservation.id.desc()).limit(5).all()
-
-        # logger.info("数据库中的日期时间格式示例:")
-        # for res in sample_reservations:
-        #     logger.info(f"ID: {res.id}, 预约序号: {res.reservation_number}, 状态: {res.status}, "
-        #                f"开始时间类型: {type(res.start_datetime)}, 开始时间: {res.start_datetime}, "
-        #                f"结束时间类型: {type(res.end_datetime)}, 结束时间: {res.end_datetime}")
-
-        #     # 检查日期时间是否为字符串类型，这可能导致比较问题
-        #     if isinstance(res.start_datetime, str) or isinstance(res.end_datetime, str):
-        #         logger.warning(f"预约ID: {res.id} 的日期时间是字符串类型，这可能导致比较问题")
+        logger.debug("当前时间: %s", now)
 
         # 查找应该更新为"使用中"的预约
-        logger.info("执行查询：查找应该更新为'使用中'的预约")
-        logger.info(f"SQL查询条件: Reservation.status == 'confirmed' AND "
-                   f"Reservation.start_datetime <= {now} AND Reservation.end_datetime > {now}")
+        logger.debug("查找应该更新为'使用中'的预约: start_datetime <= %s < end_datetime", now)
 
         # 使用try-except块来捕获可能的日期时间比较错误
         try:
@@ -62,16 +41,16 @@ def update_reservation_statuses(db: Session):
                 Reservation.end_datetime > now
             ).all()
 
-            logger.info(f"找到 {len(in_use_candidates)} 个应该更新为'使用中'的预约")
+            logger.debug("找到 %s 个应该更新为'使用中'的预约", len(in_use_candidates))
             for res in in_use_candidates:
-                logger.info(f"预约ID: {res.id}, 开始时间: {res.start_datetime}, 结束时间: {res.end_datetime}, 当前状态: {res.status}")
+                logger.debug("预约ID: %s, 开始时间: %s, 结束时间: %s, 当前状态: %s", res.id, res.start_datetime, res.end_datetime, res.status)
 
                 # 检查日期时间是否合理
                 try:
                     start_diff = (now - res.start_datetime).total_seconds()
                     end_diff = (res.end_datetime - now).total_seconds()
-                    logger.info(f"预约ID: {res.id}, 当前时间与开始时间的差值(秒): {start_diff}, "
-                               f"结束时间与当前时间的差值(秒): {end_diff}")
+                    logger.debug("预约ID: %s, 当前时间与开始时间的差值(秒): %s, 结束时间与当前时间的差值(秒): %s",
+                                 res.id, start_diff, end_diff)
 
                     # 验证时间差值是否合理
                     if start_diff < 0 or end_diff <= 0:
@@ -85,8 +64,7 @@ def update_reservation_statuses(db: Session):
             in_use_candidates = []
 
         # 查找应该更新为"已过期"的预约
-        logger.info("执行查询：查找应该更新为'已过期'的预约")
-        logger.info(f"SQL查询条件: Reservation.status.in_(['confirmed', 'in_use']) AND Reservation.end_datetime <= {now}")
+        logger.debug("查找应该更新为'已过期'的预约: end_datetime <= %s", now)
 
         # 使用try-except块来捕获可能的日期时间比较错误
         try:
@@ -95,14 +73,14 @@ def update_reservation_statuses(db: Session):
                 Reservation.end_datetime <= now
             ).all()
 
-            logger.info(f"找到 {len(expired_candidates)} 个应该更新为'已过期'的预约")
+            logger.debug("找到 %s 个应该更新为'已过期'的预约", len(expired_candidates))
             for res in expired_candidates:
-                logger.info(f"预约ID: {res.id}, 开始时间: {res.start_datetime}, 结束时间: {res.end_datetime}, 当前状态: {res.status}")
+                logger.debug("预约ID: %s, 开始时间: %s, 结束时间: %s, 当前状态: %s", res.id, res.start_datetime, res.end_datetime, res.status)
 
                 # 检查日期时间是否合理
                 try:
                     time_diff = (res.end_datetime - now).total_seconds()
-                    logger.info(f"预约ID: {res.id}, 结束时间与当前时间的差值(秒): {time_diff}")
+                    logger.debug("预约ID: %s, 结束时间与当前时间的差值(秒): %s", res.id, time_diff)
 
                     # 验证时间差值是否合理
                     if time_diff > 0:
@@ -121,7 +99,7 @@ def update_reservation_statuses(db: Session):
         if in_use_ids:
             in_use_result = db.query(Reservation).filter(
                 Reservation.id.in_(in_use_ids)
-            ).update({"status": "in_use"}, synchronize_session=False)
+            ).update({"status": "in_use", "updated_seq": next_updated_seq()}, synchronize_session=False)
         else:
             in_use_result = 0
 
@@ -129,23 +107,37 @@ def update_reservation_statuses(db: Session):
         # 只更新通过了上面验证的预约
         expired_ids = [res.id for res in expired_candidates]
         if expired_ids:
-            logger.info(f"执行SQL更新: 将ID在 {expired_ids} 中的预约状态更新为'已过期'")
+            logger.debug("将ID在 %s 中的预约状态更新为'已过期'", expired_ids)
             expired_result = db.query(Reservation).filter(
                 Reservation.id.in_(expired_ids)
-            ).update({"status": "expired"}, synchronize_session=False)
+            ).update({"status": "expired", "updated_seq": next_updated_seq()}, synchronize_session=False)
         else:
             expired_result = 0
 
         # 记录更新结果
-        logger.info(f"ORM更新结果: 使用中={in_use_result}条, 已过期={expired_result}条")
+        logger.debug("ORM更新结果: 使用中=%s条, 已过期=%s条", in_use_result, expired_result)
 
         # 提交更改
         if in_use_result > 0 or expired_result > 0:
+            changed_codes = {res.reservation_code for res in in_use_candidates}
+            changed_codes.update(res.reservation_code for res in expired_candidates if res.id in expired_ids)
             db.commit()
+
+            # 已过期的预约不再占用设备，从占用索引中移除
+            for res in expired_candidates:
+                if res.id in expired_ids:
+                    occupancy_index.remove_reservation(res)
+
+            # 批量更新绕过了ORM事件，提交后手动失效预约查询缓存
+            invalidate_reservation_codes(*changed_codes)
+
+            # 推送状态变化事件
+            publish_reservations(in_use_candidates, "status", "in_use")
+            publish_reservations([res for res in expired_candidates if res.id in expired_ids], "status", "expired")
             logger.info(f"已更新预约状态: {in_use_result}个更新为'使用中', {expired_result}个更新为'已过期'")
 
-            # 记录更新后的预约状态，用于验证
-            if expired_ids:
+            # 开启DEBUG时记录更新后的预约状态，用于验证
+            if expired_ids and logger.isEnabledFor(logging.DEBUG):
                 updated_reservations = db.query(
                     Reservation.id,
                     Reservation.reservation_number,
@@ -154,12 +146,12 @@ def update_reservation_statuses(db: Session):
                     Reservation.end_datetime
                 ).filter(Reservation.id.in_(expired_ids)).all()
 
-                logger.info("更新后的预约状态:")
+                logger.debug("更新后的预约状态:")
                 for res in updated_reservations:
-                    logger.info(f"ID: {res.id}, 预约序号: {res.reservation_number}, 状态: {res.status}, "
-                               f"开始时间: {res.start_datetime}, 结束时间: {res.end_datetime}")
+                    logger.debug("ID: %s, 预约序号: %s, 状态: %s, 开始时间: %s, 结束时间: %s",
+                                 res.id, res.reservation_number, res.status, res.start_datetime, res.end_datetime)
         else:
-            logger.info("没有预约需要更新状态")
+            logger.debug("没有预约需要更新状态")
 
         return True
     except Exception as e:
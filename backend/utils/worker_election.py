@@ -0,0 +1,79 @@
+"""
+维护进程选举
+Maintenance worker election
+
+多个工作进程运行同一应用时，用一个非阻塞文件锁选出唯一的维护进程，
+日志压缩、备份、清理等维护任务只在持有锁的进程上运行。持有锁的进程退出时
+操作系统自动释放锁，其他进程在下一次检查时接替。
+
+When several worker processes run the app, a non-blocking file lock elects a single
+maintenance worker; log compression, backups and cleanup only run on the process holding
+the lock. The OS releases the lock when that process exits, and another worker takes over
+on its next check.
+"""
+import os
+import logging
+import threading
+from typing import Optional, TextIO
+
+import portalocker
+
+from config import BASE_DIR
+
+# 设置日志
+logger = logging.getLogger(__name__)
+
+
+class WorkerElection:
+    """
+    基于文件锁的维护进程选举
+    File-lock based maintenance worker election
+    """
+
+    def __init__(self, lock_path: str):
+        self.lock_path = lock_path
+        self._file: Optional[TextIO] = None
+        self._lock = threading.Lock()
+
+    def is_elected(self) -> bool:
+        """
+        当前进程是否是维护进程；尚未当选时尝试获取锁
+        Whether this process is the maintenance worker, trying to take the lock if not yet elected
+        """
+        with self._lock:
+            if self._file is not None:
+                return True
+            os.makedirs(os.path.dirname(self.lock_path), exist_ok=True)
+            lock_file = open(self.lock_path, "a+", encoding="utf-8")
+            try:
+                portalocker.lock(lock_file, portalocker.LOCK_EX | portalocker.LOCK_NB)
+            except portalocker.LockException:
+                lock_file.close()
+                return False
+
+            # 记录持有锁的进程ID，便于排查
+            lock_file.seek(0)
+            lock_file.truncate()
+            lock_file.write(str(os.getpid()))
+            lock_file.flush()
+            self._file = lock_file
+            logger.info(f"进程 {os.getpid()} 被选为维护进程")
+            return True
+
+    def release(self):
+        """
+        释放维护进程身份
+        Give up the maintenance worker role
+        """
+        with self._lock:
+            if self._file is None:
+                return
+            try:
+                portalocker.unlock(self._file)
+            finally:
+                self._file.close()
+                self._file = None
+
+
+# 全局维护进程选举
+maintenance_worker = WorkerElection(os.path.join(BASE_DIR, "logs", ".maintenance.lock"))
@@ -42,6 +42,51 @@ STATIC_DIR = os.path.join(BASE_DIR, "backend", "static")
 # 模板文件 / Template files
 TEMPLATES_DIR = os.path.join(BASE_DIR, "backend", "templates")
 
+# 循环预约设置 / Recurring reservation settings
+RECURRING_HORIZON_WEEKS = 8  # 预先生成子预约的周数 / Weeks of child reservations materialized ahead
+
+# 预约归档设置 / Reservation archive settings
+RESERVATION_ARCHIVE_AFTER_DAYS = 400  # 结束超过该天数的已过期/已取消预约移入归档表，需大于统计的最长时间范围（一年） / Expired/cancelled reservations ended this many days ago move to the archive; keep above the longest statistics range (one year)
+RESERVATION_ARCHIVE_BATCH_SIZE = 500  # 每批归档的预约数 / Reservations moved per batch
+
+# 预约查询缓存 / Reservation lookup cache
+RESERVATION_LOOKUP_CACHE_SIZE = 512  # 缓存条目数 / Cached entries
+RESERVATION_LOOKUP_CACHE_TTL = 300   # 缓存有效期（秒），兜底其他进程的写入 / TTL in seconds, bounds writes from other processes
+
+# 设备导入设置 / Equipment import settings
+EQUIPMENT_IMPORT_CHUNK_SIZE = 500                       # 每批校验/写入的行数 / Rows validated and written per chunk
+EQUIPMENT_IMPORT_BACKGROUND_BYTES = 1024 * 1024         # 超过该大小的文件转为后台任务导入 / Files larger than this import as a background job
+EQUIPMENT_IMPORT_MAX_ERRORS = 1000                      # 错误报告最多返回的行数 / Maximum rows listed in the error report
+
+# 后台任务设置 / Background job settings
+BACKGROUND_JOB_TTL = 3600  # 已结束的后台任务保留秒数，期间可查询结果 / Seconds a finished background job stays pollable
+
+# 日志清理设置 / Log purge settings
+LOG_PURGE_BATCH_SIZE = 1000      # 每批删除的主键范围大小 / Primary-key range deleted per batch
+LOG_PURGE_BATCH_PAUSE = 0.05     # 批与批之间让出写锁的秒数 / Seconds the write lock is released between batches
+SYSTEM_LOG_RETENTION_DAYS = 365  # 系统日志保留天数，None表示不自动清理 / Days system logs are kept; None disables the scheduled purge
+EMAIL_LOG_RETENTION_DAYS = 365   # 邮件日志保留天数，None表示不自动清理 / Days email logs are kept; None disables the scheduled purge
+
+# 数据库备份设置 / Database backup settings
+DB_BACKUP_DIR = os.path.join(BASE_DIR, "backups")  # 备份和快照目录 / Directory for backups and snapshots
+DB_BACKUP_INTERVAL_HOURS = 24      # 两次自动备份的间隔小时数 / Hours between scheduled backups
+DB_BACKUP_KEEP = 7                 # 保留的压缩备份份数 / Compressed backup generations kept
+DB_BACKUP_PAGES_PER_STEP = 256     # 在线备份每步复制的页数 / Pages copied per online backup step
+DB_BACKUP_STEP_PAUSE = 0.05        # 每步之间暂停的秒数，让写入先执行 / Seconds paused between steps so writers can go first
+DB_BACKUP_MAX_RESTARTS = 6         # 复制被写入打断后步长加倍重试的次数，之后一步复制完成 / Restarts (each doubling the step) before copying in one step
+DB_SNAPSHOT_MAX_AGE = 300          # 只读快照的最长有效秒数，超过后后台刷新 / Seconds before the read-only snapshot is refreshed in the background
+
+# 数据库维护设置 / Database maintenance settings
+DB_MAINTENANCE_INTERVAL_HOURS = 1  # 两次例行维护的间隔小时数 / Hours between routine maintenance runs
+DB_ANALYZE_INTERVAL_HOURS = 24     # 完整ANALYZE的间隔小时数，其余轮次执行PRAGMA optimize / Hours between full ANALYZE runs; other runs use PRAGMA optimize
+DB_VACUUM_WINDOW = (2, 5)          # 执行incremental_vacuum的空闲时段（起止小时，可跨零点），None表示不限 / Quiet hours (start, end; may wrap midnight) for incremental_vacuum; None allows any time
+DB_VACUUM_PAGES_PER_STEP = 1000    # 每步回收的页数，步与步之间让出写锁 / Pages reclaimed per step; the write lock is released between steps
+TIME_SLOT_RETENTION_DAYS = 30      # 已结束且无预约引用的设备时间段保留天数，None表示不清理 / Days ended, unreferenced equipment time slots are kept; None disables the purge
+TOMBSTONE_RETENTION_DAYS = 90      # 预约删除记录保留天数，更早的日历同步令牌需要全量同步，None表示不清理 / Days reservation tombstones are kept; older calendar sync tokens need a full sync; None disables the purge
+
+# 数据库表查看设置 / Database browser settings
+DB_BROWSER_EXACT_COUNT_LIMIT = 10000  # 估算行数不超过该值时返回精确行数 / Exact row counts are returned for tables estimated at or below this size
+
 # 邮件设置 / Email settings
 EMAIL_SENDER = "your_email@example.com"  # 发件人邮箱 / Sender email
 EMAIL_PASSWORD = "your_email_password"   # 邮箱密码 / Email password
@@ -9,6 +9,11 @@ export default {
     return axios.post('/api/reservation/', data)
   },
 
+  // 批量创建预定（全部成功或全部不创建）
+  createReservationBatch(data) {
+    return axios.post('/api/reservation/batch', data)
+  },
+
   // 获取预定列表（管理员）
   getReservations(params) {
     return axios.get('/api/reservation', { params })
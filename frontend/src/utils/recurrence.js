@@ -0,0 +1,115 @@
+/**
+ * 循环预约展开工具函数
+ * 将日历接口返回的系列（RFC 5545 RRULE + EXDATE）展开为FullCalendar事件
+ */
+
+// RFC 5545星期代码，下标与Date.getDay()一致（0表示周日）
+const WEEKDAY_CODES = ['SU', 'MO', 'TU', 'WE', 'TH', 'FR', 'SA']
+
+const pad = value => String(value).padStart(2, '0')
+
+/**
+ * 解析RFC 5545本地时间，例如 20250301T090000
+ * @param {string} value - 日期时间字符串
+ * @returns {Date} - 本地时间日期对象
+ */
+export function parseRfcDateTime(value) {
+  return new Date(
+    Number(value.slice(0, 4)),
+    Number(value.slice(4, 6)) - 1,
+    Number(value.slice(6, 8)),
+    Number(value.slice(9, 11)),
+    Number(value.slice(11, 13)),
+    Number(value.slice(13, 15))
+  )
+}
+
+/**
+ * 格式化为RFC 5545本地时间
+ * @param {Date} date - 日期对象
+ * @returns {string} - 例如 20250301T090000
+ */
+export function formatRfcDateTime(date) {
+  return `${date.getFullYear()}${pad(date.getMonth() + 1)}${pad(date.getDate())}T` +
+    `${pad(date.getHours())}${pad(date.getMinutes())}${pad(date.getSeconds())}`
+}
+
+/**
+ * 格式化为不带时区的ISO时间，与后端返回的事件时间格式一致
+ * @param {Date} date - 日期对象
+ * @returns {string} - 例如 2025-03-01T09:00:00
+ */
+function formatLocalIso(date) {
+  return `${date.getFullYear()}-${pad(date.getMonth() + 1)}-${pad(date.getDate())}T` +
+    `${pad(date.getHours())}:${pad(date.getMinutes())}:${pad(date.getSeconds())}`
+}
+
+/**
+ * 解析RRULE，例如 FREQ=WEEKLY;BYDAY=MO,WE;UNTIL=20250630T090000
+ * @param {string} rrule - RRULE字符串
+ * @returns {Object} - 规则参数
+ */
+export function parseRRule(rrule) {
+  const rule = {}
+  rrule.split(';').forEach(part => {
+    const [key, value] = part.split('=')
+    if (key && value !== undefined) {
+      rule[key.toUpperCase()] = value
+    }
+  })
+  return rule
+}
+
+/**
+ * 将系列展开为事件
+ * 支持后端生成的DAILY、WEEKLY（BYDAY）、MONTHLY（BYMONTHDAY）规则
+ * @param {Object} series - 日历接口返回的系列
+ * @returns {Array} - FullCalendar事件，groupId为系列ID；尚未生成的实例isVirtual为true
+ */
+export function expandSeries(series) {
+  const rule = parseRRule(series.rrule)
+  const start = parseRfcDateTime(series.dtstart)
+  const until = rule.UNTIL ? parseRfcDateTime(rule.UNTIL) : start
+  const byDay = rule.BYDAY ? rule.BYDAY.split(',') : [WEEKDAY_CODES[start.getDay()]]
+  const byMonthDay = rule.BYMONTHDAY ? rule.BYMONTHDAY.split(',').map(Number) : [start.getDate()]
+  const exdates = new Set(series.exdate || [])
+  const [endHour, endMinute, endSecond] = series.endTime.split(':').map(Number)
+
+  const events = []
+  for (let current = new Date(start); current <= until; current.setDate(current.getDate() + 1)) {
+    let matches = false
+    if (rule.FREQ === 'DAILY') {
+      matches = true
+    } else if (rule.FREQ === 'WEEKLY') {
+      matches = byDay.includes(WEEKDAY_CODES[current.getDay()])
+    } else if (rule.FREQ === 'MONTHLY') {
+      matches = byMonthDay.includes(current.getDate())
+    }
+
+    const key = formatRfcDateTime(current)
+    const instance = series.instances[key]
+    if (!matches || exdates.has(key) || !instance) {
+      continue
+    }
+
+    const end = new Date(current)
+    end.setHours(endHour, endMinute, endSecond || 0)
+    // 尚未生成子预约的实例没有ID和序号，只用于显示占用
+    const isVirtual = instance[0] === null
+    events.push({
+      id: isVirtual ? `${series.id}-${key}` : instance[0],
+      groupId: series.id,
+      title: series.title,
+      start: formatLocalIso(current),
+      end: formatLocalIso(end),
+      color: series.color,
+      borderColor: series.borderColor,
+      extendedProps: {
+        ...series.extendedProps,
+        reservationNumber: instance[1],
+        isVirtual
+      }
+    })
+  }
+  return events
+}
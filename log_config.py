@@ -1,7 +1,14 @@
 import os
+import gzip
+import json
 import time
+import queue
+import atexit
+import random
 import logging
+import logging.handlers
 import shutil
+import threading
 from datetime import datetime, timedelta
 from concurrent_log_handler import ConcurrentTimedRotatingFileHandler
 
@@ -9,15 +16,121 @@ from concurrent_log_handler import ConcurrentTimedRotatingFileHandler
 LOG_DIR = "logs"
 LOG_FILE = "app.log"
 BACKUP_COUNT = 30  # 保留30天的日志
+LOG_BACKUP_DIR = os.path.join(LOG_DIR, "backups")  # 增量备份目录
+BACKUP_STATE_FILE = os.path.join(LOG_BACKUP_DIR, ".offsets.json")  # 各日志文件已备份到的偏移量
+LOG_MAX_TOTAL_BYTES = 500 * 1024 * 1024  # 历史日志和备份的总大小上限
+COPY_CHUNK_SIZE = 1024 * 1024  # 备份和压缩时每次读取的块大小
+LOG_LEVEL = logging.INFO  # 根日志级别，调试热点路径时改为logging.DEBUG
+LOG_FORMAT = "text"  # 日志格式: text 或 json（结构化日志，每行一个JSON对象）
+DEBUG_SAMPLE_RATE = 0.1  # 开启DEBUG时只保留该比例的调试日志，避免热点路径刷屏
+RATE_LIMIT_PER_SECOND = 20  # 每个模块每秒允许的INFO及以下日志数，WARNING及以上不限流
+RATE_LIMIT_BURST = 100  # 每个模块允许的突发日志数
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# LogRecord自带的属性，JSON格式化时其余属性视为extra字段输出
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+# 后台写日志的监听器和文件处理器
+_listener = None
+_file_handler = None
+
+
+class JsonFormatter(logging.Formatter):
+    """结构化日志格式：每条日志一行JSON，extra参数中的字段一并输出"""
+
+    def format(self, record):
+        data = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "module": record.module,
+            "function": record.funcName,
+            "line": record.lineno,
+            "thread": record.threadName,
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith("_"):
+                data[key] = value
+        if record.exc_info:
+            data["exception"] = self.formatException(record.exc_info)
+        if record.stack_info:
+            data["stack"] = self.formatStack(record.stack_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    按模块（日志记录器名称）限流的令牌桶，只限制INFO及以下级别；
+    被丢弃的条数附加在该模块下一条通过的日志后面
+    """
+
+    def __init__(self, rate=RATE_LIMIT_PER_SECOND, burst=RATE_LIMIT_BURST):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated, dropped = self._buckets.get(record.name, (self.burst, now, 0))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens < 1:
+                self._buckets[record.name] = (tokens, now, dropped + 1)
+                return False
+            self._buckets[record.name] = (tokens - 1, now, 0)
+        if dropped:
+            record.msg = f"{record.getMessage()} (限流丢弃了此前 {dropped} 条日志)"
+            record.args = None
+        return True
+
+
+class DebugSamplingFilter(logging.Filter):
+    """DEBUG日志按比例采样，INFO及以上全部保留"""
+
+    def __init__(self, rate=DEBUG_SAMPLE_RATE):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno > logging.DEBUG or random.random() < self.rate
+
+
+class EnqueueHandler(logging.handlers.QueueHandler):
+    """
+    只把日志放入队列的处理器。请求线程里只合并消息参数，
+    时间格式化、异常堆栈格式化和文件写入都在监听线程中完成
+    """
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
 
 def setup_logging():
-    """设置日志系统"""
+    """
+    设置日志系统
+
+    根日志记录器只挂一个入队处理器，文件和控制台处理器由后台的QueueListener线程驱动，
+    请求线程写日志只需要一次队列put
+    """
+    global _listener, _file_handler
+
     # 确保日志目录存在
     os.makedirs(LOG_DIR, exist_ok=True)
-    
+
+    # 重复调用时先停止原来的监听器，把已入队的日志写完
+    stop_logging()
+
     # 获取根日志记录器
     logger = logging.getLogger()
-    logger.setLevel(logging.INFO)
+    logger.setLevel(LOG_LEVEL)
 
     # 移除所有现有的处理器，避免重复
     for handler in logger.handlers[:]:
@@ -39,19 +152,51 @@ def setup_logging():
     handler.suffix = "%Y%m%d"
     
     # 设置日志格式
-    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    formatter = JsonFormatter() if LOG_FORMAT == "json" else logging.Formatter(TEXT_FORMAT)
     handler.setFormatter(formatter)
     
-    # 添加到根日志记录器
-    logger.addHandler(handler)
-    
     # 添加控制台输出
     console_handler = logging.StreamHandler()
     console_handler.setFormatter(formatter)
-    logger.addHandler(console_handler)
+
+    # 文件和控制台由监听线程写入，根日志记录器只负责入队
+    log_queue = queue.SimpleQueue()
+    queue_handler = EnqueueHandler(log_queue)
+    queue_handler.addFilter(DebugSamplingFilter())
+    queue_handler.addFilter(RateLimitFilter())
+    logger.addHandler(queue_handler)
+
+    _listener = logging.handlers.QueueListener(log_queue, handler, console_handler, respect_handler_level=True)
+    _listener.start()
+    _file_handler = handler
     
     return logger, handler
 
+def stop_logging():
+    """停止后台日志线程，写完队列中剩余的日志并关闭处理器"""
+    global _listener, _file_handler
+    listener, _listener = _listener, None
+    if listener is None:
+        return
+    listener.stop()
+    for handler in listener.handlers:
+        handler.close()
+    _file_handler = None
+
+atexit.register(stop_logging)
+
+def get_file_handler():
+    """返回当前的日志文件处理器，未初始化时返回None"""
+    return _file_handler
+
+def _rollover(handler):
+    """在处理器锁内轮转，避免与监听线程的写入交错"""
+    handler.acquire()
+    try:
+        handler.doRollover()
+    finally:
+        handler.release()
+
 def check_log_file():
     """检查日志文件是否存在，如不存在则创建"""
     log_path = os.path.join(LOG_DIR, LOG_FILE)
@@ -75,50 +220,153 @@ def check_log_file():
     # 检查当天的日志文件是否存在
     if not os.path.exists(today_log):
         # 如果存在基本日志文件但没有当天的日志，强制创建
-        logger = logging.getLogger()
-        for handler in logger.handlers:
-            if isinstance(handler, ConcurrentTimedRotatingFileHandler):
-                handler.doRollover()
-                break
+        handler = get_file_handler()
+        if handler is not None:
+            _rollover(handler)
 
-# 备份现有日志文件
+# 增量备份日志文件
 def backup_logs():
-    """创建当前日志文件的备份"""
-    # 备份当天的日志文件
-    today = datetime.now().strftime("%Y%m%d")
-    log_path = os.path.join(LOG_DIR, f"{LOG_FILE}.{today}")
-    
-    # 如果当天的日志文件不存在，查找主日志文件
-    if not os.path.exists(log_path):
-        log_path = os.path.join(LOG_DIR, LOG_FILE)
-    
-    if os.path.exists(log_path):
-        backup_dir = os.path.join(LOG_DIR, "backups")
-        os.makedirs(backup_dir, exist_ok=True)
-        
-        timestamp = time.strftime("%Y%m%d-%H%M%S")
-        backup_path = os.path.join(backup_dir, f"app-{timestamp}.log")
-        
+    """
+    增量备份日志：把每个未压缩日志文件自上次备份以来新增的内容追加到当天的压缩备份中
+
+    备份进度按文件（inode）记录偏移量，每次只复制新增部分，不再每小时整份复制当天的日志
+    """
+    try:
+        os.makedirs(LOG_BACKUP_DIR, exist_ok=True)
+        state = _load_backup_state()
+        new_state = {}
+        backup_path = os.path.join(LOG_BACKUP_DIR, f"app-{datetime.now().strftime('%Y%m%d')}.log.gz")
+        copied = 0
+
+        for name in sorted(os.listdir(LOG_DIR)):
+            if not name.startswith(LOG_FILE) or name.endswith(".gz"):
+                continue
+            path = os.path.join(LOG_DIR, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            key = str(stat.st_ino or name)
+            offset = state.get(key, 0)
+            # 文件被截断或清空时从头备份
+            if offset > stat.st_size:
+                offset = 0
+            if stat.st_size > offset:
+                with open(path, "rb") as source, gzip.open(backup_path, "ab") as target:
+                    source.seek(offset)
+                    remaining = stat.st_size - offset
+                    while remaining > 0:
+                        chunk = source.read(min(COPY_CHUNK_SIZE, remaining))
+                        if not chunk:
+                            break
+                        target.write(chunk)
+                        remaining -= len(chunk)
+                        offset += len(chunk)
+                        copied += len(chunk)
+            new_state[key] = offset
+
+        _save_backup_state(new_state)
+        if copied:
+            logging.info(f"日志增量备份完成: {backup_path}，新增 {copied/1024:.2f}KB")
+        return True
+    except Exception as e:
+        logging.error(f"创建日志备份失败: {e}")
+        return False
+
+def _load_backup_state():
+    """读取各日志文件已备份到的偏移量"""
+    try:
+        with open(BACKUP_STATE_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _save_backup_state(state):
+    """原子地保存备份偏移量"""
+    temp_path = f"{BACKUP_STATE_FILE}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(temp_path, BACKUP_STATE_FILE)
+
+# 压缩已轮转的日志
+def compress_rotated_logs():
+    """把已轮转的日志文件（app.log.YYYYMMDD）压缩为.gz，保留原修改时间，返回压缩的文件数"""
+    compressed = 0
+    for name in sorted(os.listdir(LOG_DIR)):
+        if not name.startswith(f"{LOG_FILE}.") or name.endswith((".gz", ".tmp", ".part")):
+            continue
+        path = os.path.join(LOG_DIR, name)
+        temp_path = f"{path}.gz.part"
         try:
-            shutil.copy2(log_path, backup_path)
-            logging.info(f"日志备份已创建: {backup_path}")
-            return True
-        except Exception as e:
-            logging.error(f"创建日志备份失败: {e}")
-            return False
-    return False
+            with open(path, "rb") as source, gzip.open(temp_path, "wb") as target:
+                shutil.copyfileobj(source, target, COPY_CHUNK_SIZE)
+            shutil.copystat(path, temp_path)
+            os.replace(temp_path, f"{path}.gz")
+            os.remove(path)
+            compressed += 1
+        except OSError as e:
+            logging.error(f"压缩日志文件失败: {name}, {e}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+    return compressed
+
+# 日志保留策略
+def enforce_log_retention(max_age_days=BACKUP_COUNT, max_total_bytes=LOG_MAX_TOTAL_BYTES):
+    """
+    删除超过max_age_days天的历史日志和备份，总大小仍超过max_total_bytes时从最旧的开始删除，
+    返回删除的文件数；正在写入的app.log不会被删除
+    """
+    files = []
+    for directory in (LOG_DIR, LOG_BACKUP_DIR):
+        if not os.path.isdir(directory):
+            continue
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if name == LOG_FILE or name.startswith(".") or not os.path.isfile(path):
+                continue
+            stat = os.stat(path)
+            files.append((stat.st_mtime, stat.st_size, path))
+    files.sort()
+
+    cutoff = time.time() - max_age_days * 86400
+    total = sum(size for _, size, _ in files)
+    deleted = 0
+    for mtime, size, path in files:
+        if mtime >= cutoff and total <= max_total_bytes:
+            break
+        try:
+            os.remove(path)
+            total -= size
+            deleted += 1
+        except OSError as e:
+            logging.error(f"删除过期日志失败: {path}, {e}")
+    return deleted
+
+def run_log_maintenance():
+    """
+    日志生命周期维护：增量备份、压缩已轮转的日志、执行保留策略
+
+    文件读写较多，应在后台线程中调用，且只在选举出的维护进程上运行
+    """
+    os.makedirs(LOG_DIR, exist_ok=True)
+    # 先备份再压缩，已轮转文件的最后一段内容也会进入备份
+    backup_logs()
+    compressed = compress_rotated_logs()
+    deleted = enforce_log_retention()
+    if compressed or deleted:
+        logging.info(f"日志维护完成: 压缩 {compressed} 个文件，删除 {deleted} 个过期文件")
+    return {"compressed": compressed, "deleted": deleted}
 
 # 手动触发日志轮转
 def force_log_rotation():
     """手动触发日志轮转"""
     try:
-        logger = logging.getLogger()
-        for handler in logger.handlers:
-            if isinstance(handler, ConcurrentTimedRotatingFileHandler):
-                logging.info("手动触发日志轮转...")
-                handler.doRollover()
-                logging.info("日志轮转完成")
-                return True
+        handler = get_file_handler()
+        if handler is not None:
+            logging.info("手动触发日志轮转...")
+            _rollover(handler)
+            logging.info("日志轮转完成")
+            return True
         logging.warning("未找到TimedRotatingFileHandler，无法执行轮转")
         return False
     except Exception as e:
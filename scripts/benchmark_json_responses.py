@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+"""
+对比列表接口的JSON响应方式：response_model校验 + 标准JSONResponse 与 直接返回FastJSONResponse，
+分别统计p95延迟以及gzip压缩前后的响应大小
+Compare list response paths: response_model validation + JSONResponse versus returning a
+FastJSONResponse directly, reporting p95 latency and response size with and without gzip
+"""
+import sys
+import time
+import statistics
+from pathlib import Path
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+# 获取项目根目录
+ROOT_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT_DIR))
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from pydantic import BaseModel
+
+from backend.middlewares.compression_middleware import JSONGZipMiddleware
+from backend.utils.fast_json import FastJSONResponse
+
+# 测试的行数及每种情况的请求次数
+ROW_COUNTS = [1000, 10000]
+ITERATIONS = 30
+
+class Row(BaseModel):
+    id: int
+    equipment_id: int
+    reservation_code: str
+    reservation_number: Optional[str] = None
+    user_name: str
+    user_department: str
+    user_contact: str
+    user_email: Optional[str] = None
+    start_datetime: datetime
+    end_datetime: datetime
+    purpose: Optional[str] = None
+    status: str
+    created_at: datetime
+    equipment_name: Optional[str] = None
+
+class RowList(BaseModel):
+    items: List[Row]
+    total: int
+
+def build_rows(count: int) -> List[dict]:
+    """生成模拟预约数据"""
+    base = datetime(2025, 1, 1, 8, 0)
+    return [
+        {
+            "id": i,
+            "equipment_id": i % 50,
+            "reservation_code": f"CODE{i:08d}",
+            "reservation_number": f"RN-20250101{i:06d}",
+            "user_name": f"用户{i}",
+            "user_department": "测试部门",
+            "user_contact": "13800000000",
+            "user_email": f"user{i}@example.com",
+            "start_datetime": base + timedelta(hours=i),
+            "end_datetime": base + timedelta(hours=i + 1),
+            "purpose": "性能测试",
+            "status": "confirmed",
+            "created_at": base,
+            "equipment_name": f"设备{i % 50}",
+        }
+        for i in range(count)
+    ]
+
+def create_app() -> FastAPI:
+    """创建只包含两个测试接口的应用"""
+    app = FastAPI()
+    app.add_middleware(JSONGZipMiddleware)
+    datasets = {count: build_rows(count) for count in ROW_COUNTS}
+
+    @app.get("/default/{count}", response_model=RowList)
+    def default_path(count: int):
+        return {"items": datasets[count], "total": count}
+
+    @app.get("/fast/{count}")
+    def fast_path(count: int):
+        return FastJSONResponse({"items": datasets[count], "total": count})
+
+    return app
+
+def measure(client: TestClient, url: str, accept_encoding: str):
+    """返回(p95毫秒, 传输字节数)"""
+    durations = []
+    size = 0
+    for _ in range(ITERATIONS):
+        start = time.perf_counter()
+        response = client.get(url, headers={"Accept-Encoding": accept_encoding})
+        durations.append((time.perf_counter() - start) * 1000)
+        size = int(response.headers["content-length"])
+        assert response.status_code == 200
+    p95 = statistics.quantiles(durations, n=20)[18]
+    return p95, size
+
+def main():
+    client = TestClient(create_app())
+    print(f"{'rows':>6} {'path':<8} {'encoding':<9} {'p95(ms)':>9} {'bytes':>10}")
+    for count in ROW_COUNTS:
+        for path in ("default", "fast"):
+            for encoding in ("identity", "gzip"):
+                p95, size = measure(client, f"/{path}/{count}", encoding)
+                print(f"{count:>6} {path:<8} {encoding:<9} {p95:>9.1f} {size:>10}")
+
+if __name__ == "__main__":
+    main()
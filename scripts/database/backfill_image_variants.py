@@ -0,0 +1,76 @@
+"""
+为已有设备图片生成缩略图和WebP/AVIF变体的脚本
+Script to generate thumbnail and WebP/AVIF variants for existing equipment images
+
+migrations/add_image_variant_fields.py只添加字段，迁移前上传的图片没有变体，设备卡片仍会下载原图。
+运行本脚本为这些设备生成变体并写入变体路径；已存在的变体文件直接复用，可以重复运行。
+migrations/add_image_variant_fields.py only adds the columns, so images uploaded before it have
+no variants and catalog cards still download the original. This script generates the variants
+for those equipment rows and stores their paths; existing variant files are reused, so it is
+safe to run again.
+
+用法 / Usage:
+    python scripts/database/backfill_image_variants.py
+"""
+import os
+import sys
+import asyncio
+import logging
+
+# 添加项目根目录到Python路径
+project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, project_root)
+
+from sqlalchemy import or_
+
+from backend.database import SessionLocal
+import backend.models  # noqa: F401  注册所有模型
+from backend.models.equipment import Equipment
+from backend.utils.image_pipeline import apply_image_variants, generate_variants, shutdown_executor
+
+# 设置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 每处理多少台设备提交一次
+COMMIT_EVERY = 50
+
+async def backfill_image_variants() -> int:
+    """
+    为有图片但缺少变体路径的设备生成变体，返回更新的设备数
+    Generate variants for equipment with an image but missing variant paths; returns the
+    number of equipment rows updated
+    """
+    db = SessionLocal()
+    try:
+        equipments = db.query(Equipment).filter(
+            Equipment.image_path.isnot(None),
+            Equipment.image_path != "",
+            or_(
+                Equipment.thumbnail_path.is_(None),
+                Equipment.image_webp_path.is_(None),
+                Equipment.image_avif_path.is_(None)
+            )
+        ).all()
+        logger.info(f"共有 {len(equipments)} 台设备缺少图片变体")
+
+        updated = 0
+        for index, equipment in enumerate(equipments, 1):
+            variants = await generate_variants(equipment.image_path)
+            if not any(variants.values()):
+                logger.warning(f"设备 {equipment.id} 的图片无法生成变体: {equipment.image_path}")
+                continue
+            apply_image_variants(equipment)
+            updated += 1
+            if index % COMMIT_EVERY == 0:
+                db.commit()
+        db.commit()
+        return updated
+    finally:
+        db.close()
+        shutdown_executor()
+
+if __name__ == "__main__":
+    logger.info("开始生成图片变体...")
+    count = asyncio.run(backfill_image_variants())
+    logger.info(f"已为 {count} 台设备生成图片变体")
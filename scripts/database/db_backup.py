@@ -0,0 +1,65 @@
+"""
+数据库备份与恢复脚本
+Database backup and restore script
+
+使用SQLite在线备份API，服务运行时也可以安全备份；恢复前会校验备份并自动保存当前数据库，
+恢复应在停止服务后执行。
+Uses the SQLite online backup API, so backups are safe while the service runs. Restores
+verify the backup and save the current database first; stop the service before restoring.
+
+用法 / Usage:
+    python scripts/database/db_backup.py backup
+    python scripts/database/db_backup.py list
+    python scripts/database/db_backup.py verify <备份文件名>
+    python scripts/database/db_backup.py restore <备份文件名>
+"""
+import os
+import sys
+import logging
+import argparse
+
+# 添加项目根目录到Python路径
+project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, project_root)
+
+from config import DB_BACKUP_DIR
+from backend.utils.db_backup import (
+    BackupError, create_backup, list_backups, restore_backup, verify_backup
+)
+
+# 设置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def main():
+    parser = argparse.ArgumentParser(description="数据库备份与恢复 / Database backup and restore")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("backup", help="立即备份数据库 / Back up the database now")
+    subparsers.add_parser("list", help="列出已有备份 / List backups")
+    verify_parser = subparsers.add_parser("verify", help="校验备份 / Verify a backup")
+    verify_parser.add_argument("name", help="备份文件名 / Backup file name")
+    restore_parser = subparsers.add_parser("restore", help="从备份恢复（请先停止服务） / Restore from a backup (stop the service first)")
+    restore_parser.add_argument("name", help="备份文件名 / Backup file name")
+    args = parser.parse_args()
+
+    try:
+        if args.command == "backup":
+            logger.info(f"备份已保存: {create_backup()}")
+        elif args.command == "list":
+            backups = list_backups()
+            if not backups:
+                logger.info(f"{DB_BACKUP_DIR} 中没有备份")
+            for backup in backups:
+                print(f"{backup['name']}  {backup['size'] / 1024:10.1f}KB  {backup['created_at']:%Y-%m-%d %H:%M:%S}")
+        elif args.command == "verify":
+            verify_backup(args.name)
+            logger.info(f"备份校验通过: {args.name}")
+        elif args.command == "restore":
+            safety_path = restore_backup(args.name)
+            logger.info(f"恢复完成，恢复前的数据库已保存到: {safety_path}")
+    except BackupError as e:
+        logger.error(str(e))
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -179,6 +179,27 @@ Dear {{ reservation.user_name }}, your equipment reservation has been updated.</
 </body></html>
 '''
 
+# 新增：批量预约确认邮件模板，逐项列出每个预约
+batch_created_html = '''
+<!DOCTYPE html>
+<html><head><meta charset="UTF-8"><title>批量预约创建 / Batch Reservation Created</title></head><body>
+<h2>批量预约创建成功 / Batch Reservation Created</h2>
+<p>尊敬的 {{ reservation.user_name }}，您的 {{ reservation["items"]|length }} 个设备预约已成功创建。<br>
+Dear {{ reservation.user_name }}, your {{ reservation["items"]|length }} equipment reservations have been created successfully.</p>
+<table border=1 cellpadding=6>
+    <tr><th>预约编号 / Reservation Code</th><th>预约序号 / Reservation Number</th><th>设备名称 / Equipment Name</th><th>地点 / Location</th><th>开始时间 / Start Time</th><th>结束时间 / End Time</th></tr>
+    {% for item in reservation["items"] %}
+    <tr><td>{{ item.reservation_code }}</td><td>{{ item.reservation_number }}</td><td>{{ item.equipment_name }}</td><td>{{ item.location }}</td><td>{{ item.start_datetime }}</td><td>{{ item.end_datetime }}</td></tr>
+    {% endfor %}
+</table>
+<p>状态 / Status: {{ reservation.status }}</p>
+{% if reservation.purpose %}
+<p>使用目的 / Purpose: {{ reservation.purpose }}</p>
+{% endif %}
+<p>如有任何问题，请联系管理员。<br>If you have any questions, please contact the administrator.</p>
+</body></html>
+'''
+
 upsert_template('reservation_single_created', '单次预约创建', '单次预约创建成功 / Single Reservation Created', single_created_html)
 upsert_template('reservation_recurring_created', '循环预约创建', '循环预约创建成功 / Recurring Reservation Created', recurring_created_html)
 upsert_template('reservation_single_cancelled', '单次预约取消', '单次预约取消 / Single Reservation Cancelled', single_cancelled_html)
@@ -186,5 +207,6 @@ upsert_template('reservation_recurring_cancelled', '循环预约子预约取消'
 upsert_template('reservation_recurring_all_cancelled', '循环预约取消', '循环预约已取消 / Recurring Reservation Cancelled', recurring_all_cancelled_html)
 # 新增：预约更新邮件模板
 upsert_template('reservation_updated', '预约更新', '预约信息已更新 / Reservation Updated', reservation_updated_html)
+upsert_template('reservation_batch_created', '批量预约创建', '批量预约创建成功 / Batch Reservation Created', batch_created_html)
 
 print('邮件模板已同步到数据库！')
\ No newline at end of file
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+"""
+测试设备占用索引在相邻/重叠预约增删后的结果
+Test the equipment occupancy index after adding and removing adjacent and overlapping bookings
+
+使用内存SQLite数据库，不影响项目数据库。
+Uses an in-memory SQLite database; the project database is not touched.
+"""
+import sys
+from pathlib import Path
+from datetime import datetime, time, date
+
+# 获取项目根目录
+ROOT_DIR = Path(__file__).resolve().parent.parent.parent
+sys.path.insert(0, str(ROOT_DIR))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from backend.database import Base
+import backend.models  # noqa: F401  注册所有模型
+from backend.models.recurring_reservation import RecurringReservation  # noqa: F401
+from backend.models.equipment import Equipment
+from backend.utils.occupancy_index import OccupancyIndex
+
+DAY = date(2030, 1, 7)
+
+
+def at(hour: int, minute: int) -> datetime:
+    return datetime.combine(DAY, time(hour, minute))
+
+
+def check(name: str, actual, expected):
+    status = "通过" if actual == expected else "失败"
+    print(f"[{status}] {name}: 期望 {expected}, 实际 {actual}")
+    return actual == expected
+
+
+def main():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    exclusive = Equipment(name="独占设备", category="测试", allow_simultaneous=False, max_simultaneous=1)
+    shared = Equipment(name="共享设备", category="测试", allow_simultaneous=True, max_simultaneous=2)
+    db.add_all([exclusive, shared])
+    db.commit()
+
+    index = OccupancyIndex()
+    index.ensure_loaded(db, [exclusive.id, shared.id])
+    results = []
+
+    # 相邻预约共用10:00-10:15时间格，移除其中一个后另一个仍占用
+    index.add(exclusive.id, at(10, 0), at(10, 10))
+    index.add(exclusive.id, at(10, 10), at(10, 20))
+    index.remove(exclusive.id, at(10, 0), at(10, 10))
+    results.append(check("相邻预约移除一个后仍占用", index.is_free(exclusive.id, at(10, 0), at(10, 15)), False))
+    results.append(check("相邻预约移除一个后find_available", index.find_available(
+        db, [exclusive.id], [DAY], time(10, 0), time(10, 15)), []))
+    index.remove(exclusive.id, at(10, 10), at(10, 20))
+    results.append(check("相邻预约全部移除后空闲", index.is_free(exclusive.id, at(10, 0), at(10, 30)), True))
+
+    # 重叠预约（如状态更新前的残留）逐个移除
+    index.add(exclusive.id, at(14, 0), at(15, 0))
+    index.add(exclusive.id, at(14, 30), at(15, 30))
+    index.remove(exclusive.id, at(14, 0), at(15, 0))
+    results.append(check("重叠预约移除一个后14:30仍占用", index.is_free(exclusive.id, at(14, 30), at(14, 45)), False))
+    results.append(check("重叠预约移除一个后14:00空闲", index.is_free(exclusive.id, at(14, 0), at(14, 30)), True))
+    index.remove(exclusive.id, at(14, 30), at(15, 30))
+    results.append(check("重叠预约全部移除后空闲", index.is_free(exclusive.id, at(14, 0), at(16, 0)), True))
+
+    # 共享设备按容量判断
+    index.add(shared.id, at(9, 0), at(9, 10))
+    index.add(shared.id, at(9, 10), at(9, 20))
+    results.append(check("共享设备容量已满", index.is_free(shared.id, at(9, 0), at(9, 15)), False))
+    index.remove(shared.id, at(9, 0), at(9, 10))
+    results.append(check("共享设备释放一个后有空余", index.is_free(shared.id, at(9, 0), at(9, 15)), True))
+    index.remove(shared.id, at(9, 10), at(9, 20))
+    results.append(check("全部移除后不保留空的日期", index.stats()["days"], 0))
+
+    db.close()
+    print("全部通过" if all(results) else "存在失败的检查")
+    return 0 if all(results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+"""
+测试循环预约编辑后子预约的同步
+Test syncing child reservations after a recurring series is edited
+
+覆盖：修改用户信息、修改时间、修改重复规则、提前结束日期，以及已生成到滚动窗口之后的
+长系列（迁移脚本把已有系列的materialized_until设为结束日期）编辑后子预约ID保持不变；
+整个系列都在滚动窗口之后、尚无子预约时，创建、修改、取消同样改变日历同步令牌，
+增量同步返回该系列并推送实时事件。
+使用内存SQLite数据库，不影响项目数据库。
+
+Covers editing user fields, times, the repeat rule and an earlier end date, and checks
+that long series materialized past the rolling horizon (the migration sets an existing
+series' materialized_until to its end date) keep their child ids when edited. A series
+lying entirely past the horizon, with no children yet, still changes the calendar sync
+token when created, edited or cancelled, and the delta sync and live events report it.
+Uses an in-memory SQLite database; the project database is not touched.
+"""
+import sys
+import asyncio
+from pathlib import Path
+from datetime import date, datetime, time, timedelta
+
+# 获取项目根目录
+ROOT_DIR = Path(__file__).resolve().parent.parent.parent
+sys.path.insert(0, str(ROOT_DIR))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from backend.database import Base
+import backend.models  # noqa: F401  注册所有模型
+from backend.models.reservation_tombstone import ReservationTombstone  # noqa: F401
+from backend.models.reservation_archive import ReservationArchive  # noqa: F401
+from backend.models.equipment import Equipment
+from backend.models.reservation import Reservation
+from backend.models.recurring_reservation import RecurringReservation
+from backend.schemas.recurring_reservation import RecurringReservationCreate, RecurringReservationUpdate
+from backend.routes.crud.recurring_reservation import (
+    create_recurring_reservation, generate_child_reservations, update_recurring_reservation,
+    cancel_recurring_reservation
+)
+from backend.routes.calendar import build_calendar, get_calendar_changes, get_sync_token, parse_sync_token
+from backend.utils.live_events import event_bus
+from backend.utils.recurrence import horizon_date
+
+results = []
+
+
+def check(name: str, actual, expected):
+    status = "通过" if actual == expected else "失败"
+    print(f"[{status}] {name}: 期望 {expected}, 实际 {actual}")
+    results.append(actual == expected)
+
+
+def children(db, series_id: int):
+    """返回 日期 -> (ID, 开始时间, 结束时间)"""
+    db.expire_all()
+    return {
+        child.start_datetime.date(): (child.id, child.start_datetime, child.end_datetime)
+        for child in db.query(Reservation).filter(Reservation.recurring_reservation_id == series_id)
+    }
+
+
+def create_series(db, equipment_id: int, start: date, end: date, legacy: bool) -> int:
+    series, message, _ = create_recurring_reservation(db, RecurringReservationCreate(
+        equipment_id=equipment_id, pattern_type="daily", start_date=start, end_date=end,
+        start_time=time(9, 0), end_time=time(10, 0),
+        user_name="测试用户", user_department="测试部门", user_contact="12345678901",
+        user_email="test@example.com", purpose="测试"
+    ))
+    assert series is not None, message
+    if legacy:
+        # 模拟迁移前创建的系列：子预约生成到结束日期
+        generate_child_reservations(db, series, series.materialized_until + timedelta(days=1), end)
+    return series.id
+
+
+def edit(db, series_id: int, **fields):
+    series, message = update_recurring_reservation(db, series_id, RecurringReservationUpdate(**fields), 1)
+    assert series is not None, message
+    db.expire_all()
+    return db.get(RecurringReservation, series_id)
+
+
+def calendar_delta(db, since: str, start: date, end: date):
+    """返回since令牌之后的(系列ID, 需要移除的系列ID)"""
+    since_seq = parse_sync_token(since, get_sync_token(db))
+    assert since_seq is not None
+    range_start = datetime.combine(start, time.min)
+    range_end = datetime.combine(end + timedelta(days=1), time.min)
+    changed, removed, series_children = get_calendar_changes(db, since_seq, range_start, range_end, None)
+    _, series, removed_series = build_calendar(db, changed, series_children, range_start, range_end)
+    return [event["id"] for event in series], removed_series
+
+
+async def check_series_beyond_horizon(db, equipment_id: int):
+    """整个系列在滚动窗口之后（尚无子预约）时的同步令牌、增量同步和实时事件"""
+    subscription = event_bus.subscribe()
+    start = horizon_date() + timedelta(weeks=4)
+    end = start + timedelta(weeks=2)
+
+    token = get_sync_token(db)
+    series_id = create_series(db, equipment_id, start, end, legacy=False)
+    check("窗口之后的系列没有子预约", children(db, series_id), {})
+    check("创建后同步令牌改变", get_sync_token(db) != token, True)
+    check("创建后增量同步返回该系列", calendar_delta(db, token, start, end), ([f"series-{series_id}"], []))
+
+    token = get_sync_token(db)
+    edit(db, series_id, purpose="窗口之后的新目的")
+    check("修改后同步令牌改变", get_sync_token(db) != token, True)
+    check("修改后增量同步返回该系列", calendar_delta(db, token, start, end), ([f"series-{series_id}"], []))
+
+    token = get_sync_token(db)
+    success, message = cancel_recurring_reservation(db, series_id)
+    assert success, message
+    check("取消后同步令牌改变", get_sync_token(db) != token, True)
+    check("取消后增量同步移除该系列", calendar_delta(db, token, start, end), ([], [series_id]))
+
+    events = []
+    while not subscription.queue.empty():
+        event = subscription.queue.get_nowait()
+        if event["id"] == series_id and event["type"].startswith("series."):
+            events.append(event["type"])
+    event_bus.unsubscribe(subscription)
+    check("推送系列实时事件", events, ["series.created", "series.updated", "series.cancelled"])
+
+
+def main():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine, autoflush=False)()
+    equipment = Equipment(name="测试设备", category="测试", status="available")
+    db.add(equipment)
+    db.commit()
+
+    start = date.today() + timedelta(days=1)
+    end = start + timedelta(weeks=20)
+    horizon = horizon_date()
+
+    # 长系列：子预约已生成到结束日期
+    series_id = create_series(db, equipment.id, start, end, legacy=True)
+    before = children(db, series_id)
+    check("长系列已生成到结束日期", max(before), end)
+
+    # 修改使用目的：所有子预约保持原ID
+    series = edit(db, series_id, purpose="新的目的")
+    after = children(db, series_id)
+    check("修改目的后子预约ID不变", {d: v[0] for d, v in after.items()} == {d: v[0] for d, v in before.items()}, True)
+    check("修改目的后materialized_until不回退", series.materialized_until, end)
+
+    # 修改时间：原地更新为真实的日期时间，窗口之后的子预约同样更新
+    edit(db, series_id, start_time=time(13, 30), end_time=time(15, 0))
+    after = children(db, series_id)
+    check("修改时间后子预约ID不变", {d: v[0] for d, v in after.items()} == {d: v[0] for d, v in before.items()}, True)
+    check("窗口之后的子预约时间已更新", after[end][1:], (datetime.combine(end, time(13, 30)), datetime.combine(end, time(15, 0))))
+    check("更新后的时间为datetime", all(isinstance(v[1], datetime) for v in after.values()), True)
+
+    # 修改规则为每周一、三：只删除不再出现的日期，保留日期的ID不变
+    edit(db, series_id, pattern_type="weekly", days_of_week=[1, 3])
+    weekly = children(db, series_id)
+    check("只保留周一和周三", {d.isoweekday() for d in weekly}, {1, 3})
+    check("保留日期的子预约ID不变", all(weekly[d][0] == after[d][0] for d in weekly), True)
+    check("窗口之后的周一、周三仍保留", any(d > horizon for d in weekly), True)
+
+    # 提前结束日期：新结束日期之后的子预约被删除
+    new_end = start + timedelta(weeks=12)
+    series = edit(db, series_id, end_date=new_end)
+    shortened = children(db, series_id)
+    check("结束日期之后没有子预约", max(shortened) <= new_end, True)
+    check("保留的子预约ID不变", all(shortened[d][0] == weekly[d][0] for d in shortened), True)
+
+    # 新系列只生成到滚动窗口，编辑后仍只到窗口
+    short_id = create_series(db, equipment.id, start, end, legacy=False)
+    series = edit(db, short_id, start_time=time(16, 0), end_time=time(17, 0))
+    check("新系列编辑后生成到滚动窗口", series.materialized_until, min(end, horizon))
+    check("新系列没有窗口之后的子预约", max(children(db, short_id)) <= horizon, True)
+
+    asyncio.run(check_series_beyond_horizon(db, equipment.id))
+
+    db.close()
+    print("全部通过" if all(results) else "存在失败的检查")
+    return 0 if all(results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+"""
+测试并发预约：同一时间段并发提交100个预约，只能有max_simultaneous个成功
+Concurrency test: 100 parallel bookings of one slot, exactly max_simultaneous may succeed
+"""
+import sys
+import threading
+from pathlib import Path
+from datetime import datetime, time, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+# 获取项目根目录
+ROOT_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT_DIR))
+
+from backend.database import SessionLocal
+from backend.models.equipment import Equipment
+from backend.models.reservation import Reservation
+from backend.models.reservation_history import ReservationHistory
+from backend.routes.crud.reservation import create_reservation
+from backend.schemas.reservation import ReservationCreate
+from backend.utils.occupancy_index import occupancy_index
+
+# 并发请求数量及设备的最大同时预约数
+REQUEST_COUNT = 100
+MAX_SIMULTANEOUS = 3
+
+def create_test_equipment() -> int:
+    """创建测试用的可同时预约设备"""
+    db = SessionLocal()
+    try:
+        equipment = Equipment(
+            name="并发测试设备",
+            category="测试",
+            status="available",
+            allow_simultaneous=True,
+            max_simultaneous=MAX_SIMULTANEOUS
+        )
+        db.add(equipment)
+        db.commit()
+        return equipment.id
+    finally:
+        db.close()
+
+def cleanup(equipment_id: int):
+    """删除测试设备及其预约"""
+    db = SessionLocal()
+    try:
+        reservation_ids = [
+            row.id for row in db.query(Reservation.id).filter(Reservation.equipment_id == equipment_id)
+        ]
+        if reservation_ids:
+            db.query(ReservationHistory).filter(
+                ReservationHistory.reservation_id.in_(reservation_ids)
+            ).delete(synchronize_session=False)
+            db.query(Reservation).filter(
+                Reservation.id.in_(reservation_ids)
+            ).delete(synchronize_session=False)
+        db.query(Equipment).filter(Equipment.id == equipment_id).delete(synchronize_session=False)
+        db.commit()
+        occupancy_index.invalidate(equipment_id)
+    finally:
+        db.close()
+
+def book(equipment_id: int, index: int, start_dt: datetime, end_dt: datetime, barrier: threading.Barrier):
+    """在独立会话中提交一个预约"""
+    reservation_data = ReservationCreate(
+        equipment_id=equipment_id,
+        user_name=f"并发用户{index}",
+        user_department="测试部门",
+        user_contact="12345678901",
+        user_email="",
+        start_datetime=start_dt,
+        end_datetime=end_dt,
+        purpose="并发预约测试",
+        skip_email=True  # 跳过发送邮件
+    )
+
+    # 所有线程同时开始
+    barrier.wait()
+
+    db = SessionLocal()
+    try:
+        db_reservation, message = create_reservation(db, reservation_data)
+        return db_reservation.reservation_number if db_reservation else None, message
+    finally:
+        db.close()
+
+def test_concurrent_reservation():
+    """测试同一时间段的并发预约"""
+    equipment_id = create_test_equipment()
+    print(f"创建测试设备: ID={equipment_id}, 最大同时预约数={MAX_SIMULTANEOUS}")
+
+    day = datetime.now().date() + timedelta(days=1)
+    start_dt = datetime.combine(day, time(10, 0))
+    end_dt = datetime.combine(day, time(12, 0))
+
+    try:
+        barrier = threading.Barrier(REQUEST_COUNT)
+        with ThreadPoolExecutor(max_workers=REQUEST_COUNT) as executor:
+            futures = [
+                executor.submit(book, equipment_id, i, start_dt, end_dt, barrier)
+                for i in range(REQUEST_COUNT)
+            ]
+            results = [future.result() for future in futures]
+
+        numbers = [number for number, _ in results if number]
+        failures = {}
+        for number, message in results:
+            if not number:
+                failures[message] = failures.get(message, 0) + 1
+
+        print(f"成功: {len(numbers)}, 失败: {REQUEST_COUNT - len(numbers)}")
+        for message, count in failures.items():
+            print(f"- {message}: {count}")
+
+        assert len(numbers) == MAX_SIMULTANEOUS, f"预期成功{MAX_SIMULTANEOUS}个，实际成功{len(numbers)}个"
+        assert len(set(numbers)) == len(numbers), "预约编号重复"
+
+        db = SessionLocal()
+        try:
+            stored = db.query(Reservation).filter(Reservation.equipment_id == equipment_id).count()
+            history = db.query(ReservationHistory).join(
+                Reservation, ReservationHistory.reservation_id == Reservation.id
+            ).filter(
+                Reservation.equipment_id == equipment_id,
+                ReservationHistory.action == "create"
+            ).count()
+        finally:
+            db.close()
+
+        assert stored == MAX_SIMULTANEOUS, f"数据库中有{stored}个预约"
+        assert history == MAX_SIMULTANEOUS, f"数据库中有{history}条创建历史"
+        print("测试通过！")
+    finally:
+        cleanup(equipment_id)
+
+if __name__ == "__main__":
+    test_concurrent_reservation()
@@ -11,21 +11,19 @@ import uvicorn
 from pathlib import Path
 from dotenv import load_dotenv
 import socket
-import asyncio
 
 # 添加项目根目录到Python路径
 project_root = Path(__file__).resolve().parent
 sys.path.append(str(project_root))
 
 # 导入新的日志配置
-from log_config import setup_logging, check_log_file, backup_logs, force_log_rotation
+from log_config import setup_logging
 
 # 加载环境变量
 load_dotenv()
 
 # 设置新的日志系统
 logger, log_handler = setup_logging()
-check_log_file()
 logger.info("设备预定系统启动中...")
 
 # 禁用其他日志记录器的传播，避免重复日志
@@ -50,25 +48,6 @@ def check_dependencies():
         logger.info("请运行 'pip install -r requirements.txt 和 pip install -r requirements_for_logging.txt' 安装所需依赖")
         return False
 
-# 日志维护任务
-async def log_maintenance_task():
-    """周期性日志维护任务"""
-    try:
-        while True:
-            # 每小时执行一次
-            await asyncio.sleep(3600)  # 3600秒 = 1小时
-            
-            logger.info("执行日志维护任务")
-            
-            # 检查日志文件
-            check_log_file()
-            
-            # 备份日志
-            backup_logs()
-            
-    except Exception as e:
-        logger.error(f"日志维护任务异常: {e}", exc_info=True)
-
 def main():
     """主函数"""
     print("\n=== 欢迎使用设备预定系统 ===\n")
@@ -98,13 +77,6 @@ def main():
     browser_thread.daemon = True
     browser_thread.start()
 
-    # 启动日志维护任务
-    async def start_log_task():
-        asyncio.create_task(log_maintenance_task())
-        
-    # 执行日志任务
-    asyncio.run(start_log_task())
-
     logger.info(f"应用程序将在 http://localhost:{port} 启动")
     logger.info(f"局域网可通过 http://{ip_address}:{port} 访问")
     print(f"应用程序将在 http://localhost:{port} 启动")